@@ -3,8 +3,12 @@
 #echo "Starting Freshclamd"
 #freshclam 
 
-echo "Starting Clamd"
-clamd &
+if [ "${CLAMD_FLEET_SIZE:-0}" -gt 0 ]; then
+    echo "Starting ${CLAMD_FLEET_SIZE} supervised clamd instances"
+else
+    echo "Starting Clamd"
+    clamd &
+fi
 
 echo "Starting API Service"
-uvicorn main:app --host 0.0.0.0 --port 8080
\ No newline at end of file
+exec python serve.py
\ No newline at end of file
@@ -0,0 +1,285 @@
+""" Archive Fan-out Scanning """
+import asyncio
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Awaitable, Callable, List, NamedTuple, Optional, Tuple
+
+from aiofile import async_open
+
+COPY_CHUNK = 1048576
+TAR_MAGIC = (b'\x1f\x8b', b'BZh', b'\xfd7zXZ\x00')
+
+
+class ArchiveLimits(NamedTuple):
+    """ Extraction limits, past which the upload is scanned whole by clamd instead """
+    max_depth: int
+    max_members: int
+    max_expanded: int
+
+
+class ArchiveLimitError(Exception):
+    """ Raised when an archive exceeds its extraction limits """
+
+
+def detect_archive(head: bytes) -> Optional[str]:
+    """
+    Archive format from the first 512 bytes of a payload
+
+        Returns:
+            format (str): 'zip', 'tar' or None. Compressed data is reported as 'tar' and
+                falls back to a whole scan if it does not hold a tarball.
+    """
+    if head.startswith((b'PK\x03\x04', b'PK\x05\x06')):
+        return 'zip'
+    if head.startswith(TAR_MAGIC) or head[257:262] == b'ustar':
+        return 'tar'
+    return None
+
+
+def _display(name: str) -> str:
+    return ''.join(ch if ch.isprintable() else '?' for ch in name)
+
+
+class _Extraction: # pylint: disable=too-few-public-methods
+    """ Extracts members into numbered files, counting members and expanded bytes """
+    def __init__(self, out_dir: str, limits: ArchiveLimits) -> None:
+        self.out_dir = out_dir
+        self.limits = limits
+        self.members: List[Tuple[str, str, int]] = []
+        self.count = 0
+        self.expanded = 0
+        self.files = 0
+
+    def _copy(self, source, name: str, depth: int) -> None:
+        self.count += 1
+        if self.count > self.limits.max_members:
+            raise ArchiveLimitError("members")
+        self.files += 1
+        path = os.path.join(self.out_dir, str(self.files))
+        size = 0
+        with open(path, 'wb') as target:
+            for chunk in iter(lambda: source.read(COPY_CHUNK), b''):
+                size += len(chunk)
+                self.expanded += len(chunk)
+                if self.expanded > self.limits.max_expanded:
+                    raise ArchiveLimitError("expanded size")
+                target.write(chunk)
+        with open(path, 'rb') as fh:
+            nested = detect_archive(fh.read(512))
+        if nested is not None and depth < self.limits.max_depth:
+            self.expanded -= size
+            self.count -= 1
+            self.extract(path, nested, name, depth + 1)
+            os.unlink(path)
+            return
+        self.members.append((name, path, size))
+
+    def extract(self, path: str, kind: str, prefix: str, depth: int) -> None:
+        """ Extract the regular files of an archive, descending into nested archives """
+        if kind == 'zip':
+            with zipfile.ZipFile(path) as archive:
+                for info in archive.infolist():
+                    if info.is_dir():
+                        continue
+                    with archive.open(info) as source:
+                        self._copy(source, f"{prefix}/{_display(info.filename)}", depth)
+            return
+        # Stream mode reads the tarball once, front to back
+        with tarfile.open(path, 'r|*') as archive:
+            for member in archive:
+                if not member.isfile():
+                    continue
+                member_file = archive.extractfile(member)
+                if member_file is not None:
+                    self._copy(member_file, f"{prefix}/{_display(member.name)}", depth)
+
+
+def extract_members(
+        path: str,
+        out_dir: str,
+        name: str,
+        limits: ArchiveLimits) -> Tuple[List[Tuple[str, str, int]], Optional[str]]:
+    """
+    Extract an archive into out_dir; runs in a worker process
+
+        Parameters:
+            path (str): the archive
+            out_dir (str): empty directory receiving numbered member files
+            name (str): display name of the archive
+            limits (ArchiveLimits): depth, member count and expanded size limits
+
+        Returns:
+            members (list): (display name, path, size) of every extracted file
+            fallback (str): why the archive must be scanned whole instead, or None
+    """
+    with open(path, 'rb') as fh:
+        kind = detect_archive(fh.read(512))
+    if kind is None:
+        return [], "not an archive"
+    extraction = _Extraction(out_dir, limits)
+    try:
+        extraction.extract(path, kind, _display(name), 1)
+    except ArchiveLimitError as err:
+        return [], f"{err} limit"
+    except (tarfile.TarError, zipfile.BadZipFile, zipfile.LargeZipFile, EOFError, OSError,
+            RuntimeError, NotImplementedError, ValueError) as err:
+        # Corrupt, encrypted or unsupported entries: clamd judges the archive itself
+        return [], f"unreadable ({type(err).__name__})"
+    if not extraction.members:
+        # Nothing to fan out, e.g. only directories or links: an empty verdict is no verdict
+        return [], "no members"
+    return extraction.members, None
+
+
+async def file_chunks(path: str, chunk_size: int) -> AsyncIterator[bytes]:
+    """ Read a file chunk by chunk without blocking the event loop """
+    async with async_open(path, 'rb') as fh:
+        async for chunk in fh.iter_chunked(chunk_size):
+            yield chunk # type: ignore[misc]
+
+
+def aggregate(results: List[Tuple[str, str]]) -> str:
+    """
+    One response for per-member verdicts, listing infected members like CONTSCAN does.
+    Without an infected member, members clamd failed to scan are listed instead, so the
+    response ends in ERROR and is never taken, or cached, as clean.
+    """
+    found = [
+        f"{name}: {result.partition(': ')[2] or result}"
+        for name, result in results if result.endswith('FOUND')]
+    if found:
+        return '\n'.join(found)
+    errors = [
+        f"{name}: {result.partition(': ')[2] or result}"
+        for name, result in results if result.endswith('ERROR')]
+    return '\n'.join(errors) if errors else 'stream: OK'
+
+
+class ArchiveScanner:
+    """
+    ArchiveScanner
+    Extracts large zip and tar(.gz/.bz2/.xz) uploads in a process pool and scans the members
+    in parallel, so one archive keeps several clamd threads busy instead of one.
+    Only member contents are scanned: bytes the container holds outside its members, such as
+    data between zip entries, zip comments or data after the tar end marker, are not seen,
+    and neither are clamd's container level heuristics.
+    """
+    def __init__(self, conf, logger) -> None:
+        """
+        ArchiveScanner constructor
+
+            Parameters:
+                conf (module): ScanCan configuration
+                logger (Logger): application logger
+
+            Returns:
+                None
+        """
+        self.conf = conf
+        self.logger = logger
+        self.limits = ArchiveLimits(
+            conf.ARCHIVE_MAX_DEPTH, conf.ARCHIVE_MAX_MEMBERS, conf.ARCHIVE_MAX_EXPANDED)
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.fanouts = 0
+        self.fallbacks = 0
+        self.members = 0
+
+    def applies(self, size: Optional[int]) -> bool:
+        """ Whether an upload is large enough to be fanned out """
+        return size is not None and size >= self.conf.ARCHIVE_MIN_SIZE
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.conf.ARCHIVE_WORKERS)
+        return self.executor
+
+    async def scan(
+            self,
+            fileobj,
+            name: str,
+            scan_member: Callable[[AsyncIterator[bytes]], Awaitable[str]]) -> Optional[str]:
+        """
+        Scan the members of an archive upload
+
+            Parameters:
+                fileobj (file): the seekable upload
+                name (str): upload file name, used to name members
+                scan_member (Callable): scans one member's chunks, returning the clamd reply
+
+            Returns:
+                result (str): aggregated verdict, or None when the upload must be scanned whole
+        """
+        fileobj.seek(0)
+        if detect_archive(fileobj.read(512)) is None:
+            return None
+        loop = asyncio.get_running_loop()
+        work_dir = tempfile.mkdtemp(
+            prefix='scancan-archive-', dir=self.conf.ARCHIVE_TMP_DIR or None)
+        cleanup = True
+        try:
+            path = os.path.join(work_dir, 'upload')
+            await loop.run_in_executor(None, _spool, fileobj, path)
+            out_dir = os.path.join(work_dir, 'members')
+            os.mkdir(out_dir)
+            extraction = loop.run_in_executor(
+                self._executor(), extract_members, path, out_dir, name, self.limits)
+            try:
+                members, fallback = await asyncio.shield(extraction)
+            except asyncio.CancelledError:
+                # The worker process cannot be interrupted; clean up once it is done
+                cleanup = False
+                extraction.add_done_callback(lambda _: shutil.rmtree(work_dir, ignore_errors=True))
+                raise
+            if fallback is not None:
+                self.fallbacks += 1
+                self.logger.info("Scanning %s whole: %s", name, fallback)
+                return None
+            self.fanouts += 1
+            self.members += len(members)
+            self.logger.info("Scanning %d members of %s", len(members), name)
+            return aggregate(await self._scan_members(members, scan_member))
+        finally:
+            if cleanup:
+                await loop.run_in_executor(None, shutil.rmtree, work_dir, True)
+
+    async def _scan_members(self, members, scan_member) -> List[Tuple[str, str]]:
+        slots = asyncio.Semaphore(self.conf.ARCHIVE_PARALLEL)
+
+        async def one(member_name: str, path: str) -> Tuple[str, str]:
+            async with slots:
+                return member_name, await scan_member(
+                    file_chunks(path, self.conf.STREAM_CHUNK_SIZE))
+
+        tasks = [asyncio.ensure_future(one(member_name, path)) for member_name, path, _ in members]
+        try:
+            return list(await asyncio.gather(*tasks))
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stop(self) -> None:
+        """ Shut the worker processes down """
+        executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def stats(self) -> dict:
+        """
+        Stats
+
+            Returns:
+                stats (dict): fanned out archives, whole-scan fallbacks and scanned members
+        """
+        return {"fanouts": self.fanouts, "fallbacks": self.fallbacks, "members": self.members}
+
+
+def _spool(fileobj, path: str) -> None:
+    fileobj.seek(0)
+    with open(path, 'wb') as target:
+        shutil.copyfileobj(fileobj, target, COPY_CHUNK)
+    fileobj.seek(0)
@@ -0,0 +1,369 @@
+""" Scan Audit Log """
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+AUDIT_FORMATS = ('ndjson', 'sqlite')
+FOUND = re.compile(r'^(?:.*:\s)?(\S+)\sFOUND$', re.MULTILINE)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS audit (
+    time TEXT NOT NULL,
+    client TEXT NOT NULL,
+    source TEXT NOT NULL,
+    target TEXT NOT NULL,
+    digest TEXT,
+    size INTEGER,
+    verdict TEXT NOT NULL,
+    signature TEXT,
+    signature_version TEXT,
+    latency_ms REAL,
+    cached INTEGER NOT NULL
+);
+"""
+COLUMNS = (
+    'time', 'client', 'source', 'target', 'digest', 'size', 'verdict', 'signature',
+    'signature_version', 'latency_ms', 'cached')
+
+_scope: ContextVar[Optional[Tuple[Any, float]]] = ContextVar('scancan_audit', default=None)
+
+
+@contextmanager
+def audit_scope(connection: Any) -> Iterator[None]:
+    """ Attribute scans in the enclosed block to a request or WebSocket and time them from now """
+    token = _scope.set((connection, time.perf_counter()))
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def client_identity(tenant: Optional[str], token: Optional[str], ip: Optional[str]) -> str:
+    """ 'tenant:<name>', 'token:<digest>' or 'ip:<address>'; bearer tokens are never recorded """
+    if tenant:
+        return f"tenant:{tenant}"
+    if token:
+        return "token:" + hashlib.sha256(token.encode()).hexdigest()[:16]
+    return f"ip:{ip or 'unknown'}"
+
+
+def _current_client() -> Tuple[str, Optional[float]]:
+    scope = _scope.get()
+    if scope is None:
+        return 'internal', None
+    connection, started = scope
+    state = getattr(connection, 'state', None)
+    token = getattr(state, 'token', None)
+    if token is None:
+        header = connection.headers.get('Authorization', '')
+        token = header.removeprefix('Bearer ').strip() or None
+    host = connection.client.host if connection.client else None
+    return client_identity(getattr(state, 'tenant', None), token, host), started
+
+
+def verdict_of(result: str) -> Tuple[str, str]:
+    """
+    Verdict of a clamd reply
+
+        Returns:
+            verdict (str): 'infected', 'error' or 'clean'
+            signature (str): matched signature names, comma separated
+    """
+    names = FOUND.findall(result)
+    if names:
+        return 'infected', ','.join(dict.fromkeys(names))
+    if result.rstrip().endswith('ERROR'):
+        return 'error', ''
+    return 'clean', ''
+
+
+class NdjsonWriter: # pylint: disable=too-few-public-methods
+    """
+    NdjsonWriter
+    Appends batches as JSON lines, renaming the file aside once it reaches max_bytes
+    """
+    def __init__(self, path: str, max_bytes: int, keep: int) -> None:
+        """
+        NdjsonWriter constructor
+
+            Parameters:
+                path (str): log file
+                max_bytes (int): size that triggers rotation, 0 never rotates
+                keep (int): rotated files to keep as path.1 ... path.N
+
+            Returns:
+                None
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.keep = keep
+
+    def write(self, batch: List[Dict[str, Any]]) -> None:
+        """ Append one batch, rotating first when the file is full """
+        data = ''.join(json.dumps(entry, separators=(',', ':')) + '\n' for entry in batch)
+        with _locked(self.path):
+            _rotate(self.path, self.max_bytes, self.keep)
+            with open(self.path, 'a', encoding='utf-8') as target:
+                target.write(data)
+
+
+class SqliteWriter: # pylint: disable=too-few-public-methods
+    """
+    SqliteWriter
+    Inserts batches into an audit table, one transaction per batch, rotating like NdjsonWriter
+    """
+    def __init__(self, path: str, max_bytes: int, keep: int) -> None:
+        """
+        SqliteWriter constructor
+
+            Parameters:
+                path (str): database file
+                max_bytes (int): size that triggers rotation, 0 never rotates
+                keep (int): rotated databases to keep as path.1 ... path.N
+
+            Returns:
+                None
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.keep = keep
+
+    def write(self, batch: List[Dict[str, Any]]) -> None:
+        """ Insert one batch, rotating first when the database is full """
+        rows = [tuple(entry.get(column) for column in COLUMNS) for entry in batch]
+        with _locked(self.path):
+            _rotate(self.path, self.max_bytes, self.keep)
+            # Opened per batch and closed before the lock is released, so rotation never
+            # moves a database another process has open for writing
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            try:
+                conn.executescript(SCHEMA)
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany(
+                    f"INSERT INTO audit ({', '.join(COLUMNS)}) "
+                    f"VALUES ({', '.join('?' for _ in COLUMNS)})", rows)
+                conn.execute("COMMIT")
+            finally:
+                conn.close()
+
+
+@contextmanager
+def _locked(path: str) -> Iterator[None]:
+    """ Serialize writers and rotation across ScanCan processes """
+    with open(path + '.lock', 'a', encoding='utf-8') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _rotate(path: str, max_bytes: int, keep: int) -> None:
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        return
+    if max_bytes <= 0 or size < max_bytes:
+        return
+    if keep <= 0:
+        os.unlink(path)
+        return
+    for number in range(keep - 1, 0, -1):
+        if os.path.exists(f"{path}.{number}"):
+            os.replace(f"{path}.{number}", f"{path}.{number + 1}")
+    os.replace(path, f"{path}.1")
+
+
+class AuditLog: # pylint: disable=too-many-instance-attributes
+    """
+    AuditLog
+    Records one entry per scan verdict. Recording appends to an in-memory ring buffer and
+    never waits; a background task writes the buffer in batches from a single thread.
+    When writes fall behind, the oldest unwritten entries are overwritten and counted.
+    """
+    def __init__(self, conf, logger) -> None:
+        """
+        AuditLog constructor
+
+            Parameters:
+                conf (module): ScanCan configuration
+                logger (Logger): application logger
+
+            Returns:
+                None
+        """
+        if conf.AUDIT_FORMAT not in AUDIT_FORMATS:
+            raise ValueError(f"AUDIT_FORMAT must be one of {', '.join(AUDIT_FORMATS)}")
+        writer = SqliteWriter if conf.AUDIT_FORMAT == 'sqlite' else NdjsonWriter
+        self.writer = writer(conf.AUDIT_PATH, conf.AUDIT_ROTATE_BYTES, conf.AUDIT_ROTATE_KEEP)
+        self.logger = logger
+        self.batch_size = conf.AUDIT_BATCH_SIZE
+        self.flush_interval = conf.AUDIT_FLUSH_INTERVAL
+        self.retry_max_delay = conf.AUDIT_RETRY_MAX_DELAY
+        self.buffer: Deque[Dict[str, Any]] = deque(maxlen=conf.AUDIT_BUFFER_SIZE)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="audit-log")
+        self.wakeup: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+        self.recorded = 0
+        self.written = 0
+        self.overwritten = 0
+        self.failed = 0
+        self.retries = 0
+        self.batches = 0
+
+    def record( # pylint: disable=too-many-arguments
+            self,
+            source: str,
+            target: str,
+            result: str,
+            *,
+            digest: Optional[str] = None,
+            size: Optional[int] = None,
+            signature_version: Optional[str] = None,
+            cached: bool = False,
+            client: Optional[str] = None,
+            started: Optional[float] = None) -> None:
+        """
+        Record a scan verdict
+
+            Parameters:
+                source (str): 'path', 'url', 'upload', 'hash', 'ws' or 'watch'
+                target (str): path, url or file name
+                result (str): clamd reply
+                digest (str): SHA-256 of the payload, if known
+                size (int): payload bytes, if known
+                signature_version (str): database version the verdict was made with
+                cached (bool): whether the verdict came from a cache
+                client (str): client identity, by default the one of the current request
+                started (float): perf_counter() when the scan started, by default the
+                    start of the current request
+
+            Returns:
+                None
+        """
+        scoped, scope_started = _current_client()
+        started = started if started is not None else scope_started
+        verdict, signature = verdict_of(result)
+        if len(self.buffer) == self.buffer.maxlen:
+            self.overwritten += 1
+        self.buffer.append({
+            "time": datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+            "client": client or scoped,
+            "source": source,
+            "target": target,
+            "digest": digest or None,
+            "size": size,
+            "verdict": verdict,
+            "signature": signature or None,
+            "signature_version": signature_version or None,
+            "latency_ms": (
+                round((time.perf_counter() - started) * 1000, 3) if started is not None else None),
+            "cached": cached,
+        })
+        self.recorded += 1
+        if len(self.buffer) >= self.batch_size and self.wakeup is not None:
+            self.wakeup.set()
+
+    def _event(self) -> asyncio.Event:
+        if self.wakeup is None:
+            self.wakeup = asyncio.Event()
+        return self.wakeup
+
+    async def start(self) -> None:
+        """ Start the background writer """
+        self._event()
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        """ Stop the background writer and write what is buffered """
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        if not await self._drain():
+            self.failed += len(self.buffer)
+            self.logger.error("Audit log dropped %d unwritten entries", len(self.buffer))
+            self.buffer.clear()
+        self.executor.shutdown(wait=True)
+
+    async def run(self) -> None:
+        """
+        Write a batch whenever one is full, or every flush_interval seconds. After a failed
+        write, wait twice as long before each retry, up to retry_max_delay.
+        """
+        delay = 0.0
+        while True:
+            if delay:
+                await asyncio.sleep(delay)
+            else:
+                try:
+                    await asyncio.wait_for(self._event().wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._event().clear()
+            if await self._drain():
+                delay = 0.0
+            else:
+                delay = min(max(self.flush_interval, delay * 2), self.retry_max_delay)
+
+    async def _drain(self) -> bool:
+        while self.buffer:
+            if not await self.flush():
+                return False
+        return True
+
+    async def flush(self) -> bool:
+        """
+        Write up to batch_size buffered entries
+
+            Returns:
+                written (bool): False when the write failed and the batch was put back
+        """
+        batch = [self.buffer.popleft() for _ in range(min(self.batch_size, len(self.buffer)))]
+        if not batch:
+            return True
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.writer.write, batch)
+        except (OSError, sqlite3.Error) as err:
+            self.retries += 1
+            self.logger.error("Audit log write of %d entries failed: %s", len(batch), err)
+            # Back in front of what was recorded meanwhile; the ring still bounds memory,
+            # so when it is full the oldest entries are the ones dropped
+            room = (self.buffer.maxlen or len(batch)) - len(self.buffer)
+            dropped = max(0, len(batch) - room)
+            self.overwritten += dropped
+            self.buffer.extendleft(reversed(batch[dropped:]))
+            return False
+        self.written += len(batch)
+        self.batches += 1
+        return True
+
+    def stats(self) -> dict:
+        """
+        Stats
+
+            Returns:
+                stats (dict): recorded, buffered, written, failed and overwritten entries,
+                    batches written and failed writes retried
+        """
+        return {
+            "recorded": self.recorded,
+            "buffered": len(self.buffer),
+            "written": self.written,
+            "failed": self.failed,
+            "overwritten": self.overwritten,
+            "batches": self.batches,
+            "retries": self.retries,
+        }
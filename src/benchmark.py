@@ -0,0 +1,99 @@
+""" Scanner Backend Benchmark """
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import time
+from typing import AsyncIterator, List
+
+import config as conf
+from clamav import ClamAvPool, ScannerBackend
+from libclamav import LibClamAvPool
+from router import BackendConf, parse_backend_spec
+
+
+def backend(spec: str, concurrency: int) -> ScannerBackend:
+    """
+    Scanner backend for a backend spec, sized for the benchmark's concurrency
+
+        Parameters:
+            spec (str): 'net:host:port', 'socket:/path/to/clamd.socket' or
+                'libclamav:/path/to/database'
+            concurrency (int): concurrent scans
+
+        Returns:
+            backend (ScannerBackend)
+    """
+    backend_conf = BackendConf(conf, **parse_backend_spec(spec))
+    if backend_conf.CLAMD_CONN == 'libclamav':
+        return LibClamAvPool(backend_conf, concurrency)
+    return ClamAvPool(backend_conf, concurrency)
+
+
+async def _chunks(payload: bytes) -> AsyncIterator[bytes]:
+    for offset in range(0, len(payload), conf.STREAM_CHUNK_SIZE):
+        yield payload[offset:offset + conf.STREAM_CHUNK_SIZE]
+
+
+async def run(spec: str, payload: bytes, requests: int, concurrency: int) -> dict:
+    """
+    INSTREAM one payload through a backend, concurrently, after warming it up
+
+        Returns:
+            results (dict): scans per second, MB per second and latency percentiles in ms
+    """
+    pool = backend(spec, concurrency)
+    pool.set_logger(logging.getLogger('benchmark'))
+    await pool.connecting()
+    latencies: List[float] = []
+    pending = iter(range(requests))
+
+    async def scanner() -> None:
+        for _ in pending:
+            start = time.perf_counter()
+            await pool.instream(_chunks(payload))
+            latencies.append(time.perf_counter() - start)
+
+    try:
+        await pool.instream(_chunks(payload))
+        start = time.perf_counter()
+        await asyncio.gather(*(scanner() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    finally:
+        await pool.close()
+    cuts = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {
+        'backend': spec,
+        'scans_per_second': round(requests / elapsed, 1),
+        'mb_per_second': round(requests * len(payload) / elapsed / 1e6, 1),
+        'p50_ms': round(cuts[49] * 1000, 2),
+        'p95_ms': round(cuts[94] * 1000, 2),
+        'p99_ms': round(cuts[98] * 1000, 2),
+    }
+
+
+def main() -> None:
+    """ Compare scanner backends on the same payload """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('backends', nargs='+', help="backend specs, e.g. net:127.0.0.1:3310")
+    parser.add_argument('--size', type=int, default=1 << 20, help="payload bytes")
+    parser.add_argument('--payload', help="file to scan instead of random bytes")
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=4)
+    args = parser.parse_args()
+    if args.payload:
+        with open(args.payload, 'rb') as source:
+            payload = source.read()
+    else:
+        payload = os.urandom(args.size)
+    print(f"{'backend':<32} {'scans/s':>9} {'MB/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for spec in args.backends:
+        result = asyncio.run(run(spec, payload, args.requests, args.concurrency))
+        print(f"{result['backend']:<32} {result['scans_per_second']:>9} "
+              f"{result['mb_per_second']:>8} {result['p50_ms']:>9} {result['p95_ms']:>9} "
+              f"{result['p99_ms']:>9}")
+
+
+if __name__ == "__main__":
+    main()
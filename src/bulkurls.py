@@ -0,0 +1,74 @@
+""" Bulk URL Scheduling """
+import asyncio
+import urllib.parse
+from collections import Counter, OrderedDict, deque
+from typing import Deque, Iterable, Optional, Tuple
+
+
+def url_host(url: str) -> str:
+    """ Host and port a url is fetched from, or the url itself when it has none """
+    try:
+        host = urllib.parse.urlsplit(url.strip()).netloc.lower()
+    except ValueError:
+        host = ''
+    return host or url
+
+
+class HostQueue:
+    """
+    HostQueue
+    Hands out urls to fetch workers with at most `per_host` in flight per host. Hosts take
+    turns, so a list dominated by one host does not hold back the others.
+    """
+    def __init__(self, urls: Iterable[str], per_host: int) -> None:
+        """
+        HostQueue constructor
+
+            Parameters:
+                urls (Iterable[str]): urls in request order
+                per_host (int): urls in flight per host
+
+            Returns:
+                None
+        """
+        self.per_host = max(1, per_host)
+        self.hosts: 'OrderedDict[str, Deque[Tuple[int, str]]]' = OrderedDict()
+        self.active: Counter = Counter()
+        self.changed = asyncio.Condition()
+        for index, url in enumerate(urls):
+            self.hosts.setdefault(url_host(url), deque()).append((index, url))
+
+    def _take(self) -> Optional[Tuple[str, int, str]]:
+        for host, queue in self.hosts.items():
+            if self.active[host] < self.per_host:
+                index, url = queue.popleft()
+                if queue:
+                    self.hosts.move_to_end(host)
+                else:
+                    del self.hosts[host]
+                self.active[host] += 1
+                return host, index, url
+        return None
+
+    async def get(self) -> Optional[Tuple[str, int, str]]:
+        """
+        Next url whose host has a free slot, waiting while every remaining host is busy
+
+            Returns:
+                item (tuple): host, index and url, or None when no urls are left
+        """
+        async with self.changed:
+            while self.hosts:
+                item = self._take()
+                if item is not None:
+                    return item
+                await self.changed.wait()
+        return None
+
+    async def done(self, host: str) -> None:
+        """ Free the slot of a finished url """
+        async with self.changed:
+            self.active[host] -= 1
+            if self.active[host] <= 0:
+                del self.active[host]
+            self.changed.notify_all()
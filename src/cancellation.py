@@ -0,0 +1,137 @@
+""" Request Cancellation on Disconnect and Deadline """
+import asyncio
+import json
+import time
+from collections import Counter
+from typing import Optional
+
+from scheduler import deadline, parse_deadline
+
+DEADLINE_HEADER = b'x-scan-deadline'
+
+
+class _Exchange:
+    """ Relays ASGI messages of one request and records how far the response got """
+    def __init__(self, receive, send) -> None:
+        self._receive = receive
+        self._send = send
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        self.started = False
+        self.complete = False
+        self.reason: Optional[str] = None
+
+    async def receive(self) -> dict:
+        """ Receive for the app, fed by pump() """
+        return await self.queue.get()
+
+    async def send(self, message: dict) -> None:
+        """ Send for the app """
+        if message["type"] == "http.response.start":
+            self.started = True
+        elif message["type"] == "http.response.body" and not message.get("more_body", False):
+            self.complete = True
+        await self._send(message)
+
+    async def pump(self, task: asyncio.Task) -> None:
+        """
+        Forward request messages to the app one at a time, so uploads keep their backpressure,
+        and cancel the app when the client disconnects before the response is complete
+        """
+        while True:
+            message = await self._receive()
+            if message["type"] == "http.disconnect" and not self.complete and not task.done():
+                self.reason = 'disconnect'
+                task.cancel()
+            await self.queue.put(message)
+            if message["type"] == "http.disconnect":
+                return
+
+    def expire(self, task: asyncio.Task) -> None:
+        """ Cancel the app when the X-Scan-Deadline passes """
+        if not task.done():
+            self.reason = 'deadline'
+            task.cancel()
+
+
+class CancelOnDisconnect: # pylint: disable=too-few-public-methods
+    """
+    CancelOnDisconnect
+    ASGI middleware that runs each HTTP request as a task and cancels it when the client
+    disconnects or its X-Scan-Deadline passes, so downloads, uploads and clamd commands of
+    abandoned requests stop instead of running to completion. The deadline is also made
+    available to the scheduler, which drops queued work that has expired.
+    """
+    def __init__(self, app, logger=None, counters: Optional[Counter] = None) -> None:
+        """
+        CancelOnDisconnect constructor
+
+            Parameters:
+                app (ASGIApp): the wrapped application
+                logger (Logger): application logger
+                counters (Counter): receives 'disconnects' and 'deadlines' counts
+
+            Returns:
+                None
+        """
+        self.app = app
+        self.logger = logger
+        self.counters = counters if counters is not None else Counter()
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        at = parse_deadline(_header(scope, DEADLINE_HEADER))
+        if at is not None and at <= time.time():
+            self.counters['deadlines'] += 1
+            await _deadline_response(send)
+            return
+        exchange = _Exchange(receive, send)
+        with deadline(at):
+            task = asyncio.ensure_future(self.app(scope, exchange.receive, exchange.send))
+        pump = asyncio.ensure_future(exchange.pump(task))
+        timer = None
+        if at is not None:
+            timer = asyncio.get_running_loop().call_later(
+                at - time.time(), exchange.expire, task)
+        try:
+            await asyncio.wait({task})
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        finally:
+            pump.cancel()
+            if timer is not None:
+                timer.cancel()
+        if not task.cancelled():
+            task.result()
+            return
+        if exchange.reason == 'deadline':
+            self.counters['deadlines'] += 1
+            if self.logger:
+                self.logger.info("Cancelled %s %s at its deadline", scope["method"], scope["path"])
+            if not exchange.started:
+                await _deadline_response(send)
+        elif exchange.reason == 'disconnect':
+            self.counters['disconnects'] += 1
+            if self.logger:
+                self.logger.info("Cancelled %s %s, client disconnected",
+                                 scope["method"], scope["path"])
+
+
+def _header(scope, name: bytes) -> Optional[str]:
+    for key, value in scope.get("headers", []):
+        if key.lower() == name:
+            return value.decode('latin-1')
+    return None
+
+
+async def _deadline_response(send) -> None:
+    body = json.dumps({"status_code": 504, "response": "Scan deadline exceeded"}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": 504,
+        "headers": [(b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
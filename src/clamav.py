@@ -1,8 +1,50 @@
 """Clamav Connector"""
-from pyvalve import PyvalveSocket, PyvalveConnectionError, PyvalveNetwork
+import asyncio
+import struct
+import time
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterable, AsyncIterator, List, Optional
 
+from pyvalve import (
+    PyvalveConnectionError,
+    PyvalveNetwork,
+    PyvalveSocket,
+    PyvalveStreamMaxLength,
+)
 
-class ClamAv:
+from tracing import span
+
+
+class ClamdTimeoutError(PyvalveConnectionError):
+    """ Raised when clamd does not answer a command within its deadline """
+
+
+class SignatureVersionCache(ABC): # pylint: disable=too-few-public-methods
+    """ Caches the clamd signature version for SIGNATURE_VERSION_TTL seconds """
+    conf: Any
+    sig_version: Optional[str] = None
+    sig_checked = 0.0
+
+    @abstractmethod
+    async def version(self) -> str:
+        """ VERSION reply """
+
+    async def signature_version(self) -> str:
+        """
+        Signature version of the loaded database, cached for SIGNATURE_VERSION_TTL seconds
+
+            Returns:
+                version (str): e.g. '27100', or the raw VERSION reply if it cannot be parsed
+        """
+        now = time.monotonic()
+        if self.sig_version is None or now - self.sig_checked > self.conf.SIGNATURE_VERSION_TTL:
+            self.sig_version = parse_signature_version(await self.version())
+            self.sig_checked = now
+        return self.sig_version
+
+
+class ClamAv(SignatureVersionCache):
     """
     ClamAv
     Provides an abstraction between Pyvalve and the application
@@ -14,50 +56,126 @@ class ClamAv:
             Returns:
                 None
         """
-        self.pvs = None
+        self.pvs: Any = None
         self.logger = None
         self.conf = conf
+        self.sig_version: Optional[str] = None
+        self.sig_checked = 0.0
 
     def set_logger(self, logger):
         """ Set Logger """
         self.logger = logger
 
+    async def _deadline(self, command: str, timeout: float, coro):
+        """ Await a command, dropping the connection if clamd misses the deadline """
+        with span('clamd', command=command):
+            return await self._within(timeout, coro)
+
+    async def _within(self, timeout: float, coro, conn: Any = None):
+        """ Await clamd, dropping the connection when it misses the deadline or nobody waits """
+        try:
+            if timeout <= 0:
+                return await coro
+            return await asyncio.wait_for(coro, timeout)
+        except asyncio.TimeoutError as err:
+            # The connection is in an unknown state, reconnect on next use
+            self._drop(conn)
+            raise ClamdTimeoutError(f"clamd did not answer within {timeout}s") from err
+        except asyncio.CancelledError:
+            # Nobody waits for the reply; closing the socket makes clamd abandon the command
+            self._drop(conn)
+            raise
+
+    def _drop(self, conn: Any = None) -> None:
+        """ Close the abandoned connection and the client's current one """
+        current = getattr(self.pvs, 'conn', None)
+        if conn is not None and conn is not current:
+            conn.writer.close()
+        if current is not None:
+            current.writer.close()
+        self.pvs = None
+
+    async def _command(self, command: str, *args):
+        await self.check_connect()
+        return await getattr(self.pvs, command)(*args)
+
     async def ping(self):
         """ Ping """
         self.logger.info("Running ping command")
-        await self.check_connect()
-        return await self.pvs.ping()
+        return await self._deadline('ping', self.conf.CLAMD_TIMEOUT_PING, self._command('ping'))
 
     async def version(self):
         """ Ping """
         self.logger.info("Running ping command")
-        await self.check_connect()
-        return await self.pvs.version()
+        return await self._deadline(
+            'version', self.conf.CLAMD_TIMEOUT_PING, self._command('version'))
 
     async def stats(self):
         """ Stats """
         self.logger.info("Running stats command")
-        await self.check_connect()
-        return await self.pvs.stats()
+        return await self._deadline('stats', self.conf.CLAMD_TIMEOUT_PING, self._command('stats'))
 
     async def scan(self, path):
         """ Scan """
         self.logger.info("Running scan command")
-        await self.check_connect()
-        return await self.pvs.scan(path)
+        return await self._deadline(
+            'scan', self.conf.CLAMD_TIMEOUT_SCAN, self._command('scan', path))
 
     async def contscan(self, path):
         """ Cont Scan """
         self.logger.info("Running contscan command")
-        await self.check_connect()
-        return await self.pvs.contscan(path)
+        return await self._deadline(
+            'contscan', self.conf.CLAMD_TIMEOUT_CONTSCAN, self._command('contscan', path))
 
     async def instream(self, file):
-        """ Instream """
+        """ Instream a file object or an async iterable of byte chunks """
         self.logger.info("Running instream command")
+        if not hasattr(file, '__aiter__'):
+            return await self._deadline(
+                'instream', self.conf.CLAMD_TIMEOUT_INSTREAM, self._instream_file(file))
+        with span('clamd', command='instream'):
+            await self._within(self.conf.CLAMD_TIMEOUT_PING, self.check_connect())
+            return await self.instream_chunks(file)
+
+    async def _instream_file(self, file):
         await self.check_connect()
         return await self.pvs.instream(file)
 
+    async def instream_chunks(self, chunks: AsyncIterable[bytes]) -> str:
+        """
+        Stream chunks to clamd as they are produced, draining after each one.
+        CLAMD_TIMEOUT_INSTREAM bounds what clamd does, each drain and the wait for the reply
+        after the last chunk, never the time the chunks take to arrive.
+
+            Parameters:
+                chunks (AsyncIterable[bytes]): the payload
+
+            Returns:
+                result (str): clamd reply
+        """
+        timeout = self.conf.CLAMD_TIMEOUT_INSTREAM
+        await self.pvs.get_connection()
+        conn = self.pvs.conn
+        try:
+            conn.writer.write(b'nINSTREAM\n')
+            async for chunk in chunks:
+                if not chunk:
+                    continue
+                conn.writer.write(struct.pack('!L', len(chunk)) + chunk)
+                await self._within(timeout, conn.writer.drain(), conn)
+            conn.writer.write(struct.pack('!L', 0))
+            await self._within(timeout, conn.writer.drain(), conn)
+            data = await self._within(timeout, conn.reader.read(), conn)
+        except (BrokenPipeError, ConnectionResetError) as exp:
+            raise PyvalveConnectionError(exp) from exp
+        finally:
+            conn.writer.close()
+
+        result = data.decode().strip()
+        if "INSTREAM size limit exceeded" in result:
+            raise PyvalveStreamMaxLength(result)
+        return result
+
     async def connecting(self):
         """ Connecting """
         self.logger.info("Connecting...")
@@ -80,3 +198,179 @@ class ClamAv:
         except AttributeError:
             self.logger.info("AttributeError, connecting...")
             await self.connecting()
+
+
+class ScannerBackend(SignatureVersionCache):
+    """
+    ScannerBackend
+    Interface of the scanners ClamRouter routes to: clamd over TCP or a unix socket
+    (ClamAvPool, ClamdSessionPool) or libclamav loaded in worker processes (LibClamAvPool).
+    Every backend answers in clamd's reply formats, e.g. 'stream: Eicar FOUND', and raises
+    pyvalve exceptions, so callers do not depend on which one is configured.
+    """
+    size: int
+
+    @abstractmethod
+    def set_logger(self, logger):
+        """ Set Logger """
+
+    @abstractmethod
+    async def ping(self) -> str:
+        """ PING reply """
+
+    @abstractmethod
+    async def stats(self) -> str:
+        """ STATS reply """
+
+    @abstractmethod
+    async def scan(self, path: str) -> str:
+        """ SCAN reply for a path """
+
+    @abstractmethod
+    async def contscan(self, path: str) -> str:
+        """ CONTSCAN reply for a path """
+
+    @abstractmethod
+    async def instream(self, file) -> str:
+        """ INSTREAM reply for a file object or an async iterable of byte chunks """
+
+    @abstractmethod
+    async def connecting(self) -> None:
+        """ Prepare every client so the first requests do not pay for it """
+
+    @abstractmethod
+    async def close(self) -> None:
+        """ Release connections or worker processes """
+
+    @abstractmethod
+    def pool_stats(self) -> dict:
+        """ Pool state for metrics """
+
+    def probe_client(self):
+        """ Client for the reload monitor's STATS and VERSION probes, outside the pool """
+        return ClamAv(self.conf)
+
+
+class ClamAvPool(ScannerBackend): # pylint: disable=too-many-instance-attributes
+    """
+    ClamAvPool
+    A fixed size pool of ClamAv clients for one clamd, exposing the ClamAv command API.
+    Every command checks a client out of the pool, so concurrent requests never share
+    a pyvalve connection.
+    """
+    def __init__(self, conf, size: int) -> None:
+        """
+        ClamAvPool constructor
+
+            Parameters:
+                conf (module): ScanCan configuration
+                size (int): number of clients
+
+            Returns:
+                None
+        """
+        self.conf = conf
+        self.size = size
+        self.logger = None
+        self.clients: List[ClamAv] = [ClamAv(conf) for _ in range(size)]
+        self.idle: Optional[asyncio.Queue] = None
+        self.waiting = 0
+        self.sig_version: Optional[str] = None
+        self.sig_checked = 0.0
+
+    def set_logger(self, logger):
+        """ Set Logger """
+        self.logger = logger
+        for client in self.clients:
+            client.set_logger(logger)
+
+    def _queue(self) -> asyncio.Queue:
+        if self.idle is None:
+            self.idle = asyncio.Queue()
+            for client in self.clients:
+                self.idle.put_nowait(client)
+        return self.idle
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[ClamAv]:
+        """ Check a client out of the pool for the duration of the block """
+        idle = self._queue()
+        self.waiting += 1
+        try:
+            with span('clamd_queue'):
+                client = await idle.get()
+        finally:
+            self.waiting -= 1
+        try:
+            yield client
+        finally:
+            idle.put_nowait(client)
+
+    async def ping(self):
+        """ Ping """
+        async with self.acquire() as client:
+            return await client.ping()
+
+    async def version(self):
+        """ Version """
+        async with self.acquire() as client:
+            return await client.version()
+
+    async def stats(self):
+        """ Stats """
+        async with self.acquire() as client:
+            return await client.stats()
+
+    async def scan(self, path):
+        """ Scan """
+        async with self.acquire() as client:
+            return await client.scan(path)
+
+    async def contscan(self, path):
+        """ Cont Scan """
+        async with self.acquire() as client:
+            return await client.contscan(path)
+
+    async def instream(self, file):
+        """ Instream """
+        async with self.acquire() as client:
+            return await client.instream(file)
+
+    async def connecting(self):
+        """ Connect and ping every client so the first requests do not pay for it """
+        await asyncio.gather(*(self._warm(client) for client in self.clients))
+
+    async def _warm(self, client: ClamAv) -> None:
+        await client.connecting()
+        await client.ping()
+
+    async def close(self) -> None:
+        """ Nothing to release, pyvalve opens a connection per command """
+
+    def pool_stats(self) -> dict:
+        """
+        Pool Stats
+
+            Returns:
+                stats (dict): pool size, idle clients and waiting requests
+        """
+        idle = self._queue()
+        return {
+            "size": self.size,
+            "idle": idle.qsize(),
+            "in_use": self.size - idle.qsize(),
+            "waiting": self.waiting,
+        }
+
+
+def split_pool_size(total: int, workers: int) -> int:
+    """ Share of a host-wide clamd pool size for one worker process """
+    return max(1, total // max(1, workers))
+
+
+def parse_signature_version(version: str) -> str:
+    """ Extract the database version from a VERSION reply like 'ClamAV 1.0.3/27100/Mon Oct 16' """
+    parts = version.strip().split('/')
+    if len(parts) >= 2 and parts[1].strip():
+        return parts[1].strip()
+    return version.strip()
@@ -0,0 +1,404 @@
+""" Multiplexed clamd IDSESSION Connections """
+import asyncio
+import os
+import struct
+import time
+from typing import Any, AsyncIterable, Dict, List, Optional, Tuple
+
+from pyvalve import (
+    PyvalveConnectionError,
+    PyvalveResponseError,
+    PyvalveScanningError,
+    PyvalveStreamMaxLength,
+)
+
+from clamav import ClamAvPool, ClamdTimeoutError, ScannerBackend
+from tracing import span
+
+STREAM_CHUNK = 65536
+END_OF_STREAM = struct.pack('!L', 0)
+
+
+class _Reply: # pylint: disable=too-few-public-methods
+    """ A command waiting for its reply """
+    __slots__ = ('future', 'multiline', 'lines')
+
+    def __init__(self, future: asyncio.Future, multiline: bool) -> None:
+        self.future = future
+        self.multiline = multiline
+        self.lines: List[str] = []
+
+
+def parse_reply(line: str) -> Tuple[int, str]:
+    """
+    Split a session reply line like '12: stream: OK' into request id and reply
+
+        Raises:
+            PyvalveConnectionError: the line carries no request id
+    """
+    request_id, sep, reply = line.partition(': ')
+    if not sep or not request_id.isdigit():
+        raise PyvalveConnectionError(f"Unexpected clamd session reply: {line}")
+    return int(request_id), reply
+
+
+class ClamdSession: # pylint: disable=too-many-instance-attributes
+    """
+    ClamdSession
+    One clamd connection in IDSESSION mode. clamd numbers the commands of a session from 1
+    and tags every reply with that number, so commands are written back to back and their
+    replies, which may arrive out of order, are matched to the waiting callers. Commands
+    are written one at a time; an INSTREAM body holds the writer until its last chunk.
+    """
+    def __init__(self, conf, logger=None) -> None:
+        """
+        ClamdSession constructor
+
+            Parameters:
+                conf (module): ScanCan configuration or a BackendConf
+                logger (Logger): application logger
+
+            Returns:
+                None
+        """
+        self.conf = conf
+        self.logger = logger
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.reader_task: Optional[asyncio.Task] = None
+        self.write_lock = asyncio.Lock()
+        self.pending: Dict[int, _Reply] = {}
+        self.next_id = 1
+        self.last_used = 0.0
+        self.commands = 0
+        self.reconnects = 0
+        self.assigned = 0
+
+    @property
+    def connected(self) -> bool:
+        """ Whether the session connection is open """
+        return self.writer is not None and not self.writer.is_closing()
+
+    @property
+    def outstanding(self) -> int:
+        """ Commands sent and not yet answered """
+        return len(self.pending)
+
+    @property
+    def writing(self) -> bool:
+        """ Whether a command is being written """
+        return self.write_lock.locked()
+
+    async def open(self) -> None:
+        """ Connect and start the session """
+        try:
+            if self.conf.CLAMD_CONN == 'net':
+                self.reader, self.writer = await asyncio.open_connection(
+                    self.conf.CLAMD_HOST, self.conf.CLAMD_PORT)
+            else:
+                self.reader, self.writer = await asyncio.open_unix_connection(
+                    self.conf.CLAMD_SOCKET)
+        except OSError as err:
+            raise PyvalveConnectionError(str(err)) from err
+        self.writer.write(b'nIDSESSION\n')
+        self.next_id = 1
+        self.reconnects += 1
+        self.reader_task = asyncio.create_task(self._read_replies(self.reader))
+
+    def close(self, error: Optional[BaseException] = None) -> None:
+        """ Close the connection, failing every command still waiting for a reply """
+        writer, self.writer = self.writer, None
+        if writer is not None:
+            writer.close()
+        task, self.reader_task = self.reader_task, None
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+        pending, self.pending = self.pending, {}
+        for reply in pending.values():
+            if not reply.future.done():
+                reply.future.set_exception(
+                    error or PyvalveConnectionError("clamd session closed"))
+
+    async def _read_replies(self, reader: asyncio.StreamReader) -> None:
+        current: Optional[_Reply] = None
+        error: Optional[BaseException] = None
+        try:
+            while True:
+                raw = await reader.readline()
+                if not raw:
+                    error = PyvalveConnectionError("clamd closed the session")
+                    break
+                line = raw.decode(errors='replace').rstrip('\n')
+                if current is not None:
+                    # STATS replies span lines up to END
+                    current.lines.append(line)
+                    if line.strip() == 'END':
+                        _resolve(current, '\n'.join(current.lines))
+                        current = None
+                    continue
+                request_id, reply = parse_reply(line)
+                waiting = self.pending.pop(request_id, None)
+                if waiting is None:
+                    # The caller gave up on this command
+                    continue
+                if waiting.multiline and reply.strip() != 'END':
+                    waiting.lines.append(reply)
+                    current = waiting
+                    continue
+                _resolve(waiting, reply)
+        except PyvalveConnectionError as err:
+            error = err
+        except OSError as err:
+            error = PyvalveConnectionError(str(err))
+        if current is not None and not current.future.done():
+            current.future.set_exception(error or PyvalveConnectionError("clamd session closed"))
+        self.close(error)
+
+    async def command(self, name: str, *args: str, body=None, timeout: float = 0) -> str:
+        """
+        Send one command on the session and wait for its reply
+
+            Parameters:
+                name (str): clamd command, e.g. 'SCAN'
+                args (str): command arguments
+                body (bytes | AsyncIterable[bytes]): INSTREAM payload
+                timeout (float): seconds clamd may take to accept each write and to reply,
+                    0 waits forever; the time the payload takes to arrive is not counted
+
+            Returns:
+                reply (str): clamd reply without the request id
+        """
+        future = asyncio.get_running_loop().create_future()
+        async with self.write_lock:
+            if not self.connected:
+                await self.open()
+            request_id = self.next_id
+            self.next_id += 1
+            self.pending[request_id] = _Reply(future, name == 'STATS')
+            self.commands += 1
+            self.last_used = time.monotonic()
+            line = ' '.join((name,) + args)
+            streaming = False
+            try:
+                self.writer.write(f'n{line}\n'.encode()) # type: ignore[union-attr]
+                if body is not None:
+                    streaming = True
+                    await self._write_stream(body, timeout)
+                    streaming = False
+                await _within(timeout, self.writer.drain()) # type: ignore[union-attr]
+            except ClamdTimeoutError as err:
+                self.close(PyvalveConnectionError(str(err)))
+                raise
+            except (OSError, PyvalveConnectionError) as err:
+                self.close(PyvalveConnectionError(str(err)))
+                raise PyvalveConnectionError(str(err)) from err
+            except BaseException:
+                # Cancelled or failed by its payload. Chunks are written whole, so ending the
+                # stream where it stopped keeps the session usable for the other commands in
+                # flight; clamd still answers this one and the reply is discarded.
+                self.pending.pop(request_id, None)
+                if streaming and self.writer is not None:
+                    self.writer.write(END_OF_STREAM)
+                raise
+        try:
+            return await _within(timeout, future)
+        finally:
+            self.pending.pop(request_id, None)
+
+    async def _write_stream(self, body, timeout: float) -> None:
+        writer: Any = self.writer
+        if isinstance(body, (bytes, bytearray)):
+            for offset in range(0, len(body), STREAM_CHUNK):
+                chunk = body[offset:offset + STREAM_CHUNK]
+                writer.write(struct.pack('!L', len(chunk)) + chunk)
+                await _within(timeout, writer.drain())
+        else:
+            async for chunk in body:
+                if chunk:
+                    writer.write(struct.pack('!L', len(chunk)) + chunk)
+                    await _within(timeout, writer.drain())
+        writer.write(END_OF_STREAM)
+
+    def info(self) -> dict:
+        """ Session state for metrics """
+        return {
+            "connected": self.connected,
+            "outstanding": self.outstanding,
+            "commands": self.commands,
+            "reconnects": self.reconnects,
+        }
+
+
+async def _within(timeout: float, awaitable):
+    """ Await clamd, raising ClamdTimeoutError after timeout seconds unless timeout is 0 """
+    if timeout <= 0:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError as err:
+        raise ClamdTimeoutError(f"clamd did not answer within {timeout}s") from err
+
+
+def _resolve(reply: _Reply, text: str) -> None:
+    if not reply.future.done():
+        reply.future.set_result(text.strip())
+
+
+def _check(reply: str) -> str:
+    if "INSTREAM size limit exceeded" in reply:
+        raise PyvalveStreamMaxLength(reply)
+    if "ERROR" in reply:
+        raise PyvalveResponseError(reply)
+    return reply
+
+
+class ClamdSessionPool(ScannerBackend): # pylint: disable=too-many-instance-attributes
+    """
+    ClamdSessionPool
+    Drop-in replacement for ClamAvPool that multiplexes commands over a few IDSESSION
+    connections, with at most `max_in_flight` unanswered commands per connection. CONTSCAN
+    replies have no end marker inside a session, so it runs on a plain connection.
+    """
+    def __init__(self, conf, size: int, max_in_flight: int) -> None:
+        """
+        ClamdSessionPool constructor
+
+            Parameters:
+                conf (module): ScanCan configuration or a BackendConf
+                size (int): number of session connections
+                max_in_flight (int): unanswered commands per connection
+
+            Returns:
+                None
+        """
+        self.conf = conf
+        self.size = max(1, size)
+        self.max_in_flight = max(1, max_in_flight)
+        self.logger = None
+        self.sessions = [ClamdSession(conf) for _ in range(self.size)]
+        self.plain = ClamAvPool(conf, 1)
+        self.slots: Optional[asyncio.Semaphore] = None
+        self.waiting = 0
+        self.sig_version: Optional[str] = None
+        self.sig_checked = 0.0
+        self.keepalive_task: Optional[asyncio.Task] = None
+
+    def set_logger(self, logger):
+        """ Set Logger """
+        self.logger = logger
+        self.plain.set_logger(logger)
+        for session in self.sessions:
+            session.logger = logger
+
+    def _slots(self) -> asyncio.Semaphore:
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.size * self.max_in_flight)
+        return self.slots
+
+    def _pick(self) -> ClamdSession:
+        """ Least loaded session, preferring one that is not busy writing a stream """
+        return min(self.sessions, key=lambda s: (s.writing, s.assigned, not s.connected))
+
+    async def _run(self, command: str, timeout: float, *args: str, body=None) -> str:
+        slots = self._slots()
+        self.waiting += 1
+        try:
+            with span('clamd_queue'):
+                await slots.acquire()
+        finally:
+            self.waiting -= 1
+        session = self._pick()
+        session.assigned += 1
+        try:
+            with span('clamd', command=command.lower()):
+                return _check(await session.command(command, *args, body=body, timeout=timeout))
+        finally:
+            session.assigned -= 1
+            slots.release()
+
+    async def ping(self):
+        """ Ping """
+        return await self._run('PING', self.conf.CLAMD_TIMEOUT_PING)
+
+    async def version(self):
+        """ Version """
+        return await self._run('VERSION', self.conf.CLAMD_TIMEOUT_PING)
+
+    async def stats(self):
+        """ Stats """
+        return await self._run('STATS', self.conf.CLAMD_TIMEOUT_PING)
+
+    async def scan(self, path):
+        """ Scan """
+        exists = await asyncio.get_running_loop().run_in_executor(None, os.path.exists, path)
+        if not exists:
+            raise PyvalveScanningError(f'Path not found: {path}')
+        return await self._run('SCAN', self.conf.CLAMD_TIMEOUT_SCAN, path)
+
+    async def contscan(self, path):
+        """ Cont Scan """
+        return await self.plain.contscan(path)
+
+    async def instream(self, file):
+        """ Instream a file object or an async iterable of byte chunks """
+        if hasattr(file, '__aiter__'):
+            body: Any = file
+        else:
+            with file as fh:
+                body = fh.read()
+        return await self._run('INSTREAM', self.conf.CLAMD_TIMEOUT_INSTREAM, body=body)
+
+    async def instream_chunks(self, chunks: AsyncIterable[bytes]) -> str:
+        """ Stream chunks to clamd as they are produced """
+        return await self.instream(chunks)
+
+    async def connecting(self):
+        """ Open every session and start the keepalive """
+        await asyncio.gather(*(self._warm(session) for session in self.sessions))
+        if self.keepalive_task is None and self.conf.CLAMD_SESSION_KEEPALIVE > 0:
+            self.keepalive_task = asyncio.create_task(self._keepalive())
+
+    async def _warm(self, session: ClamdSession) -> None:
+        await session.command('PING')
+
+    async def _keepalive(self) -> None:
+        """ Ping idle sessions before clamd's IdleTimeout closes them """
+        interval = self.conf.CLAMD_SESSION_KEEPALIVE
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            for session in self.sessions:
+                if session.connected and not session.outstanding \
+                        and now - session.last_used >= interval:
+                    try:
+                        await asyncio.wait_for(
+                            session.command('PING'), self.conf.CLAMD_TIMEOUT_PING)
+                    except (PyvalveConnectionError, asyncio.TimeoutError):
+                        session.close()
+
+    async def close(self) -> None:
+        """ Stop the keepalive and close every session """
+        task, self.keepalive_task = self.keepalive_task, None
+        if task:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        for session in self.sessions:
+            session.close()
+
+    def pool_stats(self) -> dict:
+        """
+        Pool Stats
+
+            Returns:
+                stats (dict): sessions, commands in flight and waiting requests
+        """
+        in_flight = sum(session.outstanding for session in self.sessions)
+        return {
+            "size": self.size,
+            "mode": "idsession",
+            "max_in_flight": self.max_in_flight,
+            "in_use": in_flight,
+            "idle": self.size * self.max_in_flight - in_flight,
+            "waiting": self.waiting,
+            "sessions": [session.info() for session in self.sessions],
+        }
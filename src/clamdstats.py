@@ -0,0 +1,113 @@
+""" clamd STATS Parsing """
+import re
+from typing import Any, Dict, List, Optional
+
+THREADS = re.compile(
+    r'live\s+(\d+)\s+idle\s+(\d+)\s+max\s+(\d+)(?:\s+idle-timeout\s+(\d+))?')
+QUEUE = re.compile(r'(\d+)\s+items?')
+QUEUE_ITEM = re.compile(r'^\s+(\S+)\s+(\d+(?:\.\d+)?)(?:\s+(.*))?$')
+MEMORY_FIELD = re.compile(r'(\w+)\s+(N/A|\d+(?:\.\d+)?)(M?)')
+
+
+def _megabytes(value: str, suffix: str) -> Optional[float]:
+    if value == 'N/A':
+        return None
+    # MEMSTATS reports sizes in megabytes; 'pools' alone is a count
+    return float(value) if suffix else float(int(float(value)))
+
+
+def _parse_pool_line(pool: Dict[str, Any], key: str, value: str) -> None:
+    if key == 'STATE':
+        pool['state'] = value
+    elif key == 'THREADS':
+        match = THREADS.search(value)
+        if match:
+            live, idle, most, timeout = match.groups()
+            pool['threads'] = {
+                'live': int(live),
+                'idle': int(idle),
+                'max': int(most),
+                'idle_timeout': int(timeout) if timeout is not None else None,
+            }
+    elif key == 'QUEUE':
+        match = QUEUE.search(value)
+        pool['queue']['items'] = int(match.group(1)) if match else 0
+
+
+def parse_stats(text: str) -> Dict[str, Any]:
+    """
+    Parse a clamd STATS reply
+
+        Parameters:
+            text (str): STATS reply, up to and including END
+
+        Returns:
+            stats (dict): 'pools', a list with the state, threads and queue of each thread
+                pool, and 'memory' in megabytes, None where clamd reports N/A. The commands
+                clamd lists under QUEUE, queued or running, are kept as 'jobs' with their
+                age in seconds.
+    """
+    pools: List[Dict[str, Any]] = []
+    pool: Optional[Dict[str, Any]] = None
+    memory: Dict[str, Optional[float]] = {}
+    declared = 0
+    for line in text.splitlines():
+        if not line.strip() or line.strip() == 'END':
+            continue
+        if line[0].isspace():
+            item = QUEUE_ITEM.match(line)
+            if item is not None and pools:
+                command, age, detail = item.groups()
+                pools[-1]['queue']['jobs'].append(
+                    {'command': command, 'age': float(age), 'detail': detail or ''})
+            continue
+        key, _, value = line.partition(':')
+        key, value = key.strip(), value.strip()
+        if key == 'POOLS':
+            declared = int(value) if value.isdigit() else 0
+        elif key == 'MEMSTATS':
+            memory = {
+                name: _megabytes(number, suffix)
+                for name, number, suffix in MEMORY_FIELD.findall(value)}
+        elif key in ('STATE', 'THREADS', 'QUEUE'):
+            if key == 'STATE' or pool is None:
+                pool = {'state': None, 'threads': None, 'queue': {'items': 0, 'jobs': []}}
+                pools.append(pool)
+            _parse_pool_line(pool, key, value)
+    return {'pools': pools, 'declared_pools': declared, 'memory': memory}
+
+
+def gauges(stats: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Capacity and saturation gauges from parsed STATS, summed over thread pools
+
+        Returns:
+            gauges (dict): threads live, idle, busy and max, busy share of max threads,
+                queued commands, the age of the oldest listed job, and memory in megabytes
+    """
+    live = idle = most = items = 0
+    oldest = 0.0
+    for pool in stats['pools']:
+        threads = pool['threads'] or {}
+        live += threads.get('live', 0)
+        idle += threads.get('idle', 0)
+        most += threads.get('max', 0)
+        items += pool['queue']['items']
+        for job in pool['queue']['jobs']:
+            oldest = max(oldest, job['age'])
+    busy = max(0, live - idle)
+    memory = stats['memory']
+    return {
+        'threads_live': live,
+        'threads_idle': idle,
+        'threads_busy': busy,
+        'threads_max': most,
+        'utilization': round(busy / most, 4) if most else None,
+        'queue_items': items,
+        'oldest_job_age': oldest,
+        'memory_heap': memory.get('heap'),
+        'memory_mmap': memory.get('mmap'),
+        'memory_used': memory.get('used'),
+        'memory_pools_used': memory.get('pools_used'),
+        'memory_pools_total': memory.get('pools_total'),
+    }
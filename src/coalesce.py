@@ -0,0 +1,99 @@
+""" Single-flight Request Coalescing """
+import asyncio
+import hashlib
+import os
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+class SingleFlight:
+    """
+    SingleFlight
+    Shares one in-flight operation between concurrent callers using the same key
+    """
+    def __init__(self) -> None:
+        """
+        SingleFlight constructor
+
+            Returns:
+                None
+        """
+        self.calls: Dict[str, asyncio.Future] = {}
+        self.waiters: Dict[str, int] = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.abandoned = 0
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run func once for all concurrent callers of key
+
+            Parameters:
+                key (str): coalescing key
+                func (Callable): coroutine function performing the operation
+
+            Returns:
+                result (Any): the shared result; exceptions are shared too. The operation
+                    is cancelled when every caller has been cancelled
+        """
+        future = self.calls.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            self.leaders += 1
+            future = asyncio.ensure_future(func())
+            self.calls[key] = future
+            self.waiters[key] = 0
+
+            def _forget(done: asyncio.Future) -> None:
+                if self.calls.get(key) is done:
+                    del self.calls[key]
+                    del self.waiters[key]
+
+            future.add_done_callback(_forget)
+        self.waiters[key] += 1
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if not future.done() and self.waiters[key] == 1:
+                # Nobody is left to read the result
+                future.cancel()
+                self.abandoned += 1
+            raise
+        finally:
+            if key in self.waiters and self.calls.get(key) is future:
+                self.waiters[key] -= 1
+
+    def stats(self) -> dict:
+        """
+        Stats
+
+            Returns:
+                stats (dict): leader, coalesced, abandoned and in-flight counts
+        """
+        total = self.leaders + self.coalesced
+        return {
+            "in_flight": len(self.calls),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "abandoned": self.abandoned,
+            "coalesced_ratio": self.coalesced / total if total else 0.0,
+        }
+
+
+def file_digest(fileobj, chunk_size: int = 1048576) -> str:
+    """ SHA-256 of a seekable file object, leaving it rewound """
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    for chunk in iter(lambda: fileobj.read(chunk_size), b''):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+def path_key(command: str, path: str) -> Optional[str]:
+    """ Coalescing key for a mounted path, or None if it cannot be stat'ed """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return f"{command}:{path}:{stat.st_mtime_ns}:{stat.st_size}"
@@ -3,10 +3,119 @@ import os
 
 SCAN_CAN_VERSION: str = "0.1.0"
 UPLOAD_SIZE_LIMIT: int = 104857600
-CLAMD_CONN: str = os.environ.get('CLAMD_CONN', "net")  # 'net' or 'socket'
+CLAMD_CONN: str = os.environ.get('CLAMD_CONN', "net")  # 'net', 'socket' or 'libclamav'
 CLAMD_SOCKET: str = os.environ.get('CLAMD_SOCKET', "/tmp/clamd.socket")
 CLAMD_HOST: str = os.environ.get('CLAMD_HOST', "lab3.local")
 CLAMD_PORT: int = int(os.environ.get('CLAMD_PORT', 3310))
 USE_AUTHENTICATION: bool = os.getenv("USE_AUTHENTICATION", "false").lower() == "true"
 LOG_FORMAT: str = os.getenv("LOG_FORMAT", "%(asctime)s\t%(name)s\t%(levelname)s\t%(message)s")
 LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO").upper()
+WATCH_PATHS: list = [p for p in os.getenv("WATCH_PATHS", "").split(",") if p.strip()]
+WATCH_WORKERS: int = int(os.getenv("WATCH_WORKERS", "4"))
+WATCH_QUEUE_SIZE: int = int(os.getenv("WATCH_QUEUE_SIZE", "1000"))
+WATCH_DEBOUNCE: float = float(os.getenv("WATCH_DEBOUNCE", "0.5"))
+WATCH_ACTION: str = os.getenv("WATCH_ACTION", "log")  # 'log' or 'quarantine'
+WATCH_QUARANTINE_DIR: str = os.getenv("WATCH_QUARANTINE_DIR", "/tmp/scancan-quarantine")
+WATCH_RESULTS_LOG: str = os.getenv("WATCH_RESULTS_LOG", "")
+COALESCE_SCANS: bool = os.getenv("COALESCE_SCANS", "true").lower() == "true"
+SIGNATURE_VERSION_TTL: float = float(os.getenv("SIGNATURE_VERSION_TTL", "60"))
+URL_CACHE_SIZE: int = int(os.getenv("URL_CACHE_SIZE", "0"))
+URL_CACHE_TTL: float = float(os.getenv("URL_CACHE_TTL", "3600"))
+STREAM_CHUNK_SIZE: int = int(os.getenv("STREAM_CHUNK_SIZE", "65536"))
+DECOMPRESS_MAX_SIZE: int = int(os.getenv("DECOMPRESS_MAX_SIZE", str(UPLOAD_SIZE_LIMIT)))
+DECOMPRESS_MAX_RATIO: float = float(os.getenv("DECOMPRESS_MAX_RATIO", "100"))
+AUDIT_PATH: str = os.getenv("AUDIT_PATH", "")  # empty disables the audit log
+AUDIT_FORMAT: str = os.getenv("AUDIT_FORMAT", "ndjson")  # 'ndjson' or 'sqlite'
+AUDIT_BUFFER_SIZE: int = int(os.getenv("AUDIT_BUFFER_SIZE", "10000"))  # entries
+AUDIT_BATCH_SIZE: int = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+AUDIT_FLUSH_INTERVAL: float = float(os.getenv("AUDIT_FLUSH_INTERVAL", "1.0"))  # seconds
+AUDIT_RETRY_MAX_DELAY: float = float(os.getenv("AUDIT_RETRY_MAX_DELAY", "30.0"))  # seconds
+AUDIT_ROTATE_BYTES: int = int(os.getenv("AUDIT_ROTATE_BYTES", "104857600"))
+AUDIT_ROTATE_KEEP: int = int(os.getenv("AUDIT_ROTATE_KEEP", "5"))
+VERDICT_CACHE_PATH: str = os.getenv("VERDICT_CACHE_PATH", "")
+VERDICT_CACHE_MAX_ENTRIES: int = int(os.getenv("VERDICT_CACHE_MAX_ENTRIES", "1000000"))
+VERDICT_CACHE_FLUSH_INTERVAL: float = float(os.getenv("VERDICT_CACHE_FLUSH_INTERVAL", "1.0"))
+VERDICT_CACHE_FLUSH_SIZE: int = int(os.getenv("VERDICT_CACHE_FLUSH_SIZE", "256"))
+SCANCAN_HOST: str = os.getenv("SCANCAN_HOST", "0.0.0.0")
+SCANCAN_PORT: int = int(os.getenv("SCANCAN_PORT", "8080"))
+SCANCAN_WORKERS: int = int(os.getenv("SCANCAN_WORKERS", "1"))
+CLAMD_POOL_SIZE: int = int(os.getenv("CLAMD_POOL_SIZE", "4"))  # total across all workers
+CLAMD_SESSIONS: int = int(os.getenv("CLAMD_SESSIONS", "0"))  # IDSESSION connections, 0 = off
+CLAMD_SESSION_MAX_IN_FLIGHT: int = int(os.getenv("CLAMD_SESSION_MAX_IN_FLIGHT", "16"))
+CLAMD_SESSION_KEEPALIVE: float = float(os.getenv("CLAMD_SESSION_KEEPALIVE", "10"))  # seconds
+CLAMD_STANDBY: str = os.getenv("CLAMD_STANDBY", "")  # 'net:host:port' or 'socket:/path'
+CLAMD_FLEET_SIZE: int = int(os.getenv("CLAMD_FLEET_SIZE", "0"))  # local clamd processes, 0 = off
+CLAMD_FLEET_DIR: str = os.getenv("CLAMD_FLEET_DIR", "/tmp/clamd-fleet")
+CLAMD_FLEET_CONFIG: str = os.getenv("CLAMD_FLEET_CONFIG", "/etc/clamav/clamd.conf")
+CLAMD_FLEET_BINARY: str = os.getenv("CLAMD_FLEET_BINARY", "clamd")
+CLAMD_FLEET_CHECK_INTERVAL: float = float(os.getenv("CLAMD_FLEET_CHECK_INTERVAL", "1.0"))
+CLAMD_FLEET_RELOAD_CHECK: float = float(os.getenv("CLAMD_FLEET_RELOAD_CHECK", "60"))  # seconds
+CLAMD_FLEET_RELOAD_STAGGER: float = float(os.getenv("CLAMD_FLEET_RELOAD_STAGGER", "10"))
+CLAMD_FLEET_RESTART_MAX_DELAY: float = float(os.getenv("CLAMD_FLEET_RESTART_MAX_DELAY", "60"))
+CLAMD_FLEET_PROBE_TIMEOUT: float = float(os.getenv("CLAMD_FLEET_PROBE_TIMEOUT", "1.0"))
+CLAMD_FLEET_STOP_TIMEOUT: float = float(os.getenv("CLAMD_FLEET_STOP_TIMEOUT", "10"))
+LIBCLAMAV_PATH: str = os.getenv("LIBCLAMAV_PATH", "")  # default: the system libclamav
+LIBCLAMAV_DATABASE: str = os.getenv("LIBCLAMAV_DATABASE", "/opt/clamav")
+LIBCLAMAV_WORKERS: int = int(os.getenv("LIBCLAMAV_WORKERS", "2"))  # processes, one engine each
+LIBCLAMAV_BUFFER_MAX: int = int(os.getenv("LIBCLAMAV_BUFFER_MAX", "16777216"))  # bytes
+LIBCLAMAV_TMP_DIR: str = os.getenv("LIBCLAMAV_TMP_DIR", "")
+RELOAD_CHECK_INTERVAL: float = float(os.getenv("RELOAD_CHECK_INTERVAL", "2.0"))
+RELOAD_PROBE_TIMEOUT: float = float(os.getenv("RELOAD_PROBE_TIMEOUT", "2.0"))
+RELOAD_HOLD_TIMEOUT: float = float(os.getenv("RELOAD_HOLD_TIMEOUT", "30.0"))
+CLAMD_STATS_MAX_AGE: float = float(os.getenv("CLAMD_STATS_MAX_AGE", "5.0"))  # seconds
+CLAMD_TIMEOUT_PING: float = float(os.getenv("CLAMD_TIMEOUT_PING", "5"))  # also VERSION, STATS
+CLAMD_TIMEOUT_SCAN: float = float(os.getenv("CLAMD_TIMEOUT_SCAN", "300"))
+CLAMD_TIMEOUT_CONTSCAN: float = float(os.getenv("CLAMD_TIMEOUT_CONTSCAN", "600"))
+CLAMD_TIMEOUT_INSTREAM: float = float(os.getenv("CLAMD_TIMEOUT_INSTREAM", "120"))
+CLAMD_STREAM_MAX_LENGTH: int = int(os.getenv("CLAMD_STREAM_MAX_LENGTH", "104857600"))  # clamd.conf
+BREAKER_FAILURES: int = int(os.getenv("BREAKER_FAILURES", "5"))  # 0 disables
+BREAKER_RESET: float = float(os.getenv("BREAKER_RESET", "30"))
+HEDGE_MAX_SIZE: int = int(os.getenv("HEDGE_MAX_SIZE", "0"))  # 0 disables hedging
+HEDGE_MIN_DELAY: float = float(os.getenv("HEDGE_MIN_DELAY", "0.05"))
+HEDGE_MIN_SAMPLES: int = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+SERVER_TIMING: bool = os.getenv("SERVER_TIMING", "true").lower() == "true"
+TRACE_SAMPLE_RATE: float = float(os.getenv("TRACE_SAMPLE_RATE", "0.0"))  # share of traces exported
+TRACE_FOLLOW_PARENT: bool = os.getenv("TRACE_FOLLOW_PARENT", "false").lower() == "true"
+TRACE_EXPORT_PATH: str = os.getenv("TRACE_EXPORT_PATH", "")  # OTLP/JSON lines
+TRACE_FLUSH_INTERVAL: float = float(os.getenv("TRACE_FLUSH_INTERVAL", "1.0"))
+TRACE_QUEUE_SIZE: int = int(os.getenv("TRACE_QUEUE_SIZE", "10000"))
+LOOP_MONITOR: bool = os.getenv("LOOP_MONITOR", "true").lower() == "true"
+LOOP_LAG_INTERVAL: float = float(os.getenv("LOOP_LAG_INTERVAL", "0.1"))  # seconds
+LOOP_STALL_THRESHOLD: float = float(os.getenv("LOOP_STALL_THRESHOLD", "0.1"))  # seconds
+LOOP_STALL_HISTORY: int = int(os.getenv("LOOP_STALL_HISTORY", "50"))
+LOOP_STALL_STACKS: int = int(os.getenv("LOOP_STALL_STACKS", "100"))
+PROFILE_MAX_SECONDS: float = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+PROFILE_CONTINUOUS: bool = os.getenv("PROFILE_CONTINUOUS", "false").lower() == "true"
+PROFILE_CONTINUOUS_INTERVAL: float = float(os.getenv("PROFILE_CONTINUOUS_INTERVAL", "0.1"))
+PROFILE_WINDOW: float = float(os.getenv("PROFILE_WINDOW", "10"))
+PROFILE_RETENTION: float = float(os.getenv("PROFILE_RETENTION", "300"))
+SCHED_ENABLED: bool = os.getenv("SCHED_ENABLED", "true").lower() == "true"
+SCHED_WEIGHTS: str = os.getenv("SCHED_WEIGHTS", "interactive=8,bulk=2,background=1")
+SCHED_INTERACTIVE_MAX_SIZE: int = int(os.getenv("SCHED_INTERACTIVE_MAX_SIZE", "10485760"))
+SCHED_FAST_LANE_SIZE: int = int(os.getenv("SCHED_FAST_LANE_SIZE", "1048576"))
+SCHED_FAST_LANE_SLOTS: int = int(os.getenv("SCHED_FAST_LANE_SLOTS", "1"))
+RATE_LIMIT_FILE: str = os.getenv("RATE_LIMIT_FILE", "")  # JSON tenants and limits
+RATE_LIMIT_MAX_KEYS: int = int(os.getenv("RATE_LIMIT_MAX_KEYS", "10000"))
+WS_MAX_IN_FLIGHT: int = int(os.getenv("WS_MAX_IN_FLIGHT", "32"))  # scans per connection
+WS_BUFFER_CHUNKS: int = int(os.getenv("WS_BUFFER_CHUNKS", "16"))  # queued chunks per file
+RANGE_PARALLEL: int = int(os.getenv("RANGE_PARALLEL", "4"))  # 1 disables ranged downloads
+RANGE_PART_SIZE: int = int(os.getenv("RANGE_PART_SIZE", "8388608"))
+RANGE_MIN_SIZE: int = int(os.getenv("RANGE_MIN_SIZE", "33554432"))
+BULK_URL_MAX: int = int(os.getenv("BULK_URL_MAX", "10000"))  # URLs per request
+BULK_URL_CONCURRENCY: int = int(os.getenv("BULK_URL_CONCURRENCY", "32"))
+BULK_URL_PER_HOST: int = int(os.getenv("BULK_URL_PER_HOST", "4"))
+BULK_URL_TIMEOUT: float = float(os.getenv("BULK_URL_TIMEOUT", "300"))  # seconds per URL
+ARCHIVE_FANOUT: bool = os.getenv("ARCHIVE_FANOUT", "false").lower() == "true"
+ARCHIVE_MIN_SIZE: int = int(os.getenv("ARCHIVE_MIN_SIZE", "67108864"))  # bytes
+ARCHIVE_WORKERS: int = int(os.getenv("ARCHIVE_WORKERS", "2"))  # extraction processes
+ARCHIVE_PARALLEL: int = int(os.getenv("ARCHIVE_PARALLEL", "8"))  # member scans per archive
+ARCHIVE_MAX_DEPTH: int = int(os.getenv("ARCHIVE_MAX_DEPTH", "2"))
+ARCHIVE_MAX_MEMBERS: int = int(os.getenv("ARCHIVE_MAX_MEMBERS", "10000"))
+ARCHIVE_MAX_EXPANDED: int = int(os.getenv("ARCHIVE_MAX_EXPANDED", "4294967296"))  # bytes
+ARCHIVE_TMP_DIR: str = os.getenv("ARCHIVE_TMP_DIR", "")
+UPLOAD_RESUMABLE_MAX_SIZE: int = int(
+    os.getenv("UPLOAD_RESUMABLE_MAX_SIZE", str(CLAMD_STREAM_MAX_LENGTH)))
+UPLOAD_DIR: str = os.getenv("UPLOAD_DIR", "")  # default: scancan-uploads in the temp directory
+UPLOAD_SESSION_TTL: float = float(os.getenv("UPLOAD_SESSION_TTL", "86400"))  # idle seconds
+UPLOAD_MAX_SESSIONS: int = int(os.getenv("UPLOAD_MAX_SESSIONS", "1000"))  # per worker
+UPLOAD_STALL_TIMEOUT: float = float(os.getenv("UPLOAD_STALL_TIMEOUT", "20"))  # seconds
@@ -0,0 +1,282 @@
+""" Local clamd Fleet Supervisor """
+import os
+import socket
+import subprocess
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, List, Optional
+
+from utils import database_stamp
+
+# Settings the supervisor owns in every generated clamd.conf
+OVERRIDDEN = (
+    'localsocket', 'tcpsocket', 'tcpaddr', 'pidfile', 'foreground', 'selfcheck',
+    'concurrentdatabasereload', 'logfile')
+RELOAD_SETTLE = 1.0
+
+
+def fleet_socket(directory: str, index: int) -> str:
+    """ Socket path of one fleet clamd """
+    return os.path.join(directory, f"clamd-{index}.socket")
+
+
+def render_config(base: str, directory: str, index: int) -> str:
+    """
+    clamd.conf for one fleet instance, derived from the shared one
+
+        Parameters:
+            base (str): contents of the shared clamd.conf
+            directory (str): fleet directory for sockets, pid files and configs
+            index (int): instance number
+
+        Returns:
+            config (str): the shared settings with this instance's socket, pid file and log
+                file. Database checks are disabled because the supervisor staggers reloads,
+                and reloads block so two engines never share one instance's memory.
+    """
+    lines = []
+    log_file = None
+    for line in base.splitlines():
+        words = line.split(None, 1)
+        if words and words[0].lower() in OVERRIDDEN:
+            if words[0].lower() == 'logfile' and len(words) > 1:
+                log_file = words[1].strip()
+            continue
+        lines.append(line)
+    lines += [
+        f"LocalSocket {fleet_socket(directory, index)}",
+        f"PidFile {os.path.join(directory, f'clamd-{index}.pid')}",
+        "Foreground yes",
+        "SelfCheck 0",
+        "ConcurrentDatabaseReload no",
+    ]
+    if log_file:
+        root, ext = os.path.splitext(log_file)
+        lines.append(f"LogFile {root}-{index}{ext}")
+    return '\n'.join(lines) + '\n'
+
+
+def clamd_command(path: str, command: bytes, timeout: float) -> str:
+    """ Send one command to a clamd socket and return its reply """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+        conn.settimeout(timeout)
+        conn.connect(path)
+        conn.sendall(b'n' + command + b'\n')
+        reply = b''
+        while True:
+            data = conn.recv(4096)
+            if not data:
+                break
+            reply += data
+    return reply.decode(errors='replace').strip()
+
+
+class ClamdInstance: # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    """
+    ClamdInstance
+    One supervised clamd process
+    """
+    def __init__(self, index: int, config: str, socket_path: str) -> None:
+        """
+        ClamdInstance constructor
+
+            Parameters:
+                index (int): instance number
+                config (str): generated clamd.conf path
+                socket_path (str): LocalSocket of the instance
+
+            Returns:
+                None
+        """
+        self.index = index
+        self.config = config
+        self.socket = socket_path
+        self.process: Optional[subprocess.Popen] = None
+        self.started = 0.0
+        self.restarts = 0
+        self.backoff = 0.0
+        self.next_start = 0.0
+        self.reload_sent: Optional[float] = None
+
+
+class ClamdFleet: # pylint: disable=too-many-instance-attributes
+    """
+    ClamdFleet
+    Starts CLAMD_FLEET_SIZE clamd processes, each with its own socket and generated config,
+    restarts them with backoff when they exit, and reloads their signatures one at a time
+    when the database changes, so some instances always keep scanning.
+    Runs in the serving master process, next to the uvicorn workers that scan through it.
+    """
+    def __init__(self, conf, logger: Any) -> None:
+        """
+        ClamdFleet constructor
+
+            Parameters:
+                conf (module): ScanCan configuration
+                logger (Logger): logger
+
+            Returns:
+                None
+        """
+        self.conf = conf
+        self.logger = logger
+        self.directory = conf.CLAMD_FLEET_DIR
+        self.database = ''
+        self.instances: List[ClamdInstance] = []
+        self.stamp: Optional[float] = None
+        self.next_check = 0.0
+        self.pending: Deque[ClamdInstance] = deque()
+        self.next_reload = 0.0
+        self.stopping = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.reloads = 0
+
+    def _database(self, base: str) -> str:
+        for line in base.splitlines():
+            words = line.split(None, 1)
+            if len(words) == 2 and words[0].lower() == 'databasedirectory':
+                return words[1].strip()
+        return '/var/lib/clamav'
+
+    def prepare(self) -> None:
+        """ Write one clamd.conf per instance """
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.conf.CLAMD_FLEET_CONFIG, encoding='utf-8') as source:
+            base = source.read()
+        self.database = self._database(base)
+        self.instances = []
+        for index in range(self.conf.CLAMD_FLEET_SIZE):
+            path = os.path.join(self.directory, f"clamd-{index}.conf")
+            with open(path, 'w', encoding='utf-8') as target:
+                target.write(render_config(base, self.directory, index))
+            self.instances.append(ClamdInstance(index, path, fleet_socket(self.directory, index)))
+        self.stamp = database_stamp(self.database)
+
+    def start(self) -> None:
+        """ Launch every instance and the supervising thread """
+        self.prepare()
+        self.tick(time.monotonic())
+        self.thread = threading.Thread(target=self.run, name='clamd-fleet', daemon=True)
+        self.thread.start()
+        self.logger.info("Started a fleet of %d clamd instances in %s",
+                         len(self.instances), self.directory)
+
+    def run(self) -> None:
+        """ Supervise until stopped """
+        while not self.stopping.wait(self.conf.CLAMD_FLEET_CHECK_INTERVAL):
+            try:
+                self.tick(time.monotonic())
+            except Exception as err: # pylint: disable=broad-exception-caught
+                self.logger.error("clamd fleet supervision failed: %s", err)
+
+    def stop(self) -> None:
+        """ Stop supervising and terminate every instance """
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+        for instance in self.instances:
+            if instance.process is not None and instance.process.poll() is None:
+                instance.process.terminate()
+        for instance in self.instances:
+            if instance.process is None:
+                continue
+            try:
+                instance.process.wait(self.conf.CLAMD_FLEET_STOP_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                instance.process.kill()
+                instance.process.wait()
+
+    def tick(self, now: float) -> None:
+        """ Restart exited instances and advance staggered reloads """
+        for instance in self.instances:
+            self._supervise(instance, now)
+        self._check_database(now)
+        self._advance_reload(now)
+
+    def launch(self, instance: ClamdInstance) -> subprocess.Popen:
+        """ Start one clamd in the foreground so its exit is noticed """
+        return subprocess.Popen( # pylint: disable=consider-using-with
+            [self.conf.CLAMD_FLEET_BINARY, '--config-file', instance.config],
+            stdin=subprocess.DEVNULL)
+
+    def _supervise(self, instance: ClamdInstance, now: float) -> None:
+        process = instance.process
+        if process is not None:
+            code = process.poll()
+            if code is None:
+                return
+            instance.process = None
+            instance.restarts += 1
+            if now - instance.started >= self.conf.CLAMD_FLEET_RESTART_MAX_DELAY:
+                # It ran long enough that this is not a crash loop
+                instance.backoff = 0.0
+            instance.backoff = min(
+                max(1.0, instance.backoff * 2), self.conf.CLAMD_FLEET_RESTART_MAX_DELAY)
+            instance.next_start = now + instance.backoff
+            self.logger.warning("clamd %d exited with %s, restarting in %.0fs",
+                                instance.index, code, instance.backoff)
+            if instance.reload_sent is not None:
+                # A fresh start loads the current database anyway
+                self._reloaded(instance, now)
+        if now < instance.next_start:
+            return
+        try:
+            instance.process = self.launch(instance)
+        except OSError as err:
+            instance.backoff = self.conf.CLAMD_FLEET_RESTART_MAX_DELAY
+            instance.next_start = now + instance.backoff
+            self.logger.error("Cannot start clamd %d: %s", instance.index, err)
+            return
+        instance.started = now
+
+    def _check_database(self, now: float) -> None:
+        if self.pending or now < self.next_check:
+            return
+        self.next_check = now + self.conf.CLAMD_FLEET_RELOAD_CHECK
+        stamp = database_stamp(self.database)
+        if stamp is None or stamp == self.stamp:
+            return
+        self.stamp = stamp
+        self.logger.info("Signature database changed, reloading clamd instances one at a time")
+        self.pending.extend(self.instances)
+
+    def _advance_reload(self, now: float) -> None:
+        if not self.pending:
+            return
+        instance = self.pending[0]
+        if instance.reload_sent is None:
+            if now >= self.next_reload:
+                self._send_reload(instance, now)
+            return
+        if now - instance.reload_sent < RELOAD_SETTLE:
+            return
+        # A blocking reload holds every command until the new engine is ready
+        try:
+            reply = clamd_command(instance.socket, b'PING', self.conf.CLAMD_FLEET_PROBE_TIMEOUT)
+        except OSError:
+            return
+        if reply == 'PONG':
+            self._reloaded(instance, now)
+
+    def _send_reload(self, instance: ClamdInstance, now: float) -> None:
+        if instance.process is None:
+            # Down or restarting: it comes back with the new database
+            self.pending.popleft()
+            return
+        try:
+            clamd_command(instance.socket, b'RELOAD', self.conf.CLAMD_FLEET_PROBE_TIMEOUT)
+        except OSError as err:
+            self.logger.warning("Cannot reload clamd %d: %s", instance.index, err)
+            self.pending.popleft()
+            return
+        instance.reload_sent = now
+
+    def _reloaded(self, instance: ClamdInstance, now: float) -> None:
+        self.logger.info("clamd %d reloaded its signatures in %.1fs",
+                         instance.index, now - (instance.reload_sent or now))
+        instance.reload_sent = None
+        if self.pending and self.pending[0] is instance:
+            self.pending.popleft()
+        self.reloads += 1
+        self.next_reload = now + self.conf.CLAMD_FLEET_RELOAD_STAGGER
@@ -0,0 +1,473 @@
+""" In-process libclamav Scanning """
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import tempfile
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from aiofile import async_open
+from pyvalve import PyvalveConnectionError, PyvalveResponseError, PyvalveScanningError
+
+from clamav import ClamdTimeoutError, ScannerBackend
+from tracing import span
+from utils import database_stamp
+
+CL_CLEAN = 0
+CL_VIRUS = 1
+CL_INIT_DEFAULT = 0
+CL_DB_STDOPT = 0x200a  # phishing signatures, phishing URLs and bytecode, as clamd loads them
+CL_ENGINE_DB_VERSION = 8
+CL_ENGINE_DB_TIME = 9
+CL_SCAN_GENERAL_HEURISTICS = 0x4
+CL_SCAN_PARSE_ALL = 0xffffffff
+
+Verdict = Tuple[Optional[str], Optional[str]]
+
+
+class LibClamAvError(Exception):
+    """ Raised when libclamav cannot be loaded or its engine cannot be built """
+
+
+class ScanOptions(ctypes.Structure): # pylint: disable=too-few-public-methods
+    """ struct cl_scan_options """
+    _fields_ = [
+        ("general", ctypes.c_uint32),
+        ("parse", ctypes.c_uint32),
+        ("heuristic", ctypes.c_uint32),
+        ("mail", ctypes.c_uint32),
+        ("dev", ctypes.c_uint32),
+    ]
+
+
+def _declare(lib) -> None:
+    c_char_pp = ctypes.POINTER(ctypes.c_char_p)
+    options = ctypes.POINTER(ScanOptions)
+    signatures = [
+        ("cl_init", ctypes.c_int, [ctypes.c_uint]),
+        ("cl_engine_new", ctypes.c_void_p, []),
+        ("cl_engine_free", ctypes.c_int, [ctypes.c_void_p]),
+        ("cl_load", ctypes.c_int,
+         [ctypes.c_char_p, ctypes.c_void_p, ctypes.POINTER(ctypes.c_uint), ctypes.c_uint]),
+        ("cl_engine_compile", ctypes.c_int, [ctypes.c_void_p]),
+        ("cl_engine_get_num", ctypes.c_longlong,
+         [ctypes.c_void_p, ctypes.c_int, ctypes.POINTER(ctypes.c_int)]),
+        ("cl_scanfile", ctypes.c_int,
+         [ctypes.c_char_p, c_char_pp, ctypes.POINTER(ctypes.c_ulong), ctypes.c_void_p, options]),
+        ("cl_fmap_open_memory", ctypes.c_void_p, [ctypes.c_void_p, ctypes.c_size_t]),
+        ("cl_fmap_close", None, [ctypes.c_void_p]),
+        ("cl_scanmap_callback", ctypes.c_int,
+         [ctypes.c_void_p, ctypes.c_char_p, c_char_pp, ctypes.POINTER(ctypes.c_ulong),
+          ctypes.c_void_p, options, ctypes.c_void_p]),
+        ("cl_retver", ctypes.c_char_p, []),
+        ("cl_strerror", ctypes.c_char_p, [ctypes.c_int]),
+    ]
+    for name, restype, argtypes in signatures:
+        function = getattr(lib, name)
+        function.restype = restype
+        function.argtypes = argtypes
+
+
+def find_library(path: str = '') -> str:
+    """ libclamav to load: the configured path, or the system library """
+    library = path or ctypes.util.find_library('clamav')
+    if not library:
+        raise LibClamAvError("libclamav not found, set LIBCLAMAV_PATH")
+    return library
+
+
+class Engine:
+    """
+    Engine
+    A compiled libclamav engine with its signatures loaded; one per worker process
+    """
+    def __init__(self, library: str, database: str) -> None:
+        """
+        Engine constructor, loading and compiling the signature database
+
+            Parameters:
+                library (str): libclamav shared library
+                database (str): signature database directory
+
+            Returns:
+                None
+        """
+        lib = ctypes.CDLL(library)
+        _declare(lib)
+        self.lib = lib
+        self._check(lib.cl_init(CL_INIT_DEFAULT), "cl_init")
+        self.engine = lib.cl_engine_new()
+        if not self.engine:
+            raise LibClamAvError("cl_engine_new failed")
+        signatures = ctypes.c_uint(0)
+        self._check(
+            lib.cl_load(os.fsencode(database), self.engine, ctypes.byref(signatures),
+                        CL_DB_STDOPT),
+            f"loading {database}")
+        self._check(lib.cl_engine_compile(self.engine), "cl_engine_compile")
+        self.signatures = signatures.value
+        self.options = ScanOptions(
+            general=CL_SCAN_GENERAL_HEURISTICS, parse=CL_SCAN_PARSE_ALL, heuristic=0, mail=0, dev=0)
+
+    def _check(self, ret: int, what: str) -> None:
+        if ret != CL_CLEAN:
+            raise LibClamAvError(f"{what}: {self.lib.cl_strerror(ret).decode()}")
+
+    def _verdict(self, ret: int, virname: ctypes.c_char_p) -> Verdict:
+        if ret == CL_VIRUS:
+            return (virname.value or b'').decode(errors='replace'), None
+        if ret == CL_CLEAN:
+            return None, None
+        return None, self.lib.cl_strerror(ret).decode()
+
+    def scan_file(self, path: str) -> Verdict:
+        """ Scan a file, which libclamav maps into memory itself """
+        virname = ctypes.c_char_p()
+        scanned = ctypes.c_ulong(0)
+        ret = self.lib.cl_scanfile(
+            os.fsencode(path), ctypes.byref(virname), ctypes.byref(scanned), self.engine,
+            ctypes.byref(self.options))
+        return self._verdict(ret, virname)
+
+    def scan_buffer(self, data: bytes) -> Verdict:
+        """ Scan a buffer in place, without writing it to disk """
+        virname = ctypes.c_char_p()
+        scanned = ctypes.c_ulong(0)
+        # c_char_p points into the bytes object, which stays alive for the call
+        fmap = self.lib.cl_fmap_open_memory(
+            ctypes.cast(ctypes.c_char_p(data), ctypes.c_void_p), len(data))
+        if not fmap:
+            return None, "cl_fmap_open_memory failed"
+        try:
+            ret = self.lib.cl_scanmap_callback(
+                fmap, b'stream', ctypes.byref(virname), ctypes.byref(scanned), self.engine,
+                ctypes.byref(self.options), None)
+        finally:
+            self.lib.cl_fmap_close(fmap)
+        return self._verdict(ret, virname)
+
+    def version(self) -> str:
+        """ VERSION reply, e.g. 'ClamAV 1.0.3/27100/Mon Oct 16 08:27:05 2023' """
+        err = ctypes.c_int(0)
+        database = self.lib.cl_engine_get_num(self.engine, CL_ENGINE_DB_VERSION, ctypes.byref(err))
+        built = self.lib.cl_engine_get_num(self.engine, CL_ENGINE_DB_TIME, ctypes.byref(err))
+        return f"ClamAV {self.lib.cl_retver().decode()}/{database}/{time.ctime(built)}"
+
+
+_WORKER: Dict[str, Any] = {}
+
+
+def _init_worker(library: str, database: str) -> None:
+    _WORKER['engine'] = Engine(library, database)
+
+
+def _worker_version() -> str:
+    return _WORKER['engine'].version()
+
+
+def _worker_scan_buffer(data: bytes) -> str:
+    return _reply('stream', *_WORKER['engine'].scan_buffer(data))
+
+
+def _worker_scan_file(path: str, name: str) -> str:
+    return _reply(name, *_WORKER['engine'].scan_file(path))
+
+
+def _worker_scan_path(path: str, stop_on_virus: bool) -> str:
+    """ SCAN and CONTSCAN: every file under path, reporting infected and unreadable ones """
+    if not os.path.isdir(path):
+        return _reply(path, *_WORKER['engine'].scan_file(path))
+    lines: List[str] = []
+    for root, _, files in os.walk(path):
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            virname, error = _WORKER['engine'].scan_file(file_path)
+            if virname is not None or error is not None:
+                lines.append(_reply(file_path, virname, error))
+                if virname is not None and stop_on_virus:
+                    return lines[-1]
+    return '\n'.join(lines) if lines else f"{path}: OK"
+
+
+def _reply(name: str, virname: Optional[str], error: Optional[str]) -> str:
+    """ clamd reply line for one verdict """
+    if virname is not None:
+        return f"{name}: {virname} FOUND"
+    if error is not None:
+        return f"{name}: {error} ERROR"
+    return f"{name}: OK"
+
+
+class LibClamAvPool(ScannerBackend): # pylint: disable=too-many-instance-attributes
+    """
+    LibClamAvPool
+    Scans in worker processes that each hold a compiled libclamav engine, instead of sending
+    payloads over a socket to clamd. Small streams are passed to a worker and scanned as an
+    in-memory map; larger ones are spooled to a file that libclamav maps itself. When the
+    signature database changes, a new set of workers loads it while the old one keeps
+    scanning, then takes over.
+    """
+    def __init__(self, conf, size: int) -> None:
+        """
+        LibClamAvPool constructor
+
+            Parameters:
+                conf (module): ScanCan configuration
+                size (int): worker processes, each loading its own copy of the signatures
+
+            Returns:
+                None
+        """
+        self.conf = conf
+        self.size = size
+        self.logger = None
+        self.executor: Optional[Executor] = None
+        # Calls in flight per executor, and executors to kill once theirs have finished
+        self.calls: Dict[Executor, int] = {}
+        self.retired: Set[Executor] = set()
+        self.recycles = 0
+        self.loaded_stamp: Optional[float] = None
+        self.reloading: Optional[asyncio.Task] = None
+        self.in_use = 0
+        self.reloads = 0
+        self.sig_version: Optional[str] = None
+        self.sig_checked = 0.0
+
+    def set_logger(self, logger):
+        """ Set Logger """
+        self.logger = logger
+
+    def probe_client(self):
+        """ The reload monitor probes the pool itself, there is no daemon to ask """
+        return self
+
+    def _new_executor(self) -> Executor:
+        return ProcessPoolExecutor(
+            max_workers=self.size,
+            initializer=_init_worker,
+            initargs=(find_library(self.conf.LIBCLAMAV_PATH), self.conf.LIBCLAMAV_DATABASE))
+
+    def _executor(self) -> Executor:
+        if self.executor is None:
+            try:
+                self.executor = self._new_executor()
+            except LibClamAvError as err:
+                raise PyvalveConnectionError(str(err)) from err
+            self.loaded_stamp = database_stamp(self.conf.LIBCLAMAV_DATABASE)
+        return self.executor
+
+    async def _call(self, command: str, timeout: float, function, *args) -> str:
+        loop = asyncio.get_running_loop()
+        self.in_use += 1
+        executor = None
+        try:
+            with span('libclamav', command=command):
+                executor = self._executor()
+                self.calls[executor] = self.calls.get(executor, 0) + 1
+                future = loop.run_in_executor(executor, function, *args)
+                if timeout > 0:
+                    result = await asyncio.wait_for(future, timeout)
+                else:
+                    result = await future
+        except asyncio.TimeoutError as err:
+            self._retire(executor)
+            raise ClamdTimeoutError(f"libclamav did not answer within {timeout}s") from err
+        except (BrokenProcessPool, LibClamAvError) as err:
+            self.executor = None
+            raise PyvalveConnectionError(f"libclamav worker failed: {err}") from err
+        finally:
+            self.in_use -= 1
+            if executor is not None:
+                self._finished(executor)
+        if result.endswith('ERROR') and command != 'contscan':
+            raise PyvalveResponseError(result)
+        return result
+
+    def _retire(self, executor: Optional[Executor]) -> None:
+        """
+        A running scan cannot be interrupted, so a timed out one would hold its worker.
+        New calls go to fresh workers; the old ones are killed once their other calls end.
+        """
+        if executor is None:
+            return
+        if self.executor is executor:
+            self.executor = None
+            self.recycles += 1
+            if self.logger:
+                self.logger.warning("libclamav scan timed out, replacing the workers")
+        self.retired.add(executor)
+
+    def _finished(self, executor: Executor) -> None:
+        calls = self.calls.pop(executor) - 1
+        if calls > 0:
+            self.calls[executor] = calls
+        elif executor in self.retired:
+            self.retired.discard(executor)
+            _terminate(executor)
+
+    async def ping(self):
+        """ Ping: PONG once a worker has its engine loaded """
+        await self._call('ping', self.conf.CLAMD_TIMEOUT_PING, _worker_version)
+        return 'PONG'
+
+    async def version(self):
+        """ Version """
+        return await self._call('version', self.conf.CLAMD_TIMEOUT_PING, _worker_version)
+
+    async def stats(self):
+        """ STATS in clamd's format, from the pool's own counters """
+        await self._maybe_reload()
+        busy = min(self.in_use, self.size)
+        return (
+            "POOLS: 1\n\nSTATE: VALID PRIMARY\n"
+            f"THREADS: live {busy}  idle {self.size - busy} max {self.size} idle-timeout 0\n"
+            f"QUEUE: {max(0, self.in_use - self.size)} items\n\n"
+            "MEMSTATS: heap N/A mmap N/A used N/A free N/A releasable N/A pools N/A "
+            "pools_used N/A pools_total N/A\nEND")
+
+    async def scan(self, path):
+        """ Scan """
+        if not os.path.exists(path):
+            raise PyvalveScanningError(f'Path not found: {path}')
+        return await self._call('scan', self.conf.CLAMD_TIMEOUT_SCAN, _worker_scan_path, path, True)
+
+    async def contscan(self, path):
+        """ Cont Scan """
+        if not os.path.exists(path):
+            raise PyvalveScanningError(f'Path not found: {path}')
+        return await self._call(
+            'contscan', self.conf.CLAMD_TIMEOUT_CONTSCAN, _worker_scan_path, path, False)
+
+    async def instream(self, file):
+        """ Instream a file object or an async iterable of byte chunks """
+        if not hasattr(file, '__aiter__'):
+            data = await asyncio.get_running_loop().run_in_executor(None, file.read)
+            return await self._call(
+                'instream', self.conf.CLAMD_TIMEOUT_INSTREAM, _worker_scan_buffer, data)
+        head: List[bytes] = []
+        size = 0
+        path = None
+        target = None
+        try:
+            async for chunk in file:
+                if target is not None:
+                    await target.write(chunk)
+                    continue
+                head.append(chunk)
+                size += len(chunk)
+                if size > self.conf.LIBCLAMAV_BUFFER_MAX:
+                    path, target = await self._spool(head)
+                    head.clear()
+            if target is None:
+                return await self._call(
+                    'instream', self.conf.CLAMD_TIMEOUT_INSTREAM, _worker_scan_buffer,
+                    b''.join(head))
+            spooled, target = target, None
+            await spooled.close()
+            return await self._call(
+                'instream', self.conf.CLAMD_TIMEOUT_INSTREAM, _worker_scan_file, path, 'stream')
+        finally:
+            if target is not None:
+                await target.close()
+            if path is not None:
+                await asyncio.get_running_loop().run_in_executor(None, _unlink, path)
+
+    async def _spool(self, head: List[bytes]):
+        """ Move a stream too large to pass to a worker into a file libclamav maps itself """
+        fd, path = tempfile.mkstemp(
+            prefix='scancan-stream-', dir=self.conf.LIBCLAMAV_TMP_DIR or None)
+        os.close(fd)
+        target: Any = async_open(path, 'wb')
+        await target.file.open()
+        for chunk in head:
+            await target.write(chunk)
+        return path, target
+
+    async def _maybe_reload(self) -> None:
+        """ Load a changed signature database into new workers, then switch to them """
+        if self.executor is None or self.reloading is not None:
+            return
+        stamp = await asyncio.get_running_loop().run_in_executor(
+            None, database_stamp, self.conf.LIBCLAMAV_DATABASE)
+        if stamp is not None and stamp != self.loaded_stamp:
+            self.reloading = asyncio.ensure_future(self._reload(stamp))
+
+    async def _reload(self, stamp: float) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            executor = self._new_executor()
+            try:
+                await asyncio.gather(*(
+                    loop.run_in_executor(executor, _worker_version) for _ in range(self.size)))
+            except BaseException:
+                executor.shutdown(wait=False)
+                raise
+            previous, self.executor = self.executor, executor
+            self.loaded_stamp = stamp
+            self.reloads += 1
+            if previous is not None:
+                # Scans already running in the old workers finish there
+                previous.shutdown(wait=False)
+            if self.logger:
+                self.logger.info("libclamav workers reloaded the signature database")
+        except (BrokenProcessPool, LibClamAvError, OSError) as err:
+            if self.logger:
+                self.logger.warning("libclamav reload failed, keeping old workers: %s", err)
+            self.loaded_stamp = stamp
+        finally:
+            self.reloading = None
+
+    async def connecting(self):
+        """ Start the workers and load an engine in each of them """
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.gather(*(
+                loop.run_in_executor(self._executor(), _worker_version) for _ in range(self.size)))
+        except (BrokenProcessPool, LibClamAvError) as err:
+            self.executor = None
+            raise PyvalveConnectionError(f"libclamav worker failed: {err}") from err
+
+    async def close(self) -> None:
+        """ Shut the worker processes down """
+        executor, self.executor = self.executor, None
+        if self.reloading is not None:
+            self.reloading.cancel()
+        if executor is not None:
+            executor.shutdown(wait=False)
+        for retired in self.retired:
+            _terminate(retired)
+        self.retired.clear()
+
+    def pool_stats(self) -> dict:
+        """
+        Pool Stats
+
+            Returns:
+                stats (dict): worker processes, scans in progress or queued, reloads and
+                    workers replaced after a timeout
+        """
+        return {
+            "size": self.size,
+            "in_use": min(self.in_use, self.size),
+            "waiting": max(0, self.in_use - self.size),
+            "reloads": self.reloads,
+            "recycles": self.recycles,
+        }
+
+
+def _terminate(executor: Executor) -> None:
+    """ Kill the worker processes of an executor, abandoning the scans they are running """
+    processes = getattr(executor, '_processes', None) or {}
+    for process in list(processes.values()):
+        process.kill()
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _unlink(path: str) -> None:
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,163 @@
+""" Event Loop Lag Monitor """
+import asyncio
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from profiler import StackSampler
+
+# Upper bounds of the lag histogram buckets, in milliseconds
+LAG_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class LoopMonitor: # pylint: disable=too-many-instance-attributes
+    """
+    LoopMonitor
+    Measures event loop lag as the overshoot of a short periodic sleep. A watchdog thread
+    notices when the loop misses its wakeup by more than the stall threshold and captures the
+    stack the loop thread is stuck in, while it is still stuck.
+    """
+    def __init__(self, conf, logger) -> None:
+        """
+        LoopMonitor constructor
+
+            Parameters:
+                conf (module): ScanCan configuration
+                logger (Logger): application logger
+
+            Returns:
+                None
+        """
+        self.interval = conf.LOOP_LAG_INTERVAL
+        self.threshold = conf.LOOP_STALL_THRESHOLD
+        self.logger = logger
+        self.sampler: Optional[StackSampler] = None
+        self.task: Optional[asyncio.Task] = None
+        self.watchdog: Optional[threading.Thread] = None
+        self.stopped = threading.Event()
+        self.deadline: Optional[float] = None
+        self.captured: Optional[Tuple[float, str]] = None
+        self.buckets = [0] * (len(LAG_BUCKETS) + 1)
+        self.samples = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+        self.stalls: Deque[Dict[str, Any]] = deque(maxlen=conf.LOOP_STALL_HISTORY)
+        self.stall_count = 0
+        self.stacks: Counter = Counter()
+        self.max_stacks = conf.LOOP_STALL_STACKS
+
+    async def start(self) -> None:
+        """ Start measuring on the running loop, and the watchdog thread """
+        self.sampler = StackSampler(
+            asyncio.get_running_loop(), threading.get_ident(), self.threshold)
+        self.stopped.clear()
+        self.task = asyncio.create_task(self.run())
+        self.watchdog = threading.Thread(
+            target=self.watch, name="scancan-loop-watchdog", daemon=True)
+        self.watchdog.start()
+
+    async def stop(self) -> None:
+        """ Stop measuring """
+        self.stopped.set()
+        task, self.task = self.task, None
+        if task:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        if self.watchdog is not None:
+            self.watchdog.join()
+            self.watchdog = None
+
+    async def run(self) -> None:
+        """ Sleep for interval over and over, recording how late each wakeup is """
+        while True:
+            deadline = time.monotonic() + self.interval
+            self.deadline = deadline
+            await asyncio.sleep(self.interval)
+            self.observe(max(0.0, time.monotonic() - deadline), deadline)
+
+    def observe(self, lag: float, deadline: float) -> None:
+        """ Record one lag measurement, and a stall when it passes the threshold """
+        lag_ms = lag * 1000
+        self.buckets[bisect_left(LAG_BUCKETS, lag_ms)] += 1
+        self.samples += 1
+        self.lag_total += lag
+        self.lag_max = max(self.lag_max, lag)
+        if lag < self.threshold:
+            return
+        captured = self.captured
+        task, stack = None, None
+        if captured is not None and captured[0] == deadline:
+            stack = captured[1]
+            root = stack.split(';', 1)[0]
+            task = root[len('task:'):] if root.startswith('task:') else root
+            self.count_stack(stack)
+        self.stall_count += 1
+        self.stalls.append({
+            "time": time.time(),
+            "lag_ms": round(lag_ms, 3),
+            "task": task,
+            "stack": stack.split(';') if stack else None,
+        })
+        if stack:
+            self.logger.warning(
+                "Event loop blocked for %.0f ms in %s", lag_ms, stack.rsplit(';', 1)[-1])
+        else:
+            self.logger.warning("Event loop blocked for %.0f ms", lag_ms)
+
+    def watch(self) -> None:
+        """ Capture the loop thread's stack once per stall, while the loop is blocked """
+        check = max(0.005, self.threshold / 2)
+        while not self.stopped.wait(check):
+            deadline = self.deadline
+            if deadline is None or time.monotonic() - deadline < self.threshold:
+                continue
+            captured = self.captured
+            if captured is not None and captured[0] == deadline:
+                continue
+            sampler = self.sampler
+            stack = sampler.sample() if sampler is not None else None
+            if stack is not None:
+                self.captured = (deadline, stack)
+
+    def count_stack(self, stack: str) -> None:
+        """ Count a stalled stack, forgetting the least frequent once LOOP_STALL_STACKS are kept """
+        if stack not in self.stacks and len(self.stacks) >= self.max_stacks:
+            del self.stacks[min(self.stacks, key=self.stacks.__getitem__)]
+        self.stacks[stack] += 1
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Recent stalls with their stacks, and how often each stack was caught stalling
+
+            Returns:
+                report (dict): 'stalls' newest last, 'stacks' most frequent first
+        """
+        stacks: List[Dict[str, Any]] = [
+            {"stack": stack.split(';'), "count": count}
+            for stack, count in self.stacks.most_common()]
+        return {
+            "threshold_ms": self.threshold * 1000,
+            "stalls": list(self.stalls),
+            "stacks": stacks,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Stats
+
+            Returns:
+                stats (dict): lag histogram in milliseconds, keyed by bucket upper bound,
+                    mean and max lag, and the number of stalls
+        """
+        histogram = {str(bound): count for bound, count in zip(LAG_BUCKETS, self.buckets)}
+        histogram["+Inf"] = self.buckets[-1]
+        return {
+            "lag_ms_buckets": histogram,
+            "samples": self.samples,
+            "lag_mean_ms": round(self.lag_total / self.samples * 1000, 3) if self.samples else None,
+            "lag_max_ms": round(self.lag_max * 1000, 3),
+            "stalls": self.stall_count,
+            "stall_threshold_ms": self.threshold * 1000,
+        }
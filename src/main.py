@@ -1,11 +1,16 @@
-"""ScanCan Main entry point"""
+"""ScanCan Main entry point""" # pylint: disable=too-many-lines
 import asyncio
+import functools
 import importlib.util
+import json
 import os
 import re
+import time
 import urllib
-from io import BytesIO
+from collections import Counter
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import Optional, cast
 
 from typing_extensions import Annotated
 
@@ -13,27 +18,160 @@ import aiohttp
 from aiofile import async_open
 from pyvalve import PyvalveResponseError, PyvalveConnectionError, PyvalveScanningError
 
-from fastapi import Depends, FastAPI, File, HTTPException, Request, status
-from fastapi.responses import PlainTextResponse, JSONResponse, FileResponse
+from fastapi import (
+    Depends, FastAPI, File, HTTPException, Query, Request, UploadFile, WebSocket, status,
+)
+from fastapi.responses import (
+    PlainTextResponse, JSONResponse, FileResponse, Response, StreamingResponse,
+)
 
 import config as conf
-from clamav import ClamAv
+from clamav import ClamAv, ClamAvPool, ClamdTimeoutError, split_pool_size
+from clamdsession import ClamdSessionPool
+from fleet import fleet_socket
+from libclamav import LibClamAvPool
+from router import Backend, BackendConf, CircuitOpenError, ClamRouter, parse_backend_spec
+from archive import ArchiveScanner
+from audit import AuditLog, audit_scope
+from bulkurls import HostQueue
+from cancellation import CancelOnDisconnect
+from coalesce import SingleFlight, file_digest, path_key
 from logger import Logger
+from looplag import LoopMonitor
+from metrics import Metrics
 from models import (
+    BulkUrlRequest,
+    BulkUrlResult,
     ExceptionResponse,
+    FileScanResponse,
     Health,
     HealthResponse,
     ScanResponse,
+    UploadStatus,
     Version,
     VirusFoundResponse,
 )
+from profiler import PROFILE_FORMATS, Profiler, ProfilerBusyError
+from ranged import RangeError, ranged_chunks, supports_ranges
+from ratelimit import RateLimiter, retry_after_header
+from scheduler import BACKGROUND, DeadlineExceeded, Scheduler, classify, priority
+from streams import (
+    StreamDecodeError,
+    StreamLimitError,
+    decompress_stream,
+    is_supported_encoding,
+    limit_stream,
+    upload_chunks,
+)
+from tracing import Tracer, record, span, timed_chunks
+from uploads import UploadError, UploadManager
+from urlcache import UrlCache, UrlCacheEntry
+from utils import normalize_url
+from verdictstore import VerdictStore
+from watcher import Watcher
+from wsscan import ScanChannel
 
 logger: Logger = Logger(name='ScanCan').get_logger()
+metrics: Metrics = Metrics()
+single_flight: SingleFlight = SingleFlight()
+tracer: Tracer = Tracer(conf, logger)
+metrics.register('tracing', tracer.stats)
+profiler: Profiler = Profiler(conf, logger)
+metrics.register('profiler', profiler.stats)
+loop_monitor: Optional[LoopMonitor] = None
+if conf.LOOP_MONITOR:
+    loop_monitor = LoopMonitor(conf, logger)
+    metrics.register('event_loop', loop_monitor.stats)
+metrics.register('coalescing', single_flight.stats)
+url_cache: Optional[UrlCache] = None
+if conf.URL_CACHE_SIZE > 0:
+    url_cache = UrlCache(conf.URL_CACHE_SIZE, conf.URL_CACHE_TTL)
+    metrics.register('url_cache', url_cache.stats)
+limiter: Optional[RateLimiter] = None
+if conf.RATE_LIMIT_FILE:
+    limiter = RateLimiter(conf, logger)
+    metrics.register('rate_limits', limiter.stats)
+RATE_LIMIT_EXEMPT = (
+    "/health", "/license", "/docs", "/static", "/metrics", "/openapi.json", "/favicon.ico",
+    "/clamd/stats")
+verdict_store: Optional[VerdictStore] = None
+if conf.VERDICT_CACHE_PATH:
+    verdict_store = VerdictStore(conf, logger)
+    metrics.register('verdict_store', verdict_store.stats)
+archive_scanner: Optional[ArchiveScanner] = None
+if conf.ARCHIVE_FANOUT:
+    archive_scanner = ArchiveScanner(conf, logger)
+    metrics.register('archive', archive_scanner.stats)
+uploads: UploadManager = UploadManager(conf, logger)
+metrics.register('uploads', uploads.stats)
+audit_log: Optional[AuditLog] = None
+if conf.AUDIT_PATH:
+    audit_log = AuditLog(conf, logger)
+    metrics.register('audit', audit_log.stats)
+
+
+def _audit(source: str, target: str, result: str, **fields) -> None:
+    """ Record a verdict in the audit log, when one is configured """
+    if audit_log is not None:
+        audit_log.record(source, target, result, **fields)
+
+
+def _signature_changed(signature: str) -> None:
+    """ Drop cached URL verdicts once clamd serves a new signature version """
+    logger.info("Signature version %s is active", signature)
+    if url_cache is not None:
+        url_cache.clear()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI): # pylint: disable=redefined-outer-name,unused-argument
+    """ Start and stop background services """
+    watcher = None
+    clamav = cast(ClamRouter, ClamInstance())
+    metrics.register('clamd_pool', clamav.pool_stats) # pylint: disable=no-member
+    clamav.add_listener(_signature_changed) # pylint: disable=no-member
+    try:
+        await clamav.connecting() # pylint: disable=no-member
+    except PyvalveConnectionError as err:
+        logger.warning("ClamAV warmup failed, connecting on first use: %s", err)
+    await clamav.start() # pylint: disable=no-member
+    await tracer.start()
+    await profiler.start()
+    if loop_monitor is not None:
+        await loop_monitor.start()
+    if verdict_store is not None:
+        await verdict_store.start()
+    await uploads.start()
+    if audit_log is not None:
+        await audit_log.start()
+    if conf.WATCH_PATHS:
+        watcher = Watcher(conf, ClamInstance, logger, audit_log)
+        # Watch workers inherit the background class and queue behind interactive scans
+        with priority(BACKGROUND):
+            await watcher.start()
+        metrics.register('watcher', watcher.stats)
+    yield
+    if watcher:
+        metrics.unregister('watcher')
+        await watcher.stop()
+    if verdict_store is not None:
+        await verdict_store.stop()
+    if archive_scanner is not None:
+        archive_scanner.stop()
+    await uploads.stop()
+    if audit_log is not None:
+        await audit_log.stop()
+    if loop_monitor is not None:
+        await loop_monitor.stop()
+    await profiler.stop()
+    await tracer.stop()
+    await clamav.stop() # pylint: disable=no-member
 
 app = FastAPI(
     title="ScanCan",
     description="Virus Scanning API for ClamAV",
     version=conf.SCAN_CAN_VERSION,
+    lifespan=lifespan,
 )
 
 
@@ -65,16 +203,89 @@ def authenticate(token: str):
     Args:
         token (str): The token to verify.
 
+    Returns:
+        result: The addon's result; a string names the client's tenant for rate limits.
+
     Raises:
         HTTPException: If the token is invalid or missing.
     """
     module = _load_authentication_module()
     if module is None:
-        return
+        return None
 
     result = module.authenticate(token)
     if result is False:
         raise HTTPException(status_code=401, detail="Unauthorized")
+    return result
+
+def require_admin(request: Request):
+    """
+    Allows admin endpoints only when USE_AUTHENTICATION is on and the addon
+    module's is_admin(token) accepts the bearer token.
+
+    Raises:
+        HTTPException: If admin access is not configured or the token is not an admin token.
+    """
+    if not conf.USE_AUTHENTICATION:
+        raise HTTPException(status_code=403, detail="Admin endpoints require USE_AUTHENTICATION")
+    module = _load_authentication_module()
+    if module is None or not callable(getattr(module, "is_admin", None)):
+        raise HTTPException(status_code=403, detail="Admin endpoints require addon is_admin(token)")
+    token = request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+    if not token or not module.is_admin(token):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+class _HeldSlot: # pylint: disable=too-few-public-methods
+    """ Response holding a client's concurrency slot until its body has been sent """
+    def __init__(self, response, key: str) -> None:
+        self.response = response
+        self.key = key
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await self.response(scope, receive, send)
+        finally:
+            if limiter is not None:
+                limiter.release(self.key)
+
+def _too_many(retry_after: float, reason: str) -> JSONResponse:
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        headers={"Retry-After": retry_after_header(retry_after)},
+        content=ExceptionResponse(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            response=f"Too many {'concurrent ' if reason == 'concurrency' else ''}requests"
+        ).model_dump())
+
+@app.middleware("http")
+async def rate_limit_middleware(request, call_next):
+    """ Per-client Rate Limit Middleware """
+    if limiter is None or request.url.path.startswith(RATE_LIMIT_EXEMPT):
+        return await call_next(request)
+    # Set by the authentication middleware once the addon has accepted the token
+    token = getattr(request.state, "token", None)
+    verified = token is not None
+    if not verified:
+        auth_header = request.headers.get("Authorization", "")
+        if auth_header.startswith("Bearer "):
+            token = auth_header.removeprefix("Bearer ").strip()
+    key = limiter.resolve(
+        getattr(request.state, "tenant", None),
+        token,
+        request.client.host if request.client else None,
+        verified)
+    allowed, retry_after, reason = limiter.acquire(key)
+    if not allowed:
+        logger.info("Rate limited %s (%s)", key, reason)
+        return _too_many(retry_after, reason)
+    request.state.rate_limit_key = key
+    try:
+        response = await call_next(request)
+    except BaseException:
+        limiter.release(key)
+        raise
+    # Streaming bodies, like /scanurls results, keep scanning after the headers are sent
+    return _HeldSlot(response, key)
 
 # Apply authentication conditionally
 if conf.USE_AUTHENTICATION:
@@ -86,16 +297,70 @@ if conf.USE_AUTHENTICATION:
             if not auth_header or not auth_header.startswith("Bearer "):
                 raise HTTPException(status_code=401, detail="Unauthorized")
             token = auth_header.removeprefix("Bearer ").strip()
-            authenticate(token)
+            result = authenticate(token)
+            # Kept for the rate limiter, which runs inside this middleware
+            request.state.token = token
+            if isinstance(result, str):
+                request.state.tenant = result
         response = await call_next(request)
         return response
 
+@app.middleware("http")
+async def tracing_middleware(request, call_next):
+    """ Request Tracing Middleware """
+    trace, token = tracer.begin(
+        f"{request.method} {request.url.path}", request.headers.get("traceparent"))
+    if trace is None:
+        return await call_next(request)
+    status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+    finally:
+        tracer.end(trace, token, status_code)
+    if tracer.server_timing:
+        response.headers["Server-Timing"] = trace.server_timing()
+    return response
+
+@app.middleware("http")
+async def audit_middleware(request, call_next):
+    """ Audit Scope Middleware, attributing verdicts to the client and timing them """
+    with audit_scope(request):
+        return await call_next(request)
+
+@app.middleware("http")
+async def priority_middleware(request, call_next):
+    """ Scan Priority Middleware """
+    length = request.headers.get("Content-Length")
+    size = int(length) if length and length.isdigit() else None
+    cls = classify(
+        request.headers.get("X-Scan-Priority"),
+        request.url.path,
+        size,
+        conf.SCHED_INTERACTIVE_MAX_SIZE)
+    with priority(cls, size):
+        return await call_next(request)
+
+# Outermost, so an abandoned request is cancelled through every middleware
+cancellations: Counter = Counter()
+metrics.register('cancellations', lambda: {
+    "disconnects": cancellations['disconnects'], "deadlines": cancellations['deadlines']})
+app.add_middleware(CancelOnDisconnect, logger=logger, counters=cancellations)
+
 class VirusFoundException(Exception):
     """ Virus Found Exception """
-    def __init__(self, status_code: int, response: str, path: str = ''):
+    def __init__(
+            self,
+            status_code: int,
+            response: str,
+            path: str = '',
+            digest: str = '',
+            signature: str = ''):
         self.status_code = status_code
         self.response = response
         self.path = path
+        self.digest = digest
+        self.signature = signature
 
 class ScanException(Exception):
     """ Scan Exception """
@@ -113,9 +378,15 @@ async def virus_found_exception_handler(request: Request, exc: VirusFoundExcepti
 
     if exc.path:
         error_model.path = exc.path
+    headers = None
+    if exc.digest:
+        error_model.digest = exc.digest
+        error_model.signature_version = exc.signature
+        headers = {"ETag": verdict_etag(exc.digest, exc.signature)}
 
     return JSONResponse(
         status_code=exc.status_code,
+        headers=headers,
         content=error_model.model_dump(exclude_unset=True)
     )
 
@@ -130,15 +401,95 @@ async def scan_exception_handler(request: Request, exc: ScanException): # pylint
         ).model_dump()
     )
 
+@app.exception_handler(ClamdTimeoutError)
+async def clamd_timeout_exception_handler(request: Request, exc: ClamdTimeoutError): # pylint: disable=unused-argument
+    """ ClamAV Deadline Exception Handler """
+    logger.error(str(exc))
+    return JSONResponse(
+        status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+        content=ExceptionResponse(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            response='ClamAV did not answer in time'
+        ).model_dump()
+    )
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceeded): # pylint: disable=unused-argument
+    """ X-Scan-Deadline passed before the work reached clamd """
+    return JSONResponse(
+        status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+        content=ExceptionResponse(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            response='Scan deadline exceeded'
+        ).model_dump()
+    )
+
+@app.exception_handler(CircuitOpenError)
+async def circuit_open_exception_handler(request: Request, exc: CircuitOpenError): # pylint: disable=unused-argument
+    """ ClamAV Circuit Breaker Exception Handler """
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": str(int(conf.BREAKER_RESET))},
+        content=ExceptionResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            response='ClamAV unavailable'
+        ).model_dump()
+    )
+
+@app.exception_handler(UploadError)
+async def upload_exception_handler(request: Request, exc: UploadError): # pylint: disable=unused-argument
+    """ Resumable Upload Exception Handler """
+    return JSONResponse(
+        status_code=exc.status_code,
+        content=ExceptionResponse(
+            status_code=exc.status_code,
+            response=exc.response
+        ).model_dump()
+    )
+
+def _clamd_pool(backend_conf):
+    """
+    Scanner backend: in-process libclamav engines, or a client pool for one clamd,
+    multiplexed over IDSESSION connections when configured
+    """
+    if backend_conf.CLAMD_CONN == 'libclamav':
+        return LibClamAvPool(backend_conf, conf.LIBCLAMAV_WORKERS)
+    if conf.CLAMD_SESSIONS > 0:
+        return ClamdSessionPool(
+            backend_conf, conf.CLAMD_SESSIONS, conf.CLAMD_SESSION_MAX_IN_FLIGHT)
+    return ClamAvPool(backend_conf, split_pool_size(conf.CLAMD_POOL_SIZE, conf.SCANCAN_WORKERS))
+
 class ClamInstance:
     """ ClamInstance Singleton Dependency """
     _instance = None
 
     def __new__(cls):
         if cls._instance is None:
-            logger.info("Setting up ClamAV connection")
-            cls._instance = ClamAv(conf)
+            if conf.CLAMD_FLEET_SIZE > 0:
+                backends = [
+                    Backend(f'clamd-{index}', _clamd_pool(BackendConf(
+                        conf, CLAMD_CONN='socket',
+                        CLAMD_SOCKET=fleet_socket(conf.CLAMD_FLEET_DIR, index))))
+                    for index in range(conf.CLAMD_FLEET_SIZE)]
+            else:
+                backends = [Backend('primary', _clamd_pool(conf))]
+            if conf.CLAMD_STANDBY:
+                standby = BackendConf(conf, **parse_backend_spec(conf.CLAMD_STANDBY))
+                backends.append(Backend('standby', _clamd_pool(standby), tier=1))
+            size = sum(backend.pool.size for backend in backends if backend.tier == 0)
+            if conf.CLAMD_SESSIONS > 0:
+                size *= conf.CLAMD_SESSION_MAX_IN_FLIGHT
+                logger.info("Multiplexing up to %d clamd commands over %d sessions",
+                            size, conf.CLAMD_SESSIONS)
+            else:
+                logger.info("Setting up ClamAV connection pools of %d", size)
+            cls._instance = ClamRouter(conf, backends)
             cls._instance.set_logger(logger)
+            metrics.register('clamd', cls._instance.stats_gauges)
+            if conf.SCHED_ENABLED:
+                scheduler = Scheduler(conf, size)
+                cls._instance.set_scheduler(scheduler)
+                metrics.register('scheduler', scheduler.stats)
         return cls._instance
 
     async def initialize(self):
@@ -146,7 +497,8 @@ class ClamInstance:
         Asynchronously initializes the instance by establishing a connection.
 
         This method checks if the `_instance` attribute is set and, if so, 
-        calls its `connecting` method to perform the connection process.
+        calls its `connecting` method to connect and ping every pooled client
+        of every backend.
 
         Returns:
             None
@@ -154,6 +506,19 @@ class ClamInstance:
         if self._instance:
             await self._instance.connecting()
 
+async def coalesce(key, func):
+    """
+    Run func, sharing it with identical concurrent scans when coalescing is enabled
+        Parameters:
+            key (str): coalescing key, None to always run func
+            func (Callable): coroutine function performing the scan
+        Returns:
+            result (Any)
+    """
+    if not conf.COALESCE_SCANS or key is None:
+        return await func()
+    return await single_flight.do(key, func)
+
 async def clamav_init() -> ClamAv:
     """ ClamAv Dependency """
     clamav = ClamInstance()
@@ -218,6 +583,25 @@ async def health(clamav: Annotated[ClamAv, Depends(clamav_init)]) -> HealthRespo
         version=Version(ClamAV=version_result, ScanCan=conf.SCAN_CAN_VERSION),
         stats=stats_result)).model_dump()
 
+@app.get("/clamd/stats")
+async def clamd_stats(clamav: Annotated[ClamRouter, Depends(clamav_init)]) -> dict:
+    """
+    GET /clamd/stats: parsed clamd STATS of every backend, at most CLAMD_STATS_MAX_AGE old
+        Returns:
+            result (object): backend name -> state, age, thread pools, queue, memory and
+                capacity gauges
+    """
+    return await clamav.clamd_stats(conf.CLAMD_STATS_MAX_AGE)
+
+@app.get("/metrics")
+async def show_metrics() -> dict:
+    """
+    GET /metrics: view runtime metrics of ScanCan subsystems
+        Returns:
+            metrics (dict)
+    """
+    return metrics.snapshot()
+
 @app.post("/scanpath/{path:path}",
     status_code=status.HTTP_200_OK,
     responses={
@@ -236,7 +620,7 @@ async def scan_path(path: str, clamav: Annotated[ClamAv, Depends(clamav_init)]):
     """
     logger.info("Scanning path: %s", path)
     try:
-        result = await clamav.scan(path)
+        result = await coalesce(path_key('scan', path), lambda: clamav.scan(path))
     except PyvalveResponseError as err:
         logger.exception(str(err))
         raise ScanException(
@@ -250,6 +634,7 @@ async def scan_path(path: str, clamav: Annotated[ClamAv, Depends(clamav_init)]):
             response='Error scanning'
         ) from err
 
+    _audit('path', path, result)
     if re.match(r'^.*\sFOUND$', result):
         raise VirusFoundException(
             status_code=status.HTTP_406_NOT_ACCEPTABLE,
@@ -259,6 +644,189 @@ async def scan_path(path: str, clamav: Annotated[ClamAv, Depends(clamav_init)]):
 
     return ScanResponse(response=result).model_dump()
 
+async def _scan_stream(
+        clamav: ClamAv,
+        chunks,
+        encoding: str,
+        error_response: str,
+        limit: Optional[int] = None) -> str:
+    """
+    Decode a chunked payload and stream it to ClamAV, mapping stream errors to responses.
+    An explicit limit also caps the decoded size, in place of DECOMPRESS_MAX_SIZE.
+    """
+    if not is_supported_encoding(encoding):
+        raise ScanException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            response=f"Unsupported Content-Encoding: {encoding}")
+    stream = decompress_stream(
+        limit_stream(chunks, limit or conf.UPLOAD_SIZE_LIMIT),
+        encoding,
+        conf.DECOMPRESS_MAX_SIZE if limit is None else limit,
+        conf.DECOMPRESS_MAX_RATIO,
+        conf.STREAM_CHUNK_SIZE)
+    try:
+        return await clamav.instream(stream)
+    except StreamLimitError as err:
+        raise ScanException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            response=str(err)) from err
+    except StreamDecodeError as err:
+        raise ScanException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            response=str(err)) from err
+    except PyvalveScanningError as err:
+        logger.exception(str(err))
+        raise ScanException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            response=error_response) from err
+
+def _download_chunks(session, url: str, resp):
+    """ Body of a 200 response, fetched as parallel ranges when the server allows it """
+    if conf.RANGE_PARALLEL > 1 and supports_ranges(resp.headers, conf.RANGE_MIN_SIZE):
+        return ranged_chunks(
+            session, url, resp, int(resp.headers['Content-Length']),
+            conf.RANGE_PART_SIZE, conf.RANGE_PARALLEL, conf.STREAM_CHUNK_SIZE)
+    return resp.content.iter_chunked(conf.STREAM_CHUNK_SIZE)
+
+@asynccontextmanager
+async def _client_session(session=None):
+    """ Use a shared client session, or open one for a single fetch """
+    if session is not None:
+        yield session
+        return
+    async with aiohttp.ClientSession(auto_decompress=False) as own:
+        yield own
+
+async def _fetch_and_scan_url(url: str, clamav: ClamAv, session=None) -> str:
+    """ Stream a url to ClamAV, decoding its Content-Encoding and revalidating cached verdicts """
+    sema = asyncio.BoundedSemaphore(5)
+    key = normalize_url(url)
+    cache = url_cache
+    signature = ''
+    entry = None
+    headers: dict = {}
+    if cache is not None:
+        signature = await clamav.signature_version()
+        entry = cache.get(key, signature)
+        if entry is not None:
+            headers = entry.conditional_headers()
+    try:
+        async with sema, _client_session(session) as session:
+            requested = time.perf_counter()
+            async with session.get(url, headers=headers) as resp:
+                record('download_headers', requested)
+                if resp.status == 304 and cache is not None and entry is not None:
+                    logger.info("Not modified, using cached verdict for %s", url)
+                    cache.revalidated(entry)
+                    return entry.verdict
+                if resp.status != 200:
+                    raise ScanException(
+                        status_code=status.HTTP_404_NOT_FOUND,
+                        response=f"{url} not found")
+                if int(resp.headers.get('Content-Length', 0)) > conf.UPLOAD_SIZE_LIMIT:
+                    raise ScanException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        response=f'Max size {conf.UPLOAD_SIZE_LIMIT} bytes limit exceeded')
+                response_headers = dict(resp.headers)
+                result = await _scan_stream(
+                    clamav,
+                    timed_chunks(_download_chunks(session, url, resp), 'download'),
+                    resp.headers.get('Content-Encoding', 'identity'),
+                    "Error scanning stream")
+    except RangeError as err:
+        logger.error(err)
+        raise ScanException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            response="Ranged download failed") from err
+    except aiohttp.client_exceptions.InvalidURL as err:
+        logger.error(err)
+        raise ScanException(
+            status_code=status.HTTP_406_NOT_ACCEPTABLE,
+            response="Invalid URL") from err
+
+    if cache is not None:
+        # An ERROR reply is not a verdict on the content, so it must not outlive this request
+        new_entry = None if result.endswith('ERROR') else UrlCacheEntry.from_headers(
+            response_headers, result, signature)
+        if new_entry is not None:
+            cache.put(key, new_entry)
+        else:
+            cache.discard(key)
+    return result
+
+async def _verdict(scan) -> dict: # pylint: disable=too-many-return-statements
+    """ Await a scan, returning the status code and response instead of raising """
+    try:
+        result = await scan
+    except ScanException as err:
+        return {"status_code": err.status_code, "response": err.response}
+    except ClamdTimeoutError:
+        return {"status_code": status.HTTP_504_GATEWAY_TIMEOUT,
+                "response": "ClamAV did not answer in time"}
+    except PyvalveConnectionError:
+        return {"status_code": status.HTTP_503_SERVICE_UNAVAILABLE,
+                "response": "ClamAV unavailable"}
+    except aiohttp.ClientError as err:
+        return {"status_code": status.HTTP_502_BAD_GATEWAY,
+                "response": f"Fetch failed: {type(err).__name__}"}
+    except asyncio.TimeoutError:
+        return {"status_code": status.HTTP_504_GATEWAY_TIMEOUT, "response": "Scan timed out"}
+    except DeadlineExceeded:
+        return {"status_code": status.HTTP_504_GATEWAY_TIMEOUT,
+                "response": "Scan deadline exceeded"}
+    if re.match(r'^.*\sFOUND$', result):
+        return {"status_code": status.HTTP_406_NOT_ACCEPTABLE, "response": result}
+    return {"status_code": status.HTTP_200_OK, "response": result}
+
+async def _scan_verdict(clamav: ClamAv, chunks, encoding: str) -> dict:
+    """ Scan a chunked payload, returning the status code and response instead of raising """
+    return await _verdict(_scan_stream(clamav, chunks, encoding, "Error scanning stream"))
+
+async def _bulk_scan_urls(urls, clamav: ClamAv):
+    """ Fetch and scan urls concurrently, yielding one NDJSON result line per url """
+    hosts = HostQueue(urls, conf.BULK_URL_PER_HOST)
+    results: asyncio.Queue = asyncio.Queue()
+    connector = aiohttp.TCPConnector(
+        limit=conf.BULK_URL_CONCURRENCY, limit_per_host=conf.BULK_URL_PER_HOST)
+
+    async def scan(url: str, session) -> str:
+        url = url.strip()
+        return await coalesce(
+            f"url:{normalize_url(url)}", lambda: _fetch_and_scan_url(url, clamav, session))
+
+    async def worker(session) -> None:
+        while True:
+            item = await hosts.get()
+            if item is None:
+                return
+            host, index, url = item
+            try:
+                verdict = await _verdict(
+                    asyncio.wait_for(scan(url, session), conf.BULK_URL_TIMEOUT))
+            except Exception as err: # pylint: disable=broad-exception-caught
+                # One bad url must not end the stream for the others
+                logger.exception("Bulk scan of %s failed: %s", url, err)
+                verdict = {"status_code": status.HTTP_500_INTERNAL_SERVER_ERROR,
+                           "response": "Error scanning"}
+            finally:
+                await hosts.done(host)
+            if verdict["status_code"] in (status.HTTP_200_OK, status.HTTP_406_NOT_ACCEPTABLE):
+                _audit('url', url, verdict["response"])
+            await results.put(BulkUrlResult(index=index, url=url, **verdict))
+
+    async with aiohttp.ClientSession(auto_decompress=False, connector=connector) as session:
+        workers = [
+            asyncio.create_task(worker(session))
+            for _ in range(min(conf.BULK_URL_CONCURRENCY, len(urls)))]
+        try:
+            for _ in urls:
+                result = await results.get()
+                yield json.dumps(result.model_dump()) + "\n"
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
 @app.get("/scanurl/",
     status_code=status.HTTP_200_OK,
     responses={
@@ -278,36 +846,10 @@ async def scan_url(url: str, clamav: Annotated[ClamAv, Depends(clamav_init)]):
             result (Object)
     """
 
-    sema = asyncio.BoundedSemaphore(5)
-    data = b''
     url = urllib.parse.unquote(url).strip()
     logger.info("The url is: %s", url)
-    try:
-        async with sema, aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
-                if resp.status == 200:
-                    data = await resp.read()
-                else:
-                    raise ScanException(
-                        status_code=status.HTTP_404_NOT_FOUND,
-                        response=f"{url} not found")
-    except aiohttp.client_exceptions.InvalidURL as err:
-        logger.error(err)
-        raise ScanException(
-            status_code=status.HTTP_406_NOT_ACCEPTABLE,
-            response="Invalid URL") from err
-    if len(data) > conf.UPLOAD_SIZE_LIMIT:
-        raise ScanException(
-            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-            response=f'Max size {conf.UPLOAD_SIZE_LIMIT} bytes limit exceeded')
-
-    try:
-        result = await clamav.instream(BytesIO(data))
-    except PyvalveScanningError as err:
-        logger.exception(str(err))
-        raise ScanException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            response="Error scanning stream") from err
+    result = await coalesce(f"url:{normalize_url(url)}", lambda: _fetch_and_scan_url(url, clamav))
+    _audit('url', url, result)
 
     if re.match(r'^.*\sFOUND$', result):
         raise VirusFoundException(
@@ -317,6 +859,40 @@ async def scan_url(url: str, clamav: Annotated[ClamAv, Depends(clamav_init)]):
         )
     return ScanResponse(response=result).model_dump()
 
+@app.post("/scanurls",
+    status_code=status.HTTP_200_OK,
+    response_class=StreamingResponse,
+    responses={
+        status.HTTP_200_OK: {"model": BulkUrlResult, "content": {"application/x-ndjson": {}}},
+        status.HTTP_400_BAD_REQUEST: {"model": ExceptionResponse}
+        }
+    )
+async def scan_urls(
+        request: BulkUrlRequest,
+        http_request: Request,
+        clamav: Annotated[ClamAv, Depends(clamav_init)]):
+    """
+    POST /scanurls: fetch and scan many urls with ClamAV
+        Parameters:
+            request (BulkUrlRequest): {"urls": [...]}
+        Returns:
+            results (NDJSON): one BulkUrlResult line per url, in completion order
+    """
+    if len(request.urls) > conf.BULK_URL_MAX:
+        raise ScanException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            response=f"At most {conf.BULK_URL_MAX} urls per request")
+    key = getattr(http_request.state, "rate_limit_key", None)
+    if limiter is not None and key is not None:
+        # The middleware took one token for the request, each further url costs another
+        retry_after = limiter.charge(key, len(request.urls) - 1)
+        if retry_after > 0:
+            logger.info("Rate limited %s (%d urls)", key, len(request.urls))
+            return _too_many(retry_after, 'rate')
+    logger.info("Bulk scanning %d urls", len(request.urls))
+    return StreamingResponse(
+        _bulk_scan_urls(request.urls, clamav), media_type="application/x-ndjson")
+
 @app.post("/contscan/{path:path}",
     status_code=status.HTTP_200_OK,
     responses={
@@ -335,13 +911,14 @@ async def cont_scan(path: str, clamav: Annotated[ClamAv, Depends(clamav_init)]):
     """
     logger.info("Scanning path: %s", path)
     try:
-        result = await clamav.contscan(path)
+        result = await coalesce(path_key('contscan', path), lambda: clamav.contscan(path))
     except PyvalveScanningError as err:
         logger.exception(err)
         raise ScanException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             response="Error scanning (cont)") from err
 
+    _audit('path', path, result)
     regex = re.compile(r'^.*\sFOUND', re.MULTILINE)
     if re.match(regex, result):
         raise VirusFoundException(
@@ -353,41 +930,372 @@ async def cont_scan(path: str, clamav: Annotated[ClamAv, Depends(clamav_init)]):
 @app.post("/scanfile",
     status_code=status.HTTP_200_OK,
     responses={
-        status.HTTP_200_OK: {"model": ScanResponse},
+        status.HTTP_200_OK: {"model": FileScanResponse},
         status.HTTP_500_INTERNAL_SERVER_ERROR: {"model": ExceptionResponse},
         status.HTTP_406_NOT_ACCEPTABLE: {"model": VirusFoundResponse},
         status.HTTP_413_REQUEST_ENTITY_TOO_LARGE: {"model": ExceptionResponse}
     }
 )
-async def scan_upload_file(clamav: Annotated[ClamAv, Depends(clamav_init)], file: bytes = File()):
+async def scan_upload_file(
+        clamav: Annotated[ClamAv, Depends(clamav_init)],
+        file: UploadFile = File()):
     """
     POST /scanfile: scan a file stream with ClamAV
         Parameters:
-            file (bytes): an uploaded file
+            file (UploadFile): an uploaded file, optionally sent with a
+                gzip, deflate or zstd Content-Encoding part header
         Returns:
             result (Object)
     """
-    if len(file) > conf.UPLOAD_SIZE_LIMIT:
+    if file.size is not None and file.size > conf.UPLOAD_SIZE_LIMIT:
         raise ScanException(
             status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
             response=f'Max size {conf.UPLOAD_SIZE_LIMIT} bytes limit exceeded')
 
-    try:
-        result = await clamav.instream(BytesIO(file))
-    except PyvalveScanningError as err:
-        logger.exception(str(err))
-        raise ScanException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            response="Error scanning file") from err
+    record('upload')
+    encoding = file.headers.get('Content-Encoding', 'identity').strip().lower()
+    with span('hash'):
+        digest = await asyncio.get_running_loop().run_in_executor(None, file_digest, file.file)
+    key = f"sha256:{digest}" if encoding == 'identity' else f"{encoding}+sha256:{digest}"
 
-    if re.match(r'^.*\sFOUND$', result):
+    store = verdict_store
+    signature = await clamav.signature_version()
+    result = None
+    if store is not None:
+        with span('verdict_cache'):
+            result = await store.lookup(key, signature)
+
+    async def scan() -> str:
+        fanout = archive_scanner
+        if fanout is not None and encoding == 'identity' and fanout.applies(file.size):
+            result = await fanout.scan(
+                file.file,
+                file.filename or 'upload',
+                lambda chunks: _scan_stream(clamav, chunks, encoding, "Error scanning file"))
+            if result is not None:
+                return result
+        await file.seek(0)
+        chunks = upload_chunks(file, conf.STREAM_CHUNK_SIZE)
+        return await _scan_stream(clamav, chunks, encoding, "Error scanning file")
+
+    cached = result is not None
+    if result is None:
+        result = await coalesce(key, scan)
+        if store is not None and not result.endswith('ERROR'):
+            store.put(key, signature, result)
+
+    _audit('upload', file.filename or 'upload', result, digest=digest, size=file.size,
+           signature_version=signature, cached=cached)
+    return _verdict_response(result, digest, signature)
+
+def verdict_etag(digest: str, signature: str) -> str:
+    """ ETag of a file verdict, changing with the content and the signature version """
+    return f'"{digest}-{signature}"'
+
+def _verdict_response(result: str, digest: str, signature: str) -> JSONResponse:
+    """ FileScanResponse for a clamd reply, raising VirusFoundException for infected files """
+    # Archive fan-out lists one line per infected member
+    if re.search(r'^.*\sFOUND$', result, re.MULTILINE):
         raise VirusFoundException(
             status_code=status.HTTP_406_NOT_ACCEPTABLE,
-            response=result)
+            response=result,
+            digest=digest,
+            signature=signature)
 
-    return ScanResponse(
+    return JSONResponse(
         status_code=status.HTTP_200_OK,
-        response=result).model_dump()
+        headers={"ETag": verdict_etag(digest, signature)},
+        content=FileScanResponse(
+            response=result, digest=digest, signature_version=signature).model_dump())
+
+@app.get("/scanhash/{sha256}",
+    status_code=status.HTTP_200_OK,
+    responses={
+        status.HTTP_200_OK: {"model": FileScanResponse},
+        status.HTTP_304_NOT_MODIFIED: {"description": "Verdict matches If-None-Match"},
+        status.HTTP_400_BAD_REQUEST: {"model": ExceptionResponse},
+        status.HTTP_404_NOT_FOUND: {"model": ExceptionResponse},
+        status.HTTP_406_NOT_ACCEPTABLE: {"model": VirusFoundResponse}
+    }
+)
+async def scan_hash(
+        sha256: str,
+        request: Request,
+        clamav: Annotated[ClamAv, Depends(clamav_init)]):
+    """
+    GET /scanhash/{sha256}: verdict of a file already scanned under the current signatures,
+    answered from the verdict store so clients only upload on a miss
+        Parameters:
+            sha256 (str): hex SHA-256 of the file
+        Returns:
+            result (Object): as /scanfile would answer, 404 when the file must be uploaded
+    """
+    digest = sha256.lower()
+    if not re.fullmatch(r'[0-9a-f]{64}', digest):
+        raise ScanException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            response="Invalid SHA-256 digest")
+    signature = await clamav.signature_version()
+    result = None
+    store = verdict_store
+    if store is not None:
+        with span('verdict_cache'):
+            result = await store.lookup(f"sha256:{digest}", signature)
+    if result is None:
+        raise ScanException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            response=f"{digest} not scanned under signature version {signature}")
+    _audit('hash', digest, result, digest=digest, signature_version=signature, cached=True)
+    etag = verdict_etag(digest, signature)
+    if etag in request.headers.get("If-None-Match", ""):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return _verdict_response(result, digest, signature)
+
+def _upload_scan(clamav: ClamAv):
+    """ Scan callable streaming a resumable upload to ClamAV """
+    return lambda chunks: _scan_stream(
+        clamav, chunks, 'identity', "Error scanning file", uploads.max_length)
+
+def _upload_headers(session) -> dict:
+    return {
+        "Upload-Offset": str(session.offset),
+        "Upload-Length": str(session.length),
+        "Cache-Control": "no-store",
+    }
+
+@app.post("/uploads",
+    status_code=status.HTTP_201_CREATED,
+    responses={
+        status.HTTP_201_CREATED: {"model": UploadStatus},
+        status.HTTP_400_BAD_REQUEST: {"model": ExceptionResponse},
+        status.HTTP_413_REQUEST_ENTITY_TOO_LARGE: {"model": ExceptionResponse},
+        status.HTTP_503_SERVICE_UNAVAILABLE: {"model": ExceptionResponse}
+    }
+)
+async def create_upload(request: Request):
+    """
+    POST /uploads: start a resumable upload
+        Parameters:
+            Upload-Length (header): total size of the file in bytes
+        Returns:
+            result (Object): the upload, with its URL in the Location header
+    """
+    length = request.headers.get("Upload-Length", "")
+    if not length.isdigit():
+        raise UploadError(status.HTTP_400_BAD_REQUEST, "Missing or invalid Upload-Length")
+    session = await uploads.create(int(length))
+    headers = _upload_headers(session)
+    headers["Location"] = f"/uploads/{session.id}"
+    return JSONResponse(
+        status_code=status.HTTP_201_CREATED,
+        headers=headers,
+        content=UploadStatus(
+            id=session.id, offset=session.offset, length=session.length).model_dump())
+
+@app.head("/uploads/{upload_id}")
+async def upload_offset(upload_id: str):
+    """
+    HEAD /uploads/{upload_id}: offset to resume an upload from
+        Returns:
+            Upload-Offset and Upload-Length headers
+    """
+    session = await uploads.get(upload_id)
+    return Response(status_code=status.HTTP_200_OK, headers=_upload_headers(session))
+
+@app.patch("/uploads/{upload_id}",
+    status_code=status.HTTP_204_NO_CONTENT,
+    responses={
+        status.HTTP_404_NOT_FOUND: {"model": ExceptionResponse},
+        status.HTTP_409_CONFLICT: {"model": ExceptionResponse},
+        status.HTTP_413_REQUEST_ENTITY_TOO_LARGE: {"model": ExceptionResponse}
+    }
+)
+async def append_upload(
+        upload_id: str,
+        request: Request,
+        clamav: Annotated[ClamAv, Depends(clamav_init)]):
+    """
+    PATCH /uploads/{upload_id}: append a chunk to an upload
+        Parameters:
+            Upload-Offset (header): bytes of the upload already sent, from HEAD
+        Returns:
+            the new Upload-Offset header
+    """
+    offset = request.headers.get("Upload-Offset", "")
+    if not offset.isdigit():
+        raise UploadError(status.HTTP_400_BAD_REQUEST, "Missing or invalid Upload-Offset")
+    session = await uploads.append(
+        upload_id, int(offset), request.stream(), _upload_scan(clamav))
+    return Response(status_code=status.HTTP_204_NO_CONTENT, headers=_upload_headers(session))
+
+@app.post("/uploads/{upload_id}/finalize",
+    status_code=status.HTTP_200_OK,
+    responses={
+        status.HTTP_200_OK: {"model": FileScanResponse},
+        status.HTTP_404_NOT_FOUND: {"model": ExceptionResponse},
+        status.HTTP_406_NOT_ACCEPTABLE: {"model": VirusFoundResponse},
+        status.HTTP_409_CONFLICT: {"model": ExceptionResponse},
+        status.HTTP_500_INTERNAL_SERVER_ERROR: {"model": ExceptionResponse}
+    }
+)
+async def finalize_upload(upload_id: str, clamav: Annotated[ClamAv, Depends(clamav_init)]):
+    """
+    POST /uploads/{upload_id}/finalize: verdict of a complete upload
+        Returns:
+            result (Object)
+    """
+    signature = await clamav.signature_version()
+    digest, result = await uploads.finalize(upload_id, _upload_scan(clamav))
+    store = verdict_store
+    if store is not None and not result.endswith('ERROR'):
+        store.put(f"sha256:{digest}", signature, result)
+    _audit('upload', upload_id, result, digest=digest, signature_version=signature)
+    return _verdict_response(result, digest, signature)
+
+@app.delete("/uploads/{upload_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_upload(upload_id: str):
+    """
+    DELETE /uploads/{upload_id}: abort an upload
+    """
+    await uploads.delete(upload_id)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+@app.websocket("/ws/scan")
+async def ws_scan(websocket: WebSocket, clamav: Annotated[ClamAv, Depends(clamav_init)]):
+    """
+    WS /ws/scan: scan many files over one connection
+        Binary frames carry chunks tagged with a file id, the END flag closes a file;
+        verdicts come back as JSON text frames {"id", "status_code", "response"}.
+        The bearer token may be sent as an Authorization header or a token query parameter.
+    """
+    auth_header = websocket.headers.get("Authorization", "")
+    token = auth_header.removeprefix("Bearer ").strip() or websocket.query_params.get("token")
+    tenant = None
+    if conf.USE_AUTHENTICATION:
+        try:
+            if not token:
+                raise HTTPException(status_code=401, detail="Unauthorized")
+            result = authenticate(token)
+        except HTTPException:
+            await websocket.close(code=1008)
+            return
+        tenant = result if isinstance(result, str) else None
+    key = None
+    if limiter is not None:
+        key = limiter.resolve(
+            tenant, token, websocket.client.host if websocket.client else None,
+            conf.USE_AUTHENTICATION)
+        if not limiter.acquire(key)[0]:
+            await websocket.close(code=1013)
+            return
+    websocket.state.token = token
+    websocket.state.tenant = tenant
+
+    async def scan(chunks, encoding: str) -> dict:
+        started = time.perf_counter()
+        verdict = await _scan_verdict(clamav, chunks, encoding)
+        if verdict["status_code"] in (status.HTTP_200_OK, status.HTTP_406_NOT_ACCEPTABLE):
+            _audit('ws', 'stream', verdict["response"], started=started)
+        return verdict
+
+    try:
+        await websocket.accept()
+        cls = classify(websocket.headers.get("X-Scan-Priority"), "/ws/scan", None, 0)
+        with priority(cls), audit_scope(websocket):
+            admit = None
+            if limiter is not None and key is not None:
+                # The connection holds a concurrency slot, each file it carries costs a token
+                admit = functools.partial(limiter.charge, key, 1)
+            channel = ScanChannel(websocket, scan, conf, logger, admit)
+            await channel.run()
+    finally:
+        if limiter is not None and key is not None:
+            limiter.release(key)
+
+@app.get("/admin/profile",
+    dependencies=[Depends(require_admin)],
+    responses={
+        status.HTTP_403_FORBIDDEN: {"model": ExceptionResponse},
+        status.HTTP_409_CONFLICT: {"model": ExceptionResponse}
+    }
+)
+async def admin_profile(
+        seconds: float = Query(10.0, gt=0, le=conf.PROFILE_MAX_SECONDS),
+        output: str = Query('collapsed', alias='format'),
+        interval: float = Query(0.005, ge=0.001, le=1.0)):
+    """
+    GET /admin/profile: profile this worker for a number of seconds
+        Parameters:
+            seconds (float): profiling duration
+            format (str): 'collapsed' for flamegraph stacks rooted at the running
+                asyncio task, or 'pstats' for a cProfile dump
+            interval (float): sampling interval for 'collapsed'
+        Returns:
+            profile (file)
+    """
+    if output not in PROFILE_FORMATS:
+        raise ScanException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            response=f"format must be one of {', '.join(PROFILE_FORMATS)}")
+    logger.warning("Profiling worker %d for %ss (%s)", os.getpid(), seconds, output)
+    try:
+        if output == 'pstats':
+            content = await profiler.cprofile(seconds)
+        else:
+            content = (await profiler.sample(seconds, interval)).encode()
+    except ProfilerBusyError as err:
+        raise ScanException(
+            status_code=status.HTTP_409_CONFLICT,
+            response=str(err)) from err
+    return Response(
+        content=content,
+        media_type='application/octet-stream' if output == 'pstats' else 'text/plain',
+        headers={
+            "Content-Disposition": f'attachment; filename="scancan-{os.getpid()}.{output}"',
+            "X-Profile-Pid": str(os.getpid()),
+        })
+
+@app.get("/admin/profile/recent",
+    dependencies=[Depends(require_admin)],
+    response_class=PlainTextResponse,
+    responses={
+        status.HTTP_403_FORBIDDEN: {"model": ExceptionResponse},
+        status.HTTP_404_NOT_FOUND: {"model": ExceptionResponse}
+    }
+)
+async def admin_profile_recent(seconds: float = Query(300.0, gt=0)):
+    """
+    GET /admin/profile/recent: collapsed stacks from the continuous sampler
+        Parameters:
+            seconds (float): how far back to merge
+        Returns:
+            profile (string)
+    """
+    if not conf.PROFILE_CONTINUOUS:
+        raise ScanException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            response="Continuous profiling is disabled")
+    return PlainTextResponse(
+        profiler.recent(seconds), headers={"X-Profile-Pid": str(os.getpid())})
+
+@app.get("/admin/loop/stalls",
+    dependencies=[Depends(require_admin)],
+    responses={
+        status.HTTP_403_FORBIDDEN: {"model": ExceptionResponse},
+        status.HTTP_404_NOT_FOUND: {"model": ExceptionResponse}
+    }
+)
+async def admin_loop_stalls() -> dict:
+    """
+    GET /admin/loop/stalls: recent event loop stalls of this worker and the stacks that caused them
+        Returns:
+            report (Object): stalls with their lag and stack, and stacks by stall count
+    """
+    if loop_monitor is None:
+        raise ScanException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            response="Event loop monitoring is disabled")
+    return dict(loop_monitor.report(), pid=os.getpid())
 
 @app.get("/license", response_class=PlainTextResponse)
 async def show_license():
@@ -0,0 +1,34 @@
+""" Metrics Registry """
+from typing import Any, Callable, Dict
+
+
+class Metrics:
+    """
+    Metrics
+    Collects named metric providers and renders them as a single snapshot
+    """
+    def __init__(self) -> None:
+        """
+        Metrics constructor
+
+            Returns:
+                None
+        """
+        self.providers: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+    def register(self, name: str, provider: Callable[[], Dict[str, Any]]) -> None:
+        """ Register a provider returning a dict of metrics """
+        self.providers[name] = provider
+
+    def unregister(self, name: str) -> None:
+        """ Remove a provider """
+        self.providers.pop(name, None)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Snapshot
+
+            Returns:
+                metrics (dict): provider name -> metrics
+        """
+        return {name: provider() for name, provider in self.providers.items()}
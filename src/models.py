@@ -1,5 +1,5 @@
 """ Pydantic Models """
-from typing import Optional
+from typing import List, Optional
 from pydantic import BaseModel
 
 class Version(BaseModel):
@@ -44,6 +44,17 @@ class ScanResponse(BaseModel):
     """
     response: str
 
+class FileScanResponse(ScanResponse):
+    """
+    Represents the response for an uploaded file scan.
+
+    Attributes:
+        digest (str): The SHA-256 of the file as uploaded.
+        signature_version (str): The signature version the verdict was given with.
+    """
+    digest: str
+    signature_version: str
+
 class ExceptionResponse(BaseModel):
     """
     Represents a generic exception response.
@@ -61,5 +72,42 @@ class VirusFoundResponse(ExceptionResponse):
 
     Attributes:
         path (Optional[str]): The path of the infected file, if available.
+        digest (Optional[str]): The SHA-256 of an uploaded file.
+        signature_version (Optional[str]): The signature version it was scanned with.
     """
     path: Optional[str] = None
+    digest: Optional[str] = None
+    signature_version: Optional[str] = None
+
+class BulkUrlRequest(BaseModel):
+    """
+    Represents a bulk URL scan request.
+
+    Attributes:
+        urls (List[str]): The URLs to fetch and scan.
+    """
+    urls: List[str]
+
+class BulkUrlResult(ExceptionResponse):
+    """
+    Represents the result for one URL of a bulk scan, streamed as one NDJSON line.
+
+    Attributes:
+        index (int): The position of the URL in the request.
+        url (str): The URL.
+    """
+    index: int
+    url: str
+
+class UploadStatus(BaseModel):
+    """
+    Represents the state of a resumable upload.
+
+    Attributes:
+        id (str): The upload id.
+        offset (int): The bytes received so far.
+        length (int): The total upload size.
+    """
+    id: str
+    offset: int
+    length: int
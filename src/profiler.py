@@ -0,0 +1,211 @@
+""" Live Worker Profiling """
+import asyncio
+import cProfile
+import io
+import marshal
+import pstats
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Deque, Dict, Optional, Tuple
+
+PROFILE_FORMATS = ('collapsed', 'pstats')
+
+
+class ProfilerBusyError(Exception):
+    """ Raised when a profile is requested while another one is running """
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename}:{frame.f_lineno})"
+
+
+def collapse_stack(frame, root: str) -> str:
+    """ A frame and its callers as one collapsed-stack line, outermost first """
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.append(root)
+    return ';'.join(reversed(labels))
+
+
+def render_collapsed(samples: Counter) -> str:
+    """ Collapsed stacks in the format read by flamegraph.pl and speedscope """
+    return ''.join(f"{stack} {count}\n" for stack, count in samples.most_common())
+
+
+class StackSampler:
+    """
+    StackSampler
+    Samples the event loop thread from a background thread. Each sample is rooted at the
+    asyncio task that was running, so time is attributed per task as well as per frame.
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop, thread_id: int, interval: float) -> None:
+        """
+        StackSampler constructor
+
+            Parameters:
+                loop (AbstractEventLoop): the event loop to sample
+                thread_id (int): ident of the thread running the loop
+                interval (float): seconds between samples
+
+            Returns:
+                None
+        """
+        self.loop = loop
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.samples: Counter = Counter()
+        self.count = 0
+
+    def sample(self) -> Optional[str]:
+        """ Take one sample of the loop thread """
+        frame = sys._current_frames().get(self.thread_id) # pylint: disable=protected-access
+        if frame is None:
+            return None
+        task = asyncio.current_task(self.loop)
+        root = f"task:{task.get_name()}" if task is not None else "loop:idle-or-callbacks"
+        return collapse_stack(frame, root)
+
+    def run(self) -> None:
+        """ Sample until stopped """
+        while not self.stopped.wait(self.interval):
+            stack = self.sample()
+            if stack is not None:
+                self.samples[stack] += 1
+                self.count += 1
+
+    def start(self) -> None:
+        """ Start sampling in a daemon thread """
+        self.thread = threading.Thread(target=self.run, name="scancan-profiler", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> Counter:
+        """ Stop sampling and return the collected samples """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        return self.samples
+
+
+class Profiler:
+    """
+    Profiler
+    On-demand sampling and cProfile runs of the live worker, plus an optional low-rate
+    continuous sampler keeping the last PROFILE_RETENTION seconds in fixed-size windows
+    """
+    def __init__(self, conf, logger) -> None:
+        """
+        Profiler constructor
+
+            Parameters:
+                conf (module): ScanCan configuration
+                logger (Logger): application logger
+
+            Returns:
+                None
+        """
+        self.conf = conf
+        self.logger = logger
+        self.lock = asyncio.Lock()
+        windows = max(1, int(conf.PROFILE_RETENTION // conf.PROFILE_WINDOW))
+        self.history: Deque[Tuple[float, Counter]] = deque(maxlen=windows)
+        self.task: Optional[asyncio.Task] = None
+        self.runs = 0
+
+    def _sampler(self, interval: float) -> StackSampler:
+        return StackSampler(asyncio.get_running_loop(), threading.get_ident(), interval)
+
+    async def sample(self, seconds: float, interval: float) -> str:
+        """
+        Sample the event loop thread for a number of seconds
+
+            Returns:
+                profile (str): collapsed stacks
+        """
+        if self.lock.locked():
+            raise ProfilerBusyError("A profile is already running")
+        async with self.lock:
+            self.runs += 1
+            sampler = self._sampler(interval)
+            sampler.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                samples = sampler.stop()
+        return render_collapsed(samples)
+
+    async def cprofile(self, seconds: float) -> bytes:
+        """
+        Run cProfile on the event loop thread for a number of seconds
+
+            Returns:
+                profile (bytes): marshalled pstats data, readable with pstats.Stats(path)
+        """
+        if self.lock.locked():
+            raise ProfilerBusyError("A profile is already running")
+        async with self.lock:
+            self.runs += 1
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profile.disable()
+        stats = pstats.Stats(profile, stream=io.StringIO())
+        return marshal.dumps(stats.stats) # type: ignore[attr-defined]
+
+    async def start(self) -> None:
+        """ Start the continuous sampler when PROFILE_CONTINUOUS is set """
+        if self.conf.PROFILE_CONTINUOUS:
+            self.task = asyncio.create_task(self.run())
+            self.logger.info(
+                "Continuous profiling every %ss, keeping %ss",
+                self.conf.PROFILE_CONTINUOUS_INTERVAL, self.conf.PROFILE_RETENTION)
+
+    async def stop(self) -> None:
+        """ Stop the continuous sampler """
+        task, self.task = self.task, None
+        if task:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def run(self) -> None:
+        """ Sample continuously, closing a window every PROFILE_WINDOW seconds """
+        sampler = self._sampler(self.conf.PROFILE_CONTINUOUS_INTERVAL)
+        sampler.start()
+        try:
+            while True:
+                await asyncio.sleep(self.conf.PROFILE_WINDOW)
+                window, sampler.samples = sampler.samples, Counter()
+                self.history.append((time.time(), window))
+        finally:
+            sampler.stop()
+
+    def recent(self, seconds: float) -> str:
+        """ Merged collapsed stacks of the continuous windows closed in the last seconds """
+        since = time.time() - seconds
+        merged: Counter = Counter()
+        for closed, window in list(self.history):
+            if closed >= since:
+                merged.update(window)
+        return render_collapsed(merged)
+
+    def stats(self) -> Dict[str, object]:
+        """
+        Stats
+
+            Returns:
+                stats (dict): run count and continuous sampling state
+        """
+        return {
+            "runs": self.runs,
+            "running": self.lock.locked(),
+            "continuous": self.task is not None,
+            "windows": len(self.history),
+        }
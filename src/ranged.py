@@ -0,0 +1,111 @@
+""" Parallel Ranged Downloads """
+import asyncio
+from typing import AsyncIterator, Dict, Mapping, Optional
+
+
+class RangeError(Exception):
+    """ Raised when a range request does not return the expected bytes """
+
+
+def range_validator(headers: Mapping[str, str]) -> Optional[str]:
+    """ Strong validator to send as If-Range, so every range comes from the same object """
+    etag = headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return headers.get('Last-Modified')
+
+
+def supports_ranges(headers: Mapping[str, str], min_size: int) -> bool:
+    """
+    Whether a 200 response can be fetched as parallel byte ranges
+
+        Parameters:
+            headers (Mapping): response headers of the initial GET
+            min_size (int): smaller objects are fetched as one stream
+
+        Returns:
+            supported (bool)
+    """
+    if headers.get('Accept-Ranges', '').strip().lower() != 'bytes':
+        return False
+    if headers.get('Content-Encoding', 'identity').strip().lower() != 'identity':
+        return False
+    if range_validator(headers) is None:
+        return False
+    try:
+        return int(headers.get('Content-Length', '')) >= min_size
+    except ValueError:
+        return False
+
+
+async def ranged_chunks( # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+        session,
+        url: str,
+        resp,
+        total: int,
+        part_size: int,
+        parallel: int,
+        chunk_size: int = 65536) -> AsyncIterator[bytes]:
+    """
+    Yield an object in order while fetching up to `parallel` parts at once. The first part
+    is read from the already open response `resp`; the others are requested with Range and
+    If-Range headers into a reorder buffer holding at most `parallel` parts, plus the part
+    being yielded.
+
+        Parameters:
+            session (ClientSession): session for the range requests
+            url (str): object url
+            resp (ClientResponse): open 200 response of the initial GET
+            total (int): object size from Content-Length
+            part_size (int): bytes per range request
+            parallel (int): parts in flight
+            chunk_size (int): max bytes per yielded chunk
+
+        Returns:
+            chunks (AsyncIterator[bytes])
+    """
+    if_range = range_validator(resp.headers) or ''
+    parts = (total + part_size - 1) // part_size
+    window: Dict[int, asyncio.Task] = {}
+    next_part = 1
+
+    async def fetch(index: int) -> bytes:
+        start = index * part_size
+        end = min(total, start + part_size) - 1
+        headers = {'Range': f'bytes={start}-{end}', 'If-Range': if_range}
+        async with session.get(url, headers=headers) as part:
+            if part.status != 206:
+                raise RangeError(f"Range {start}-{end} of {url} returned {part.status}")
+            data = await part.read()
+        if len(data) != end - start + 1:
+            raise RangeError(f"Range {start}-{end} of {url} returned {len(data)} bytes")
+        return data
+
+    def fill() -> None:
+        nonlocal next_part
+        while next_part < parts and len(window) < parallel:
+            window[next_part] = asyncio.ensure_future(fetch(next_part))
+            next_part += 1
+
+    try:
+        fill()
+        first = min(part_size, total)
+        received = 0
+        async for chunk in resp.content.iter_chunked(chunk_size):
+            chunk = chunk[:first - received]
+            received += len(chunk)
+            yield chunk
+            if received >= first:
+                break
+        resp.close()
+        if received < first:
+            raise RangeError(f"{url} ended after {received} bytes")
+        for index in range(1, parts):
+            data = await window.pop(index)
+            fill()
+            for offset in range(0, len(data), chunk_size):
+                yield data[offset:offset + chunk_size]
+    finally:
+        for task in window.values():
+            task.cancel()
+        await asyncio.gather(*window.values(), return_exceptions=True)
@@ -0,0 +1,231 @@
+""" Per-client Rate Limits and Concurrency Quotas """
+import hashlib
+import json
+import math
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+UNLIMITED = {"rate": 0.0, "burst": 0.0, "concurrency": 0}
+
+
+class Limits: # pylint: disable=too-few-public-methods
+    """ Rate, burst and concurrency limits of one tenant; 0 means unlimited """
+    __slots__ = ('rate', 'burst', 'concurrency')
+
+    def __init__(self, rate: float = 0.0, burst: float = 0.0, concurrency: int = 0) -> None:
+        self.rate = float(rate)
+        self.burst = float(burst) if burst else max(float(rate), 1.0)
+        self.concurrency = int(concurrency)
+
+    @classmethod
+    def from_dict(cls, values: dict, default: Optional['Limits'] = None) -> 'Limits':
+        """ Limits from a config mapping, missing keys fall back to default """
+        base = default or Limits()
+        return cls(
+            values.get("rate", base.rate),
+            values.get("burst", base.burst if "rate" not in values else 0.0),
+            values.get("concurrency", base.concurrency))
+
+
+class Usage: # pylint: disable=too-many-instance-attributes
+    """ Token bucket, in-flight count and counters of one client key """
+    __slots__ = ('limits', 'tokens', 'updated', 'active', 'allowed', 'rate_limited',
+                 'concurrency_limited', 'named')
+
+    def __init__(self, limits: Limits, named: bool) -> None:
+        self.limits = limits
+        self.tokens = limits.burst
+        self.updated = time.monotonic()
+        self.active = 0
+        self.allowed = 0
+        self.rate_limited = 0
+        self.concurrency_limited = 0
+        self.named = named
+
+    def take(self, now: float, cost: float = 1.0) -> float:
+        """
+        Take cost tokens, returning 0 or the seconds until they are available.
+        A cost above the burst is admitted from a full bucket and leaves it in debt.
+        """
+        if self.limits.rate <= 0:
+            return 0.0
+        self.tokens = min(self.limits.burst, self.tokens + (now - self.updated) * self.limits.rate)
+        self.updated = now
+        needed = min(cost, self.limits.burst)
+        if self.tokens >= needed:
+            self.tokens -= cost
+            return 0.0
+        return (needed - self.tokens) / self.limits.rate
+
+    def info(self) -> dict:
+        """ Usage for metrics """
+        return {
+            "active": self.active,
+            "allowed": self.allowed,
+            "rate_limited": self.rate_limited,
+            "concurrency_limited": self.concurrency_limited,
+            "tokens": round(self.tokens, 2) if self.limits.rate > 0 else None,
+        }
+
+
+class RateLimiter:
+    """
+    RateLimiter
+    In-memory token buckets and concurrency quotas keyed by tenant, bearer token or client IP.
+    Tenants and their limits come from a JSON file:
+
+        {
+            "default": {"rate": 5, "burst": 10, "concurrency": 2},
+            "tenants": {
+                "webapp": {"rate": 50, "burst": 100, "concurrency": 8,
+                           "tokens": ["..."], "ips": ["10.0.0.5"]}
+            }
+        }
+    """
+    def __init__(self, conf, logger) -> None:
+        """
+        RateLimiter constructor
+
+            Parameters:
+                conf (module): ScanCan configuration
+                logger (Logger): application logger
+
+            Returns:
+                None
+        """
+        self.logger = logger
+        self.max_keys = conf.RATE_LIMIT_MAX_KEYS
+        self.default = Limits()
+        self.tenants: Dict[str, Limits] = {}
+        self.by_token: Dict[str, str] = {}
+        self.by_ip: Dict[str, str] = {}
+        self.usage: 'OrderedDict[str, Usage]' = OrderedDict()
+        if conf.RATE_LIMIT_FILE:
+            with open(conf.RATE_LIMIT_FILE, encoding='utf-8') as fh:
+                self.configure(json.load(fh))
+
+    def configure(self, config: dict) -> None:
+        """ Load default and per tenant limits """
+        self.default = Limits.from_dict(config.get("default", UNLIMITED))
+        for name, values in config.get("tenants", {}).items():
+            self.tenants[name] = Limits.from_dict(values, self.default)
+            for token in values.get("tokens", []):
+                self.by_token[token] = name
+            for ip in values.get("ips", []):
+                self.by_ip[ip] = name
+        self.logger.info("Rate limits loaded for %d tenants", len(self.tenants))
+
+    def resolve(self, tenant: Optional[str], token: Optional[str], ip: Optional[str],
+                verified: bool = True) -> str:
+        """
+        Client key of a request
+
+            Parameters:
+                tenant (str): tenant name returned by the authentication addon, if any
+                token (str): bearer token, if any
+                ip (str): client address
+                verified (bool): whether the authentication addon accepted the token; an
+                    unverified token only counts when it is listed in the limits file,
+                    otherwise clients could pick a fresh bucket per request
+
+            Returns:
+                key (str): a configured tenant name, 'token:<digest>' or 'ip:<address>'
+        """
+        if tenant:
+            return tenant
+        if token:
+            name = self.by_token.get(token)
+            if name:
+                return name
+            if verified:
+                return "token:" + hashlib.sha256(token.encode()).hexdigest()[:16]
+        if ip and ip in self.by_ip:
+            return self.by_ip[ip]
+        return f"ip:{ip or 'unknown'}"
+
+    def _usage(self, key: str) -> Usage:
+        usage = self.usage.get(key)
+        if usage is None:
+            named = key in self.tenants
+            usage = Usage(self.tenants.get(key, self.default), named)
+            self.usage[key] = usage
+            if len(self.usage) > self.max_keys:
+                # Drop the least recently seen idle client
+                for old_key, old in self.usage.items():
+                    if not old.named and old.active == 0:
+                        del self.usage[old_key]
+                        break
+        else:
+            self.usage.move_to_end(key)
+        return usage
+
+    def acquire(self, key: str) -> Tuple[bool, float, str]:
+        """
+        Admit one request for a client
+
+            Returns:
+                allowed (bool)
+                retry_after (float): seconds to wait when not allowed
+                reason (str): 'rate' or 'concurrency' when not allowed
+        """
+        usage = self._usage(key)
+        if usage.limits.concurrency and usage.active >= usage.limits.concurrency:
+            usage.concurrency_limited += 1
+            return False, 1.0, 'concurrency'
+        wait = usage.take(time.monotonic())
+        if wait > 0:
+            usage.rate_limited += 1
+            return False, wait, 'rate'
+        usage.active += 1
+        usage.allowed += 1
+        return True, 0.0, ''
+
+    def charge(self, key: str, cost: float) -> float:
+        """
+        Charge an admitted request for the extra items it scans
+
+            Parameters:
+                key (str): client key
+                cost (float): tokens to take on top of the one acquire() took
+
+            Returns:
+                retry_after (float): 0 when charged, else seconds to wait
+        """
+        usage = self._usage(key)
+        if cost <= 0:
+            return 0.0
+        wait = usage.take(time.monotonic(), cost)
+        if wait > 0:
+            usage.rate_limited += 1
+        return wait
+
+    def release(self, key: str) -> None:
+        """ Mark a request of a client as finished """
+        usage = self.usage.get(key)
+        if usage is not None and usage.active > 0:
+            usage.active -= 1
+
+    def stats(self) -> dict:
+        """
+        Stats
+
+            Returns:
+                stats (dict): usage per configured tenant plus totals for other clients
+        """
+        tenants = {}
+        others = {"clients": 0, "active": 0, "allowed": 0, "rate_limited": 0,
+                  "concurrency_limited": 0}
+        for key, usage in self.usage.items():
+            if usage.named:
+                tenants[key] = usage.info()
+                continue
+            others["clients"] += 1
+            for field in ("active", "allowed", "rate_limited", "concurrency_limited"):
+                others[field] += getattr(usage, field)
+        return {"tenants": tenants, "others": others}
+
+
+def retry_after_header(seconds: float) -> str:
+    """ Retry-After value in whole seconds, at least 1 """
+    return str(max(1, math.ceil(seconds)))
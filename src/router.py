@@ -0,0 +1,591 @@
+""" Clamd Backend Router """
+import asyncio
+import re
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Deque, List, Optional, Tuple
+
+from pyvalve import PyvalveConnectionError, PyvalveError
+
+from clamav import ClamdTimeoutError, ScannerBackend, parse_signature_version
+from clamdstats import gauges, parse_stats
+from scheduler import Scheduler, check_deadline, current_priority
+from tracing import span
+
+READY = 'ready'
+RELOADING = 'reloading'
+DOWN = 'down'
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Failures that say something about the backend, not about the payload
+BACKEND_ERRORS = (PyvalveConnectionError, OSError)
+HEDGE_WINDOW = 200
+
+
+class CircuitOpenError(PyvalveConnectionError):
+    """ Raised when every ready backend has an open circuit breaker """
+
+
+class PayloadError(Exception):
+    """
+    Raised inside a backend when the payload source fails, e.g. a client upload or a remote
+    download, so the failure is not counted against the backend. ClamRouter re-raises the
+    original error to its caller.
+    """
+    def __init__(self, error: Exception) -> None:
+        super().__init__(str(error))
+        self.error = error
+
+
+class CircuitBreaker:
+    """
+    CircuitBreaker
+    Opens after `failures` consecutive backend errors and rejects commands for `reset`
+    seconds, then lets a single trial command through to decide whether to close again
+    """
+    def __init__(self, failures: int, reset: float) -> None:
+        """
+        CircuitBreaker constructor
+
+            Parameters:
+                failures (int): consecutive failures that open the breaker, 0 disables it
+                reset (float): seconds to stay open before a trial command
+
+            Returns:
+                None
+        """
+        self.failures = failures
+        self.reset = reset
+        self.state = CLOSED
+        self.consecutive = 0
+        self.opened = 0.0
+        self.trial = False
+        self.trips = 0
+
+    def available(self) -> bool:
+        """ Whether a command may be sent now """
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            return time.monotonic() - self.opened >= self.reset
+        return not self.trial
+
+    def begin(self) -> None:
+        """ Mark a command as sent, making it the trial when the reset time has passed """
+        if self.state == OPEN and time.monotonic() - self.opened >= self.reset:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN:
+            self.trial = True
+
+    def success(self) -> None:
+        """ Record a successful command """
+        self.state = CLOSED
+        self.consecutive = 0
+        self.trial = False
+
+    def failure(self) -> None:
+        """ Record a failed command """
+        self.consecutive += 1
+        self.trial = False
+        if self.failures <= 0:
+            return
+        if self.state == HALF_OPEN or self.consecutive >= self.failures:
+            if self.state != OPEN:
+                self.trips += 1
+            self.state = OPEN
+            self.opened = time.monotonic()
+
+
+class BackendConf: # pylint: disable=too-few-public-methods
+    """
+    BackendConf
+    ScanCan configuration with the clamd connection settings of one backend
+    """
+    def __init__(self, conf, **overrides) -> None:
+        self._conf = conf
+        self.__dict__.update(overrides)
+
+    def __getattr__(self, name):
+        return getattr(self._conf, name)
+
+
+def parse_backend_spec(spec: str) -> dict:
+    """
+    Parse a backend spec, 'net:host:port', 'socket:/path/to/clamd.socket' or
+    'libclamav:/path/to/database'
+
+        Returns:
+            settings (dict): CLAMD_CONN and connection setting overrides
+    """
+    kind, _, rest = spec.strip().partition(':')
+    if kind == 'socket' and rest:
+        return {'CLAMD_CONN': 'socket', 'CLAMD_SOCKET': rest}
+    if kind == 'libclamav' and rest:
+        return {'CLAMD_CONN': 'libclamav', 'LIBCLAMAV_DATABASE': rest}
+    if kind == 'net' and rest:
+        host, _, port = rest.rpartition(':')
+        if host and port.isdigit():
+            return {'CLAMD_CONN': 'net', 'CLAMD_HOST': host, 'CLAMD_PORT': int(port)}
+    raise ValueError(f"Invalid clamd backend spec: {spec}")
+
+
+def stats_state(stats: str) -> str:
+    """ Backend state from a STATS reply """
+    match = re.search(r'^STATE:\s*(.+)$', stats, re.MULTILINE)
+    if match and match.group(1).strip() == 'VALID PRIMARY':
+        return READY
+    return RELOADING
+
+
+def oldest_signature(signatures: List[str]) -> Optional[str]:
+    """
+    Database version every backend that may take a scan has loaded. Verdicts are cached under
+    it, so none is stored under a version newer than the database that produced it while
+    backends reload one after another. None when versions differ and cannot be ordered.
+    """
+    if not signatures:
+        return None
+    if all(signature.isdigit() for signature in signatures):
+        return min(signatures, key=int)
+    if len(set(signatures)) == 1:
+        return signatures[0]
+    return None
+
+
+class Backend: # pylint: disable=too-many-instance-attributes,too-few-public-methods
+    """
+    Backend
+    One clamd with its client pool and the state observed by the reload monitor
+    """
+    def __init__(self, name: str, pool: ScannerBackend, tier: int = 0) -> None:
+        """
+        Backend constructor
+
+            Parameters:
+                name (str): display name
+                pool (ScannerBackend): clients for this clamd, or in-process engines
+                tier (int): routing preference, lower tiers are used first
+
+            Returns:
+                None
+        """
+        self.name = name
+        self.pool = pool
+        self.probe_client = pool.probe_client()
+        self.breaker = CircuitBreaker(pool.conf.BREAKER_FAILURES, pool.conf.BREAKER_RESET)
+        self.tier = tier
+        self.state = READY
+        self.signature: Optional[str] = None
+        self.in_flight = 0
+        self.checked = 0.0
+        self.stats: Optional[dict] = None
+        self.stats_checked = 0.0
+
+    def info(self) -> dict:
+        """ Backend state for metrics """
+        return {
+            "tier": self.tier,
+            "state": self.state,
+            "signature": self.signature,
+            "in_flight": self.in_flight,
+            "breaker": self.breaker.state,
+            "breaker_trips": self.breaker.trips,
+            "pool": self.pool.pool_stats(),
+        }
+
+
+class ClamRouter: # pylint: disable=too-many-instance-attributes,too-many-public-methods
+    """
+    ClamRouter
+    Routes clamd commands to the preferred ready backend. A monitor task watches
+    VERSION and STATS of every backend; while a backend reloads its database, new
+    commands go to a ready standby or are held until a backend is ready again.
+    """
+    def __init__(self, conf, backends: List[Backend]) -> None:
+        """
+        ClamRouter constructor
+
+            Parameters:
+                conf (module): ScanCan configuration
+                backends (list): backends in preference order
+
+            Returns:
+                None
+        """
+        self.conf = conf
+        self.backends = backends
+        self.logger: Any = None
+        self.signature: Optional[str] = None
+        self.listeners: List[Callable[[str], None]] = []
+        self.changed: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+        self.held = 0
+        self.switches = 0
+        self.active: Optional[Backend] = None
+        self.scheduler: Optional[Scheduler] = None
+        self.latencies: Deque[float] = deque(maxlen=HEDGE_WINDOW)
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.refreshing: Optional[asyncio.Future] = None
+
+    def set_logger(self, logger):
+        """ Set Logger """
+        self.logger = logger
+        for backend in self.backends:
+            backend.pool.set_logger(logger)
+            backend.probe_client.set_logger(logger)
+
+    def add_listener(self, listener: Callable[[str], None]) -> None:
+        """ Call listener(signature) whenever the active signature version changes """
+        self.listeners.append(listener)
+
+    def _event(self) -> asyncio.Event:
+        if self.changed is None:
+            self.changed = asyncio.Event()
+        return self.changed
+
+    def _ready(self, exclude: Optional[Backend] = None) -> Optional[Backend]:
+        ready = [
+            backend for backend in self.backends
+            if backend.state == READY and backend.breaker.available() and backend is not exclude]
+        if not ready:
+            return None
+        return min(ready, key=lambda backend: (backend.tier, backend.in_flight))
+
+    async def choose(self) -> Backend:
+        """
+        Choose a backend, holding the caller while every backend is reloading
+
+            Returns:
+                backend (Backend)
+        """
+        backend = self._ready()
+        if backend is not None:
+            return backend
+        if any(candidate.state == READY for candidate in self.backends):
+            raise CircuitOpenError("Circuit breaker open for every ready clamd backend")
+        self.held += 1
+        deadline = time.monotonic() + self.conf.RELOAD_HOLD_TIMEOUT
+        with span('reload_hold'):
+            while backend is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                event = self._event()
+                event.clear()
+                try:
+                    await asyncio.wait_for(event.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+                backend = self._ready()
+        if backend is None:
+            usable = [
+                candidate for candidate in self.backends
+                if candidate.state != DOWN and candidate.breaker.available()]
+            if not usable:
+                raise PyvalveConnectionError("No clamd backend available")
+            backend = min(usable, key=lambda candidate: (candidate.tier, candidate.in_flight))
+        return backend
+
+    def set_scheduler(self, scheduler: Scheduler) -> None:
+        """ Admit commands through a priority scheduler """
+        self.scheduler = scheduler
+
+    @asynccontextmanager
+    async def _slot(self) -> AsyncIterator[None]:
+        if self.scheduler is None:
+            check_deadline()
+            yield
+            return
+        cls, size = current_priority()
+        async with self.scheduler.slot(cls, size):
+            yield
+
+    async def _call(self, command: str, *args):
+        async with self._slot():
+            return await self._run(await self.choose(), command, *args)
+
+    async def _run(self, backend: Backend, command: str, *args):
+        backend.in_flight += 1
+        backend.breaker.begin()
+        try:
+            result = await getattr(backend.pool, command)(*args)
+        except PayloadError as err:
+            backend.breaker.trial = False
+            raise err.error from None
+        except BACKEND_ERRORS:
+            backend.breaker.failure()
+            raise
+        except asyncio.CancelledError:
+            backend.breaker.trial = False
+            raise
+        finally:
+            backend.in_flight -= 1
+        backend.breaker.success()
+        return result
+
+    async def ping(self):
+        """ Ping """
+        return await self._call('ping')
+
+    async def version(self):
+        """ Version """
+        return await self._call('version')
+
+    async def stats(self):
+        """ Stats """
+        return await self._call('stats')
+
+    async def scan(self, path):
+        """ Scan """
+        return await self._call('scan', path)
+
+    async def contscan(self, path):
+        """ Cont Scan """
+        return await self._call('contscan', path)
+
+    async def instream(self, file):
+        """ Instream, hedging payloads up to HEDGE_MAX_SIZE bytes across backends """
+        hedging = self.conf.HEDGE_MAX_SIZE > 0 and len(self.backends) > 1
+        if not hasattr(file, '__aiter__'):
+            return await self._call('instream', file)
+        if not hedging:
+            return await self._call('instream', payload_chunks(file))
+        head, rest = await buffer_stream(file, self.conf.HEDGE_MAX_SIZE)
+        if rest is not None:
+            return await self._call('instream', replay(head, payload_chunks(rest)))
+        async with self._slot():
+            return await self._hedged(head)
+
+    def hedge_delay(self) -> Optional[float]:
+        """ p95 latency of small INSTREAMs, None until HEDGE_MIN_SAMPLES have been seen """
+        if len(self.latencies) < self.conf.HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return max(self.conf.HEDGE_MIN_DELAY, ordered[int(len(ordered) * 0.95) - 1])
+
+    async def _timed(self, backend: Backend, head: List[bytes]) -> str:
+        started = time.monotonic()
+        result = await self._run(backend, 'instream', replay(head))
+        self.latencies.append(time.monotonic() - started)
+        return result
+
+    async def _hedged(self, head: List[bytes]) -> str:
+        """ Send a buffered payload, and once it passes the p95 latency, to a second backend """
+        backend = await self.choose()
+        first = asyncio.ensure_future(self._timed(backend, head))
+        tasks = [first]
+        try:
+            delay = self.hedge_delay()
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                second = None if done else self._ready(exclude=backend)
+                if second is not None:
+                    self.hedges += 1
+                    tasks.append(asyncio.ensure_future(self._timed(second, head)))
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            self.hedge_wins += 1
+                        return task.result()
+            return first.result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    task.exception()
+
+    async def signature_version(self) -> str:
+        """ Signature version loaded by every backend that may take a scan """
+        if self.signature is not None:
+            return self.signature
+        return await (await self.choose()).pool.signature_version()
+
+    async def connecting(self):
+        """ Warm every backend pool """
+        results = await asyncio.gather(
+            *(backend.pool.connecting() for backend in self.backends), return_exceptions=True)
+        for backend, result in zip(self.backends, results):
+            if isinstance(result, Exception):
+                backend.state = DOWN
+                self.logger.warning("Backend %s failed warmup: %s", backend.name, result)
+        if all(isinstance(result, Exception) for result in results):
+            raise PyvalveConnectionError("No clamd backend reachable")
+
+    async def start(self) -> None:
+        """ Start the reload monitor """
+        await self.check()
+        self.task = asyncio.create_task(self.monitor())
+
+    async def stop(self) -> None:
+        """ Stop the reload monitor and close the backend pools """
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        for backend in self.backends:
+            await backend.pool.close()
+
+    async def monitor(self) -> None:
+        """ Probe every backend every RELOAD_CHECK_INTERVAL seconds """
+        while True:
+            await asyncio.sleep(self.conf.RELOAD_CHECK_INTERVAL)
+            await self.check()
+
+    async def check(self) -> None:
+        """ Probe all backends once and update routing """
+        await asyncio.gather(*(self.probe(backend) for backend in self.backends))
+        self.update()
+
+    async def probe(self, backend: Backend) -> None:
+        """
+        Refresh one backend's state and signature version from STATS and VERSION.
+        Probes use a dedicated client so a saturated pool is not mistaken for a reload.
+        """
+        timeout = self.conf.RELOAD_PROBE_TIMEOUT
+        try:
+            stats = await asyncio.wait_for(backend.probe_client.stats(), timeout)
+            version = await asyncio.wait_for(backend.probe_client.version(), timeout)
+        except (asyncio.TimeoutError, ClamdTimeoutError):
+            # A clamd that stops answering while up is usually busy loading its database
+            state, signature = RELOADING, backend.signature
+        except (PyvalveError, OSError):
+            state, signature = DOWN, backend.signature
+        else:
+            state, signature = stats_state(stats), parse_signature_version(version)
+            backend.stats = parse_stats(stats)
+            backend.stats_checked = time.monotonic()
+        if state != backend.state:
+            self.logger.info("Backend %s is now %s", backend.name, state)
+        backend.state = state
+        backend.signature = signature
+        backend.checked = time.monotonic()
+
+    def update(self) -> None:
+        """ Switch the active backend and signature version atomically """
+        active = self._ready()
+        if active is not self.active:
+            if active is not None:
+                self.logger.info("Routing scans to backend %s", active.name)
+            if self.active is not None:
+                self.switches += 1
+            self.active = active
+        signature = oldest_signature([
+            backend.signature for backend in self.backends
+            if backend.state != DOWN and backend.signature])
+        if signature is not None and signature != self.signature:
+            previous, self.signature = self.signature, signature
+            if previous is not None:
+                self.logger.info("Signature version changed from %s to %s", previous, signature)
+            for listener in self.listeners:
+                listener(signature)
+        if active is not None:
+            self._event().set()
+
+    async def clamd_stats(self, max_age: float) -> dict:
+        """
+        Parsed STATS of every backend, probing again when older than max_age
+
+            Parameters:
+                max_age (float): seconds a probe result may be reused
+
+            Returns:
+                stats (dict): backend name -> state, age in seconds, parsed STATS and gauges;
+                    stats are None for a backend that has not answered yet
+        """
+        now = time.monotonic()
+        if any(now - backend.checked > max_age for backend in self.backends):
+            # Concurrent callers share one round of probes
+            if self.refreshing is None:
+                self.refreshing = asyncio.ensure_future(self.check())
+                self.refreshing.add_done_callback(self._refreshed)
+            await asyncio.shield(self.refreshing)
+        now = time.monotonic()
+        return {
+            backend.name: {
+                "state": backend.state,
+                "age": round(now - backend.stats_checked, 3) if backend.stats else None,
+                "stats": backend.stats,
+                "gauges": gauges(backend.stats) if backend.stats else None,
+            }
+            for backend in self.backends}
+
+    def _refreshed(self, _: asyncio.Future) -> None:
+        self.refreshing = None
+
+    def stats_gauges(self) -> dict:
+        """
+        Capacity gauges of every backend from the last monitor probe
+
+            Returns:
+                gauges (dict): backend name -> gauges, for backends that have answered STATS
+        """
+        return {
+            backend.name: gauges(backend.stats)
+            for backend in self.backends if backend.stats is not None}
+
+    def pool_stats(self) -> dict:
+        """
+        Pool Stats
+
+            Returns:
+                stats (dict): per backend state plus routing counters
+        """
+        return {
+            "active": self.active.name if self.active else None,
+            "signature": self.signature,
+            "held": self.held,
+            "switches": self.switches,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "hedge_delay": self.hedge_delay(),
+            "backends": {backend.name: backend.info() for backend in self.backends},
+        }
+
+
+async def buffer_stream(
+        chunks: AsyncIterable[bytes], max_bytes: int
+        ) -> Tuple[List[bytes], Optional[AsyncIterator[bytes]]]:
+    """
+    Read a stream into memory up to max_bytes
+
+        Returns:
+            head (list): chunks read so far
+            rest (AsyncIterator): remainder of the stream, None if it fit entirely
+    """
+    iterator = chunks.__aiter__() # pylint: disable=unnecessary-dunder-call
+    head: List[bytes] = []
+    size = 0
+    async for chunk in iterator:
+        head.append(chunk)
+        size += len(chunk)
+        if size > max_bytes:
+            return head, iterator
+    return head, None
+
+
+async def payload_chunks(chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    """ Yield the chunks of a payload, wrapping errors of its source in PayloadError """
+    try:
+        async for chunk in chunks:
+            yield chunk
+    except Exception as err: # pylint: disable=broad-exception-caught
+        raise PayloadError(err) from err
+
+
+async def replay(
+        head: List[bytes], rest: Optional[AsyncIterable[bytes]] = None) -> AsyncIterator[bytes]:
+    """ Yield buffered chunks, then the rest of the stream """
+    for chunk in head:
+        yield chunk
+    if rest is not None:
+        async for chunk in rest:
+            yield chunk
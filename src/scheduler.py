@@ -0,0 +1,262 @@
+""" Scan Scheduling """
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Deque, Dict, Iterator, Optional, Tuple
+
+from tracing import span
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+BACKGROUND = 'background'
+PRIORITY_CLASSES = (INTERACTIVE, BULK, BACKGROUND)
+
+_priority: ContextVar[Tuple[str, Optional[int]]] = ContextVar(
+    'scancan_priority', default=(INTERACTIVE, None))
+_deadline: ContextVar[Optional[float]] = ContextVar('scancan_deadline', default=None)
+
+
+class DeadlineExceeded(Exception):
+    """ Raised when work is about to be dispatched after its X-Scan-Deadline """
+
+
+def current_priority() -> Tuple[str, Optional[int]]:
+    """ Priority class and payload size of the scan being served """
+    return _priority.get()
+
+
+@contextmanager
+def priority(cls: str, size: Optional[int] = None) -> Iterator[None]:
+    """ Run the enclosed block, and tasks it creates, under a priority class """
+    token = _priority.set((cls, size))
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def parse_deadline(value: Optional[str]) -> Optional[float]:
+    """
+    Parse an X-Scan-Deadline value, Unix time in seconds or an HTTP-date
+
+        Returns:
+            deadline (float): Unix time, None when the header is missing or invalid
+    """
+    if not value or not value.strip():
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+@contextmanager
+def deadline(at: Optional[float]) -> Iterator[None]:
+    """ Run the enclosed block, and tasks it creates, with a deadline in Unix time """
+    token = _deadline.set(at)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """ Seconds left until the deadline of the scan being served, None without one """
+    at = _deadline.get()
+    return None if at is None else at - time.time()
+
+
+def check_deadline() -> None:
+    """ Drop work whose deadline has passed """
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded("Scan deadline exceeded")
+
+
+async def _until_deadline(future: asyncio.Future) -> None:
+    left = remaining()
+    if left is None:
+        await future
+        return
+    done, _ = await asyncio.wait({future}, timeout=max(0.0, left))
+    if not done:
+        raise DeadlineExceeded("Scan deadline exceeded")
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    """ Parse 'interactive=8,bulk=2,background=1' into class weights """
+    weights = {INTERACTIVE: 8.0, BULK: 2.0, BACKGROUND: 1.0}
+    for item in spec.split(','):
+        name, _, value = item.partition('=')
+        name = name.strip()
+        if name not in weights or not value.strip():
+            continue
+        weights[name] = max(float(value), 0.001)
+    return weights
+
+
+def classify(header: Optional[str], path: str, size: Optional[int], interactive_max: int) -> str:
+    """
+    Priority class of a request
+
+        Parameters:
+            header (str): X-Scan-Priority value, wins when it names a known class
+            path (str): request path
+            size (int): Content-Length, if known
+            interactive_max (int): larger payloads are treated as bulk
+
+        Returns:
+            cls (str): 'interactive', 'bulk' or 'background'
+    """
+    if header and header.strip().lower() in PRIORITY_CLASSES:
+        return header.strip().lower()
+    if path.startswith(('/contscan/', '/scanpath/', '/scanurls')):
+        return BULK
+    if size is not None and size > interactive_max:
+        return BULK
+    return INTERACTIVE
+
+
+class Scheduler: # pylint: disable=too-many-instance-attributes
+    """
+    Scheduler
+    Admits at most `capacity` clamd commands at a time. Waiting commands are released in
+    weighted fair queueing order across the priority classes, except small payloads,
+    which use a fast lane with slots that other work cannot take.
+    """
+    def __init__(self, conf, capacity: int) -> None:
+        """
+        Scheduler constructor
+
+            Parameters:
+                conf (module): ScanCan configuration
+                capacity (int): concurrent clamd commands, normally the pool size
+
+            Returns:
+                None
+        """
+        self.capacity = max(1, capacity)
+        self.reserved = min(conf.SCHED_FAST_LANE_SLOTS, self.capacity - 1)
+        self.fast_size = conf.SCHED_FAST_LANE_SIZE
+        self.weights = parse_weights(conf.SCHED_WEIGHTS)
+        self.active = 0
+        self.vtime = 0.0
+        self.finish: Dict[str, float] = {cls: 0.0 for cls in PRIORITY_CLASSES}
+        self.queues: Dict[str, Deque[Tuple[float, asyncio.Future]]] = {
+            cls: deque() for cls in PRIORITY_CLASSES}
+        self.fast: Deque[asyncio.Future] = deque()
+        self.dispatched: Dict[str, int] = {cls: 0 for cls in PRIORITY_CLASSES}
+        self.waited: Dict[str, float] = {cls: 0.0 for cls in PRIORITY_CLASSES}
+        self.fast_dispatched = 0
+        self.expired: Dict[str, int] = {cls: 0 for cls in PRIORITY_CLASSES}
+
+    def _general_free(self) -> bool:
+        return self.active < self.capacity - self.reserved
+
+    def _waiting(self) -> bool:
+        return bool(self.fast) or any(self.queues.values())
+
+    @asynccontextmanager
+    async def slot(self, cls: str, size: Optional[int] = None) -> AsyncIterator[None]:
+        """ Hold one clamd slot for the duration of the block, waiting until the deadline """
+        cls = cls if cls in self.queues else INTERACTIVE
+        left = remaining()
+        if left is not None and left <= 0:
+            self.expired[cls] += 1
+            raise DeadlineExceeded("Scan deadline exceeded")
+        fast = size is not None and size <= self.fast_size
+        started = time.monotonic()
+        if not self._waiting() and (self._general_free() or (fast and self.active < self.capacity)):
+            self.active += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            if fast:
+                self.fast.append(future)
+            else:
+                tag = max(self.vtime, self.finish[cls]) + 1.0 / self.weights[cls]
+                self.finish[cls] = tag
+                self.queues[cls].append((tag, future))
+            # A fast lane slot may be free even though general work is queued
+            self._dispatch()
+            try:
+                with span('sched_queue', priority=cls):
+                    await _until_deadline(future)
+            except (asyncio.CancelledError, DeadlineExceeded) as err:
+                if future.done() and not future.cancelled():
+                    self._release()
+                else:
+                    self._forget(future)
+                if isinstance(err, DeadlineExceeded):
+                    self.expired[cls] += 1
+                raise
+        self.dispatched[cls] += 1
+        self.fast_dispatched += fast
+        self.waited[cls] += time.monotonic() - started
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _forget(self, future: asyncio.Future) -> None:
+        if future in self.fast:
+            self.fast.remove(future)
+            return
+        for queue in self.queues.values():
+            for entry in queue:
+                if entry[1] is future:
+                    queue.remove(entry)
+                    return
+
+    def _release(self) -> None:
+        self.active -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """ Hand free slots to waiters, fast lane first, then the lowest finish tag """
+        while self.active < self.capacity:
+            if self.fast:
+                future = self.fast.popleft()
+            elif self._general_free():
+                heads = [(queue[0][0], cls) for cls, queue in self.queues.items() if queue]
+                if not heads:
+                    return
+                tag, cls = min(heads)
+                self.vtime = tag
+                future = self.queues[cls].popleft()[1]
+            else:
+                return
+            if not future.done():
+                self.active += 1
+                future.set_result(None)
+
+    def stats(self) -> dict:
+        """
+        Stats
+
+            Returns:
+                stats (dict): slot usage plus per class queue length, dispatch count and mean wait
+        """
+        return {
+            "capacity": self.capacity,
+            "reserved_fast_lane": self.reserved,
+            "active": self.active,
+            "fast_lane_waiting": len(self.fast),
+            "fast_lane_dispatched": self.fast_dispatched,
+            "classes": {
+                cls: {
+                    "weight": self.weights[cls],
+                    "waiting": len(self.queues[cls]),
+                    "dispatched": self.dispatched[cls],
+                    "expired": self.expired[cls],
+                    "wait_avg": (
+                        self.waited[cls] / self.dispatched[cls] if self.dispatched[cls] else 0.0),
+                } for cls in PRIORITY_CLASSES
+            },
+        }
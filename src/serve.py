@@ -0,0 +1,45 @@
+""" ScanCan Server """
+import importlib.util
+
+import uvicorn
+
+import config as conf
+from fleet import ClamdFleet
+from logger import Logger
+
+
+def server_options() -> dict:
+    """
+    Uvicorn options for the configured serving mode
+
+        Returns:
+            options (dict)
+    """
+    return {
+        "host": conf.SCANCAN_HOST,
+        "port": conf.SCANCAN_PORT,
+        "workers": max(1, conf.SCANCAN_WORKERS),
+        "loop": "uvloop" if importlib.util.find_spec("uvloop") else "asyncio",
+        "http": "httptools" if importlib.util.find_spec("httptools") else "h11",
+        "log_level": conf.LOG_LEVEL.lower(),
+    }
+
+
+def main() -> None:
+    """
+    Run ScanCan with a prefork master and SCANCAN_WORKERS worker processes, and the local
+    clamd fleet in the master when CLAMD_FLEET_SIZE is set
+    """
+    fleet = None
+    if conf.CLAMD_FLEET_SIZE > 0:
+        fleet = ClamdFleet(conf, Logger(name='ScanCan').get_logger())
+        fleet.start()
+    try:
+        uvicorn.run("main:app", **server_options())
+    finally:
+        if fleet is not None:
+            fleet.stop()
+
+
+if __name__ == "__main__":
+    main()
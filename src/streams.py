@@ -0,0 +1,212 @@
+""" Chunked Stream Helpers """
+import zlib
+from typing import AsyncIterable, AsyncIterator, BinaryIO, cast
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None  # type: ignore[assignment]
+
+DECODE_ERRORS: tuple = (zlib.error,) + ((zstandard.ZstdError,) if zstandard else ())
+
+# Ratio checks only start once this much output exists, so tiny inputs are not flagged
+RATIO_CHECK_FLOOR = 1048576
+
+
+class StreamLimitError(Exception):
+    """ Raised when a stream exceeds a size or compression ratio limit """
+
+
+class UnsupportedEncodingError(Exception):
+    """ Raised for a Content-Encoding ScanCan cannot decode """
+
+
+class StreamDecodeError(Exception):
+    """ Raised when an encoded stream is corrupt """
+
+
+class _ZlibDecoder:
+    """ gzip/deflate decoder yielding bounded output per call """
+    def __init__(self, encoding: str, chunk_size: int) -> None:
+        self.encoding = encoding
+        self.chunk_size = chunk_size
+        self.started = False
+        wbits = 16 + zlib.MAX_WBITS if encoding == 'gzip' else zlib.MAX_WBITS
+        self.obj = zlib.decompressobj(wbits)
+
+    def decode(self, data: bytes):
+        """ Decode one input chunk """
+        if not self.started and self.encoding == 'deflate':
+            self.started = True
+            try:
+                probe = zlib.decompressobj(zlib.MAX_WBITS)
+                probe.decompress(data[:2])
+            except zlib.error:
+                # Some servers send raw deflate without the zlib wrapper
+                self.obj = zlib.decompressobj(-zlib.MAX_WBITS)
+        while data:
+            out = self.obj.decompress(data, self.chunk_size)
+            if out:
+                yield out
+            data = self.obj.unconsumed_tail
+            if self.obj.eof and self.obj.unused_data and self.encoding == 'gzip':
+                # Concatenated gzip members
+                data = self.obj.unused_data
+                self.obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def flush(self):
+        """ Flush remaining output """
+        out = self.obj.flush()
+        if out:
+            yield out
+
+
+class _NeedInput(Exception):
+    """ Raised by _ZstdFeed once the decoder has consumed every chunk received so far """
+
+
+class _ZstdFeed: # pylint: disable=too-few-public-methods
+    """ Source for zstandard's stream reader holding the input received so far """
+    def __init__(self) -> None:
+        self.buffer = bytearray()
+        self.closed = False
+
+    def read(self, size: int = -1) -> bytes:
+        """ Hand the reader up to size buffered bytes, b'' only once the stream has ended """
+        if not self.buffer:
+            if self.closed:
+                return b''
+            raise _NeedInput()
+        if size < 0:
+            size = len(self.buffer)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+
+class _ZstdDecoder:
+    """
+    zstd decoder yielding bounded output per call. read1() reads the feed at most once and
+    only when the input it holds produces no more output, so interrupting it for more input
+    loses nothing.
+    """
+    def __init__(self, chunk_size: int) -> None:
+        self.chunk_size = chunk_size
+        self.feed = _ZstdFeed()
+        self.reader = zstandard.ZstdDecompressor().stream_reader(
+            cast(BinaryIO, self.feed), read_size=chunk_size, read_across_frames=True)
+
+    def decode(self, data: bytes):
+        """ Decode one input chunk """
+        self.feed.buffer += data
+        yield from self._drain()
+
+    def flush(self):
+        """ Flush remaining output """
+        self.feed.closed = True
+        yield from self._drain()
+
+    def _drain(self):
+        while True:
+            try:
+                out = self.reader.read1(self.chunk_size)
+            except _NeedInput:
+                return
+            if not out:
+                return
+            yield out
+
+
+def is_supported_encoding(encoding: str) -> bool:
+    """ Whether decompress_stream can decode encoding """
+    encoding = (encoding or 'identity').strip().lower()
+    if encoding == 'zstd':
+        return zstandard is not None
+    return encoding in ('identity', 'gzip', 'x-gzip', 'deflate')
+
+
+def _decoder(encoding: str, chunk_size: int):
+    if encoding in ('gzip', 'x-gzip'):
+        return _ZlibDecoder('gzip', chunk_size)
+    if encoding == 'deflate':
+        return _ZlibDecoder('deflate', chunk_size)
+    if encoding == 'zstd' and zstandard is not None:
+        return _ZstdDecoder(chunk_size)
+    raise UnsupportedEncodingError(f"Unsupported Content-Encoding: {encoding}")
+
+
+async def limit_stream(chunks: AsyncIterable[bytes], max_bytes: int) -> AsyncIterator[bytes]:
+    """
+    Pass chunks through, raising once more than max_bytes have been seen
+
+        Parameters:
+            chunks (AsyncIterable[bytes]): source stream
+            max_bytes (int): size limit
+
+        Returns:
+            chunks (AsyncIterator[bytes])
+    """
+    total = 0
+    async for chunk in chunks:
+        total += len(chunk)
+        if total > max_bytes:
+            raise StreamLimitError(f'Max size {max_bytes} bytes limit exceeded')
+        yield chunk
+
+
+async def decompress_stream(
+        chunks: AsyncIterable[bytes],
+        encoding: str,
+        max_size: int,
+        max_ratio: float,
+        chunk_size: int = 65536) -> AsyncIterator[bytes]:
+    """
+    Decode a Content-Encoding chunk by chunk
+
+        Parameters:
+            chunks (AsyncIterable[bytes]): encoded stream
+            encoding (str): Content-Encoding value, 'identity' passes chunks through
+            max_size (int): max decoded bytes
+            max_ratio (float): max decoded/encoded ratio
+            chunk_size (int): max bytes produced per decode step
+
+        Returns:
+            chunks (AsyncIterator[bytes]): decoded stream
+    """
+    encoding = (encoding or 'identity').strip().lower()
+    if encoding == 'identity':
+        async for chunk in limit_stream(chunks, max_size):
+            yield chunk
+        return
+
+    decoder = _decoder(encoding, chunk_size)
+    consumed = 0
+    produced = 0
+
+    def check(out: bytes) -> bytes:
+        nonlocal produced
+        produced += len(out)
+        if produced > max_size:
+            raise StreamLimitError(f'Max decompressed size {max_size} bytes limit exceeded')
+        if produced > RATIO_CHECK_FLOOR and produced > consumed * max_ratio:
+            raise StreamLimitError(f'Max compression ratio {max_ratio} exceeded')
+        return out
+
+    try:
+        async for chunk in chunks:
+            consumed += len(chunk)
+            for out in decoder.decode(chunk):
+                yield check(out)
+        for out in decoder.flush():
+            yield check(out)
+    except DECODE_ERRORS as err:
+        raise StreamDecodeError(f'Invalid {encoding} stream: {err}') from err
+
+
+async def upload_chunks(upload, chunk_size: int = 65536) -> AsyncIterator[bytes]:
+    """ Read an UploadFile chunk by chunk """
+    while True:
+        chunk = await upload.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
@@ -0,0 +1,302 @@
+""" Request Tracing """
+import asyncio
+import json
+import os
+import random
+import re
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from typing import (
+    Any, AsyncIterable, AsyncIterator, Deque, Dict, Iterator, List, Optional, Tuple,
+)
+
+TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+
+_current: ContextVar[Optional['Trace']] = ContextVar('scancan_trace', default=None)
+
+
+def parent_sampled(traceparent: Optional[str]) -> bool:
+    """ Whether a W3C traceparent header carries the sampled flag """
+    match = TRACEPARENT.match(traceparent or '')
+    return match is not None and bool(int(match.group(3), 16) & 1)
+
+
+class Span: # pylint: disable=too-few-public-methods
+    """ One timed phase of a request """
+    __slots__ = ('name', 'span_id', 'start', 'end', 'attributes')
+
+    def __init__(self, name: str, start: float, end: float, attributes: Dict[str, Any]) -> None:
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.start = start
+        self.end = end
+        self.attributes = attributes
+
+    @property
+    def duration(self) -> float:
+        """ Duration in seconds """
+        return self.end - self.start
+
+
+class Trace: # pylint: disable=too-many-instance-attributes
+    """
+    Trace
+    The spans recorded while serving one request. Times are perf_counter values,
+    converted to wall clock nanoseconds on export.
+    """
+    def __init__(self, name: str, sampled: bool, traceparent: Optional[str] = None) -> None:
+        """
+        Trace constructor
+
+            Parameters:
+                name (str): root span name, e.g. 'POST /scanfile'
+                sampled (bool): whether the trace is exported
+                traceparent (str): W3C traceparent header of the caller, whose trace is continued
+
+            Returns:
+                None
+        """
+        self.name = name
+        self.trace_id = os.urandom(16).hex()
+        self.parent_id = ''
+        self.sampled = sampled
+        match = TRACEPARENT.match(traceparent or '')
+        if match:
+            self.trace_id, self.parent_id, _flags = match.groups()
+        self.span_id = os.urandom(8).hex()
+        self.wall_ns = time.time_ns()
+        self.start = time.perf_counter()
+        self.end = self.start
+        self.status = 0
+        self.spans: List[Span] = []
+        self.totals: Dict[str, Tuple[float, float]] = {}
+
+    def add(self, name: str, start: float, end: float, **attributes) -> None:
+        """ Record a span between two perf_counter values """
+        self.spans.append(Span(name, start, end, attributes))
+
+    def accumulate(self, name: str, start: float, duration: float) -> None:
+        """ Add to a phase made of many short waits, e.g. reading a download chunk by chunk """
+        first, total = self.totals.get(name, (start, 0.0))
+        self.totals[name] = (first, total + duration)
+
+    def finish(self, status: int) -> None:
+        """ Close the root span """
+        self.end = time.perf_counter()
+        self.status = status
+        for name, (first, total) in self.totals.items():
+            self.add(name, first, first + total, accumulated=True)
+        self.totals.clear()
+
+    def server_timing(self) -> str:
+        """ Server-Timing header value, durations in milliseconds """
+        entries = [f"{span.name};dur={span.duration * 1000:.1f}" for span in self.spans]
+        entries.append(f"total;dur={(self.end - self.start) * 1000:.1f}")
+        return ", ".join(entries)
+
+    def _wall(self, perf: float) -> str:
+        return str(self.wall_ns + int((perf - self.start) * 1e9))
+
+    def otlp(self, service: str) -> dict:
+        """ The trace as an OTLP/JSON ExportTraceServiceRequest """
+        root = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id,
+            "name": self.name,
+            "kind": SPAN_KIND_SERVER,
+            "startTimeUnixNano": self._wall(self.start),
+            "endTimeUnixNano": self._wall(self.end),
+            "attributes": _attributes({"http.response.status_code": self.status}),
+        }
+        children = [{
+            "traceId": self.trace_id,
+            "spanId": span.span_id,
+            "parentSpanId": self.span_id,
+            "name": span.name,
+            "kind": SPAN_KIND_INTERNAL,
+            "startTimeUnixNano": self._wall(span.start),
+            "endTimeUnixNano": self._wall(span.end),
+            "attributes": _attributes(span.attributes),
+        } for span in self.spans]
+        return {"resourceSpans": [{
+            "resource": {"attributes": _attributes({"service.name": service})},
+            "scopeSpans": [{"scope": {"name": "scancan"}, "spans": [root] + children}],
+        }]}
+
+
+def _attributes(values: Dict[str, Any]) -> List[dict]:
+    attributes = []
+    for key, value in values.items():
+        if isinstance(value, bool):
+            attributes.append({"key": key, "value": {"boolValue": value}})
+        elif isinstance(value, int):
+            attributes.append({"key": key, "value": {"intValue": str(value)}})
+        else:
+            attributes.append({"key": key, "value": {"stringValue": str(value)}})
+    return attributes
+
+
+def current_trace() -> Optional[Trace]:
+    """ The trace of the request being served, if any """
+    return _current.get()
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[None]:
+    """ Time the enclosed block as a span of the current trace; a no-op without one """
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, start, time.perf_counter(), **attributes)
+
+
+@contextmanager
+def detached() -> Iterator[None]:
+    """ Run the enclosed block, and tasks it creates, outside the current trace """
+    token = _current.set(None)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def record(name: str, start: Optional[float] = None) -> None:
+    """ Record a span from a perf_counter value, or the start of the request, until now """
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, trace.start if start is None else start, time.perf_counter())
+
+
+async def timed_chunks(chunks: AsyncIterable[bytes], name: str) -> AsyncIterator[bytes]:
+    """ Pass chunks through, accumulating the time spent waiting for each one """
+    trace = _current.get()
+    if trace is None:
+        async for chunk in chunks:
+            yield chunk
+        return
+    iterator = chunks.__aiter__() # pylint: disable=unnecessary-dunder-call
+    while True:
+        start = time.perf_counter()
+        try:
+            chunk = await iterator.__anext__() # pylint: disable=unnecessary-dunder-call
+        except StopAsyncIteration:
+            break
+        trace.accumulate(name, start, time.perf_counter() - start)
+        yield chunk
+
+
+class Tracer: # pylint: disable=too-many-instance-attributes
+    """
+    Tracer
+    Starts a trace per request and exports a sampled share of them as OTLP/JSON lines
+    """
+    def __init__(self, conf, logger) -> None:
+        """
+        Tracer constructor
+
+            Parameters:
+                conf (module): ScanCan configuration
+                logger (Logger): application logger
+
+            Returns:
+                None
+        """
+        self.server_timing = conf.SERVER_TIMING
+        self.sample_rate = conf.TRACE_SAMPLE_RATE
+        self.follow_parent = conf.TRACE_FOLLOW_PARENT
+        self.path = conf.TRACE_EXPORT_PATH
+        self.flush_interval = conf.TRACE_FLUSH_INTERVAL
+        self.logger = logger
+        self.queue: Deque[str] = deque(maxlen=conf.TRACE_QUEUE_SIZE)
+        self.task: Optional[asyncio.Task] = None
+        self.traces = 0
+        self.sampled = 0
+        self.exported = 0
+        self.dropped = 0
+
+    def begin(self, name: str, traceparent: Optional[str] = None):
+        """
+        Start a trace for the current request
+
+            Returns:
+                trace (Trace): None when neither Server-Timing nor export wants it
+                token (Token): pass to end()
+        """
+        sampled = bool(self.path) and (
+            random.random() < self.sample_rate
+            or (self.follow_parent and parent_sampled(traceparent)))
+        if not sampled and not self.server_timing:
+            return None, None
+        trace = Trace(name, sampled, traceparent)
+        self.traces += 1
+        return trace, _current.set(trace)
+
+    def end(self, trace: Trace, token: Token, status: int) -> None:
+        """ Finish a trace and queue it for export if sampled """
+        _current.reset(token)
+        trace.finish(status)
+        if trace.sampled and self.path:
+            self.sampled += 1
+            if len(self.queue) == self.queue.maxlen:
+                self.dropped += 1
+            self.queue.append(json.dumps(trace.otlp('scancan'), separators=(',', ':')))
+
+    async def start(self) -> None:
+        """ Start the periodic export task """
+        if self.path:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        """ Stop exporting and flush queued traces """
+        task, self.task = self.task, None
+        if task:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        await self.flush()
+
+    async def run(self) -> None:
+        """ Flush queued traces every flush_interval seconds """
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except OSError as err:
+                self.logger.error("Trace export failed: %s", err)
+
+    async def flush(self) -> None:
+        """ Append queued traces to the export file """
+        if not self.queue or not self.path:
+            return
+        lines = list(self.queue)
+        self.queue.clear()
+        await asyncio.get_running_loop().run_in_executor(None, self._write, lines)
+        self.exported += len(lines)
+
+    def _write(self, lines: List[str]) -> None:
+        with open(self.path, 'a', encoding='utf-8') as fh:
+            fh.write("\n".join(lines) + "\n")
+
+    def stats(self) -> dict:
+        """
+        Stats
+
+            Returns:
+                stats (dict): traced, sampled, exported and dropped counts
+        """
+        return {
+            "traces": self.traces,
+            "sampled": self.sampled,
+            "exported": self.exported,
+            "dropped": self.dropped,
+            "queued": len(self.queue),
+        }
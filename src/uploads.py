@@ -0,0 +1,399 @@
+""" Resumable Chunked Uploads """
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+import uuid
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+
+from scheduler import classify, deadline, priority
+from tracing import detached
+
+UPLOAD_ID = re.compile(r'[0-9a-f]{32}')
+READ_CHUNK = 1048576
+
+Scan = Callable[[AsyncIterator[bytes]], Awaitable[str]]
+
+
+class UploadError(Exception):
+    """ Upload Error, carrying the HTTP status it is answered with """
+    def __init__(self, status_code: int, response: str):
+        super().__init__(response)
+        self.status_code = status_code
+        self.response = response
+
+
+class UploadStalled(Exception):
+    """ Raised into an incremental scan when no new data arrives in time """
+
+
+class UploadSession: # pylint: disable=too-many-instance-attributes,too-few-public-methods
+    """ State of one upload held by this worker; the files on disk are the source of truth """
+    def __init__(self, upload_id: str, path: str, length: int) -> None:
+        self.id = upload_id
+        self.path = path
+        self.length = length
+        self.offset = 0
+        self.digest = hashlib.sha256()
+        self.data = asyncio.Event()
+        self.busy = False
+        self.scan_task: Optional[asyncio.Future] = None
+        self.touched = time.monotonic()
+
+    def write(self, fd: int, chunk: bytes) -> None:
+        """ Write a chunk at the current offset and hash it; runs in a thread """
+        view = memoryview(chunk)
+        position = self.offset
+        while view:
+            written = os.pwrite(fd, view, position)
+            view = view[written:]
+            position += written
+        self.digest.update(chunk)
+
+
+class UploadManager: # pylint: disable=too-many-instance-attributes
+    """
+    UploadManager
+    Resumable uploads: a session is created with its total length, chunks are appended at
+    explicit offsets and the upload is finalized once complete. Chunks are written to disk and
+    hashed as they arrive, and clamd starts reading the stream with the first chunk, so the
+    verdict is ready shortly after the last one lands. Session metadata is kept next to the
+    data, so any worker process can continue an upload another one started.
+    """
+    def __init__(self, conf, logger) -> None:
+        """
+        UploadManager constructor
+
+            Parameters:
+                conf (module): ScanCan configuration
+                logger (Logger): application logger
+
+            Returns:
+                None
+        """
+        self.conf = conf
+        self.logger = logger
+        self.directory = conf.UPLOAD_DIR or os.path.join(tempfile.gettempdir(), 'scancan-uploads')
+        self.max_length = conf.UPLOAD_RESUMABLE_MAX_SIZE
+        if conf.CLAMD_CONN != 'libclamav' and conf.CLAMD_STREAM_MAX_LENGTH > 0:
+            # clamd answers INSTREAM payloads over its StreamMaxLength with an error
+            self.max_length = min(self.max_length, conf.CLAMD_STREAM_MAX_LENGTH)
+        self.sessions: Dict[str, UploadSession] = {}
+        self.sweeper: Optional[asyncio.Task] = None
+        self.created = 0
+        self.completed = 0
+        self.adopted = 0
+        self.restarts = 0
+        self.expired = 0
+
+    def _paths(self, upload_id: str) -> Tuple[str, str]:
+        base = os.path.join(self.directory, upload_id)
+        return base + '.part', base + '.json'
+
+    async def start(self) -> None:
+        """ Create the upload directory and start expiring idle uploads """
+        os.makedirs(self.directory, exist_ok=True)
+        if self.sweeper is None:
+            self.sweeper = asyncio.ensure_future(self._sweep())
+
+    async def stop(self) -> None:
+        """ Stop the sweeper and incremental scans; uploads stay on disk to be resumed """
+        if self.sweeper is not None:
+            self.sweeper.cancel()
+            await asyncio.gather(self.sweeper, return_exceptions=True)
+            self.sweeper = None
+        tasks = [s.scan_task for s in self.sessions.values() if s.scan_task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.sessions.clear()
+
+    async def create(self, length: int) -> UploadSession:
+        """
+        Create an upload
+
+            Parameters:
+                length (int): total upload size in bytes
+
+            Returns:
+                session (UploadSession): the new, empty upload
+        """
+        if length < 0:
+            raise UploadError(400, "Invalid Upload-Length")
+        if length > self.max_length:
+            raise UploadError(413, f'Max size {self.max_length} bytes limit exceeded')
+        if len(self.sessions) >= self.conf.UPLOAD_MAX_SESSIONS:
+            raise UploadError(503, "Too many uploads in progress")
+        upload_id = uuid.uuid4().hex
+        part, meta = self._paths(upload_id)
+        await asyncio.get_running_loop().run_in_executor(
+            None, _create_files, part, meta, {"length": length, "created": time.time()})
+        session = UploadSession(upload_id, part, length)
+        self.sessions[upload_id] = session
+        self.created += 1
+        return session
+
+    async def get(self, upload_id: str) -> UploadSession:
+        """
+        Current state of an upload, continuing it from disk when another worker received the
+        last chunks
+
+            Parameters:
+                upload_id (str): upload id
+
+            Returns:
+                session (UploadSession)
+        """
+        if not UPLOAD_ID.fullmatch(upload_id):
+            raise UploadError(404, "Upload not found")
+        part, meta = self._paths(upload_id)
+        try:
+            size = os.stat(part).st_size
+        except FileNotFoundError:
+            self._forget(upload_id)
+            raise UploadError(404, "Upload not found") from None
+        session = self.sessions.get(upload_id)
+        if session is not None and session.offset == size:
+            session.touched = time.monotonic()
+            return session
+        if session is not None and session.busy:
+            # Our own append has written past the recorded offset and is about to record it
+            return session
+        loop = asyncio.get_running_loop()
+        try:
+            length, digest, size = await loop.run_in_executor(None, _recover, part, meta)
+        except FileNotFoundError:
+            self._forget(upload_id)
+            raise UploadError(404, "Upload not found") from None
+        if session is None:
+            session = UploadSession(upload_id, part, length)
+            self.sessions[upload_id] = session
+        self.adopted += 1
+        session.digest = digest
+        session.offset = size
+        session.touched = time.monotonic()
+        session.data.set()
+        return session
+
+    async def append(
+            self,
+            upload_id: str,
+            offset: int,
+            chunks: AsyncIterator[bytes],
+            scan: Scan) -> UploadSession:
+        """
+        Append chunks to an upload
+
+            Parameters:
+                upload_id (str): upload id
+                offset (int): Upload-Offset the client resumes from, must match the upload
+                chunks (AsyncIterator[bytes]): request body
+                scan (Scan): streams a payload to clamd, started with the first chunk
+
+            Returns:
+                session (UploadSession): the upload, with the offset reached
+        """
+        session = await self.get(upload_id)
+        if session.busy:
+            raise UploadError(409, "Upload is being written to")
+        session.busy = True
+        try:
+            fd = os.open(session.path, os.O_WRONLY)
+            try:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    raise UploadError(409, "Upload is being written to") from None
+                if os.fstat(fd).st_size != session.offset:
+                    session.busy = False
+                    session = await self.get(upload_id)
+                    session.busy = True
+                if offset != session.offset:
+                    raise UploadError(409, f"Upload-Offset mismatch, upload is at {session.offset}")
+                self._ensure_scan(session, scan, retry=False)
+                await self._write(session, fd, chunks)
+            finally:
+                os.close(fd)
+        finally:
+            session.busy = False
+            session.touched = time.monotonic()
+        return session
+
+    async def _write(self, session: UploadSession, fd: int, chunks: AsyncIterator[bytes]) -> None:
+        loop = asyncio.get_running_loop()
+        async for chunk in chunks:
+            if not chunk:
+                continue
+            if session.offset + len(chunk) > session.length:
+                raise UploadError(413, f"Upload exceeds its Upload-Length of {session.length}")
+            write = loop.run_in_executor(None, session.write, fd, chunk)
+            try:
+                await asyncio.shield(write)
+            except asyncio.CancelledError:
+                # The write cannot be interrupted; record it so the offset matches the file
+                await asyncio.wait({write})
+                if not write.exception():
+                    session.offset += len(chunk)
+                raise
+            session.offset += len(chunk)
+            session.data.set()
+
+    def _ensure_scan(self, session: UploadSession, scan: Scan, retry: bool) -> asyncio.Future:
+        task = session.scan_task
+        if task is not None and (
+                not retry or not task.done() or not (task.cancelled() or task.exception())):
+            return task
+        if task is not None:
+            self.restarts += 1
+        cls = classify(None, '/uploads', session.length, self.conf.SCHED_INTERACTIVE_MAX_SIZE)
+        # The scan outlives the request that starts it
+        with detached(), deadline(None), priority(cls, session.length):
+            task = asyncio.ensure_future(scan(self._tail(session)))
+        # A failed scan is only restarted by finalize, once all data is on disk
+        task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        session.scan_task = task
+        return task
+
+    async def _tail(self, session: UploadSession) -> AsyncIterator[bytes]:
+        """ Upload data from the start, waiting for chunks that have not arrived yet """
+        loop = asyncio.get_running_loop()
+        fd = await loop.run_in_executor(None, os.open, session.path, os.O_RDONLY)
+        try:
+            position = 0
+            while position < session.length:
+                if position >= session.offset:
+                    # clamd's INSTREAM deadline does not count this wait, only stalls end it
+                    session.data.clear()
+                    try:
+                        await asyncio.wait_for(session.data.wait(), self.conf.UPLOAD_STALL_TIMEOUT)
+                    except asyncio.TimeoutError:
+                        raise UploadStalled(f"No data for upload {session.id}") from None
+                    continue
+                size = min(self.conf.STREAM_CHUNK_SIZE, session.offset - position)
+                chunk = await loop.run_in_executor(None, os.pread, fd, size, position)
+                if not chunk:
+                    raise UploadStalled(f"Upload {session.id} was truncated")
+                position += len(chunk)
+                yield chunk
+        finally:
+            os.close(fd)
+
+    async def finalize(self, upload_id: str, scan: Scan) -> Tuple[str, str]:
+        """
+        Finish a complete upload and return its verdict
+
+            Parameters:
+                upload_id (str): upload id
+                scan (Scan): streams a payload to clamd, when no incremental scan succeeded
+
+            Returns:
+                digest (str): SHA-256 of the upload
+                result (str): clamd reply
+        """
+        session = await self.get(upload_id)
+        if session.busy:
+            raise UploadError(409, "Upload is being written to")
+        if session.offset != session.length:
+            raise UploadError(409, f"Upload incomplete at offset {session.offset}")
+        task = self._ensure_scan(session, scan, retry=True)
+        # Keep scanning when the client gives up, so a retried finalize picks the verdict up
+        result = await asyncio.shield(task)
+        digest = session.digest.hexdigest()
+        await self._remove(upload_id)
+        self.completed += 1
+        return digest, result
+
+    async def delete(self, upload_id: str) -> None:
+        """ Abort an upload and remove its data """
+        await self.get(upload_id)
+        await self._remove(upload_id)
+
+    def _forget(self, upload_id: str) -> None:
+        session = self.sessions.pop(upload_id, None)
+        if session is not None and session.scan_task is not None:
+            session.scan_task.cancel()
+
+    async def _remove(self, upload_id: str) -> None:
+        self._forget(upload_id)
+        await asyncio.get_running_loop().run_in_executor(
+            None, _remove_files, *self._paths(upload_id))
+
+    async def _sweep(self) -> None:
+        ttl = self.conf.UPLOAD_SESSION_TTL
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(min(ttl, 60))
+            now = time.monotonic()
+            for upload_id, session in list(self.sessions.items()):
+                if not session.busy and now - session.touched > ttl:
+                    self._forget(upload_id)
+            removed = await loop.run_in_executor(None, _expire_files, self.directory, ttl)
+            if removed:
+                self.expired += removed
+                self.logger.info("Expired %d idle uploads", removed)
+
+    def stats(self) -> dict:
+        """
+        Stats
+
+            Returns:
+                stats (dict): uploads in progress in this worker, created, completed, continued
+                    from disk, restarted scans and expired uploads
+        """
+        return {
+            "sessions": len(self.sessions),
+            "created": self.created,
+            "completed": self.completed,
+            "adopted": self.adopted,
+            "restarts": self.restarts,
+            "expired": self.expired,
+        }
+
+
+def _create_files(part: str, meta: str, info: dict) -> None:
+    with open(meta, 'w', encoding='utf-8') as fh:
+        json.dump(info, fh)
+    with open(part, 'xb'):
+        pass
+
+
+def _recover(part: str, meta: str):
+    with open(meta, encoding='utf-8') as fh:
+        length = int(json.load(fh)["length"])
+    digest = hashlib.sha256()
+    size = 0
+    with open(part, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(READ_CHUNK), b''):
+            digest.update(chunk)
+            size += len(chunk)
+    return length, digest, size
+
+
+def _remove_files(*paths: str) -> None:
+    for path in paths:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def _expire_files(directory: str, ttl: float) -> int:
+    cutoff = time.time() - ttl
+    removed = 0
+    for name in os.listdir(directory):
+        if not name.endswith('.json'):
+            continue
+        meta = os.path.join(directory, name)
+        part = meta[:-len('.json')] + '.part'
+        try:
+            last = max(os.stat(path).st_mtime for path in (meta, part) if os.path.exists(path))
+        except (OSError, ValueError):
+            continue
+        if last < cutoff:
+            _remove_files(part, meta)
+            removed += 1
+    return removed
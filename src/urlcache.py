@@ -0,0 +1,113 @@
+""" URL Result Cache """
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+
+@dataclass
+class UrlCacheEntry:
+    """
+    A cached URL verdict together with the validators of the scanned object
+    """
+    verdict: str
+    signature: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    content_length: Optional[str] = None
+    stored: float = field(default_factory=time.monotonic)
+
+    def conditional_headers(self) -> Dict[str, str]:
+        """ Headers for a conditional GET revalidating this entry """
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    @classmethod
+    def from_headers(cls, headers, verdict: str, signature: str) -> Optional['UrlCacheEntry']:
+        """ Build an entry from response headers, None if the response has no validators """
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        if not etag and not last_modified:
+            return None
+        return cls(
+            verdict=verdict,
+            signature=signature,
+            etag=etag,
+            last_modified=last_modified,
+            content_length=headers.get('Content-Length'))
+
+
+class UrlCache:
+    """
+    UrlCache
+    LRU/TTL bounded cache of URL verdicts keyed by normalized URL
+    """
+    def __init__(self, max_size: int, ttl: float) -> None:
+        """
+        UrlCache constructor
+
+            Parameters:
+                max_size (int): max number of entries
+                ttl (float): seconds an entry may be revalidated before it is dropped
+
+            Returns:
+                None
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: 'OrderedDict[str, UrlCacheEntry]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, url: str, signature: str) -> Optional[UrlCacheEntry]:
+        """ Entry for url if it is fresh and was scanned with signature """
+        entry = self.entries.get(url)
+        if entry is None:
+            self.misses += 1
+            return None
+        if time.monotonic() - entry.stored > self.ttl or entry.signature != signature:
+            del self.entries[url]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(url)
+        return entry
+
+    def put(self, url: str, entry: UrlCacheEntry) -> None:
+        """ Store an entry, evicting the least recently used ones """
+        self.entries[url] = entry
+        self.entries.move_to_end(url)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def revalidated(self, entry: UrlCacheEntry) -> None:
+        """ Record a 304 for entry and restart its TTL """
+        self.hits += 1
+        entry.stored = time.monotonic()
+
+    def discard(self, url: str) -> None:
+        """ Drop the entry for url """
+        self.entries.pop(url, None)
+
+    def clear(self) -> None:
+        """ Drop every entry """
+        self.entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Stats
+
+            Returns:
+                stats (dict): size, revalidation hits, misses and evictions
+        """
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -1,8 +1,44 @@
 """ Utils """
+import os
+import urllib.parse
+from typing import Optional
+
 from pyvalve import PyvalveSocket
 
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
 async def get_clamav_connection() -> PyvalveSocket:
     """ Get clamav connection """
     pvs = await PyvalveSocket()
     pvs.set_persistant_connection(True)
     return pvs
+
+
+def normalize_url(url: str) -> str:
+    """ Normalize a url so equivalent spellings compare equal """
+    parts = urllib.parse.urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port and DEFAULT_PORTS.get(scheme) != port:
+        host = f"{host}:{port}"
+    if parts.username:
+        userinfo = parts.username
+        if parts.password:
+            userinfo = f"{userinfo}:{parts.password}"
+        host = f"{userinfo}@{host}"
+    return urllib.parse.urlunsplit((scheme, host, parts.path or '/', parts.query, ''))
+
+
+def database_stamp(database: str) -> Optional[float]:
+    """ Latest modification time in a signature database directory, None if unreadable """
+    try:
+        with os.scandir(database) as entries:
+            stamps = [entry.stat().st_mtime for entry in entries if entry.is_file()]
+    except OSError:
+        return None
+    return max(stamps, default=0.0)
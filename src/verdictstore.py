@@ -0,0 +1,214 @@
+""" Persistent Verdict Store """
+import asyncio
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS verdicts (
+    key TEXT NOT NULL,
+    signature TEXT NOT NULL,
+    verdict TEXT NOT NULL,
+    stored REAL NOT NULL,
+    PRIMARY KEY (key, signature)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS verdicts_stored ON verdicts (stored);
+"""
+
+
+class VerdictStore: # pylint: disable=too-many-instance-attributes
+    """
+    VerdictStore
+    SQLite (WAL) backed verdict cache shared by every ScanCan process on a host.
+    Lookups and batched writes run on one background thread, so the event loop never
+    waits on the database.
+    """
+    def __init__(self, conf, logger) -> None:
+        """
+        VerdictStore constructor
+
+            Parameters:
+                conf (module): ScanCan configuration
+                logger (Logger): application logger
+
+            Returns:
+                None
+        """
+        self.path = conf.VERDICT_CACHE_PATH
+        self.max_entries = conf.VERDICT_CACHE_MAX_ENTRIES
+        self.flush_interval = conf.VERDICT_CACHE_FLUSH_INTERVAL
+        self.flush_size = conf.VERDICT_CACHE_FLUSH_SIZE
+        self.logger = logger
+        self.reader: Optional[sqlite3.Connection] = None
+        self.writer: Optional[sqlite3.Connection] = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="verdict-store")
+        self.pending: Dict[Tuple[str, str], Tuple[str, float]] = {}
+        self.signature: Optional[str] = None
+        self.purge: Optional[str] = None
+        self.task: Optional[asyncio.Task] = None
+        self.flushing: Optional[asyncio.Task] = None
+        # Rows in the database as of the last count, plus rows this process inserted since;
+        # recounted only when it passes max_entries
+        self.count = 0
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def open(self) -> None:
+        """ Open the database, creating the schema if needed """
+        self.writer = self._connect()
+        self.writer.executescript(SCHEMA)
+        self.count = self.writer.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0]
+        self.reader = self._connect()
+
+    async def start(self) -> None:
+        """ Open the database and start the periodic flush task """
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.open)
+        self.task = asyncio.create_task(self.run())
+        self.logger.info("Verdict store opened at %s", self.path)
+
+    async def stop(self) -> None:
+        """ Flush pending writes and close the database """
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        if self.flushing:
+            await asyncio.gather(self.flushing, return_exceptions=True)
+        await self.flush()
+        for conn in (self.reader, self.writer):
+            if conn is not None:
+                conn.close()
+        self.reader = self.writer = None
+        self.executor.shutdown(wait=True)
+
+    async def run(self) -> None:
+        """ Flush pending writes every flush_interval seconds """
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self._flush_logged()
+
+    async def _flush_logged(self) -> None:
+        try:
+            await self.flush()
+        except sqlite3.Error as err:
+            self.logger.error("Verdict store flush failed: %s", err)
+
+    async def lookup(self, key: str, signature: str) -> Optional[str]:
+        """
+        Lookup a verdict
+
+            Parameters:
+                key (str): content key, e.g. 'sha256:<hex>'
+                signature (str): current signature version
+
+            Returns:
+                verdict (str): cached verdict, None on a miss
+        """
+        pending = self.pending.get((key, signature))
+        if pending is not None:
+            self.hits += 1
+            return pending[0]
+        verdict = None
+        if self.reader is not None:
+            verdict = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self._read, key, signature)
+        if verdict is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return verdict
+
+    def _read(self, key: str, signature: str) -> Optional[str]:
+        conn = self.reader
+        if conn is None:
+            return None
+        row = conn.execute(
+            "SELECT verdict FROM verdicts WHERE key = ? AND signature = ?",
+            (key, signature)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, signature: str, verdict: str) -> None:
+        """ Buffer a verdict; it is written on the next flush """
+        if signature != self.signature:
+            if self.signature is not None:
+                self.logger.info("Signature version is now %s, invalidating verdicts", signature)
+            self.signature = signature
+            self.purge = signature
+        self.pending[(key, signature)] = (verdict, time.time())
+        if len(self.pending) >= self.flush_size and (
+                self.flushing is None or self.flushing.done()):
+            self.flushing = asyncio.create_task(self._flush_logged())
+
+    async def flush(self) -> None:
+        """ Write buffered verdicts in one transaction """
+        if self.writer is None or not self.pending:
+            return
+        batch, self.pending = self.pending, {}
+        purge, self.purge = self.purge, None
+        await asyncio.get_running_loop().run_in_executor(self.executor, self._write, batch, purge)
+
+    def _write(self, batch: Dict[Tuple[str, str], Tuple[str, float]], purge: Optional[str]) -> None:
+        """
+        Insert a batch, drop verdicts of other signature versions and evict the oldest.
+        Eviction trims to 90% of max_entries, so the table is only counted again after
+        that many more inserts.
+        """
+        conn = self.writer
+        if conn is None:
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO verdicts (key, signature, verdict, stored) "
+                "VALUES (?, ?, ?, ?)",
+                [(key, sig, verdict, stored) for (key, sig), (verdict, stored) in batch.items()])
+            count = self.count + len(batch)
+            if purge is not None and purge.isdigit():
+                # Other processes may still be on the previous version, so only drop older ones
+                count -= conn.execute(
+                    "DELETE FROM verdicts WHERE CAST(signature AS INTEGER) < ?",
+                    (int(purge),)).rowcount
+            elif purge is not None:
+                count -= conn.execute(
+                    "DELETE FROM verdicts WHERE signature != ?", (purge,)).rowcount
+            if count > self.max_entries:
+                count = conn.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0]
+                if count > self.max_entries:
+                    excess = count - self.max_entries + self.max_entries // 10
+                    conn.execute(
+                        "DELETE FROM verdicts WHERE (key, signature) IN "
+                        "(SELECT key, signature FROM verdicts ORDER BY stored LIMIT ?)", (excess,))
+                    self.evictions += excess
+                    count -= excess
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        self.count = max(count, 0)
+        self.writes += len(batch)
+
+    def stats(self) -> dict:
+        """
+        Stats
+
+            Returns:
+                stats (dict): hit, miss, write and eviction counters
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "pending": len(self.pending),
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "signature": self.signature,
+        }
@@ -0,0 +1,332 @@
+"""Inotify Watch Mode"""
+import asyncio
+import ctypes
+import ctypes.util
+import json
+import os
+import re
+import shutil
+import struct
+import time
+import uuid
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from aiofile import async_open
+from pyvalve import PyvalveError
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct('iIII')
+THROUGHPUT_WINDOW = 60.0
+
+
+class Inotify:
+    """
+    Inotify
+    Minimal ctypes binding for the Linux inotify API
+    """
+    def __init__(self) -> None:
+        """
+        Inotify constructor
+
+            Returns:
+                None
+        """
+        libc_name = ctypes.util.find_library('c') or 'libc.so.6'
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.paths: Dict[int, str] = {}
+
+    def add_watch(self, path: str, mask: int = WATCH_MASK) -> int:
+        """ Add a watch on a directory """
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        self.paths[wd] = path
+        return wd
+
+    def read_events(self) -> List[Tuple[str, int, str]]:
+        """
+        Read pending events
+
+            Returns:
+                events (list): (directory, mask, name) tuples
+        """
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0').decode(errors='surrogateescape')
+            offset += length
+            if mask & IN_IGNORED:
+                self.paths.pop(wd, None)
+                continue
+            events.append((self.paths.get(wd, ''), mask, name))
+        return events
+
+    def close(self) -> None:
+        """ Close the inotify descriptor """
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class Watcher: # pylint: disable=too-many-instance-attributes
+    """
+    Watcher
+    Watches directories for new files and scans them with a pool of ClamAv clients
+    """
+    def __init__(self, conf, clamav_factory: Callable, logger, audit=None) -> None:
+        """
+        Watcher constructor
+
+            Parameters:
+                conf (module): ScanCan configuration
+                clamav_factory (Callable): returns a new ClamAv client
+                logger (Logger): application logger
+                audit (AuditLog): audit log that verdicts are also recorded in, if any
+
+            Returns:
+                None
+        """
+        self.conf = conf
+        self.clamav_factory = clamav_factory
+        self.logger = logger
+        self.audit = audit
+        self.inotify: Optional[Inotify] = None
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=conf.WATCH_QUEUE_SIZE)
+        self.pending: Dict[str, Tuple[asyncio.TimerHandle, float]] = {}
+        self.overflow: Dict[str, float] = {}
+        self.workers: List[asyncio.Task] = []
+        self.in_progress = 0
+        self.scanned = 0
+        self.infected = 0
+        self.errors = 0
+        self.lag_max = 0.0
+        self.lag_total = 0.0
+        self.completed: Deque[float] = deque()
+
+    async def start(self) -> None:
+        """ Start watching the configured paths and spawn the scan workers """
+        loop = asyncio.get_running_loop()
+        self.inotify = Inotify()
+        for path in self.conf.WATCH_PATHS:
+            self.watch_tree(path.strip())
+        loop.add_reader(self.inotify.fd, self.on_readable)
+        for number in range(self.conf.WATCH_WORKERS):
+            clamav = self.clamav_factory()
+            self.workers.append(
+                asyncio.create_task(self.worker(clamav), name=f"watch-worker-{number}"))
+        self.logger.info("Watching %s with %d workers", self.conf.WATCH_PATHS, len(self.workers))
+
+    async def stop(self) -> None:
+        """ Stop watching and cancel the scan workers """
+        if self.inotify:
+            asyncio.get_running_loop().remove_reader(self.inotify.fd)
+            self.inotify.close()
+            self.inotify = None
+        for handle, _ in self.pending.values():
+            handle.cancel()
+        self.pending.clear()
+        self.overflow.clear()
+        for task in self.workers:
+            task.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    def watch_tree(self, root: str, backfill: bool = False) -> None:
+        """
+        Add watches for a directory and all of its subdirectories
+
+            Parameters:
+                root (str): directory
+                backfill (bool): also queue the files already there, for a directory that was
+                    created or moved in after watching started
+
+            Returns:
+                None
+        """
+        if self.inotify is None:
+            return
+        for dirpath, _dirnames, _filenames in os.walk(root):
+            try:
+                self.inotify.add_watch(dirpath)
+            except OSError as err:
+                self.logger.error("Unable to watch %s: %s", dirpath, err)
+                continue
+            if backfill:
+                self.backfill(dirpath)
+
+    def backfill(self, directory: str) -> None:
+        """ Queue files that landed in a directory before its watch was added """
+        try:
+            with os.scandir(directory) as entries:
+                files = [entry.path for entry in entries if entry.is_file(follow_symlinks=False)]
+        except OSError as err:
+            self.logger.error("Unable to list %s: %s", directory, err)
+            return
+        # Files that were still being written are debounced again by their own events
+        for path in files:
+            self.debounce(path)
+
+    def on_readable(self) -> None:
+        """ Handle inotify events """
+        if self.inotify is None:
+            return
+        for directory, mask, name in self.inotify.read_events():
+            if mask & IN_Q_OVERFLOW:
+                self.logger.warning("Inotify queue overflow, events were lost")
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.watch_tree(path, backfill=True)
+                continue
+            if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                self.debounce(path)
+
+    def debounce(self, path: str) -> None:
+        """ (Re)schedule a path to be queued once its events settle """
+        loop = asyncio.get_running_loop()
+        first_seen = time.monotonic()
+        if path in self.pending:
+            handle, first_seen = self.pending[path]
+            handle.cancel()
+        handle = loop.call_later(self.conf.WATCH_DEBOUNCE, self.enqueue, path)
+        self.pending[path] = (handle, first_seen)
+
+    def enqueue(self, path: str) -> None:
+        """ Move a settled path onto the scan queue, or hold it back while the queue is full """
+        _, first_seen = self.pending.pop(path)
+        # Paths already held back go first, so the queue keeps arrival order
+        if self.overflow or self.queue.full():
+            if not self.overflow:
+                self.logger.warning("Watch queue full, holding files until workers catch up")
+            self.overflow.setdefault(path, first_seen)
+            return
+        self.queue.put_nowait((path, first_seen))
+
+    def refill(self) -> None:
+        """ Move held back paths onto the scan queue as workers make room """
+        while self.overflow and not self.queue.full():
+            path = next(iter(self.overflow))
+            self.queue.put_nowait((path, self.overflow.pop(path)))
+
+    async def worker(self, clamav) -> None:
+        """ Scan queued paths until cancelled """
+        while True:
+            path, first_seen = await self.queue.get()
+            self.refill()
+            self.in_progress += 1
+            try:
+                await self.process(clamav, path, first_seen)
+            except Exception as err: # pylint: disable=broad-exception-caught
+                # A failure must not end the worker and shrink the pool for good
+                self.errors += 1
+                self.logger.exception("Watch scan of %s failed: %s", path, err)
+            finally:
+                self.in_progress -= 1
+                self.queue.task_done()
+
+    async def process(self, clamav, path: str, first_seen: float) -> None:
+        """ Scan one path and act on the verdict """
+        try:
+            result = await clamav.scan(path)
+        except PyvalveError as err:
+            self.errors += 1
+            self.logger.error("Error scanning %s: %s", path, err)
+            return
+
+        now = time.monotonic()
+        lag = now - first_seen
+        self.scanned += 1
+        self.lag_total += lag
+        self.lag_max = max(self.lag_max, lag)
+        self.completed.append(now)
+        self.trim_completed(now)
+
+        infected = bool(re.match(r'^.*\sFOUND$', result))
+        action = 'log'
+        if infected:
+            self.infected += 1
+            if self.conf.WATCH_ACTION == 'quarantine':
+                action = await self.quarantine(path)
+        await self.record(path, result, infected, action, lag)
+
+    async def quarantine(self, path: str) -> str:
+        """ Move an infected file into the quarantine directory """
+        try:
+            os.makedirs(self.conf.WATCH_QUARANTINE_DIR, mode=0o700, exist_ok=True)
+            target = os.path.join(
+                self.conf.WATCH_QUARANTINE_DIR,
+                f"{int(time.time())}-{uuid.uuid4().hex[:12]}-{os.path.basename(path)}")
+            await asyncio.get_running_loop().run_in_executor(None, shutil.move, path, target)
+        except OSError as err:
+            self.logger.error("Unable to quarantine %s: %s", path, err)
+            return 'quarantine-failed'
+        self.logger.warning("Quarantined %s to %s", path, target)
+        return 'quarantined'
+
+    async def record(self, path: str, result: str, infected: bool, action: str, lag: float) -> None:
+        """ Write a verdict to the logger, the audit log and the results log """
+        self.logger.info("Watch verdict for %s: %s", path, result)
+        if self.audit is not None:
+            self.audit.record(
+                'watch', path, result, client='watcher', started=time.perf_counter() - lag)
+        if not self.conf.WATCH_RESULTS_LOG:
+            return
+        line = json.dumps({
+            "time": time.time(),
+            "path": path,
+            "result": result,
+            "infected": infected,
+            "action": action,
+            "lag": round(lag, 6),
+        })
+        async with async_open(self.conf.WATCH_RESULTS_LOG, 'a') as fh:
+            await fh.write(line + "\n")
+
+    def trim_completed(self, now: float) -> None:
+        """ Forget completion times that fell out of the throughput window """
+        while self.completed and now - self.completed[0] > THROUGHPUT_WINDOW:
+            self.completed.popleft()
+
+    def stats(self) -> dict:
+        """
+        Stats
+
+            Returns:
+                stats (dict): backlog, lag and throughput counters
+        """
+        self.trim_completed(time.monotonic())
+        return {
+            "watched_dirs": len(self.inotify.paths) if self.inotify else 0,
+            "backlog": self.queue.qsize(),
+            "pending": len(self.pending),
+            "overflow": len(self.overflow),
+            "in_progress": self.in_progress,
+            "scanned": self.scanned,
+            "infected": self.infected,
+            "errors": self.errors,
+            "lag_avg": self.lag_total / self.scanned if self.scanned else 0.0,
+            "lag_max": self.lag_max,
+            "throughput": len(self.completed) / THROUGHPUT_WINDOW,
+        }
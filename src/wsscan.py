@@ -0,0 +1,188 @@
+""" WebSocket Scan Channel """
+import asyncio
+import json
+import math
+import struct
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+FLAG_END = 0x01
+FRAME_HEADER = struct.Struct('!BH')
+
+
+class FrameError(Exception):
+    """ Raised for a malformed binary frame """
+
+
+def encode_frame(file_id: str, chunk: bytes = b'', end: bool = False) -> bytes:
+    """ Binary frame: flags (1 byte), id length (2 bytes), id, chunk """
+    raw_id = file_id.encode()
+    return FRAME_HEADER.pack(FLAG_END if end else 0, len(raw_id)) + raw_id + chunk
+
+
+def parse_frame(data: bytes) -> Tuple[int, str, bytes]:
+    """
+    Parse a binary frame
+
+        Returns:
+            flags (int), file_id (str), chunk (bytes)
+    """
+    if len(data) < FRAME_HEADER.size:
+        raise FrameError("Frame too short")
+    flags, length = FRAME_HEADER.unpack_from(data)
+    start = FRAME_HEADER.size
+    if length == 0 or len(data) < start + length:
+        raise FrameError("Invalid file id")
+    try:
+        file_id = data[start:start + length].decode()
+    except UnicodeDecodeError as err:
+        raise FrameError("Invalid file id") from err
+    return flags, file_id, data[start + length:]
+
+
+class _File: # pylint: disable=too-few-public-methods
+    """ One file being received and scanned """
+    __slots__ = ('queue', 'task')
+
+    def __init__(self, queue: asyncio.Queue, task: asyncio.Task) -> None:
+        self.queue = queue
+        self.task = task
+
+
+class ScanChannel: # pylint: disable=too-many-instance-attributes
+    """
+    ScanChannel
+    Receives many files over one WebSocket and scans them concurrently. Binary frames carry
+    chunks tagged with a file id; the END flag closes a file, so a small file is a single
+    frame. A text frame {"type": "begin", "id": ..., "encoding": "gzip"} may announce a
+    Content-Encoding first. Verdicts are sent as JSON text frames tagged with the file id,
+    in completion order.
+    """
+    def __init__(self, websocket, scan: Callable[..., Awaitable[dict]], conf, logger,
+                 admit: Optional[Callable[[], float]] = None) -> None:
+        """
+        ScanChannel constructor
+
+            Parameters:
+                websocket (WebSocket): an accepted WebSocket
+                scan (Callable): scan(chunks, encoding) -> verdict dict
+                conf (module): ScanCan configuration
+                logger (Logger): application logger
+                admit (Callable): admit() -> 0 or seconds to wait, called once per file
+
+            Returns:
+                None
+        """
+        self.websocket = websocket
+        self.scan = scan
+        self.admit = admit
+        self.logger = logger
+        self.buffer_chunks = conf.WS_BUFFER_CHUNKS
+        self.slots = asyncio.Semaphore(conf.WS_MAX_IN_FLIGHT)
+        self.files: Dict[str, _File] = {}
+        # Files refused by admit(), whose remaining chunks are dropped until their end
+        self.refused: Set[str] = set()
+        self.tasks: Set[asyncio.Task] = set()
+        self.send_lock = asyncio.Lock()
+
+    async def run(self) -> None:
+        """ Serve the channel until the client disconnects """
+        try:
+            while True:
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                if message.get("bytes") is not None:
+                    await self.on_frame(message["bytes"])
+                elif message.get("text") is not None:
+                    await self.on_text(message["text"])
+        finally:
+            for task in self.tasks:
+                task.cancel()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def send(self, message: dict) -> None:
+        """ Send one JSON message; scans finish concurrently so sends are serialized """
+        async with self.send_lock:
+            await self.websocket.send_text(json.dumps(message))
+
+    async def on_text(self, text: str) -> None:
+        """ Handle a control message """
+        try:
+            message = json.loads(text)
+            kind, file_id = message["type"], str(message["id"])
+        except (ValueError, KeyError, TypeError):
+            await self.send({"id": None, "status_code": 400, "response": "Invalid control message"})
+            return
+        if kind == "begin" and file_id not in self.files:
+            if await self.admitted(file_id):
+                await self.start(file_id, str(message.get("encoding", "identity")))
+        elif kind == "end":
+            self.refused.discard(file_id)
+            await self.finish(file_id)
+        elif kind == "cancel" and file_id in self.files:
+            self.files.pop(file_id).task.cancel()
+
+    async def on_frame(self, data: bytes) -> None:
+        """ Handle a chunk frame """
+        try:
+            flags, file_id, chunk = parse_frame(data)
+        except FrameError as err:
+            await self.send({"id": None, "status_code": 400, "response": str(err)})
+            return
+        entry = self.files.get(file_id)
+        if entry is None:
+            if file_id in self.refused or not await self.admitted(file_id):
+                if flags & FLAG_END:
+                    self.refused.discard(file_id)
+                return
+            entry = await self.start(file_id, "identity")
+        if chunk and not entry.task.done():
+            await entry.queue.put(chunk)
+        if flags & FLAG_END:
+            await self.finish(file_id)
+
+    async def admitted(self, file_id: str) -> bool:
+        """ Charge a new file against the client's rate limit, refusing it with a 429 verdict """
+        retry_after = self.admit() if self.admit is not None else 0.0
+        if retry_after <= 0:
+            return True
+        self.refused.add(file_id)
+        await self.send({"id": file_id, "status_code": 429, "response": "Too many requests",
+                         "retry_after": max(1, math.ceil(retry_after))})
+        return False
+
+    async def start(self, file_id: str, encoding: str) -> _File:
+        """ Start scanning a file, waiting while WS_MAX_IN_FLIGHT scans are running """
+        await self.slots.acquire()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.buffer_chunks)
+        task = asyncio.create_task(self.process(file_id, queue, encoding))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        entry = _File(queue, task)
+        self.files[file_id] = entry
+        return entry
+
+    async def finish(self, file_id: str) -> None:
+        """ Mark the end of a file """
+        entry = self.files.pop(file_id, None)
+        if entry is not None and not entry.task.done():
+            await entry.queue.put(None)
+
+    async def process(self, file_id: str, queue: asyncio.Queue, encoding: str) -> None:
+        """ Scan one file and send its verdict """
+        try:
+            verdict = await self.scan(_drain(queue), encoding)
+            await self.send({"id": file_id, **verdict})
+        finally:
+            self.slots.release()
+            # Unblock a receiver waiting to queue chunks for a scan that ended early
+            while not queue.empty():
+                queue.get_nowait()
+
+
+async def _drain(queue: asyncio.Queue) -> AsyncIterator[bytes]:
+    while True:
+        chunk: Optional[bytes] = await queue.get()
+        if chunk is None:
+            return
+        yield chunk
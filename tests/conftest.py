@@ -0,0 +1,15 @@
+"""Shared test fixtures"""
+from types import SimpleNamespace
+
+import pytest
+
+
+@pytest.fixture
+def conf(request, tmp_path):
+    """
+    Configuration of the test module's CONF mapping, fresh for every test so tests
+    override settings by assigning attributes. Callable values are called with tmp_path.
+    """
+    values = getattr(request.module, "CONF")
+    return SimpleNamespace(**{
+        key: value(tmp_path) if callable(value) else value for key, value in values.items()})
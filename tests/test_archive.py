@@ -0,0 +1,155 @@
+"""Tests for src/archive.py"""
+import io
+import tarfile
+import zipfile
+from types import SimpleNamespace
+
+import pytest
+
+from src.archive import (
+    ArchiveLimits,
+    ArchiveScanner,
+    aggregate,
+    detect_archive,
+    extract_members,
+)
+
+LIMITS = ArchiveLimits(max_depth=2, max_members=100, max_expanded=1 << 20)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+class DummyLogger:
+    def info(self, *args):
+        pass
+
+
+def _tgz(files):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def _zip(files):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, data in files.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def _extract(tmp_path, payload, limits=LIMITS):
+    path = tmp_path / "upload"
+    path.write_bytes(payload)
+    out_dir = tmp_path / "members"
+    out_dir.mkdir()
+    return extract_members(str(path), str(out_dir), "upload.zip", limits)
+
+
+def test_detect_archive():
+    assert detect_archive(_zip({"a": b"1"})[:512]) == "zip"
+    assert detect_archive(_tgz({"a": b"1"})[:512]) == "tar"
+    assert detect_archive(b"plain text") is None
+
+
+def test_nested_archives_are_extracted_up_to_max_depth(tmp_path):
+    payload = _zip({"a.txt": b"alpha", "inner.tgz": _tgz({"dir/b.txt": b"beta"})})
+
+    members, fallback = _extract(tmp_path, payload)
+
+    assert fallback is None
+    assert [(name, size) for name, _, size in members] == [
+        ("upload.zip/a.txt", 5), ("upload.zip/inner.tgz/dir/b.txt", 4)]
+    assert open(members[1][1], "rb").read() == b"beta"
+
+
+def test_archive_below_max_depth_is_kept_whole(tmp_path):
+    inner = _tgz({"b.txt": b"beta"})
+    payload = _zip({"inner.tgz": inner})
+
+    members, fallback = _extract(tmp_path, payload, LIMITS._replace(max_depth=1))
+
+    assert fallback is None
+    assert [(name, size) for name, _, size in members] == [("upload.zip/inner.tgz", len(inner))]
+
+
+@pytest.mark.parametrize("limits,reason", [
+    (LIMITS._replace(max_members=1), "members limit"),
+    (LIMITS._replace(max_expanded=6), "expanded size limit"),
+])
+def test_limits_fall_back_to_whole_scan(tmp_path, limits, reason):
+    members, fallback = _extract(tmp_path, _zip({"a": b"1234", "b": b"5678"}), limits)
+
+    assert members == []
+    assert fallback == reason
+
+
+def test_archive_without_files_falls_back(tmp_path):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as archive:
+        directory = tarfile.TarInfo("empty-dir")
+        directory.type = tarfile.DIRTYPE
+        archive.addfile(directory)
+        link = tarfile.TarInfo("link")
+        link.type = tarfile.SYMTYPE
+        link.linkname = "/etc/passwd"
+        archive.addfile(link)
+
+    members, fallback = _extract(tmp_path, buffer.getvalue())
+
+    assert members == []
+    assert fallback == "no members"
+
+
+def test_corrupt_archive_falls_back(tmp_path):
+    members, fallback = _extract(tmp_path, b"\x1f\x8b" + b"\x00" * 100)
+
+    assert members == []
+    assert fallback.startswith("unreadable")
+
+
+def test_aggregate_names_infected_members():
+    assert aggregate([("x/a", "stream: OK")]) == "stream: OK"
+    assert aggregate([("x/a", "stream: OK"), ("x/b", "stream: Eicar FOUND")]) == "x/b: Eicar FOUND"
+
+
+def test_aggregate_reports_members_that_failed_to_scan():
+    results = [("a.tar/x", "stream: Can't allocate memory ERROR"), ("a.tar/y", "stream: OK")]
+
+    assert aggregate(results) == "a.tar/x: Can't allocate memory ERROR"
+    assert aggregate(results + [("a.tar/z", "stream: Eicar FOUND")]) == "a.tar/z: Eicar FOUND"
+
+
+@pytest.mark.anyio
+async def test_scanner_scans_members_in_worker_process(tmp_path):
+    conf = SimpleNamespace(
+        ARCHIVE_MAX_DEPTH=2, ARCHIVE_MAX_MEMBERS=100, ARCHIVE_MAX_EXPANDED=1 << 20,
+        ARCHIVE_MIN_SIZE=0, ARCHIVE_WORKERS=1, ARCHIVE_PARALLEL=2, ARCHIVE_TMP_DIR=str(tmp_path),
+        STREAM_CHUNK_SIZE=4)
+    scanner = ArchiveScanner(conf, DummyLogger())
+    scanned = []
+
+    async def scan_member(chunks):
+        data = b"".join([chunk async for chunk in chunks])
+        scanned.append(data)
+        return "stream: Eicar FOUND" if b"EICAR" in data else "stream: OK"
+
+    try:
+        payload = io.BytesIO(_tgz({"ok.txt": b"clean", "bad.txt": b"xEICARx"}))
+        result = await scanner.scan(payload, "build.tgz", scan_member)
+        plain = await scanner.scan(io.BytesIO(b"not an archive"), "a.txt", scan_member)
+    finally:
+        scanner.stop()
+
+    assert result == "build.tgz/bad.txt: Eicar FOUND"
+    assert sorted(scanned) == [b"clean", b"xEICARx"]
+    assert plain is None
+    assert scanner.stats() == {"fanouts": 1, "fallbacks": 0, "members": 2}
+    assert list(tmp_path.iterdir()) == []
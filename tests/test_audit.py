@@ -0,0 +1,193 @@
+"""Tests for src/audit.py"""
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from src.audit import (
+    AuditLog,
+    NdjsonWriter,
+    audit_scope,
+    client_identity,
+    verdict_of,
+)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+CONF = {
+    "AUDIT_PATH": lambda tmp_path: str(tmp_path / "audit.ndjson"),
+    "AUDIT_FORMAT": "ndjson",
+    "AUDIT_BUFFER_SIZE": 100,
+    "AUDIT_BATCH_SIZE": 10,
+    "AUDIT_FLUSH_INTERVAL": 60,
+    "AUDIT_RETRY_MAX_DELAY": 60,
+    "AUDIT_ROTATE_BYTES": 0,
+    "AUDIT_ROTATE_KEEP": 2,
+}
+
+
+def _lines(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_verdict_of_clamd_replies():
+    assert verdict_of("stream: OK") == ("clean", "")
+    assert verdict_of("stream: Eicar-Signature FOUND") == ("infected", "Eicar-Signature")
+    assert verdict_of("a.zip/a: Eicar FOUND\na.zip/b: Eicar FOUND\na.zip/c: Other FOUND") == (
+        "infected", "Eicar,Other")
+    assert verdict_of("/data: lstat() failed: No such file or directory. ERROR") == ("error", "")
+
+
+def test_client_identity_never_records_tokens():
+    assert client_identity("acme", "secret", "10.0.0.1") == "tenant:acme"
+    assert client_identity(None, "secret", "10.0.0.1").startswith("token:")
+    assert "secret" not in client_identity(None, "secret", "10.0.0.1")
+    assert client_identity(None, None, None) == "ip:unknown"
+
+
+@pytest.mark.anyio
+async def test_batches_are_written_in_the_background(tmp_path, conf):
+    audit = AuditLog(conf, logging.getLogger("test"))
+    await audit.start()
+    request = SimpleNamespace(
+        state=SimpleNamespace(), headers={"Authorization": "Bearer secret"},
+        client=SimpleNamespace(host="10.0.0.1"))
+    try:
+        with audit_scope(request):
+            for number in range(12):
+                audit.record("upload", f"file-{number}", "stream: OK", digest="ab", size=3)
+        audit.record("path", "/data/x", "/data/x: Eicar FOUND")
+        # Recording only buffers; the full batch wakes the writer
+        assert audit.stats()["recorded"] == 13
+        for _ in range(100):
+            if audit.written >= 10:
+                break
+            await asyncio.sleep(0.01)
+        assert audit.stats()["batches"] >= 1
+    finally:
+        await audit.stop()
+
+    lines = _lines(tmp_path / "audit.ndjson")
+    assert len(lines) == 13
+    assert lines[0]["client"] == client_identity(None, "secret", "10.0.0.1")
+    assert lines[0]["verdict"] == "clean"
+    assert lines[0]["latency_ms"] >= 0
+    assert lines[-1]["client"] == "internal"
+    assert lines[-1]["signature"] == "Eicar"
+    assert audit.stats()["written"] == 13
+
+
+def test_full_buffer_overwrites_the_oldest_entries(conf):
+    conf.AUDIT_BUFFER_SIZE = 3
+    audit = AuditLog(conf, logging.getLogger("test"))
+
+    for number in range(5):
+        audit.record("path", f"/data/{number}", "OK", started=time.perf_counter())
+
+    assert [entry["target"] for entry in audit.buffer] == ["/data/2", "/data/3", "/data/4"]
+    assert audit.stats()["overwritten"] == 2
+
+
+@pytest.mark.anyio
+async def test_failed_writes_are_retried_in_order(tmp_path, conf):
+    conf.AUDIT_BATCH_SIZE = 2
+    conf.AUDIT_BUFFER_SIZE = 3
+    audit = AuditLog(conf, logging.getLogger("test"))
+    write = audit.writer.write
+
+    def failing_write(batch):
+        raise OSError("disk full")
+
+    audit.writer.write = failing_write
+    try:
+        audit.record("path", "/data/0", "OK")
+        audit.record("path", "/data/1", "OK")
+
+        assert await audit.flush() is False
+        assert [entry["target"] for entry in audit.buffer] == ["/data/0", "/data/1"]
+
+        audit.record("path", "/data/2", "OK")
+        await audit.flush()
+        audit.record("path", "/data/3", "OK")
+        # The ring bound still holds, dropping the oldest entry
+        assert [entry["target"] for entry in audit.buffer] == ["/data/1", "/data/2", "/data/3"]
+
+        audit.writer.write = write
+        assert await audit.flush() is True
+        assert await audit.flush() is True
+    finally:
+        await audit.stop()
+
+    assert [line["target"] for line in _lines(tmp_path / "audit.ndjson")] == [
+        "/data/1", "/data/2", "/data/3"]
+    assert audit.stats()["retries"] == 2
+    assert audit.stats()["overwritten"] == 1
+    assert audit.stats()["failed"] == 0
+
+
+@pytest.mark.anyio
+async def test_background_writer_backs_off_after_failures(monkeypatch, conf):
+    conf.AUDIT_FLUSH_INTERVAL = 1
+    conf.AUDIT_RETRY_MAX_DELAY = 3
+    audit = AuditLog(conf, logging.getLogger("test"))
+    delays = []
+
+    async def fake_sleep(delay):
+        delays.append(delay)
+        if len(delays) == 3:
+            raise asyncio.CancelledError
+
+    async def failing_flush():
+        return False
+
+    monkeypatch.setattr("src.audit.asyncio.sleep", fake_sleep)
+    monkeypatch.setattr(audit, "flush", failing_flush)
+    audit.record("path", "/data/0", "OK")
+    audit._event().set()
+
+    with pytest.raises(asyncio.CancelledError):
+        await audit.run()
+
+    assert delays == [1, 2, 3]
+
+
+def test_ndjson_writer_rotates(tmp_path):
+    path = tmp_path / "audit.ndjson"
+    writer = NdjsonWriter(str(path), 30, 2)
+
+    for number in range(4):
+        writer.write([{"target": f"/data/{number}", "verdict": "clean"}])
+
+    assert _lines(path) == [{"target": "/data/3", "verdict": "clean"}]
+    assert _lines(tmp_path / "audit.ndjson.1")[0]["target"] == "/data/2"
+    assert _lines(tmp_path / "audit.ndjson.2")[0]["target"] == "/data/1"
+    assert not (tmp_path / "audit.ndjson.3").exists()
+
+
+@pytest.mark.anyio
+async def test_sqlite_format(tmp_path, conf):
+    conf.AUDIT_PATH = str(tmp_path / "audit.db")
+    conf.AUDIT_FORMAT = "sqlite"
+    audit = AuditLog(conf, logging.getLogger("test"))
+    await audit.start()
+    audit.record("hash", "ab" * 32, "stream: OK", digest="ab" * 32, signature_version="27100",
+                 cached=True)
+    await audit.stop()
+
+    with sqlite3.connect(tmp_path / "audit.db") as conn:
+        rows = conn.execute("SELECT source, verdict, signature_version, cached FROM audit").fetchall()
+    assert rows == [("hash", "clean", "27100", 1)]
+
+
+def test_unknown_format_is_rejected(conf):
+    conf.AUDIT_FORMAT = "csv"
+    with pytest.raises(ValueError):
+        AuditLog(conf, logging.getLogger("test"))
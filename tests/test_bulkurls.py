@@ -0,0 +1,44 @@
+"""Tests for src/bulkurls.py"""
+import asyncio
+
+import pytest
+
+from src.bulkurls import HostQueue, url_host
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+def test_url_host():
+    assert url_host(" https://Example.com:8443/a?b ") == "example.com:8443"
+    assert url_host("not a url") == "not a url"
+
+
+@pytest.mark.anyio
+async def test_hosts_take_turns():
+    queue = HostQueue(["http://a/1", "http://a/2", "http://a/3", "http://b/1"], per_host=4)
+
+    taken = [await queue.get() for _ in range(4)]
+
+    assert [item[2] for item in taken] == ["http://a/1", "http://b/1", "http://a/2", "http://a/3"]
+    assert await queue.get() is None
+
+
+@pytest.mark.anyio
+async def test_per_host_limit_waits_for_done():
+    queue = HostQueue(["http://a/1", "http://a/2"], per_host=1)
+    host, index, _ = await queue.get()
+    assert (host, index) == ("a", 0)
+
+    waiter = asyncio.ensure_future(queue.get())
+    await asyncio.sleep(0)
+    assert not waiter.done()
+
+    await queue.done(host)
+
+    assert (await waiter)[1] == 1
+    await queue.done(host)
+    assert await queue.get() is None
+    assert not queue.active
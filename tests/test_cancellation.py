@@ -0,0 +1,118 @@
+"""Tests for src/cancellation.py"""
+import asyncio
+import json
+import sys
+import time
+from collections import Counter
+
+import pytest
+
+from src.cancellation import CancelOnDisconnect
+
+# The middleware sets the deadline on the scheduler module as the app imports it
+remaining = sys.modules['scheduler'].remaining
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+def _scope(headers=()):
+    return {"type": "http", "method": "POST", "path": "/scanfile", "headers": list(headers)}
+
+
+class Client:
+    """Feeds request messages and collects response messages."""
+
+    def __init__(self, messages, disconnect_after=None):
+        self.messages = list(messages)
+        self.disconnect_after = disconnect_after
+        self.sent = []
+
+    async def receive(self):
+        if self.messages:
+            return self.messages.pop(0)
+        if self.disconnect_after is None:
+            await asyncio.sleep(10)
+        await asyncio.sleep(self.disconnect_after)
+        return {"type": "http.disconnect"}
+
+    async def send(self, message):
+        self.sent.append(message)
+
+
+async def _respond(send, body=b"OK"):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": body})
+
+
+@pytest.mark.anyio
+async def test_request_is_relayed_to_the_app():
+    async def app(scope, receive, send):
+        first = await receive()
+        second = await receive()
+        await _respond(send, first["body"] + second["body"])
+
+    client = Client([
+        {"type": "http.request", "body": b"a", "more_body": True},
+        {"type": "http.request", "body": b"b", "more_body": False},
+    ])
+    await CancelOnDisconnect(app)(_scope(), client.receive, client.send)
+
+    assert client.sent[1]["body"] == b"ab"
+
+
+@pytest.mark.anyio
+async def test_disconnect_cancels_the_app():
+    cancelled = asyncio.Event()
+    counters = Counter()
+
+    async def app(scope, receive, send):
+        await receive()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    client = Client([{"type": "http.request", "body": b"", "more_body": False}], 0.01)
+    await asyncio.wait_for(
+        CancelOnDisconnect(app, counters=counters)(_scope(), client.receive, client.send), 1)
+
+    assert cancelled.is_set()
+    assert counters["disconnects"] == 1
+    assert client.sent == []
+
+
+@pytest.mark.anyio
+async def test_deadline_cancels_the_app_and_answers_504():
+    seen = []
+    counters = Counter()
+
+    async def app(scope, receive, send):
+        seen.append(remaining())
+        await asyncio.sleep(10)
+
+    header = (b"x-scan-deadline", str(time.time() + 0.05).encode())
+    client = Client([{"type": "http.request", "body": b"", "more_body": False}])
+    await asyncio.wait_for(
+        CancelOnDisconnect(app, counters=counters)(_scope([header]), client.receive, client.send),
+        1)
+
+    assert 0 < seen[0] <= 0.05
+    assert client.sent[0]["status"] == 504
+    assert json.loads(client.sent[1]["body"])["response"] == "Scan deadline exceeded"
+    assert counters["deadlines"] == 1
+
+
+@pytest.mark.anyio
+async def test_expired_deadline_is_rejected_without_running_the_app():
+    async def app(scope, receive, send):
+        raise AssertionError("app must not run")
+
+    header = (b"x-scan-deadline", str(time.time() - 1).encode())
+    client = Client([])
+    await CancelOnDisconnect(app)(_scope([header]), client.receive, client.send)
+
+    assert client.sent[0]["status"] == 504
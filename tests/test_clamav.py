@@ -1,9 +1,19 @@
 """Tests for src/clamav.py"""
+import asyncio
 from types import SimpleNamespace
 
 import pytest
 
-from src.clamav import ClamAv, PyvalveConnectionError
+from src.clamav import (
+    ClamAv,
+    ClamAvPool,
+    ClamdTimeoutError,
+    PyvalveConnectionError,
+    PyvalveStreamMaxLength,
+    ScannerBackend,
+    parse_signature_version,
+    split_pool_size,
+)
 
 
 class DummyLogger:
@@ -58,6 +68,11 @@ def conf():
         CLAMD_HOST="127.0.0.1",
         CLAMD_PORT=3310,
         CLAMD_SOCKET="/tmp/clamd.sock",
+        SIGNATURE_VERSION_TTL=60,
+        CLAMD_TIMEOUT_PING=5,
+        CLAMD_TIMEOUT_SCAN=5,
+        CLAMD_TIMEOUT_CONTSCAN=5,
+        CLAMD_TIMEOUT_INSTREAM=5,
     )
 
 
@@ -273,3 +288,300 @@ async def test_instream_calls_underlying_instream(monkeypatch, conf):
 
     assert result == "OK"
     assert clam.pvs.called["instream"] == payload
+
+
+def test_parse_signature_version():
+    assert parse_signature_version("ClamAV 1.0.3/27100/Mon Oct 16 08:00:00 2026\n") == "27100"
+    assert parse_signature_version("ClamAV 1.0.3") == "ClamAV 1.0.3"
+
+
+@pytest.mark.anyio
+async def test_signature_version_is_cached(monkeypatch, conf):
+    clam = ClamAv(conf)
+    clam.set_logger(DummyLogger())
+    calls = {"count": 0}
+
+    async def fake_version():
+        calls["count"] += 1
+        return "ClamAV 1.0.3/27100/Mon Oct 16 08:00:00 2026"
+
+    monkeypatch.setattr(clam, "version", fake_version)
+
+    assert await clam.signature_version() == "27100"
+    assert await clam.signature_version() == "27100"
+    assert calls["count"] == 1
+
+
+class FakeWriter:
+    """Stream writer stub collecting written bytes."""
+
+    def __init__(self):
+        self.data = b""
+        self.closed = False
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        return None
+
+    def close(self):
+        self.closed = True
+
+
+class FakeReader:
+    """Stream reader stub returning a canned reply."""
+
+    def __init__(self, reply):
+        self.reply = reply
+
+    async def read(self):
+        return self.reply
+
+
+class StreamingPVS:
+    """Fake pyvalve client exposing a raw connection."""
+
+    def __init__(self, reply=b"stream: OK\n"):
+        self.conn = None
+        self.writer = FakeWriter()
+        self.reply = reply
+
+    async def get_connection(self):
+        self.conn = SimpleNamespace(writer=self.writer, reader=FakeReader(self.reply))
+
+
+async def _chunks(*parts):
+    for part in parts:
+        yield part
+
+
+@pytest.mark.anyio
+async def test_instream_streams_async_chunks(monkeypatch, conf):
+    clam = ClamAv(conf)
+    clam.set_logger(DummyLogger())
+    clam.pvs = StreamingPVS()
+
+    async def fake_check_connect():
+        return None
+
+    monkeypatch.setattr(clam, "check_connect", fake_check_connect)
+
+    result = await clam.instream(_chunks(b"ab", b"", b"c"))
+
+    assert result == "stream: OK"
+    assert clam.pvs.writer.data == (
+        b"nINSTREAM\n\x00\x00\x00\x02ab\x00\x00\x00\x01c\x00\x00\x00\x00")
+    assert clam.pvs.writer.closed is True
+
+
+@pytest.mark.anyio
+async def test_instream_chunks_size_limit(conf):
+    clam = ClamAv(conf)
+    clam.pvs = StreamingPVS(reply=b"INSTREAM size limit exceeded. ERROR\n")
+
+    with pytest.raises(PyvalveStreamMaxLength):
+        await clam.instream_chunks(_chunks(b"abc"))
+
+
+@pytest.mark.anyio
+async def test_instream_chunks_closes_connection_when_source_fails(conf):
+    clam = ClamAv(conf)
+    clam.pvs = StreamingPVS()
+
+    async def failing():
+        yield b"abc"
+        raise ValueError("source failed")
+
+    with pytest.raises(ValueError):
+        await clam.instream_chunks(failing())
+
+    assert clam.pvs.writer.closed is True
+
+
+@pytest.mark.anyio
+async def test_instream_deadline_does_not_count_a_slow_source(monkeypatch, conf):
+    conf.CLAMD_TIMEOUT_INSTREAM = 0.05
+    clam = ClamAv(conf)
+    clam.set_logger(DummyLogger())
+    clam.pvs = StreamingPVS()
+
+    async def fake_check_connect():
+        return None
+
+    async def slow():
+        for part in (b"ab", b"cd"):
+            await asyncio.sleep(0.1)
+            yield part
+
+    monkeypatch.setattr(clam, "check_connect", fake_check_connect)
+
+    assert await clam.instream(slow()) == "stream: OK"
+
+
+@pytest.mark.anyio
+async def test_instream_deadline_applies_to_the_reply(monkeypatch, conf):
+    conf.CLAMD_TIMEOUT_INSTREAM = 0.05
+    clam = ClamAv(conf)
+    clam.set_logger(DummyLogger())
+    pvs = StreamingPVS()
+    clam.pvs = pvs
+
+    async def fake_check_connect():
+        return None
+
+    async def hanging_read():
+        await asyncio.sleep(10)
+
+    async def get_connection():
+        pvs.conn = SimpleNamespace(writer=pvs.writer, reader=SimpleNamespace(read=hanging_read))
+
+    monkeypatch.setattr(clam, "check_connect", fake_check_connect)
+    monkeypatch.setattr(pvs, "get_connection", get_connection)
+
+    with pytest.raises(ClamdTimeoutError):
+        await clam.instream(_chunks(b"abc"))
+
+    assert pvs.writer.closed is True
+    assert clam.pvs is None
+
+
+class SlowPVS(FakePVS):
+    """Fake pyvalve client tracking concurrent use."""
+
+    active = 0
+    peak = 0
+
+    async def scan(self, path):
+        SlowPVS.active += 1
+        SlowPVS.peak = max(SlowPVS.peak, SlowPVS.active)
+        await asyncio.sleep(0.01)
+        SlowPVS.active -= 1
+        return f"{path}: OK"
+
+
+def _pool(conf, size):
+    pool = ClamAvPool(conf, size)
+    pool.set_logger(DummyLogger())
+    for client in pool.clients:
+        client.pvs = SlowPVS()
+
+        async def fake_check_connect():
+            return None
+
+        client.check_connect = fake_check_connect
+    return pool
+
+
+@pytest.mark.anyio
+async def test_pool_limits_concurrency_to_size(conf):
+    SlowPVS.active = SlowPVS.peak = 0
+    pool = _pool(conf, 2)
+
+    results = await asyncio.gather(*(pool.scan(f"/f{i}") for i in range(6)))
+
+    assert results == [f"/f{i}: OK" for i in range(6)]
+    assert SlowPVS.peak == 2
+    assert pool.pool_stats() == {"size": 2, "idle": 2, "in_use": 0, "waiting": 0}
+
+
+@pytest.mark.anyio
+async def test_pool_releases_client_on_error(conf):
+    pool = _pool(conf, 1)
+
+    async def broken(path):
+        raise PyvalveConnectionError("down")
+
+    pool.clients[0].pvs.scan = broken
+
+    with pytest.raises(PyvalveConnectionError):
+        await pool.scan("/f")
+
+    assert pool.pool_stats()["idle"] == 1
+
+
+@pytest.mark.anyio
+async def test_pool_connecting_warms_every_client(monkeypatch, conf):
+    pool = ClamAvPool(conf, 3)
+    pool.set_logger(DummyLogger())
+    created = []
+
+    async def fake_network(host, port):
+        created.append(FakePVS())
+        return created[-1]
+
+    monkeypatch.setattr("src.clamav.PyvalveNetwork", fake_network)
+
+    await pool.connecting()
+
+    assert len(created) == 3
+    assert all(pvs.called["ping"] >= 1 for pvs in created)
+
+
+@pytest.mark.anyio
+async def test_pool_signature_version_is_cached(conf):
+    pool = _pool(conf, 2)
+
+    assert await pool.signature_version() == "ClamAV 1.2.3"
+    assert await pool.signature_version() == "ClamAV 1.2.3"
+    assert sum(client.pvs.called.get("version", 0) for client in pool.clients) == 1
+
+
+def test_scanner_backend_requires_the_whole_interface():
+    class PingOnly(ScannerBackend):
+        async def ping(self):
+            return "PONG"
+
+    with pytest.raises(TypeError):
+        PingOnly()
+
+
+@pytest.mark.parametrize("total,workers,expected", [(8, 4, 2), (3, 4, 1), (8, 0, 8), (9, 2, 4)])
+def test_split_pool_size(total, workers, expected):
+    assert split_pool_size(total, workers) == expected
+
+
+class HangingPVS(FakePVS):
+    async def scan(self, path):
+        await asyncio.sleep(10)
+
+
+@pytest.mark.anyio
+async def test_scan_deadline_raises_and_drops_connection(conf):
+    conf.CLAMD_TIMEOUT_SCAN = 0.01
+    clam = ClamAv(conf)
+    clam.set_logger(DummyLogger())
+    clam.pvs = HangingPVS()
+
+    with pytest.raises(ClamdTimeoutError):
+        await clam.scan("/tmp/file")
+
+    assert clam.pvs is None
+
+
+@pytest.mark.anyio
+async def test_zero_deadline_disables_timeout(conf):
+    conf.CLAMD_TIMEOUT_PING = 0
+    clam = ClamAv(conf)
+    clam.set_logger(DummyLogger())
+    clam.pvs = FakePVS()
+
+    assert await clam.ping() == "PONG"
+
+
+@pytest.mark.anyio
+async def test_cancelled_command_closes_connection(conf):
+    closed = []
+    clam = ClamAv(conf)
+    clam.set_logger(DummyLogger())
+    clam.pvs = HangingPVS()
+    clam.pvs.conn = SimpleNamespace(writer=SimpleNamespace(close=lambda: closed.append(True)))
+
+    task = asyncio.ensure_future(clam.scan("/tmp/file"))
+    await asyncio.sleep(0.01)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert closed == [True]
+    assert clam.pvs is None
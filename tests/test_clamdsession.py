@@ -0,0 +1,283 @@
+"""Tests for src/clamdsession.py"""
+import asyncio
+import struct
+
+import pytest
+
+from src.clamdsession import (
+    ClamdSession,
+    ClamdSessionPool,
+    ClamdTimeoutError,
+    PyvalveConnectionError,
+    PyvalveStreamMaxLength,
+    parse_reply,
+)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+class FakeClamd:
+    """IDSESSION server answering commands concurrently, so replies can overtake each other."""
+
+    def __init__(self, delays=None, drop_after=None):
+        self.delays = delays or {}
+        self.drop_after = drop_after
+        self.server = None
+        self.sessions = 0
+        self.commands = []
+        self.streams = []
+        self.handlers = set()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await asyncio.wait_for(asyncio.gather(*self.handlers), 1)
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        self.handlers.add(asyncio.current_task())
+        assert await reader.readline() == b"nIDSESSION\n"
+        self.sessions += 1
+        request_id = 0
+        tasks = []
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            request_id += 1
+            command = line.decode().strip()[1:]
+            self.commands.append(command)
+            if self.drop_after is not None and request_id > self.drop_after:
+                break
+            body = b""
+            if command == "INSTREAM":
+                try:
+                    while True:
+                        (size,) = struct.unpack("!L", await reader.readexactly(4))
+                        if not size:
+                            break
+                        body += await reader.readexactly(size)
+                except asyncio.IncompleteReadError:
+                    break
+                self.streams.append(body)
+            tasks.append(asyncio.ensure_future(self.reply(writer, request_id, command, body)))
+        for task in tasks:
+            task.cancel()
+        writer.close()
+
+    async def reply(self, writer, request_id, command, body):
+        await asyncio.sleep(self.delays.get(command.split(" ")[0], 0))
+        if command == "PING":
+            text = "PONG"
+        elif command == "VERSION":
+            text = "ClamAV 1.0.3/27100/Mon Oct 16"
+        elif command == "STATS":
+            text = "POOLS: 1\n\nSTATE: VALID PRIMARY\nQUEUE: 0 items\nEND"
+        elif command == "INSTREAM":
+            text = "stream: Eicar FOUND" if b"EICAR" in body else "stream: OK"
+        elif command.startswith("SCAN "):
+            text = f"{command[5:]}: OK"
+        else:
+            text = "UNKNOWN COMMAND"
+        writer.write(f"{request_id}: {text}\n".encode())
+
+
+CONF = {
+    "CLAMD_CONN": "net",
+    "CLAMD_HOST": "127.0.0.1",
+    "CLAMD_PORT": 0,
+    "CLAMD_SOCKET": "/tmp/clamd.sock",
+    "SIGNATURE_VERSION_TTL": 60,
+    "CLAMD_TIMEOUT_PING": 5,
+    "CLAMD_TIMEOUT_SCAN": 5,
+    "CLAMD_TIMEOUT_CONTSCAN": 5,
+    "CLAMD_TIMEOUT_INSTREAM": 5,
+    "CLAMD_SESSION_KEEPALIVE": 0,
+}
+
+
+async def _chunks(*parts):
+    for part in parts:
+        yield part
+
+
+def test_parse_reply():
+    assert parse_reply("12: stream: OK") == (12, "stream: OK")
+    with pytest.raises(PyvalveConnectionError):
+        parse_reply("COMMAND READ TIMED OUT")
+
+
+@pytest.mark.anyio
+async def test_replies_are_matched_out_of_order_on_one_connection(conf):
+    clamd = FakeClamd(delays={"VERSION": 0.05})
+    conf.CLAMD_PORT = await clamd.start()
+    session = ClamdSession(conf)
+    try:
+        version = asyncio.ensure_future(session.command("VERSION"))
+        await asyncio.sleep(0.01)
+        ping = await session.command("PING")
+        assert not version.done()
+        assert ping == "PONG"
+        assert await version == "ClamAV 1.0.3/27100/Mon Oct 16"
+        assert clamd.sessions == 1
+        assert session.outstanding == 0
+    finally:
+        session.close()
+        await clamd.stop()
+
+
+@pytest.mark.anyio
+async def test_stats_reply_spans_lines_and_instream_body_is_sent(conf):
+    clamd = FakeClamd()
+    conf.CLAMD_PORT = await clamd.start()
+    pool = ClamdSessionPool(conf, size=1, max_in_flight=4)
+    try:
+        stats, clean, infected = await asyncio.gather(
+            pool.stats(),
+            pool.instream(_chunks(b"hello ", b"world")),
+            pool.instream(_chunks(b"X5O!P%@AP EICAR")),
+        )
+        assert stats.startswith("POOLS: 1")
+        assert stats.endswith("END")
+        assert clean == "stream: OK"
+        assert infected == "stream: Eicar FOUND"
+        assert b"hello world" in clamd.streams
+        assert pool.pool_stats()["sessions"][0]["commands"] == 3
+    finally:
+        await pool.close()
+        await clamd.stop()
+
+
+@pytest.mark.anyio
+async def test_timeout_keeps_session_and_late_reply_is_dropped(conf):
+    clamd = FakeClamd(delays={"VERSION": 0.2})
+    conf.CLAMD_PORT = await clamd.start()
+    conf.CLAMD_TIMEOUT_PING = 0.05
+    pool = ClamdSessionPool(conf, 1, 4)
+    try:
+        with pytest.raises(ClamdTimeoutError):
+            await pool.version()
+        assert await pool._run("PING", 1) == "PONG"
+        await asyncio.sleep(0.25)
+        assert await pool._run("PING", 1) == "PONG"
+        assert clamd.sessions == 1
+    finally:
+        await pool.close()
+        await clamd.stop()
+
+
+@pytest.mark.anyio
+async def test_closed_session_fails_pending_and_reconnects(conf):
+    clamd = FakeClamd(delays={"VERSION": 1}, drop_after=1)
+    conf.CLAMD_PORT = await clamd.start()
+    session = ClamdSession(conf)
+    try:
+        with pytest.raises(PyvalveConnectionError):
+            await asyncio.gather(session.command("VERSION"), session.command("PING"))
+        clamd.drop_after = None
+        clamd.delays = {}
+        assert await session.command("PING") == "PONG"
+        assert clamd.sessions == 2
+    finally:
+        session.close()
+        await clamd.stop()
+
+
+@pytest.mark.anyio
+async def test_in_flight_commands_are_bounded_per_session(conf):
+    clamd = FakeClamd(delays={"PING": 0.05})
+    conf.CLAMD_PORT = await clamd.start()
+    pool = ClamdSessionPool(conf, size=2, max_in_flight=2)
+    try:
+        seen = []
+
+        async def ping():
+            result = await pool.ping()
+            seen.append(max(session.outstanding for session in pool.sessions))
+            return result
+
+        results = await asyncio.gather(*(ping() for _ in range(8)))
+        assert results == ["PONG"] * 8
+        assert max(seen) <= 2
+        assert clamd.sessions == 2
+    finally:
+        await pool.close()
+        await clamd.stop()
+
+
+@pytest.mark.anyio
+async def test_size_limit_reply_raises_stream_max_length(conf):
+    clamd = FakeClamd()
+
+    async def reply(writer, request_id, command, body):
+        writer.write(f"{request_id}: INSTREAM size limit exceeded. ERROR\n".encode())
+
+    clamd.reply = reply
+    conf.CLAMD_PORT = await clamd.start()
+    pool = ClamdSessionPool(conf, 1, 1)
+    try:
+        with pytest.raises(PyvalveStreamMaxLength):
+            await pool.instream(_chunks(b"data"))
+    finally:
+        await pool.close()
+        await clamd.stop()
+
+
+@pytest.mark.anyio
+async def test_failing_payload_ends_its_stream_and_keeps_the_session(conf):
+    clamd = FakeClamd(delays={"VERSION": 0.05})
+    conf.CLAMD_PORT = await clamd.start()
+    session = ClamdSession(conf)
+
+    async def failing():
+        yield b"data"
+        raise ValueError("payload failed")
+
+    try:
+        version = asyncio.ensure_future(session.command("VERSION"))
+        await asyncio.sleep(0.01)
+        with pytest.raises(ValueError):
+            await session.command("INSTREAM", body=failing())
+        assert session.connected
+        assert await session.command("PING") == "PONG"
+        assert await version == "ClamAV 1.0.3/27100/Mon Oct 16"
+        assert clamd.streams == [b"data"]
+        assert clamd.sessions == 1
+    finally:
+        session.close()
+        await clamd.stop()
+
+
+@pytest.mark.anyio
+async def test_cancelled_instream_does_not_fail_sibling_commands(conf):
+    clamd = FakeClamd(delays={"SCAN": 0.05})
+    conf.CLAMD_PORT = await clamd.start()
+    pool = ClamdSessionPool(conf, size=1, max_in_flight=4)
+    stalled = asyncio.Event()
+
+    async def stalling():
+        yield b"partial"
+        stalled.set()
+        await asyncio.sleep(10)
+        yield b"never sent"
+
+    try:
+        scan = asyncio.ensure_future(pool._run("SCAN", 5, "/data/a"))
+        upload = asyncio.ensure_future(pool.instream(stalling()))
+        await stalled.wait()
+        upload.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await upload
+        assert await scan == "/data/a: OK"
+        assert await pool.ping() == "PONG"
+        assert clamd.streams == [b"partial"]
+        assert clamd.sessions == 1
+    finally:
+        await pool.close()
+        await clamd.stop()
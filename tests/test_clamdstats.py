@@ -0,0 +1,58 @@
+"""Tests for src/clamdstats.py"""
+from src.clamdstats import gauges, parse_stats
+
+STATS = (
+    "POOLS: 1\n"
+    "\n"
+    "STATE: VALID PRIMARY\n"
+    "THREADS: live 3  idle 1 max 12 idle-timeout 30\n"
+    "QUEUE: 1 items\n"
+    "\tINSTREAM 4.250117 \n"
+    "\tSCAN 0.812000 /data/big.iso\n"
+    "\tSTATS 0.000394 \n"
+    "\n"
+    "MEMSTATS: heap 9.082M mmap 0.000M used 6.902M free 2.184M releasable 0.129M "
+    "pools 1 pools_used 565.979M pools_total 565.999M\n"
+    "END"
+)
+
+
+def test_parse_stats():
+    stats = parse_stats(STATS)
+
+    assert stats["declared_pools"] == 1
+    (pool,) = stats["pools"]
+    assert pool["state"] == "VALID PRIMARY"
+    assert pool["threads"] == {"live": 3, "idle": 1, "max": 12, "idle_timeout": 30}
+    assert pool["queue"]["items"] == 1
+    assert pool["queue"]["jobs"][1] == {"command": "SCAN", "age": 0.812, "detail": "/data/big.iso"}
+    assert stats["memory"]["heap"] == 9.082
+    assert stats["memory"]["pools_used"] == 565.979
+
+
+def test_gauges_sum_pools_and_keep_unavailable_memory_as_none():
+    text = (
+        "POOLS: 2\n\nSTATE: VALID PRIMARY\nTHREADS: live 2  idle 0 max 4 idle-timeout 30\n"
+        "QUEUE: 3 items\n\tSCAN 7.5 /a\n\n"
+        "STATE: VALID PRIMARY\nTHREADS: live 1  idle 1 max 4 idle-timeout 30\nQUEUE: 0 items\n\n"
+        "MEMSTATS: heap N/A mmap N/A used N/A free N/A releasable N/A pools 1 "
+        "pools_used 100.000M pools_total 120.000M\nEND"
+    )
+
+    result = gauges(parse_stats(text))
+
+    assert result["threads_live"] == 3
+    assert result["threads_busy"] == 2
+    assert result["threads_max"] == 8
+    assert result["utilization"] == 0.25
+    assert result["queue_items"] == 3
+    assert result["oldest_job_age"] == 7.5
+    assert result["memory_heap"] is None
+    assert result["memory_pools_total"] == 120.0
+
+
+def test_parse_stats_tolerates_partial_replies():
+    stats = parse_stats("POOLS: 1\n\nSTATE: VALID PRIMARY\nTHREADS: live 1\n")
+
+    assert stats["pools"][0]["threads"] is None
+    assert gauges(stats)["utilization"] is None
@@ -0,0 +1,137 @@
+"""Tests for src/coalesce.py"""
+import asyncio
+import os
+
+import pytest
+
+import io
+
+from src.coalesce import SingleFlight, file_digest, path_key
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.mark.anyio
+async def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    calls = {"count": 0}
+    release = asyncio.Event()
+
+    async def scan():
+        calls["count"] += 1
+        await release.wait()
+        return "OK"
+
+    waiters = [asyncio.ensure_future(flight.do("key", scan)) for _ in range(5)]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*waiters)
+
+    assert results == ["OK"] * 5
+    assert calls["count"] == 1
+    assert flight.stats() == {
+        "in_flight": 0,
+        "leaders": 1,
+        "coalesced": 4,
+        "abandoned": 0,
+        "coalesced_ratio": 0.8,
+    }
+
+
+@pytest.mark.anyio
+async def test_exceptions_are_shared_and_key_is_released():
+    flight = SingleFlight()
+    release = asyncio.Event()
+
+    async def fail():
+        await release.wait()
+        raise RuntimeError("clamd down")
+
+    waiters = [asyncio.ensure_future(flight.do("key", fail)) for _ in range(2)]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*waiters, return_exceptions=True)
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert not flight.calls
+
+
+@pytest.mark.anyio
+async def test_sequential_calls_are_not_coalesced():
+    flight = SingleFlight()
+
+    async def scan():
+        return "OK"
+
+    await flight.do("key", scan)
+    await flight.do("key", scan)
+
+    assert flight.leaders == 2
+    assert flight.coalesced == 0
+
+
+@pytest.mark.anyio
+async def test_cancelled_waiter_does_not_cancel_shared_call():
+    flight = SingleFlight()
+    release = asyncio.Event()
+
+    async def scan():
+        await release.wait()
+        return "OK"
+
+    first = asyncio.ensure_future(flight.do("key", scan))
+    second = asyncio.ensure_future(flight.do("key", scan))
+    await asyncio.sleep(0)
+    first.cancel()
+    release.set()
+
+    assert await second == "OK"
+
+
+@pytest.mark.anyio
+async def test_shared_call_is_cancelled_when_every_waiter_is():
+    flight = SingleFlight()
+    started = asyncio.Event()
+    cancelled = asyncio.Event()
+
+    async def scan():
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    waiters = [asyncio.ensure_future(flight.do("key", scan)) for _ in range(2)]
+    await started.wait()
+    for waiter in waiters:
+        waiter.cancel()
+    await asyncio.gather(*waiters, return_exceptions=True)
+    await asyncio.wait_for(cancelled.wait(), 1)
+
+    assert flight.abandoned == 1
+    await asyncio.sleep(0)
+    assert not flight.calls and not flight.waiters
+
+
+def test_file_digest_rewinds():
+    fileobj = io.BytesIO(b"abc")
+
+    assert file_digest(fileobj, chunk_size=2) == (
+        "ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad")
+    assert fileobj.tell() == 0
+
+
+def test_path_key_includes_mtime_and_size(tmp_path):
+    target = tmp_path / "file.txt"
+    target.write_bytes(b"data")
+    stat = os.stat(target)
+
+    assert path_key("scan", str(target)) == f"scan:{target}:{stat.st_mtime_ns}:4"
+
+
+def test_path_key_missing_path(tmp_path):
+    assert path_key("scan", str(tmp_path / "missing")) is None
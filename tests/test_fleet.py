@@ -0,0 +1,169 @@
+"""Tests for src/fleet.py"""
+import logging
+import os
+import socket
+import threading
+from types import SimpleNamespace
+
+import src.fleet as fleet_module
+from src.fleet import ClamdFleet, clamd_command, fleet_socket, render_config
+
+BASE_CONFIG = """# shared settings
+DatabaseDirectory {database}
+LocalSocket /tmp/clamd.socket
+LocalSocketMode 660
+SelfCheck 600
+LogFile /var/log/clamav/clamd.log
+"""
+
+
+class FakeProcess:
+    """Popen stand-in whose exit code the test sets."""
+
+    pid = 4242
+
+    def __init__(self):
+        self.code = None
+
+    def poll(self):
+        return self.code
+
+    def terminate(self):
+        self.code = -15
+
+    def wait(self, timeout=None):
+        return self.code
+
+
+def _fleet(tmp_path, size=2, **overrides):
+    database = tmp_path / "db"
+    database.mkdir(exist_ok=True)
+    base = tmp_path / "clamd.conf"
+    base.write_text(BASE_CONFIG.format(database=database))
+    values = dict(
+        CLAMD_FLEET_SIZE=size,
+        CLAMD_FLEET_DIR=str(tmp_path / "fleet"),
+        CLAMD_FLEET_CONFIG=str(base),
+        CLAMD_FLEET_BINARY="clamd",
+        CLAMD_FLEET_CHECK_INTERVAL=1.0,
+        CLAMD_FLEET_RELOAD_CHECK=60,
+        CLAMD_FLEET_RELOAD_STAGGER=10,
+        CLAMD_FLEET_RESTART_MAX_DELAY=30,
+        CLAMD_FLEET_PROBE_TIMEOUT=1.0,
+        CLAMD_FLEET_STOP_TIMEOUT=1.0,
+    )
+    values.update(overrides)
+    fleet = ClamdFleet(SimpleNamespace(**values), logging.getLogger("test"))
+    fleet.launched = []
+
+    def launch(instance):
+        fleet.launched.append(instance.index)
+        return FakeProcess()
+
+    fleet.launch = launch
+    fleet.prepare()
+    return fleet
+
+
+def test_render_config_gives_each_instance_its_own_socket():
+    base = BASE_CONFIG.format(database="/opt/clamav")
+
+    config = render_config(base, "/run/fleet", 1).splitlines()
+
+    assert "LocalSocket /run/fleet/clamd-1.socket" in config
+    assert "LocalSocket /tmp/clamd.socket" not in config
+    assert "LocalSocketMode 660" in config
+    assert "SelfCheck 0" in config
+    assert "ConcurrentDatabaseReload no" in config
+    assert "LogFile /var/log/clamav/clamd-1.log" in config
+    assert fleet_socket("/run/fleet", 1) == "/run/fleet/clamd-1.socket"
+
+
+def test_crashed_instances_restart_with_backoff(tmp_path):
+    fleet = _fleet(tmp_path)
+    fleet.tick(100.0)
+    assert fleet.launched == [0, 1]
+    assert sorted(os.listdir(tmp_path / "fleet")) == ["clamd-0.conf", "clamd-1.conf"]
+
+    fleet.instances[0].process.code = 1
+    fleet.tick(101.0)
+    assert fleet.launched == [0, 1]
+    fleet.tick(102.0)
+    assert fleet.launched == [0, 1, 0]
+    # Crashing again straight away doubles the delay
+    fleet.instances[0].process.code = 1
+    fleet.tick(103.0)
+    fleet.tick(104.0)
+    assert fleet.launched == [0, 1, 0]
+    fleet.tick(105.0)
+    assert fleet.launched == [0, 1, 0, 0]
+    assert fleet.instances[0].restarts == 2
+
+    fleet.stop()
+    assert all(instance.process.code == -15 for instance in fleet.instances)
+
+
+def test_database_change_reloads_one_instance_at_a_time(tmp_path, monkeypatch):
+    fleet = _fleet(tmp_path, size=3)
+    sent = []
+    reloading = set()
+
+    def command(path, name, timeout):
+        sent.append((path, name))
+        if name == b"RELOAD":
+            reloading.add(path)
+            return "RELOADING"
+        if path in reloading:
+            raise socket.timeout("timed out")
+        return "PONG"
+
+    monkeypatch.setattr(fleet_module, "clamd_command", command)
+    fleet.tick(100.0)
+    database = tmp_path / "db" / "daily.cvd"
+    database.write_bytes(b"signatures")
+    os.utime(database, (1e9, 1e9))
+
+    fleet.tick(200.0)
+    sockets = [instance.socket for instance in fleet.instances]
+    assert sent == [(sockets[0], b"RELOAD")]
+    # Still loading: the PING times out and nothing else reloads
+    fleet.tick(202.0)
+    assert sent[-1] == (sockets[0], b"PING")
+    assert len(sent) == 2
+    reloading.clear()
+    fleet.tick(203.0)
+    assert fleet.reloads == 1
+    fleet.tick(205.0)
+    assert (sockets[1], b"RELOAD") not in sent
+    fleet.tick(213.0)
+    assert sent[-1] == (sockets[1], b"RELOAD")
+    # An instance that crashes while reloading comes back with the new database
+    fleet.instances[1].process.code = 1
+    fleet.tick(214.0)
+    fleet.tick(224.0)
+    assert sent[-1] == (sockets[2], b"RELOAD")
+    reloading.clear()
+    fleet.tick(226.0)
+    assert fleet.reloads == 3
+    assert not fleet.pending
+
+
+def test_clamd_command_reads_the_whole_reply(tmp_path):
+    path = str(tmp_path / "clamd.socket")
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(1)
+
+    def answer():
+        conn, _ = server.accept()
+        with conn:
+            assert conn.recv(64) == b"nPING\n"
+            conn.sendall(b"PONG\n")
+
+    thread = threading.Thread(target=answer)
+    thread.start()
+    try:
+        assert clamd_command(path, b"PING", 1.0) == "PONG"
+    finally:
+        thread.join()
+        server.close()
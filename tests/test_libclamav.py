@@ -0,0 +1,218 @@
+"""Tests for src/libclamav.py"""
+import asyncio
+import io
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytest
+
+from src import libclamav
+from src.clamdstats import parse_stats
+from src.libclamav import (
+    ClamdTimeoutError,
+    LibClamAvPool,
+    PyvalveConnectionError,
+    PyvalveResponseError,
+    PyvalveScanningError,
+)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+class FakeEngine:
+    """Engine flagging payloads that contain EICAR, and failing on ones that contain BROKEN."""
+
+    def __init__(self, version="ClamAV 1.0.3/27100/Mon Oct 16 08:27:05 2023"):
+        self.buffers = []
+        self.files = []
+        self.release = version
+
+    @staticmethod
+    def _verdict(data):
+        if b"BROKEN" in data:
+            return None, "Can't read file"
+        return ("Eicar-Signature", None) if b"EICAR" in data else (None, None)
+
+    def scan_buffer(self, data):
+        self.buffers.append(data)
+        return self._verdict(data)
+
+    def scan_file(self, path):
+        self.files.append(path)
+        with open(path, "rb") as source:
+            return self._verdict(source.read())
+
+    def version(self):
+        return self.release
+
+
+CONF = {
+    "LIBCLAMAV_PATH": "",
+    "LIBCLAMAV_DATABASE": lambda tmp_path: str(tmp_path / "db"),
+    "LIBCLAMAV_BUFFER_MAX": 8,
+    "LIBCLAMAV_TMP_DIR": lambda tmp_path: str(tmp_path / "spool"),
+    "CLAMD_TIMEOUT_PING": 0,
+    "CLAMD_TIMEOUT_SCAN": 0,
+    "CLAMD_TIMEOUT_CONTSCAN": 0,
+    "CLAMD_TIMEOUT_INSTREAM": 0,
+}
+
+
+@pytest.fixture
+def conf(conf, tmp_path):
+    (tmp_path / "db").mkdir()
+    (tmp_path / "spool").mkdir()
+    return conf
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    fake = FakeEngine()
+    monkeypatch.setitem(libclamav._WORKER, "engine", fake)
+    return fake
+
+
+@pytest.fixture
+def pool(conf, monkeypatch, engine):
+    pool = LibClamAvPool(conf, 2)
+    # Threads share the fake engine; the real pool loads one per process
+    monkeypatch.setattr(pool, "_new_executor", lambda: ThreadPoolExecutor(max_workers=2))
+    yield pool
+    if pool.executor is not None:
+        pool.executor.shutdown()
+
+
+async def _chunks(*parts):
+    for part in parts:
+        yield part
+
+
+@pytest.mark.anyio
+async def test_small_streams_are_scanned_in_memory(pool, engine, tmp_path):
+    assert await pool.ping() == "PONG"
+    assert await pool.instream(_chunks(b"EIC", b"AR")) == "stream: Eicar-Signature FOUND"
+    assert await pool.instream(io.BytesIO(b"clean")) == "stream: OK"
+    assert engine.buffers == [b"EICAR", b"clean"]
+    assert engine.files == []
+
+
+@pytest.mark.anyio
+async def test_large_streams_are_spooled_to_a_file(pool, engine, tmp_path):
+    result = await pool.instream(_chunks(b"0123", b"4567", b"89EICAR"))
+
+    assert result == "stream: Eicar-Signature FOUND"
+    assert engine.buffers == []
+    assert len(engine.files) == 1
+    assert os.listdir(tmp_path / "spool") == []
+
+
+@pytest.mark.anyio
+async def test_scan_stops_at_the_first_infection_and_contscan_does_not(pool, tmp_path):
+    target = tmp_path / "target"
+    target.mkdir()
+    (target / "a.txt").write_bytes(b"EICAR")
+    (target / "b.txt").write_bytes(b"EICAR")
+    (target / "c.txt").write_bytes(b"clean")
+
+    assert await pool.scan(str(target)) == f"{target}/a.txt: Eicar-Signature FOUND"
+    assert (await pool.contscan(str(target))).splitlines() == [
+        f"{target}/a.txt: Eicar-Signature FOUND",
+        f"{target}/b.txt: Eicar-Signature FOUND",
+    ]
+    assert await pool.scan(str(target / "c.txt")) == f"{target}/c.txt: OK"
+    with pytest.raises(PyvalveScanningError):
+        await pool.scan(str(target / "missing"))
+
+
+@pytest.mark.anyio
+async def test_engine_errors_are_response_errors(pool):
+    with pytest.raises(PyvalveResponseError):
+        await pool.instream(_chunks(b"BROKEN"))
+
+
+@pytest.mark.anyio
+async def test_stats_reply_parses_like_clamd(pool):
+    await pool.connecting()
+    stats = parse_stats(await pool.stats())
+
+    assert stats["pools"][0]["state"] == "VALID PRIMARY"
+    assert stats["pools"][0]["threads"]["max"] == 2
+    assert pool.pool_stats() == {"size": 2, "in_use": 0, "waiting": 0, "reloads": 0,
+                                 "recycles": 0}
+
+
+@pytest.mark.anyio
+async def test_changed_database_is_loaded_by_new_workers(pool, tmp_path):
+    await pool.connecting()
+    previous = pool.executor
+    database = tmp_path / "db" / "daily.cvd"
+    database.write_bytes(b"signatures")
+    later = os.stat(database).st_mtime + 60
+    os.utime(database, (later, later))
+
+    await pool.stats()
+    await pool.reloading
+
+    assert pool.executor is not previous
+    assert pool.reloads == 1
+    assert await pool.version() == "ClamAV 1.0.3/27100/Mon Oct 16 08:27:05 2023"
+
+
+@pytest.mark.anyio
+async def test_missing_library_is_a_connection_error(tmp_path, conf):
+    conf.LIBCLAMAV_PATH = str(tmp_path / "libclamav.so")
+    pool = LibClamAvPool(conf, 1)
+    try:
+        with pytest.raises(PyvalveConnectionError):
+            await pool.connecting()
+    finally:
+        await pool.close()
+
+
+@pytest.mark.anyio
+async def test_timed_out_scan_kills_its_workers(pool, monkeypatch):
+    executors = []
+
+    def new_executor():
+        executors.append(ProcessPoolExecutor(max_workers=1))
+        return executors[-1]
+
+    monkeypatch.setattr(pool, "_new_executor", new_executor)
+
+    stuck = asyncio.ensure_future(pool._call("scan", 1, time.sleep, 60))
+    await asyncio.sleep(0.5)
+    processes = list(executors[0]._processes.values())
+    with pytest.raises(ClamdTimeoutError):
+        await stuck
+
+    assert processes
+    assert pool.executor is None
+    assert pool.pool_stats()["recycles"] == 1
+    for process in processes:
+        process.join(5)
+        assert not process.is_alive()
+    assert await pool._call("version", 5, str, "fresh") == "fresh"
+    assert len(executors) == 2
+
+
+@pytest.mark.anyio
+async def test_timed_out_workers_finish_their_other_scans_first(pool):
+    release = threading.Event()
+    slow = asyncio.ensure_future(
+        pool._call("scan", 0, lambda: "slow: OK" if release.wait(5) else "slow: late"))
+    await asyncio.sleep(0.05)
+    old = pool.executor
+
+    with pytest.raises(ClamdTimeoutError):
+        await pool._call("scan", 0.05, time.sleep, 0.5)
+
+    assert old in pool.retired
+    release.set()
+    assert await slow == "slow: OK"
+    assert old not in pool.retired
+    assert pool.calls == {}
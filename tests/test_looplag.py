@@ -0,0 +1,84 @@
+"""Tests for src/looplag.py"""
+import asyncio
+import logging
+import time
+
+import pytest
+
+from src.looplag import LoopMonitor
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+CONF = {
+    "LOOP_LAG_INTERVAL": 0.01,
+    "LOOP_STALL_THRESHOLD": 0.05,
+    "LOOP_STALL_HISTORY": 5,
+    "LOOP_STALL_STACKS": 10,
+}
+
+
+def blocking_call():
+    time.sleep(0.3)
+
+
+async def handler():
+    await asyncio.sleep(0.05)
+    blocking_call()
+
+
+@pytest.mark.anyio
+async def test_stall_captures_the_blocking_stack(conf):
+    monitor = LoopMonitor(conf, logging.getLogger("test"))
+    await monitor.start()
+    try:
+        await asyncio.create_task(handler(), name="blocker")
+        await asyncio.sleep(0.05)
+    finally:
+        await monitor.stop()
+
+    report = monitor.report()
+    stall = report["stalls"][-1]
+    assert stall["lag_ms"] >= 200
+    assert stall["task"] == "blocker"
+    assert stall["stack"][0] == "task:blocker"
+    assert any(frame.startswith("blocking_call") for frame in stall["stack"])
+    assert report["stacks"][0]["count"] == 1
+    stats = monitor.stats()
+    assert stats["stalls"] == 1
+    assert stats["lag_ms_buckets"]["500"] == 1
+    assert stats["samples"] > 1
+
+
+def test_lag_histogram_and_history(conf):
+    conf.LOOP_STALL_HISTORY = 2
+    monitor = LoopMonitor(conf, logging.getLogger("test"))
+
+    for lag in (0.0005, 0.003, 0.06, 0.07, 7.0):
+        monitor.observe(lag, deadline=0.0)
+
+    stats = monitor.stats()
+    assert stats["lag_ms_buckets"]["1"] == 1
+    assert stats["lag_ms_buckets"]["5"] == 1
+    assert stats["lag_ms_buckets"]["100"] == 2
+    assert stats["lag_ms_buckets"]["+Inf"] == 1
+    assert stats["lag_max_ms"] == 7000.0
+    assert stats["stalls"] == 3
+    # Stalls the watchdog missed are still counted, without a stack
+    assert [stall["stack"] for stall in monitor.report()["stalls"]] == [None, None]
+
+
+def test_stalled_stacks_are_bounded(conf):
+    conf.LOOP_STALL_STACKS = 2
+    monitor = LoopMonitor(conf, logging.getLogger("test"))
+
+    for stack in ("task:a;f", "task:a;f", "task:b;g", "task:c;h"):
+        monitor.captured = (0.0, stack)
+        monitor.observe(0.1, deadline=0.0)
+
+    report = monitor.report()
+    assert [entry["stack"] for entry in report["stacks"]] == [["task:a", "f"], ["task:c", "h"]]
+    assert report["stalls"][-1]["task"] == "c"
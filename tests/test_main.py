@@ -1,3 +1,7 @@
+import gzip
+import json
+from types import SimpleNamespace
+
 import aiohttp
 import pytest
 
@@ -16,7 +20,12 @@ def _clear_dependency_overrides():
     app.dependency_overrides.clear()
 
 
+async def _fake_signature_version():
+    return "27100"
+
+
 def _make_fake_clamav(**methods):
+    methods.setdefault("signature_version", _fake_signature_version)
     wrapped = {k: staticmethod(v) for k, v in methods.items()}
     return type("FakeClamAV", (), wrapped)()
 
@@ -25,10 +34,17 @@ def _override_clamav(fake):
     app.dependency_overrides[clamav_init] = lambda: fake
 
 
-def _fake_client_session(status=200, data=b"file content"):
+def _fake_client_session(status=200, data=b"file content", headers=None, requests=None):
+    class FakeContent:
+        async def iter_chunked(self, size):
+            for offset in range(0, len(data), size):
+                yield data[offset:offset + size]
+
     class FakeResp:
         def __init__(self):
             self.status = status
+            self.headers = headers or {}
+            self.content = FakeContent()
 
         async def read(self):
             return data
@@ -40,7 +56,12 @@ def _fake_client_session(status=200, data=b"file content"):
             return None
 
     class FakeSession:
-        def get(self, url):
+        def __init__(self, **kwargs):
+            self.kwargs = kwargs
+
+        def get(self, url, **kwargs):
+            if requests is not None:
+                requests.append((url, kwargs))
             return FakeResp()
 
         async def __aenter__(self):
@@ -210,6 +231,30 @@ def test_scan_path_virus_found():
     assert response.json()["path"] == "somefile.txt"
 
 
+def test_scan_verdicts_are_audited(monkeypatch, tmp_path):
+    async def fake_scan(path):
+        return f"{path}: Eicar FOUND"
+
+    audit = main_module.AuditLog(SimpleNamespace(
+        AUDIT_PATH=str(tmp_path / "audit.ndjson"), AUDIT_FORMAT="ndjson", AUDIT_BUFFER_SIZE=10,
+        AUDIT_BATCH_SIZE=10, AUDIT_FLUSH_INTERVAL=1, AUDIT_RETRY_MAX_DELAY=1,
+        AUDIT_ROTATE_BYTES=0, AUDIT_ROTATE_KEEP=1),
+        main_module.logger)
+    monkeypatch.setattr(main_module, "audit_log", audit)
+    _override_clamav(_make_fake_clamav(scan=fake_scan))
+
+    response = client.post("/scanpath/somefile.txt")
+
+    assert response.status_code == 406
+    entry = audit.buffer[0]
+    assert entry["client"] == "ip:testclient"
+    assert entry["source"] == "path"
+    assert entry["target"] == "somefile.txt"
+    assert entry["verdict"] == "infected"
+    assert entry["signature"] == "Eicar"
+    assert entry["latency_ms"] >= 0
+
+
 def test_scan_path_response_error(monkeypatch):
     class FakeResponseError(Exception):
         pass
@@ -246,6 +291,32 @@ def test_scan_path_scanning_error(monkeypatch):
     assert response.json()["response"] == "Error scanning"
 
 
+def test_scan_path_clamd_timeout():
+    async def fake_scan(path):
+        raise main_module.ClamdTimeoutError("clamd did not answer within 1s")
+
+    fake = _make_fake_clamav(scan=fake_scan)
+    _override_clamav(fake)
+
+    response = client.post("/scanpath/somefile.txt")
+
+    assert response.status_code == 504
+    assert response.json()["response"] == "ClamAV did not answer in time"
+
+
+def test_scan_path_circuit_open():
+    async def fake_scan(path):
+        raise main_module.CircuitOpenError("open")
+
+    fake = _make_fake_clamav(scan=fake_scan)
+    _override_clamav(fake)
+
+    response = client.post("/scanpath/somefile.txt")
+
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
+
+
 def test_scan_url(monkeypatch):
     async def fake_instream(data):
         return "OK"
@@ -279,7 +350,7 @@ def test_scan_url_invalid_url(monkeypatch):
         return "OK"
 
     class BadSession:
-        def get(self, url):
+        def get(self, url, **kwargs):
             raise aiohttp.client_exceptions.InvalidURL(url)
 
         async def __aenter__(self):
@@ -290,7 +361,7 @@ def test_scan_url_invalid_url(monkeypatch):
 
     fake = _make_fake_clamav(instream=fake_instream)
     _override_clamav(fake)
-    monkeypatch.setattr(aiohttp, "ClientSession", lambda: BadSession())
+    monkeypatch.setattr(aiohttp, "ClientSession", lambda **kwargs: BadSession())
 
     response = client.get("/scanurl/?url=://not-a-url")
 
@@ -298,8 +369,14 @@ def test_scan_url_invalid_url(monkeypatch):
     assert response.json()["response"] == "Invalid URL"
 
 
+async def _drain(data):
+    async for _ in data:
+        pass
+
+
 def test_scan_url_too_large(monkeypatch):
     async def fake_instream(data):
+        await _drain(data)
         return "OK"
 
     fake = _make_fake_clamav(instream=fake_instream)
@@ -465,3 +542,812 @@ def test_show_license(monkeypatch):
 
     assert response.status_code == 200
     assert "MIT License" in response.text
+
+
+def test_show_metrics(monkeypatch):
+    monkeypatch.setattr(main_module.metrics, "providers", {"watcher": lambda: {"backlog": 3}})
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.json() == {"watcher": {"backlog": 3}}
+
+
+def test_scan_upload_file_coalesces_identical_payloads(monkeypatch):
+    calls = []
+
+    async def fake_do(key, func):
+        calls.append(key)
+        return await func()
+
+    async def fake_instream(data):
+        return "OK"
+
+    monkeypatch.setattr(main_module.single_flight, "do", fake_do)
+    _override_clamav(_make_fake_clamav(instream=fake_instream))
+
+    client.post("/scanfile", files={"file": b"abc"})
+    client.post("/scanfile", files={"file": b"abc"})
+
+    assert calls[0].startswith("sha256:")
+    assert calls[0] == calls[1]
+
+
+def test_scan_url_coalesces_on_normalized_url(monkeypatch):
+    calls = []
+
+    async def fake_do(key, func):
+        calls.append(key)
+        return await func()
+
+    async def fake_instream(data):
+        return "OK"
+
+    monkeypatch.setattr(main_module.single_flight, "do", fake_do)
+    monkeypatch.setattr(aiohttp, "ClientSession", _fake_client_session())
+    _override_clamav(_make_fake_clamav(instream=fake_instream))
+
+    client.get("/scanurl/?url=HTTPS://Example.com:443/a")
+
+    assert calls == ["url:https://example.com/a"]
+
+
+def test_coalescing_disabled(monkeypatch):
+    async def fail_do(key, func):
+        raise AssertionError("should not coalesce")
+
+    async def fake_scan(path):
+        return "OK"
+
+    monkeypatch.setattr(main_module.single_flight, "do", fail_do)
+    monkeypatch.setattr(main_module.conf, "COALESCE_SCANS", False)
+    _override_clamav(_make_fake_clamav(scan=fake_scan))
+
+    response = client.post("/scanpath/somefile.txt")
+
+    assert response.status_code == 200
+
+
+def _cached_url_clamav(scans):
+    async def fake_instream(data):
+        scans.append(data)
+        return "stream: OK"
+
+    async def fake_signature_version():
+        return "27100"
+
+    return _make_fake_clamav(instream=fake_instream, signature_version=fake_signature_version)
+
+
+def test_scan_url_stores_validators_and_revalidates(monkeypatch):
+    scans, requests = [], []
+    cache = main_module.UrlCache(max_size=10, ttl=60)
+    monkeypatch.setattr(main_module, "url_cache", cache)
+    _override_clamav(_cached_url_clamav(scans))
+
+    monkeypatch.setattr(aiohttp, "ClientSession", _fake_client_session(
+        headers={"ETag": '"v1"'}, requests=requests))
+    first = client.get("/scanurl/?url=https://example.com/file.bin")
+
+    monkeypatch.setattr(aiohttp, "ClientSession", _fake_client_session(
+        status=304, data=b"", requests=requests))
+    second = client.get("/scanurl/?url=https://example.com/file.bin")
+
+    assert first.json()["response"] == "stream: OK"
+    assert second.status_code == 200
+    assert second.json()["response"] == "stream: OK"
+    assert len(scans) == 1
+    assert requests[0][1]["headers"] == {}
+    assert requests[1][1]["headers"] == {"If-None-Match": '"v1"'}
+    assert cache.stats()["hits"] == 1
+
+
+def test_scan_url_without_validators_is_not_cached(monkeypatch):
+    scans = []
+    cache = main_module.UrlCache(max_size=10, ttl=60)
+    monkeypatch.setattr(main_module, "url_cache", cache)
+    _override_clamav(_cached_url_clamav(scans))
+    monkeypatch.setattr(aiohttp, "ClientSession", _fake_client_session())
+
+    client.get("/scanurl/?url=https://example.com/file.bin")
+
+    assert cache.stats()["size"] == 0
+
+
+def test_scan_url_error_replies_are_not_cached(monkeypatch):
+    async def fake_instream(data):
+        return "INSTREAM size limit exceeded. ERROR"
+
+    async def fake_signature_version():
+        return "27100"
+
+    cache = main_module.UrlCache(max_size=10, ttl=60)
+    monkeypatch.setattr(main_module, "url_cache", cache)
+    _override_clamav(_make_fake_clamav(
+        instream=fake_instream, signature_version=fake_signature_version))
+    monkeypatch.setattr(aiohttp, "ClientSession", _fake_client_session(headers={"ETag": '"v1"'}))
+
+    client.get("/scanurl/?url=https://example.com/file.bin")
+
+    assert cache.stats()["size"] == 0
+
+
+def _collecting_instream(received):
+    async def fake_instream(data):
+        received.append(b"".join([chunk async for chunk in data]))
+        return "stream: OK"
+
+    return fake_instream
+
+
+def test_scan_upload_file_decodes_gzip_part(monkeypatch):
+    received = []
+    _override_clamav(_make_fake_clamav(instream=_collecting_instream(received)))
+
+    response = client.post("/scanfile", files={
+        "file": ("log.txt", gzip.compress(b"hello world"), "text/plain", {"Content-Encoding": "gzip"})})
+
+    assert response.status_code == 200
+    assert received == [b"hello world"]
+
+
+def test_scan_upload_file_unsupported_encoding():
+    _override_clamav(_make_fake_clamav(instream=_collecting_instream([])))
+
+    response = client.post("/scanfile", files={
+        "file": ("log.txt", b"data", "text/plain", {"Content-Encoding": "br"})})
+
+    assert response.status_code == 415
+
+
+def test_scan_upload_file_decompression_limit(monkeypatch):
+    _override_clamav(_make_fake_clamav(instream=_collecting_instream([])))
+    monkeypatch.setattr(main_module.conf, "DECOMPRESS_MAX_SIZE", 5)
+
+    response = client.post("/scanfile", files={
+        "file": ("log.txt", gzip.compress(b"hello world"), "text/plain", {"Content-Encoding": "gzip"})})
+
+    assert response.status_code == 413
+
+
+def test_scan_url_decodes_content_encoding(monkeypatch):
+    received = []
+    _override_clamav(_make_fake_clamav(instream=_collecting_instream(received)))
+    monkeypatch.setattr(aiohttp, "ClientSession", _fake_client_session(
+        data=gzip.compress(b"remote body"), headers={"Content-Encoding": "gzip"}))
+
+    response = client.get("/scanurl/?url=https://example.com/dump.log")
+
+    assert response.status_code == 200
+    assert received == [b"remote body"]
+
+
+class FakeVerdictStore:
+    """In-memory stand-in for the persistent verdict store."""
+
+    def __init__(self, verdicts=None):
+        self.verdicts = dict(verdicts or {})
+
+    async def lookup(self, key, signature):
+        return self.verdicts.get((key, signature))
+
+    def put(self, key, signature, verdict):
+        self.verdicts[(key, signature)] = verdict
+
+
+def test_scan_upload_file_uses_verdict_store(monkeypatch):
+    scans = []
+    store = FakeVerdictStore()
+    monkeypatch.setattr(main_module, "verdict_store", store)
+    _override_clamav(_cached_url_clamav(scans))
+
+    first = client.post("/scanfile", files={"file": b"abc"})
+    second = client.post("/scanfile", files={"file": b"abc"})
+
+    assert first.json()["response"] == second.json()["response"] == "stream: OK"
+    assert len(scans) == 1
+    assert list(store.verdicts) == [(
+        "sha256:ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad", "27100")]
+
+
+ABC_SHA256 = "ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad"
+
+
+def test_scan_upload_file_returns_digest_and_etag():
+    async def fake_instream(data):
+        return "stream: OK"
+
+    _override_clamav(_make_fake_clamav(instream=fake_instream))
+
+    response = client.post("/scanfile", files={"file": b"abc"})
+
+    assert response.json() == {
+        "response": "stream: OK", "digest": ABC_SHA256, "signature_version": "27100"}
+    assert response.headers["ETag"] == f'"{ABC_SHA256}-27100"'
+
+
+def test_scan_hash_answers_from_verdict_store(monkeypatch):
+    async def fake_instream(data):
+        raise AssertionError("a hash check must not scan")
+
+    store = FakeVerdictStore({
+        (f"sha256:{ABC_SHA256}", "27100"): "stream: OK",
+        (f"sha256:{'e' * 64}", "27100"): "stream: Eicar FOUND",
+        (f"sha256:{'f' * 64}", "27099"): "stream: OK",
+    })
+    monkeypatch.setattr(main_module, "verdict_store", store)
+    _override_clamav(_make_fake_clamav(instream=fake_instream))
+
+    hit = client.get(f"/scanhash/{ABC_SHA256.upper()}")
+    assert hit.status_code == 200
+    assert hit.json()["digest"] == ABC_SHA256
+    assert hit.headers["ETag"] == f'"{ABC_SHA256}-27100"'
+    assert client.get(
+        f"/scanhash/{ABC_SHA256}", headers={"If-None-Match": hit.headers["ETag"]}).status_code == 304
+
+    infected = client.get(f"/scanhash/{'e' * 64}")
+    assert infected.status_code == 406
+    assert infected.json()["signature_version"] == "27100"
+
+    # Verdicts of older signature versions are misses
+    assert client.get(f"/scanhash/{'f' * 64}").status_code == 404
+    assert client.get("/scanhash/not-a-digest").status_code == 400
+
+
+def test_clamd_stats_endpoint():
+    stats = {"primary": {"state": "ready", "age": 0.5, "stats": {}, "gauges": {"threads_busy": 1}}}
+    seen = []
+
+    async def fake_clamd_stats(max_age):
+        seen.append(max_age)
+        return stats
+
+    _override_clamav(_make_fake_clamav(clamd_stats=fake_clamd_stats))
+
+    response = client.get("/clamd/stats")
+
+    assert response.status_code == 200
+    assert response.json() == stats
+    assert seen == [main_module.conf.CLAMD_STATS_MAX_AGE]
+
+
+def test_lifespan_warms_and_monitors_clamd(monkeypatch):
+    calls = []
+
+    class FakePool:
+        async def connecting(self):
+            calls.append("connecting")
+
+        def pool_stats(self):
+            return {"size": 1}
+
+        def add_listener(self, listener):
+            calls.append("listener")
+
+        async def start(self):
+            calls.append("start")
+
+        async def stop(self):
+            calls.append("stop")
+
+    monkeypatch.setattr(main_module.ClamInstance, "_instance", FakePool())
+
+    with TestClient(app) as lifespan_client:
+        response = lifespan_client.get("/metrics")
+
+    assert calls == ["listener", "connecting", "start", "stop"]
+    assert response.json()["clamd_pool"] == {"size": 1}
+
+
+def test_lifespan_tolerates_unreachable_clamd(monkeypatch):
+    class FakePool:
+        async def connecting(self):
+            raise main_module.PyvalveConnectionError("socket file not found")
+
+        def pool_stats(self):
+            return {}
+
+        def add_listener(self, listener):
+            pass
+
+        async def start(self):
+            pass
+
+        async def stop(self):
+            pass
+
+    monkeypatch.setattr(main_module.ClamInstance, "_instance", FakePool())
+
+    with TestClient(app):
+        pass
+
+
+def test_signature_change_clears_url_cache(monkeypatch):
+    cache = main_module.UrlCache(max_size=10, ttl=60)
+    cache.put("https://example.com/", main_module.UrlCacheEntry(verdict="OK", signature="1", etag="x"))
+    monkeypatch.setattr(main_module, "url_cache", cache)
+
+    main_module._signature_changed("2")
+
+    assert cache.stats()["size"] == 0
+
+
+def test_responses_carry_server_timing():
+    async def fake_scan(path):
+        return "OK"
+
+    fake = _make_fake_clamav(scan=fake_scan)
+    _override_clamav(fake)
+
+    response = client.post("/scanpath/somefile.txt")
+
+    assert response.status_code == 200
+    assert "total;dur=" in response.headers["Server-Timing"]
+
+
+def test_admin_profile_requires_authentication(monkeypatch):
+    monkeypatch.setattr(main_module.conf, "USE_AUTHENTICATION", False)
+
+    response = client.get("/admin/profile?seconds=0.01")
+
+    assert response.status_code == 403
+
+
+def test_admin_loop_stalls_requires_authentication(monkeypatch):
+    monkeypatch.setattr(main_module.conf, "USE_AUTHENTICATION", False)
+
+    response = client.get("/admin/loop/stalls")
+
+    assert response.status_code == 403
+
+
+def test_admin_profile_uses_addon_is_admin(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    addon_dir = tmp_path / "addon"
+    addon_dir.mkdir()
+    (addon_dir / "authentication.py").write_text(
+        "def authenticate(token):\n"
+        "    return True\n"
+        "\n"
+        "def is_admin(token):\n"
+        "    return token == 'admin-token'\n"
+    )
+    monkeypatch.setattr(main_module.conf, "USE_AUTHENTICATION", True)
+
+    denied = client.get(
+        "/admin/profile?seconds=0.01", headers={"Authorization": "Bearer user-token"})
+    allowed = client.get(
+        "/admin/profile?seconds=0.01&interval=0.001", headers={"Authorization": "Bearer admin-token"})
+
+    assert denied.status_code == 403
+    assert allowed.status_code == 200
+    assert allowed.headers["Content-Disposition"].endswith('.collapsed"')
+
+
+def test_admin_profile_rejects_unknown_format(tmp_path, monkeypatch):
+    monkeypatch.setattr(main_module.conf, "USE_AUTHENTICATION", True)
+    monkeypatch.setattr(main_module, "_load_authentication_module",
+                        lambda: type("Addon", (), {"is_admin": staticmethod(lambda token: True)}))
+
+    response = client.get(
+        "/admin/profile?seconds=0.01&format=svg", headers={"Authorization": "Bearer t"})
+
+    assert response.status_code == 400
+
+
+def test_rate_limited_requests_get_429(monkeypatch):
+    limiter = main_module.RateLimiter(
+        type("Conf", (), {"RATE_LIMIT_FILE": "", "RATE_LIMIT_MAX_KEYS": 10}), main_module.logger)
+    limiter.configure({"default": {"rate": 0.5, "burst": 1}})
+    monkeypatch.setattr(main_module, "limiter", limiter)
+
+    async def fake_scan(path):
+        return "OK"
+
+    _override_clamav(_make_fake_clamav(scan=fake_scan))
+
+    first = client.post("/scanpath/somefile.txt")
+    second = client.post("/scanpath/somefile.txt")
+    health_metrics = client.get("/metrics")
+
+    assert first.status_code == 200
+    assert second.status_code == 429
+    assert second.headers["Retry-After"] == "2"
+    assert health_metrics.status_code == 200
+
+
+def test_websocket_scan_channel(monkeypatch):
+    from src.wsscan import encode_frame
+
+    monkeypatch.setattr(main_module.conf, "USE_AUTHENTICATION", False)
+
+    async def fake_instream(chunks):
+        data = b"".join([chunk async for chunk in chunks])
+        return "stream: Eicar FOUND" if b"EICAR" in data else "stream: OK"
+
+    _override_clamav(_make_fake_clamav(instream=fake_instream))
+
+    with client.websocket_connect("/ws/scan") as websocket:
+        websocket.send_bytes(encode_frame("clean", b"hello", end=True))
+        websocket.send_bytes(encode_frame("bad", b"EICAR", end=True))
+        verdicts = {}
+        for _ in range(2):
+            message = websocket.receive_json()
+            verdicts[message["id"]] = message
+
+    assert verdicts["clean"]["status_code"] == 200
+    assert verdicts["bad"] == {"id": "bad", "status_code": 406, "response": "stream: Eicar FOUND"}
+
+
+def test_websocket_scan_charges_a_token_per_file(monkeypatch):
+    from src.wsscan import encode_frame
+
+    limiter = main_module.RateLimiter(
+        type("Conf", (), {"RATE_LIMIT_FILE": "", "RATE_LIMIT_MAX_KEYS": 10}), main_module.logger)
+    limiter.configure({"default": {"rate": 0.1, "burst": 2}})
+    monkeypatch.setattr(main_module, "limiter", limiter)
+    monkeypatch.setattr(main_module.conf, "USE_AUTHENTICATION", False)
+
+    async def fake_instream(chunks):
+        return "stream: OK" if [chunk async for chunk in chunks] else "stream: empty"
+
+    _override_clamav(_make_fake_clamav(instream=fake_instream))
+
+    with client.websocket_connect("/ws/scan") as websocket:
+        websocket.send_bytes(encode_frame("one", b"hello", end=True))
+        first = websocket.receive_json()
+        websocket.send_bytes(encode_frame("two", b"hello", end=True))
+        second = websocket.receive_json()
+
+    assert first["status_code"] == 200
+    assert second["status_code"] == 429
+    assert limiter.usage["ip:testclient"].active == 0
+
+
+def test_websocket_scan_requires_token_with_authentication(monkeypatch):
+    from starlette.websockets import WebSocketDisconnect
+
+    monkeypatch.setattr(main_module.conf, "USE_AUTHENTICATION", True)
+
+    with pytest.raises(WebSocketDisconnect):
+        with client.websocket_connect("/ws/scan") as websocket:
+            websocket.receive_json()
+
+
+def test_scan_url_uses_ranged_download_when_supported(monkeypatch):
+    received = []
+    calls = []
+    _override_clamav(_make_fake_clamav(instream=_collecting_instream(received)))
+    monkeypatch.setattr(aiohttp, "ClientSession", _fake_client_session(
+        data=b"0123456789",
+        headers={"Accept-Ranges": "bytes", "Content-Length": "10", "ETag": '"v1"'}))
+    monkeypatch.setattr(main_module.conf, "RANGE_MIN_SIZE", 5)
+
+    async def fake_ranged(session, url, resp, total, part_size, parallel, chunk_size):
+        calls.append((url, total))
+        yield b"01234"
+        yield b"56789"
+
+    monkeypatch.setattr(main_module, "ranged_chunks", fake_ranged)
+
+    response = client.get("/scanurl/?url=https://example.com/big.iso")
+
+    assert response.status_code == 200
+    assert calls == [("https://example.com/big.iso", 10)]
+    assert received == [b"0123456789"]
+
+
+def test_scan_url_ranged_download_failure(monkeypatch):
+    _override_clamav(_make_fake_clamav(instream=_collecting_instream([])))
+    monkeypatch.setattr(aiohttp, "ClientSession", _fake_client_session(
+        headers={"Accept-Ranges": "bytes", "Content-Length": "12", "ETag": '"v1"'}))
+    monkeypatch.setattr(main_module.conf, "RANGE_MIN_SIZE", 5)
+
+    async def failing_ranged(*args):
+        raise main_module.RangeError("changed")
+        yield b""  # pylint: disable=unreachable
+
+    monkeypatch.setattr(main_module, "ranged_chunks", failing_ranged)
+
+    response = client.get("/scanurl/?url=https://example.com/changing.iso")
+
+    assert response.status_code == 502
+
+
+def test_scan_urls_streams_per_url_results(monkeypatch):
+    bodies = {"https://a.example/ok": b"clean", "https://a.example/bad": b"eicar"}
+
+    async def fake_instream(data):
+        payload = b"".join([chunk async for chunk in data])
+        return "Eicar FOUND" if payload == b"eicar" else "OK"
+
+    class FakeResp:
+        def __init__(self, url):
+            self.status = 200 if url in bodies else 404
+            self.headers = {}
+            self.content = self
+            self.data = bodies.get(url, b"")
+
+        async def iter_chunked(self, size):
+            yield self.data
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *args):
+            return None
+
+    class FakeSession:
+        def __init__(self, **kwargs):
+            self.kwargs = kwargs
+
+        def get(self, url, **kwargs):
+            if url.startswith("://"):
+                raise aiohttp.client_exceptions.InvalidURL(url)
+            if url.startswith("https://down"):
+                raise aiohttp.ClientConnectionError("refused")
+            return FakeResp(url)
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *args):
+            return None
+
+    _override_clamav(_make_fake_clamav(instream=fake_instream))
+    monkeypatch.setattr(aiohttp, "ClientSession", FakeSession)
+    monkeypatch.setattr(aiohttp, "TCPConnector", lambda **kwargs: kwargs)
+    urls = ["https://a.example/ok", "https://a.example/bad", "https://a.example/missing",
+            "://not-a-url", "https://down.example/x"]
+
+    response = client.post("/scanurls", json={"urls": urls})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    by_index = {line["index"]: line for line in lines}
+    assert len(lines) == 5
+    assert by_index[0] == {"status_code": 200, "response": "OK", "index": 0, "url": urls[0]}
+    assert by_index[1]["status_code"] == 406
+    assert by_index[1]["response"] == "Eicar FOUND"
+    assert by_index[2]["status_code"] == 404
+    assert by_index[3] == {
+        "status_code": 406, "response": "Invalid URL", "index": 3, "url": urls[3]}
+    assert by_index[4]["status_code"] == 502
+
+
+def test_scan_urls_rejects_too_many_urls(monkeypatch):
+    _override_clamav(_make_fake_clamav())
+    monkeypatch.setattr(main_module.conf, "BULK_URL_MAX", 1)
+
+    response = client.post("/scanurls", json={"urls": ["https://a", "https://b"]})
+
+    assert response.status_code == 400
+    assert "At most 1" in response.json()["response"]
+
+
+def test_scan_urls_charges_a_token_per_url(monkeypatch):
+    limiter = main_module.RateLimiter(
+        type("Conf", (), {"RATE_LIMIT_FILE": "", "RATE_LIMIT_MAX_KEYS": 10}), main_module.logger)
+    limiter.configure({"default": {"rate": 0.1, "burst": 2, "concurrency": 1}})
+    monkeypatch.setattr(main_module, "limiter", limiter)
+    active = []
+
+    async def fake_bulk(urls, clamav):
+        for index, url in enumerate(urls):
+            active.append(limiter.usage["ip:testclient"].active)
+            yield json.dumps({"index": index, "url": url}) + "\n"
+
+    monkeypatch.setattr(main_module, "_bulk_scan_urls", fake_bulk)
+    _override_clamav(_make_fake_clamav())
+
+    first = client.post("/scanurls", json={"urls": ["https://a", "https://b"]})
+    second = client.post("/scanurls", json={"urls": ["https://c"]})
+
+    assert first.status_code == 200
+    assert len(first.text.splitlines()) == 2
+    # The concurrency slot is held while the body streams and released afterwards
+    assert active == [1, 1]
+    assert limiter.usage["ip:testclient"].active == 0
+    assert second.status_code == 429
+
+
+def test_scan_urls_rejects_more_urls_than_the_client_has_tokens(monkeypatch):
+    limiter = main_module.RateLimiter(
+        type("Conf", (), {"RATE_LIMIT_FILE": "", "RATE_LIMIT_MAX_KEYS": 10}), main_module.logger)
+    limiter.configure({"default": {"rate": 0.1, "burst": 2}})
+    monkeypatch.setattr(main_module, "limiter", limiter)
+    _override_clamav(_make_fake_clamav())
+
+    response = client.post("/scanurls", json={"urls": ["https://a", "https://b", "https://c"]})
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "10"
+
+
+def test_unverified_bearer_tokens_share_the_client_address_bucket(monkeypatch):
+    limiter = main_module.RateLimiter(
+        type("Conf", (), {"RATE_LIMIT_FILE": "", "RATE_LIMIT_MAX_KEYS": 10}), main_module.logger)
+    limiter.configure({"default": {"rate": 0.5, "burst": 1}})
+    monkeypatch.setattr(main_module, "limiter", limiter)
+    monkeypatch.setattr(main_module.conf, "USE_AUTHENTICATION", False)
+
+    async def fake_scan(path):
+        return "OK"
+
+    _override_clamav(_make_fake_clamav(scan=fake_scan))
+
+    first = client.post("/scanpath/somefile.txt", headers={"Authorization": "Bearer one"})
+    second = client.post("/scanpath/somefile.txt", headers={"Authorization": "Bearer two"})
+
+    assert first.status_code == 200
+    assert second.status_code == 429
+
+
+def test_expired_scan_deadline_returns_504():
+    async def fake_instream(data):
+        raise AssertionError("expired work must not reach clamd")
+
+    _override_clamav(_make_fake_clamav(instream=fake_instream))
+
+    response = client.post(
+        "/scanfile",
+        files={"file": ("a.txt", b"data")},
+        headers={"X-Scan-Deadline": "1"},
+    )
+
+    assert response.status_code == 504
+    assert response.json()["response"] == "Scan deadline exceeded"
+
+
+def test_scan_file_fans_out_archive_members(monkeypatch, tmp_path):
+    import io
+    import zipfile
+    from types import SimpleNamespace
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("docs/readme.txt", b"clean")
+        archive.writestr("bin/tool.exe", b"EICAR")
+
+    async def fake_instream(data):
+        payload = b"".join([chunk async for chunk in data])
+        return "stream: Eicar FOUND" if payload == b"EICAR" else "stream: OK"
+
+    conf = SimpleNamespace(
+        ARCHIVE_MAX_DEPTH=2, ARCHIVE_MAX_MEMBERS=100, ARCHIVE_MAX_EXPANDED=1 << 20,
+        ARCHIVE_MIN_SIZE=0, ARCHIVE_WORKERS=1, ARCHIVE_PARALLEL=2, ARCHIVE_TMP_DIR=str(tmp_path),
+        STREAM_CHUNK_SIZE=65536)
+    scanner = main_module.ArchiveScanner(conf, main_module.logger)
+    monkeypatch.setattr(main_module, "archive_scanner", scanner)
+    _override_clamav(_make_fake_clamav(instream=fake_instream))
+
+    try:
+        response = client.post("/scanfile", files={"file": ("dist.zip", buffer.getvalue())})
+    finally:
+        scanner.stop()
+
+    assert response.status_code == 406
+    assert response.json()["response"] == "dist.zip/bin/tool.exe: Eicar FOUND"
+
+
+def test_scan_file_does_not_cache_archives_with_failed_members(monkeypatch, tmp_path):
+    import io
+    import zipfile
+    from types import SimpleNamespace
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("docs/readme.txt", b"clean")
+        archive.writestr("data/huge.bin", b"HUGE")
+
+    async def fake_instream(data):
+        payload = b"".join([chunk async for chunk in data])
+        return "stream: Can't allocate memory ERROR" if payload == b"HUGE" else "stream: OK"
+
+    conf = SimpleNamespace(
+        ARCHIVE_MAX_DEPTH=2, ARCHIVE_MAX_MEMBERS=100, ARCHIVE_MAX_EXPANDED=1 << 20,
+        ARCHIVE_MIN_SIZE=0, ARCHIVE_WORKERS=1, ARCHIVE_PARALLEL=2, ARCHIVE_TMP_DIR=str(tmp_path),
+        STREAM_CHUNK_SIZE=65536)
+    scanner = main_module.ArchiveScanner(conf, main_module.logger)
+    store = FakeVerdictStore()
+    monkeypatch.setattr(main_module, "archive_scanner", scanner)
+    monkeypatch.setattr(main_module, "verdict_store", store)
+    _override_clamav(_make_fake_clamav(instream=fake_instream))
+
+    try:
+        response = client.post("/scanfile", files={"file": ("dist.zip", buffer.getvalue())})
+    finally:
+        scanner.stop()
+
+    assert response.json()["response"] == "dist.zip/data/huge.bin: Can't allocate memory ERROR"
+    assert store.verdicts == {}
+
+
+class FakeUploadPool:
+    """Scanner pool stand-in letting the app start up for resumable upload tests."""
+
+    async def connecting(self):
+        pass
+
+    def pool_stats(self):
+        return {}
+
+    def add_listener(self, listener):
+        pass
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+
+def test_resumable_upload_is_scanned_as_chunks_arrive(monkeypatch, tmp_path):
+    from types import SimpleNamespace
+
+    received = []
+
+    async def fake_instream(chunks):
+        async for chunk in chunks:
+            received.append(chunk)
+        return "stream: Eicar FOUND" if b"".join(received) == b"EICAR-test" else "stream: OK"
+
+    conf = SimpleNamespace(
+        UPLOAD_DIR=str(tmp_path), UPLOAD_RESUMABLE_MAX_SIZE=100, UPLOAD_SESSION_TTL=3600,
+        UPLOAD_MAX_SESSIONS=10, UPLOAD_STALL_TIMEOUT=5, CLAMD_CONN="net",
+        CLAMD_STREAM_MAX_LENGTH=1 << 30,
+        STREAM_CHUNK_SIZE=65536, SCHED_INTERACTIVE_MAX_SIZE=1 << 20)
+    monkeypatch.setattr(main_module.ClamInstance, "_instance", FakeUploadPool())
+    monkeypatch.setattr(main_module, "uploads", main_module.UploadManager(conf, main_module.logger))
+    _override_clamav(_make_fake_clamav(instream=fake_instream))
+
+    with TestClient(app) as upload_client:
+        assert upload_client.post("/uploads").status_code == 400
+        assert upload_client.post("/uploads", headers={"Upload-Length": "101"}).status_code == 413
+        created = upload_client.post("/uploads", headers={"Upload-Length": "10"})
+        assert created.status_code == 201
+        location = created.headers["Location"]
+        assert created.json() == {"id": location.rsplit("/", 1)[1], "offset": 0, "length": 10}
+
+        patched = upload_client.patch(location, content=b"EICAR", headers={"Upload-Offset": "0"})
+        assert patched.status_code == 204
+        assert patched.headers["Upload-Offset"] == "5"
+        conflict = upload_client.patch(location, content=b"-test", headers={"Upload-Offset": "0"})
+        assert conflict.status_code == 409
+        assert upload_client.head(location).headers["Upload-Offset"] == "5"
+        assert upload_client.post(f"{location}/finalize").status_code == 409
+
+        upload_client.patch(location, content=b"-test", headers={"Upload-Offset": "5"})
+        response = upload_client.post(f"{location}/finalize")
+        assert upload_client.head(location).status_code == 404
+
+    assert response.status_code == 406
+    assert response.json()["response"] == "stream: Eicar FOUND"
+    assert received == [b"EICAR", b"-test"]
+
+
+def test_resumable_upload_is_not_capped_at_the_decompression_limit(monkeypatch, tmp_path):
+    from types import SimpleNamespace
+
+    async def fake_instream(chunks):
+        return f"stream: OK {len(b''.join([chunk async for chunk in chunks]))}"
+
+    conf = SimpleNamespace(
+        UPLOAD_DIR=str(tmp_path), UPLOAD_RESUMABLE_MAX_SIZE=1000, UPLOAD_SESSION_TTL=3600,
+        UPLOAD_MAX_SESSIONS=10, UPLOAD_STALL_TIMEOUT=5, CLAMD_CONN="net",
+        CLAMD_STREAM_MAX_LENGTH=1000,
+        STREAM_CHUNK_SIZE=65536, SCHED_INTERACTIVE_MAX_SIZE=1 << 20)
+    monkeypatch.setattr(main_module.conf, "DECOMPRESS_MAX_SIZE", 10)
+    monkeypatch.setattr(main_module.ClamInstance, "_instance", FakeUploadPool())
+    monkeypatch.setattr(main_module, "uploads", main_module.UploadManager(conf, main_module.logger))
+    _override_clamav(_make_fake_clamav(instream=fake_instream))
+
+    with TestClient(app) as upload_client:
+        location = upload_client.post("/uploads", headers={"Upload-Length": "500"}).headers["Location"]
+        patched = upload_client.patch(location, content=b"x" * 500, headers={"Upload-Offset": "0"})
+        response = upload_client.post(f"{location}/finalize")
+
+    assert patched.status_code == 204
+    assert response.status_code == 200
+    assert response.json()["response"] == "stream: OK 500"
@@ -0,0 +1,19 @@
+"""Tests for src/metrics.py"""
+from src.metrics import Metrics
+
+
+def test_snapshot_collects_registered_providers():
+    metrics = Metrics()
+    metrics.register("one", lambda: {"value": 1})
+    metrics.register("two", lambda: {"value": 2})
+
+    assert metrics.snapshot() == {"one": {"value": 1}, "two": {"value": 2}}
+
+
+def test_unregister_removes_provider():
+    metrics = Metrics()
+    metrics.register("one", lambda: {"value": 1})
+    metrics.unregister("one")
+    metrics.unregister("missing")
+
+    assert metrics.snapshot() == {}
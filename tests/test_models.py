@@ -4,6 +4,8 @@ import pytest
 from pydantic import ValidationError
 
 from src.models import (
+    BulkUrlRequest,
+    BulkUrlResult,
     ExceptionResponse,
     Health,
     HealthResponse,
@@ -81,3 +83,11 @@ def test_validation_error_when_required_fields_missing():
 
     with pytest.raises(ValidationError):
         ExceptionResponse(response="Error scanning")
+
+
+def test_bulk_url_result_dump():
+    model = BulkUrlResult(status_code=404, response="not found", index=2, url="https://x")
+
+    assert model.model_dump() == {
+        "status_code": 404, "response": "not found", "index": 2, "url": "https://x"}
+    assert BulkUrlRequest(urls=["https://x"]).urls == ["https://x"]
@@ -0,0 +1,97 @@
+"""Tests for src/profiler.py"""
+import asyncio
+import logging
+import marshal
+import sys
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+import pytest
+
+from src.profiler import Profiler, ProfilerBusyError, collapse_stack, render_collapsed
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def profiler():
+    conf = SimpleNamespace(
+        PROFILE_CONTINUOUS=False,
+        PROFILE_CONTINUOUS_INTERVAL=0.001,
+        PROFILE_WINDOW=0.05,
+        PROFILE_RETENTION=1,
+    )
+    return Profiler(conf, logging.getLogger("test"))
+
+
+def test_collapse_stack_is_outermost_first():
+    def inner():
+        return collapse_stack(sys._getframe(), "root")
+
+    stack = inner().split(";")
+
+    assert stack[0] == "root"
+    assert stack[-1].startswith("inner (")
+    assert stack[-2].startswith("test_collapse_stack_is_outermost_first (")
+
+
+def test_render_collapsed_orders_by_count():
+    assert render_collapsed(Counter({"a;b": 1, "a;c": 3})) == "a;c 3\na;b 1\n"
+
+
+def _burn(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+@pytest.mark.anyio
+async def test_sample_attributes_stacks_to_running_task(profiler):
+    async def busy():
+        for _ in range(10):
+            _burn(0.01)
+            await asyncio.sleep(0)
+
+    work = asyncio.create_task(busy(), name="busy-task")
+    output = await profiler.sample(0.2, 0.001)
+    await work
+
+    lines = output.splitlines()
+    assert lines
+    assert any(line.startswith("task:busy-task;") and "_burn" in line for line in lines)
+
+
+@pytest.mark.anyio
+async def test_cprofile_returns_pstats_data(profiler):
+    data = await profiler.cprofile(0.01)
+
+    stats = marshal.loads(data)
+    assert isinstance(stats, dict)
+
+
+@pytest.mark.anyio
+async def test_concurrent_profiles_are_rejected(profiler):
+    first = asyncio.create_task(profiler.sample(0.05, 0.01))
+    await asyncio.sleep(0)
+
+    with pytest.raises(ProfilerBusyError):
+        await profiler.cprofile(0.01)
+    await first
+
+
+@pytest.mark.anyio
+async def test_continuous_sampling_keeps_recent_windows(profiler):
+    profiler.conf.PROFILE_CONTINUOUS = True
+    await profiler.start()
+    for _ in range(15):
+        _burn(0.01)
+        await asyncio.sleep(0.001)
+    await profiler.stop()
+
+    assert profiler.stats()["windows"] >= 1
+    assert profiler.recent(60)
+    assert profiler.recent(0) == ""
@@ -0,0 +1,114 @@
+"""Tests for src/ranged.py"""
+import asyncio
+import random
+
+import pytest
+
+from src.ranged import RangeError, range_validator, ranged_chunks, supports_ranges
+
+BODY = bytes(random.Random(7).getrandbits(8) for _ in range(1000))
+HEADERS = {"Accept-Ranges": "bytes", "Content-Length": "1000", "ETag": '"v1"'}
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+class FakeContent:
+    def __init__(self, data):
+        self.data = data
+
+    async def iter_chunked(self, size):
+        for offset in range(0, len(self.data), size):
+            yield self.data[offset:offset + size]
+
+
+class FakeResponse:
+    def __init__(self, status, data, headers=None):
+        self.status = status
+        self.data = data
+        self.headers = headers or {}
+        self.content = FakeContent(data)
+        self.closed = False
+
+    async def read(self):
+        return self.data
+
+    def close(self):
+        self.closed = True
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return None
+
+
+class FakeSession:
+    """ Serves ranges of BODY with random delays, tracking concurrency """
+
+    def __init__(self, status=206):
+        self.status = status
+        self.requests = []
+        self.active = 0
+        self.peak = 0
+
+    def get(self, url, headers):
+        self.requests.append(headers)
+        session = self
+
+        class Pending:
+            async def __aenter__(self):
+                session.active += 1
+                session.peak = max(session.peak, session.active)
+                await asyncio.sleep(random.random() / 100)
+                session.active -= 1
+                start, end = headers["Range"].removeprefix("bytes=").split("-")
+                return FakeResponse(session.status, BODY[int(start):int(end) + 1])
+
+            async def __aexit__(self, *args):
+                return None
+
+        return Pending()
+
+
+def test_supports_ranges():
+    assert supports_ranges(HEADERS, 100)
+    assert not supports_ranges(HEADERS, 2000)
+    assert not supports_ranges({**HEADERS, "Accept-Ranges": "none"}, 100)
+    assert not supports_ranges({**HEADERS, "Content-Encoding": "gzip"}, 100)
+    assert not supports_ranges({"Accept-Ranges": "bytes", "Content-Length": "1000"}, 100)
+
+
+def test_range_validator_skips_weak_etags():
+    assert range_validator({"ETag": 'W/"v1"', "Last-Modified": "Mon"}) == "Mon"
+    assert range_validator(HEADERS) == '"v1"'
+
+
+async def _collect(session, resp, parallel=3):
+    chunks = ranged_chunks(session, "http://x/obj", resp, 1000, 128, parallel, chunk_size=50)
+    return [chunk async for chunk in chunks]
+
+
+@pytest.mark.anyio
+async def test_parts_are_reassembled_in_order_with_bounded_window():
+    session = FakeSession()
+    resp = FakeResponse(200, BODY, HEADERS)
+
+    chunks = await _collect(session, resp)
+
+    assert b"".join(chunks) == BODY
+    assert max(len(chunk) for chunk in chunks) <= 50
+    assert resp.closed
+    assert len(session.requests) == 7
+    assert session.peak <= 3
+    assert all(request["If-Range"] == '"v1"' for request in session.requests)
+
+
+@pytest.mark.anyio
+async def test_changed_object_raises_range_error():
+    session = FakeSession(status=200)
+
+    with pytest.raises(RangeError):
+        await _collect(session, FakeResponse(200, BODY, HEADERS))
@@ -0,0 +1,96 @@
+"""Tests for src/ratelimit.py"""
+import json
+import logging
+from types import SimpleNamespace
+
+import pytest
+
+from src.ratelimit import RateLimiter, retry_after_header
+
+CONFIG = {
+    "default": {"rate": 1, "burst": 2},
+    "tenants": {
+        "webapp": {"rate": 100, "concurrency": 1, "tokens": ["web-token"], "ips": ["10.0.0.5"]},
+    },
+}
+
+
+@pytest.fixture
+def limiter(tmp_path):
+    path = tmp_path / "limits.json"
+    path.write_text(json.dumps(CONFIG))
+    conf = SimpleNamespace(RATE_LIMIT_FILE=str(path), RATE_LIMIT_MAX_KEYS=3)
+    return RateLimiter(conf, logging.getLogger("test"))
+
+
+def test_resolve_prefers_tenant_then_token_then_ip(limiter):
+    assert limiter.resolve("billing", "web-token", "1.2.3.4") == "billing"
+    assert limiter.resolve(None, "web-token", "1.2.3.4") == "webapp"
+    assert limiter.resolve(None, None, "10.0.0.5") == "webapp"
+    assert limiter.resolve(None, "other", "1.2.3.4").startswith("token:")
+    assert "other" not in limiter.resolve(None, "other", "1.2.3.4")
+    assert limiter.resolve(None, None, "1.2.3.4") == "ip:1.2.3.4"
+
+
+def test_unverified_tokens_fall_back_to_the_client_address(limiter):
+    assert limiter.resolve(None, "other", "1.2.3.4", verified=False) == "ip:1.2.3.4"
+    assert limiter.resolve(None, "web-token", "1.2.3.4", verified=False) == "webapp"
+
+
+def test_token_bucket_limits_rate(monkeypatch, limiter):
+    now = [1000.0]
+    monkeypatch.setattr("src.ratelimit.time.monotonic", lambda: now[0])
+
+    results = []
+    for _ in range(3):
+        allowed, retry_after, reason = limiter.acquire("ip:1.2.3.4")
+        limiter.release("ip:1.2.3.4")
+        results.append((allowed, round(retry_after, 2), reason))
+
+    assert results == [(True, 0.0, ""), (True, 0.0, ""), (False, 1.0, "rate")]
+
+    now[0] += 1.0
+    assert limiter.acquire("ip:1.2.3.4")[0]
+
+
+def test_charge_takes_a_token_per_item(monkeypatch, limiter):
+    now = [1000.0]
+    monkeypatch.setattr("src.ratelimit.time.monotonic", lambda: now[0])
+
+    assert limiter.acquire("ip:1.2.3.4")[0]
+    assert limiter.charge("ip:1.2.3.4", 1) == 0.0
+    assert limiter.charge("ip:1.2.3.4", 1) == 1.0
+
+    now[0] += 2.0
+    # More items than the burst are admitted from a full bucket, leaving it in debt
+    assert limiter.charge("ip:1.2.3.4", 5) == 0.0
+    assert limiter.acquire("ip:1.2.3.4") == (False, 4.0, "rate")
+
+
+def test_concurrency_quota(limiter):
+    assert limiter.acquire("webapp") == (True, 0.0, "")
+    assert limiter.acquire("webapp") == (False, 1.0, "concurrency")
+
+    limiter.release("webapp")
+
+    assert limiter.acquire("webapp")[0]
+    stats = limiter.stats()["tenants"]["webapp"]
+    assert stats["allowed"] == 2
+    assert stats["concurrency_limited"] == 1
+
+
+def test_anonymous_clients_are_bounded_and_aggregated(limiter):
+    limiter.acquire("webapp")
+    for number in range(5):
+        limiter.acquire(f"ip:10.1.0.{number}")
+        limiter.release(f"ip:10.1.0.{number}")
+
+    stats = limiter.stats()
+    assert len(limiter.usage) == 3
+    assert "webapp" in stats["tenants"]
+    assert stats["others"]["clients"] == 2
+
+
+def test_retry_after_header_rounds_up():
+    assert retry_after_header(0.2) == "1"
+    assert retry_after_header(2.1) == "3"
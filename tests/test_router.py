@@ -0,0 +1,409 @@
+"""Tests for src/router.py"""
+import asyncio
+import logging
+from types import SimpleNamespace
+
+import pytest
+
+from src.router import (
+    DOWN,
+    READY,
+    RELOADING,
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    Backend,
+    BackendConf,
+    CircuitBreaker,
+    CircuitOpenError,
+    ClamRouter,
+    PyvalveConnectionError,
+    Scheduler,
+    oldest_signature,
+    parse_backend_spec,
+    stats_state,
+)
+
+VALID_STATS = "POOLS: 1\n\nSTATE: VALID PRIMARY\nTHREADS: live 1\n"
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def conf():
+    return SimpleNamespace(
+        CLAMD_CONN="net",
+        CLAMD_HOST="127.0.0.1",
+        CLAMD_PORT=3310,
+        CLAMD_SOCKET="/tmp/clamd.sock",
+        SIGNATURE_VERSION_TTL=60,
+        RELOAD_CHECK_INTERVAL=60,
+        RELOAD_PROBE_TIMEOUT=0.05,
+        RELOAD_HOLD_TIMEOUT=1.0,
+        BREAKER_FAILURES=2,
+        BREAKER_RESET=60,
+        HEDGE_MAX_SIZE=0,
+        HEDGE_MIN_DELAY=0.01,
+        HEDGE_MIN_SAMPLES=3,
+    )
+
+
+class FakePool:
+    """Pool stub answering scans with its own name."""
+
+    def __init__(self, conf, name):
+        self.conf = conf
+        self.name = name
+
+    def set_logger(self, logger):
+        pass
+
+    async def scan(self, path):
+        if self.name == "broken":
+            raise PyvalveConnectionError("down")
+        return f"{self.name}: {path}: OK"
+
+    async def instream(self, chunks):
+        data = b"".join([chunk async for chunk in chunks])
+        if self.name == "slow":
+            await asyncio.sleep(1.0)
+        return f"{self.name}: {len(data)}: OK"
+
+    async def signature_version(self):
+        return "27100"
+
+    async def connecting(self):
+        if self.name == "broken":
+            raise PyvalveConnectionError("down")
+
+    def pool_stats(self):
+        return {"size": 1}
+
+    def probe_client(self):
+        return FakeProbe()
+
+
+class FakeProbe:
+    """Probe client stub with configurable replies."""
+
+    def __init__(self, stats=VALID_STATS, version="ClamAV 1.0.3/27100/Mon", delay=0.0, error=None):
+        self.reply_stats = stats
+        self.reply_version = version
+        self.delay = delay
+        self.error = error
+
+    def set_logger(self, logger):
+        pass
+
+    async def stats(self):
+        if self.error:
+            raise self.error
+        await asyncio.sleep(self.delay)
+        return self.reply_stats
+
+    async def version(self):
+        return self.reply_version
+
+
+def _router(conf, *names):
+    backends = [Backend(name, FakePool(conf, name), tier=tier) for tier, name in enumerate(names)]
+    router = ClamRouter(conf, backends)
+    router.set_logger(logging.getLogger("test"))
+    return router
+
+
+def test_parse_backend_spec():
+    assert parse_backend_spec("net:clamd2.local:3311") == {
+        "CLAMD_CONN": "net", "CLAMD_HOST": "clamd2.local", "CLAMD_PORT": 3311}
+    assert parse_backend_spec("socket:/tmp/clamd-2.socket") == {
+        "CLAMD_CONN": "socket", "CLAMD_SOCKET": "/tmp/clamd-2.socket"}
+    assert parse_backend_spec("libclamav:/var/lib/clamav") == {
+        "CLAMD_CONN": "libclamav", "LIBCLAMAV_DATABASE": "/var/lib/clamav"}
+    with pytest.raises(ValueError):
+        parse_backend_spec("net:nohost")
+
+
+def test_backend_conf_overrides_connection_settings(conf):
+    backend_conf = BackendConf(conf, CLAMD_PORT=3311)
+
+    assert backend_conf.CLAMD_PORT == 3311
+    assert backend_conf.CLAMD_HOST == "127.0.0.1"
+
+
+def test_stats_state():
+    assert stats_state(VALID_STATS) == READY
+    assert stats_state("POOLS: 1\n\nSTATE: INVALID PRIMARY\n") == RELOADING
+    assert stats_state("") == RELOADING
+
+
+@pytest.mark.anyio
+async def test_routes_to_primary_then_standby_while_primary_reloads(conf):
+    router = _router(conf, "primary", "standby")
+
+    assert await router.scan("/f") == "primary: /f: OK"
+
+    router.backends[0].state = RELOADING
+    router.update()
+
+    assert await router.scan("/f") == "standby: /f: OK"
+    assert router.pool_stats()["active"] == "standby"
+
+
+@pytest.mark.anyio
+async def test_holds_scans_until_a_backend_is_ready(conf):
+    router = _router(conf, "primary")
+    router.backends[0].state = RELOADING
+
+    pending = asyncio.ensure_future(router.scan("/f"))
+    await asyncio.sleep(0.01)
+    assert not pending.done()
+
+    router.backends[0].state = READY
+    router.update()
+
+    assert await pending == "primary: /f: OK"
+    assert router.held == 1
+
+
+@pytest.mark.anyio
+async def test_hold_timeout_falls_back_to_reloading_backend(conf):
+    conf.RELOAD_HOLD_TIMEOUT = 0.01
+    router = _router(conf, "primary")
+    router.backends[0].state = RELOADING
+
+    assert await router.scan("/f") == "primary: /f: OK"
+
+
+@pytest.mark.anyio
+async def test_all_backends_down_raises(conf):
+    conf.RELOAD_HOLD_TIMEOUT = 0.01
+    router = _router(conf, "primary")
+    router.backends[0].state = DOWN
+
+    with pytest.raises(PyvalveConnectionError):
+        await router.scan("/f")
+
+
+@pytest.mark.anyio
+async def test_probe_detects_reload_by_state_and_timeout(conf):
+    router = _router(conf, "primary", "standby")
+    router.backends[0].probe_client = FakeProbe(stats="POOLS: 1\n\nSTATE: INVALID PRIMARY\n")
+    router.backends[1].probe_client = FakeProbe(delay=1.0)
+
+    await router.check()
+
+    assert router.backends[0].state == RELOADING
+    assert router.backends[1].state == RELOADING
+
+
+@pytest.mark.anyio
+async def test_probe_marks_unreachable_backend_down(conf):
+    router = _router(conf, "primary")
+    router.backends[0].probe_client = FakeProbe(error=PyvalveConnectionError("refused"))
+
+    await router.check()
+
+    assert router.backends[0].state == DOWN
+
+
+@pytest.mark.anyio
+async def test_clamd_stats_are_cached_and_refreshed_once(conf):
+    router = _router(conf, "primary", "standby")
+    stats = "POOLS: 1\n\nSTATE: VALID PRIMARY\nTHREADS: live 2  idle 1 max 10 idle-timeout 30\n"
+    for backend in router.backends:
+        backend.probe_client = FakeProbe(stats=stats, delay=0.01)
+    router.backends[1].probe_client.error = PyvalveConnectionError("refused")
+    calls = []
+    original = router.check
+
+    async def check():
+        calls.append(1)
+        await original()
+
+    router.check = check
+
+    first, second = await asyncio.gather(router.clamd_stats(60), router.clamd_stats(60))
+
+    assert first == second
+    assert first["primary"]["gauges"]["threads_busy"] == 1
+    assert first["standby"] == {"state": DOWN, "age": None, "stats": None, "gauges": None}
+    assert router.stats_gauges() == {"primary": first["primary"]["gauges"]}
+    # A failed probe counts as fresh too, so a down standby does not force probes
+    await router.clamd_stats(60)
+    assert len(calls) == 1
+
+
+@pytest.mark.anyio
+async def test_signature_change_notifies_listeners(conf):
+    router = _router(conf, "primary")
+    seen = []
+    router.add_listener(seen.append)
+    probe = FakeProbe()
+    router.backends[0].probe_client = probe
+
+    await router.check()
+    probe.reply_version = "ClamAV 1.0.3/27101/Tue"
+    await router.check()
+    await router.check()
+
+    assert seen == ["27100", "27101"]
+    assert await router.signature_version() == "27101"
+
+
+@pytest.mark.anyio
+async def test_staggered_fleet_reload_keys_verdicts_on_the_oldest_signature(conf):
+    backends = [Backend(f"clamd-{index}", FakePool(conf, f"clamd-{index}")) for index in range(2)]
+    router = ClamRouter(conf, backends)
+    router.set_logger(logging.getLogger("test"))
+    seen = []
+    router.add_listener(seen.append)
+    first, second = FakeProbe(), FakeProbe()
+    backends[0].probe_client, backends[1].probe_client = first, second
+    await router.check()
+
+    first.reply_version = "ClamAV 1.0.3/27101/Tue"
+    await router.check()
+    # The other instance still scans with 27100, so verdicts stay keyed on it
+    assert await router.signature_version() == "27100"
+    second.error = PyvalveConnectionError("restarting")
+    await router.check()
+    assert await router.signature_version() == "27101"
+    second.error = None
+    await router.check()
+    assert await router.signature_version() == "27100"
+    second.reply_version = "ClamAV 1.0.3/27101/Tue"
+    await router.check()
+
+    assert seen == ["27100", "27101", "27100", "27101"]
+    assert await router.signature_version() == "27101"
+
+
+def test_oldest_signature():
+    assert oldest_signature(["27101", "27100", "27102"]) == "27100"
+    assert oldest_signature(["custom", "custom"]) == "custom"
+    assert oldest_signature(["custom", "27100"]) is None
+    assert oldest_signature([]) is None
+
+
+@pytest.mark.anyio
+async def test_connecting_marks_failed_backends_down(conf):
+    router = _router(conf, "primary", "broken")
+
+    await router.connecting()
+
+    assert router.backends[1].state == DOWN
+
+    router = _router(conf, "broken")
+    with pytest.raises(PyvalveConnectionError):
+        await router.connecting()
+
+
+def test_circuit_breaker_opens_and_recovers(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("src.router.time.monotonic", lambda: now[0])
+    breaker = CircuitBreaker(failures=2, reset=30)
+
+    breaker.failure()
+    assert breaker.state == CLOSED
+    breaker.failure()
+    assert breaker.state == OPEN
+    assert not breaker.available()
+
+    now[0] += 30
+    assert breaker.available()
+    breaker.begin()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.available()
+
+    breaker.failure()
+    assert breaker.state == OPEN
+    assert breaker.trips == 2
+
+    now[0] += 30
+    breaker.begin()
+    breaker.success()
+    assert breaker.state == CLOSED
+    assert breaker.available()
+
+
+@pytest.mark.anyio
+async def test_open_breaker_routes_to_standby_then_fails_fast(conf):
+    router = _router(conf, "broken", "standby")
+
+    for _ in range(2):
+        with pytest.raises(PyvalveConnectionError):
+            await router.scan("/f")
+
+    assert router.backends[0].breaker.state == OPEN
+    assert await router.scan("/f") == "standby: /f: OK"
+
+    router.backends[1].breaker.state = OPEN
+    router.backends[1].breaker.opened = float("inf")
+    with pytest.raises(CircuitOpenError):
+        await router.scan("/f")
+
+
+async def _payload(*parts):
+    for part in parts:
+        yield part
+
+
+@pytest.mark.anyio
+async def test_payload_source_failures_do_not_trip_the_breaker(conf):
+    router = _router(conf, "primary")
+
+    async def failing():
+        yield b"abc"
+        raise ConnectionResetError("client went away")
+
+    for _ in range(3):
+        with pytest.raises(ConnectionResetError):
+            await router.instream(failing())
+
+    assert router.backends[0].breaker.state == CLOSED
+    assert router.backends[0].breaker.consecutive == 0
+    assert await router.instream(_payload(b"abc")) == "primary: 3: OK"
+
+
+@pytest.mark.anyio
+async def test_hedges_slow_small_instream_to_second_backend(conf):
+    conf.HEDGE_MAX_SIZE = 100
+    router = _router(conf, "slow", "standby")
+    router.latencies.extend([0.01] * 3)
+
+    result = await router.instream(_payload(b"abc", b"def"))
+
+    assert result == "standby: 6: OK"
+    assert router.hedges == 1
+    assert router.hedge_wins == 1
+
+
+@pytest.mark.anyio
+async def test_does_not_hedge_large_or_unsampled_instream(conf):
+    conf.HEDGE_MAX_SIZE = 4
+    router = _router(conf, "primary", "standby")
+    router.latencies.extend([0.01] * 3)
+
+    assert await router.instream(_payload(b"abc", b"def")) == "primary: 6: OK"
+
+    conf.HEDGE_MAX_SIZE = 100
+    router.latencies.clear()
+    assert router.hedge_delay() is None
+    assert await router.instream(_payload(b"abc")) == "primary: 3: OK"
+    assert router.hedges == 0
+
+
+@pytest.mark.anyio
+async def test_scheduler_admits_commands_by_priority(monkeypatch, conf):
+    router = _router(conf, "primary")
+    scheduler = Scheduler(SimpleNamespace(
+        SCHED_WEIGHTS="", SCHED_FAST_LANE_SIZE=0, SCHED_FAST_LANE_SLOTS=0), 1)
+    router.set_scheduler(scheduler)
+    monkeypatch.setattr("src.router.current_priority", lambda: ("bulk", None))
+
+    assert await router.scan("/f") == "primary: /f: OK"
+
+    assert scheduler.stats()["classes"]["bulk"]["dispatched"] == 1
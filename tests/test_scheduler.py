@@ -0,0 +1,155 @@
+"""Tests for src/scheduler.py"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from src.scheduler import (
+    BACKGROUND,
+    BULK,
+    INTERACTIVE,
+    DeadlineExceeded,
+    Scheduler,
+    classify,
+    current_priority,
+    deadline,
+    parse_deadline,
+    parse_weights,
+    priority,
+    remaining,
+)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+def _scheduler(capacity, slots=0, fast_size=0):
+    conf = SimpleNamespace(
+        SCHED_WEIGHTS="interactive=4,bulk=1,background=1",
+        SCHED_FAST_LANE_SIZE=fast_size,
+        SCHED_FAST_LANE_SLOTS=slots,
+    )
+    return Scheduler(conf, capacity)
+
+
+def test_parse_weights_ignores_unknown_classes():
+    assert parse_weights("interactive=3, bulk=0.5, nightly=9") == {
+        INTERACTIVE: 3.0, BULK: 0.5, BACKGROUND: 1.0}
+
+
+@pytest.mark.parametrize("header,path,size,expected", [
+    ("background", "/scanfile", 10, BACKGROUND),
+    ("urgent", "/contscan/data", None, BULK),
+    (None, "/scanpath/data", None, BULK),
+    (None, "/scanfile", 100, BULK),
+    (None, "/scanfile", 10, INTERACTIVE),
+    (None, "/scanurl/", None, INTERACTIVE),
+])
+def test_classify(header, path, size, expected):
+    assert classify(header, path, size, 50) == expected
+
+
+def test_priority_scope():
+    with priority(BULK, 12):
+        assert current_priority() == (BULK, 12)
+    assert current_priority() == (INTERACTIVE, None)
+
+
+async def _run(scheduler, cls, order, name, size=None, hold=0.0):
+    async with scheduler.slot(cls, size):
+        order.append(name)
+        await asyncio.sleep(hold)
+
+
+@pytest.mark.anyio
+async def test_weighted_fair_order_favours_interactive():
+    scheduler = _scheduler(1)
+    order = []
+    blocker = asyncio.create_task(_run(scheduler, BULK, order, "blocker", hold=0.01))
+    await asyncio.sleep(0)
+    tasks = [asyncio.create_task(_run(scheduler, BULK, order, f"b{i}")) for i in range(4)]
+    tasks += [asyncio.create_task(_run(scheduler, INTERACTIVE, order, f"i{i}")) for i in range(4)]
+    await asyncio.gather(blocker, *tasks)
+
+    served = order[1:]
+    assert served.index("i3") < served.index("b1")
+    assert set(served) == {f"b{i}" for i in range(4)} | {f"i{i}" for i in range(4)}
+    assert scheduler.active == 0
+
+
+@pytest.mark.anyio
+async def test_fast_lane_bypasses_queued_bulk_work():
+    scheduler = _scheduler(2, slots=1, fast_size=100)
+    order = []
+    big = asyncio.create_task(_run(scheduler, BULK, order, "big", size=10**6, hold=0.05))
+    await asyncio.sleep(0)
+    queued = asyncio.create_task(_run(scheduler, BULK, order, "queued", size=10**6))
+    await asyncio.sleep(0)
+    small = asyncio.create_task(_run(scheduler, INTERACTIVE, order, "small", size=10))
+    await asyncio.wait_for(small, 0.04)
+
+    assert order == ["big", "small"]
+    await asyncio.gather(big, queued)
+    assert scheduler.stats()["fast_lane_dispatched"] == 1
+
+
+@pytest.mark.anyio
+async def test_cancelled_waiter_leaves_the_queue():
+    scheduler = _scheduler(1)
+    order = []
+    blocker = asyncio.create_task(_run(scheduler, BULK, order, "blocker", hold=0.01))
+    await asyncio.sleep(0)
+    waiter = asyncio.create_task(_run(scheduler, BULK, order, "waiter"))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    await asyncio.gather(blocker, waiter, return_exceptions=True)
+
+    assert order == ["blocker"]
+    assert scheduler.stats()["classes"][BULK]["waiting"] == 0
+    assert scheduler.active == 0
+
+
+def test_parse_deadline():
+    assert parse_deadline("1760000000.5") == 1760000000.5
+    assert parse_deadline("Thu, 09 Oct 2025 08:53:20 GMT") == 1759999999 + 1
+    assert parse_deadline("soon") is None
+    assert parse_deadline(None) is None
+
+
+@pytest.mark.anyio
+async def test_expired_deadline_is_dropped_before_dispatch():
+    scheduler = _scheduler(1)
+
+    with deadline(time.time() - 1):
+        with pytest.raises(DeadlineExceeded):
+            async with scheduler.slot(BULK):
+                pass
+
+    assert scheduler.active == 0
+    assert scheduler.stats()["classes"][BULK]["expired"] == 1
+
+
+@pytest.mark.anyio
+async def test_queued_work_expires_and_leaves_the_queue():
+    scheduler = _scheduler(1)
+    release = asyncio.Event()
+
+    async def hold():
+        async with scheduler.slot(INTERACTIVE):
+            await release.wait()
+
+    holder = asyncio.ensure_future(hold())
+    await asyncio.sleep(0)
+    with deadline(time.time() + 0.02):
+        assert 0 < remaining() <= 0.02
+        with pytest.raises(DeadlineExceeded):
+            async with scheduler.slot(BULK):
+                pass
+
+    assert not scheduler.queues[BULK]
+    release.set()
+    await holder
+    assert scheduler.active == 0
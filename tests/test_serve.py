@@ -0,0 +1,65 @@
+"""Tests for src/serve.py"""
+import src.serve as serve_module
+
+
+def test_server_options_use_configured_workers(monkeypatch):
+    monkeypatch.setattr(serve_module.conf, "SCANCAN_WORKERS", 4)
+    monkeypatch.setattr(serve_module.conf, "SCANCAN_PORT", 9000)
+
+    options = serve_module.server_options()
+
+    assert options["workers"] == 4
+    assert options["port"] == 9000
+    assert options["loop"] in ("uvloop", "asyncio")
+    assert options["http"] in ("httptools", "h11")
+
+
+def test_server_options_prefer_uvloop_and_httptools(monkeypatch):
+    monkeypatch.setattr(serve_module.importlib.util, "find_spec", lambda name: object())
+
+    options = serve_module.server_options()
+
+    assert options["loop"] == "uvloop"
+    assert options["http"] == "httptools"
+
+
+def test_server_options_fall_back_without_accelerators(monkeypatch):
+    monkeypatch.setattr(serve_module.importlib.util, "find_spec", lambda name: None)
+    monkeypatch.setattr(serve_module.conf, "SCANCAN_WORKERS", 0)
+
+    options = serve_module.server_options()
+
+    assert options["loop"] == "asyncio"
+    assert options["http"] == "h11"
+    assert options["workers"] == 1
+
+
+def test_main_runs_uvicorn(monkeypatch):
+    calls = []
+    monkeypatch.setattr(serve_module.uvicorn, "run", lambda app, **kwargs: calls.append((app, kwargs)))
+
+    serve_module.main()
+
+    assert calls[0][0] == "main:app"
+
+
+def test_main_supervises_the_clamd_fleet_around_uvicorn(monkeypatch):
+    events = []
+
+    class FakeFleet:
+        def __init__(self, conf, logger):
+            events.append(("init", conf.CLAMD_FLEET_SIZE))
+
+        def start(self):
+            events.append("start")
+
+        def stop(self):
+            events.append("stop")
+
+    monkeypatch.setattr(serve_module.conf, "CLAMD_FLEET_SIZE", 3)
+    monkeypatch.setattr(serve_module, "ClamdFleet", FakeFleet)
+    monkeypatch.setattr(serve_module.uvicorn, "run", lambda app, **kwargs: events.append("run"))
+
+    serve_module.main()
+
+    assert events == [("init", 3), "start", "run", "stop"]
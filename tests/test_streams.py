@@ -0,0 +1,146 @@
+"""Tests for src/streams.py"""
+import gzip
+import zlib
+
+import pytest
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+from src.streams import (
+    StreamDecodeError,
+    StreamLimitError,
+    UnsupportedEncodingError,
+    decompress_stream,
+    is_supported_encoding,
+    limit_stream,
+    upload_chunks,
+)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+async def _source(data, size=7):
+    for offset in range(0, len(data), size):
+        yield data[offset:offset + size]
+
+
+async def _collect(stream):
+    return b"".join([chunk async for chunk in stream])
+
+
+PAYLOAD = b"ScanCan streaming payload " * 200
+
+
+@pytest.mark.anyio
+async def test_identity_passes_through():
+    assert await _collect(decompress_stream(_source(PAYLOAD), "identity", 10**6, 100)) == PAYLOAD
+
+
+@pytest.mark.anyio
+async def test_gzip_is_decoded_in_bounded_chunks():
+    stream = decompress_stream(_source(gzip.compress(PAYLOAD)), "gzip", 10**6, 1000, chunk_size=64)
+    chunks = [chunk async for chunk in stream]
+
+    assert b"".join(chunks) == PAYLOAD
+    assert max(len(chunk) for chunk in chunks) <= 64
+
+
+@pytest.mark.anyio
+async def test_concatenated_gzip_members():
+    data = gzip.compress(b"first ") + gzip.compress(b"second")
+
+    assert await _collect(decompress_stream(_source(data), "gzip", 10**6, 1000)) == b"first second"
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("wbits", [zlib.MAX_WBITS, -zlib.MAX_WBITS])
+async def test_deflate_with_and_without_zlib_wrapper(wbits):
+    compressor = zlib.compressobj(wbits=wbits)
+    data = compressor.compress(PAYLOAD) + compressor.flush()
+
+    assert await _collect(decompress_stream(_source(data), "deflate", 10**6, 1000)) == PAYLOAD
+
+
+@pytest.mark.anyio
+async def test_decompressed_size_limit():
+    with pytest.raises(StreamLimitError):
+        await _collect(decompress_stream(_source(gzip.compress(PAYLOAD)), "gzip", 100, 1000))
+
+
+@pytest.mark.anyio
+async def test_compression_ratio_limit():
+    bomb = gzip.compress(b"\0" * (4 * 1048576))
+
+    with pytest.raises(StreamLimitError) as exc:
+        await _collect(decompress_stream(_source(bomb, 1024), "gzip", 10**8, 10))
+
+    assert "ratio" in str(exc.value)
+
+
+@pytest.mark.skipif(zstandard is None, reason="zstandard is not installed")
+@pytest.mark.anyio
+async def test_zstd_frames_are_decoded_in_bounded_chunks():
+    compressor = zstandard.ZstdCompressor()
+    data = compressor.compress(PAYLOAD) + compressor.compress(b"second frame")
+
+    chunks = [chunk async for chunk in decompress_stream(_source(data, 3), "zstd", 10**6, 1000, 64)]
+
+    assert b"".join(chunks) == PAYLOAD + b"second frame"
+    assert max(len(chunk) for chunk in chunks) <= 64
+
+
+@pytest.mark.skipif(zstandard is None, reason="zstandard is not installed")
+@pytest.mark.anyio
+async def test_zstd_bomb_is_stopped_without_expanding_it():
+    # 512 MiB of zeros compresses to a few KB, a single input chunk
+    bomb = zstandard.ZstdCompressor().compress(b"\0" * (512 * 1048576))
+    sizes = []
+
+    with pytest.raises(StreamLimitError):
+        async for chunk in decompress_stream(_source(bomb, 65536), "zstd", 10**10, 100):
+            sizes.append(len(chunk))
+
+    assert max(sizes) <= 65536
+    assert sum(sizes) < 2 * 1048576
+
+
+@pytest.mark.anyio
+async def test_corrupt_stream():
+    with pytest.raises(StreamDecodeError):
+        await _collect(decompress_stream(_source(b"not gzip at all"), "gzip", 10**6, 100))
+
+
+@pytest.mark.anyio
+async def test_unsupported_encoding():
+    assert not is_supported_encoding("br")
+    assert is_supported_encoding("GZIP")
+
+    with pytest.raises(UnsupportedEncodingError):
+        await _collect(decompress_stream(_source(PAYLOAD), "br", 10**6, 100))
+
+
+@pytest.mark.anyio
+async def test_limit_stream():
+    assert await _collect(limit_stream(_source(b"12345"), 5)) == b"12345"
+
+    with pytest.raises(StreamLimitError):
+        await _collect(limit_stream(_source(b"123456"), 5))
+
+
+@pytest.mark.anyio
+async def test_upload_chunks():
+    class FakeUpload:
+        def __init__(self):
+            self.data = b"abcdefg"
+
+        async def read(self, size):
+            chunk, self.data = self.data[:size], self.data[size:]
+            return chunk
+
+    assert [chunk async for chunk in upload_chunks(FakeUpload(), 3)] == [b"abc", b"def", b"g"]
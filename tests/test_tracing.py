@@ -0,0 +1,116 @@
+"""Tests for src/tracing.py"""
+import asyncio
+import json
+import logging
+
+import pytest
+
+from src.tracing import Trace, Tracer, current_trace, record, span, timed_chunks
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+CONF = {
+    "SERVER_TIMING": True,
+    "TRACE_SAMPLE_RATE": 0.0,
+    "TRACE_FOLLOW_PARENT": False,
+    "TRACE_EXPORT_PATH": "",
+    "TRACE_FLUSH_INTERVAL": 60,
+    "TRACE_QUEUE_SIZE": 2,
+}
+
+
+def test_spans_are_noops_without_a_trace():
+    with span("clamd"):
+        pass
+    record("upload")
+
+    assert current_trace() is None
+
+
+def test_server_timing_lists_spans_and_total(conf):
+    tracer = Tracer(conf, logging.getLogger("test"))
+    trace, token = tracer.begin("POST /scanfile")
+
+    with span("hash"):
+        pass
+    record("upload")
+    tracer.end(trace, token, 200)
+
+    header = trace.server_timing()
+    assert header.startswith("hash;dur=")
+    assert ", upload;dur=" in header
+    assert header.split(", ")[-1].startswith("total;dur=")
+    assert current_trace() is None
+
+
+def test_disabled_tracer_does_not_trace(conf):
+    conf.SERVER_TIMING = False
+    tracer = Tracer(conf, logging.getLogger("test"))
+
+    assert tracer.begin("GET /health") == (None, None)
+
+
+def test_traceparent_is_continued():
+    trace = Trace("GET /scanurl/", False, "00-" + "a" * 32 + "-" + "b" * 16 + "-01")
+
+    assert trace.trace_id == "a" * 32
+    assert trace.parent_id == "b" * 16
+    assert not trace.sampled
+
+
+@pytest.mark.parametrize("follow_parent", [False, True])
+def test_traceparent_sampled_flag_needs_follow_parent(conf, follow_parent):
+    conf.TRACE_EXPORT_PATH = "traces.ndjson"
+    conf.TRACE_FOLLOW_PARENT = follow_parent
+    tracer = Tracer(conf, logging.getLogger("test"))
+
+    trace, token = tracer.begin("GET /scanurl/", "00-" + "a" * 32 + "-" + "b" * 16 + "-01")
+    tracer.end(trace, token, 200)
+
+    assert trace.sampled is follow_parent
+
+
+@pytest.mark.anyio
+async def test_timed_chunks_accumulates_waits(conf):
+    tracer = Tracer(conf, logging.getLogger("test"))
+    trace, token = tracer.begin("GET /scanurl/")
+
+    async def slow():
+        for part in (b"a", b"b"):
+            await asyncio.sleep(0.01)
+            yield part
+
+    assert [chunk async for chunk in timed_chunks(slow(), "download")] == [b"a", b"b"]
+    tracer.end(trace, token, 200)
+
+    download = [s for s in trace.spans if s.name == "download"]
+    assert len(download) == 1
+    assert download[0].duration >= 0.02
+    assert download[0].attributes == {"accumulated": True}
+
+
+@pytest.mark.anyio
+async def test_sampled_traces_are_exported_as_otlp_json(tmp_path, conf):
+    path = tmp_path / "traces.jsonl"
+    conf.TRACE_SAMPLE_RATE = 1.0
+    conf.TRACE_EXPORT_PATH = str(path)
+    tracer = Tracer(conf, logging.getLogger("test"))
+    for _ in range(3):
+        trace, token = tracer.begin("POST /scanfile")
+        with span("clamd", command="instream"):
+            pass
+        tracer.end(trace, token, 200)
+
+    await tracer.flush()
+
+    lines = path.read_text().splitlines()
+    assert len(lines) == 2
+    assert tracer.stats()["dropped"] == 1
+    spans = json.loads(lines[0])["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert [s["name"] for s in spans] == ["POST /scanfile", "clamd"]
+    assert spans[1]["parentSpanId"] == spans[0]["spanId"]
+    assert spans[1]["attributes"] == [{"key": "command", "value": {"stringValue": "instream"}}]
@@ -0,0 +1,171 @@
+"""Tests for src/uploads.py"""
+import asyncio
+import hashlib
+import logging
+import os
+import time
+
+import pytest
+
+from src.uploads import UploadError, UploadManager, UploadStalled, _expire_files
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+CONF = {
+    "UPLOAD_DIR": lambda tmp_path: str(tmp_path),
+    "UPLOAD_RESUMABLE_MAX_SIZE": 1 << 20,
+    "UPLOAD_SESSION_TTL": 3600,
+    "UPLOAD_MAX_SESSIONS": 10,
+    "UPLOAD_STALL_TIMEOUT": 5,
+    "CLAMD_CONN": "net",
+    "CLAMD_STREAM_MAX_LENGTH": 1 << 30,
+    "STREAM_CHUNK_SIZE": 4,
+    "SCHED_INTERACTIVE_MAX_SIZE": 1 << 20,
+}
+
+
+async def _body(*parts):
+    for part in parts:
+        yield part
+
+
+class RecordingScan:
+    """Scan callable recording the bytes clamd would have received, and when."""
+
+    def __init__(self):
+        self.payloads = []
+        self.received = []
+        self.calls = 0
+
+    async def __call__(self, chunks):
+        self.calls += 1
+        payload = b""
+        async for chunk in chunks:
+            payload += chunk
+            self.received.append(len(payload))
+        self.payloads.append(payload)
+        return "stream: Eicar FOUND" if b"EICAR" in payload else "stream: OK"
+
+
+@pytest.mark.anyio
+async def test_chunks_are_scanned_as_they_arrive(tmp_path, conf):
+    manager = UploadManager(conf, logging.getLogger("test"))
+    await manager.start()
+    scan = RecordingScan()
+    try:
+        session = await manager.create(12)
+        await manager.append(session.id, 0, _body(b"hello "), scan)
+        await asyncio.sleep(0.05)
+        # clamd has the first chunk before the second one is sent
+        assert scan.received[-1] == 6
+        await manager.append(session.id, 6, _body(b"wor", b"ld!"), scan)
+        digest, result = await manager.finalize(session.id, scan)
+        assert result == "stream: OK"
+        assert digest == hashlib.sha256(b"hello world!").hexdigest()
+        assert scan.payloads == [b"hello world!"]
+        assert scan.calls == 1
+        assert os.listdir(tmp_path) == []
+        assert manager.stats()["completed"] == 1
+    finally:
+        await manager.stop()
+
+
+def test_length_is_capped_at_clamd_stream_max_length(conf):
+    conf.UPLOAD_RESUMABLE_MAX_SIZE = 1 << 30
+    conf.CLAMD_STREAM_MAX_LENGTH = 1 << 20
+
+    assert UploadManager(conf, logging.getLogger("test")).max_length == 1 << 20
+    conf.CLAMD_CONN = "libclamav"
+    assert UploadManager(conf, logging.getLogger("test")).max_length == 1 << 30
+
+
+@pytest.mark.anyio
+async def test_offset_and_length_are_enforced(conf):
+    manager = UploadManager(conf, logging.getLogger("test"))
+    await manager.start()
+    scan = RecordingScan()
+    try:
+        with pytest.raises(UploadError) as err:
+            await manager.create(2 << 20)
+        assert err.value.status_code == 413
+        session = await manager.create(4)
+        await manager.append(session.id, 0, _body(b"ab"), scan)
+        with pytest.raises(UploadError) as err:
+            await manager.append(session.id, 0, _body(b"ab"), scan)
+        assert err.value.status_code == 409
+        with pytest.raises(UploadError) as err:
+            await manager.append(session.id, 2, _body(b"cde"), scan)
+        assert err.value.status_code == 413
+        with pytest.raises(UploadError) as err:
+            await manager.finalize(session.id, scan)
+        assert err.value.status_code == 409
+        with pytest.raises(UploadError) as err:
+            await manager.get("../../etc/passwd")
+        assert err.value.status_code == 404
+    finally:
+        await manager.stop()
+
+
+@pytest.mark.anyio
+async def test_stalled_scan_is_restarted_at_finalize(conf):
+    conf.UPLOAD_STALL_TIMEOUT = 0.05
+    manager = UploadManager(conf, logging.getLogger("test"))
+    await manager.start()
+    scan = RecordingScan()
+    try:
+        session = await manager.create(8)
+        await manager.append(session.id, 0, _body(b"X5O!"), scan)
+        with pytest.raises(UploadStalled):
+            await session.scan_task
+        await manager.append(session.id, 4, _body(b"EICAR"[:4]), scan)
+        _, result = await manager.finalize(session.id, scan)
+        assert result == "stream: OK"
+        assert scan.payloads == [b"X5O!EICA"]
+        assert manager.stats()["restarts"] == 1
+    finally:
+        await manager.stop()
+
+
+@pytest.mark.anyio
+async def test_another_worker_continues_from_disk(conf):
+    first = UploadManager(conf, logging.getLogger("test"))
+    second = UploadManager(conf, logging.getLogger("test"))
+    await first.start()
+    await second.start()
+    scan = RecordingScan()
+    try:
+        session = await first.create(10)
+        await first.append(session.id, 0, _body(b"EICAR"), scan)
+        resumed = await second.get(session.id)
+        assert resumed.offset == 5
+        await second.append(session.id, 5, _body(b"-test"), scan)
+        # The first worker notices its view is stale
+        assert (await first.get(session.id)).offset == 10
+        digest, result = await second.finalize(session.id, scan)
+        assert digest == hashlib.sha256(b"EICAR-test").hexdigest()
+        assert result == "stream: Eicar FOUND"
+        assert second.stats()["adopted"] == 1
+    finally:
+        await first.stop()
+        await second.stop()
+
+
+@pytest.mark.anyio
+async def test_idle_uploads_expire(tmp_path, conf):
+    conf.UPLOAD_SESSION_TTL = 60
+    manager = UploadManager(conf, logging.getLogger("test"))
+    await manager.start()
+    try:
+        session = await manager.create(4)
+        old = time.time() - 120
+        for name in os.listdir(tmp_path):
+            os.utime(tmp_path / name, (old, old))
+        assert _expire_files(str(tmp_path), 60) == 1
+        with pytest.raises(UploadError):
+            await manager.get(session.id)
+    finally:
+        await manager.stop()
@@ -0,0 +1,67 @@
+"""Tests for src/urlcache.py"""
+from src.urlcache import UrlCache, UrlCacheEntry
+
+
+def _entry(**kwargs):
+    values = {"verdict": "stream: OK", "signature": "27100", "etag": '"abc"'}
+    values.update(kwargs)
+    return UrlCacheEntry(**values)
+
+
+def test_conditional_headers():
+    entry = _entry(last_modified="Mon, 16 Oct 2026 10:00:00 GMT")
+
+    assert entry.conditional_headers() == {
+        "If-None-Match": '"abc"',
+        "If-Modified-Since": "Mon, 16 Oct 2026 10:00:00 GMT",
+    }
+
+
+def test_from_headers_requires_validators():
+    assert UrlCacheEntry.from_headers({"Content-Length": "5"}, "OK", "1") is None
+
+    entry = UrlCacheEntry.from_headers({"ETag": '"x"', "Content-Length": "5"}, "OK", "1")
+
+    assert entry.etag == '"x"'
+    assert entry.content_length == "5"
+
+
+def test_get_returns_entry_for_matching_signature():
+    cache = UrlCache(max_size=2, ttl=60)
+    entry = _entry()
+    cache.put("https://example.com/", entry)
+
+    assert cache.get("https://example.com/", "27100") is entry
+    assert cache.get("https://example.com/", "27101") is None
+    assert cache.get("https://example.com/", "27100") is None
+
+
+def test_get_expires_entries_after_ttl(monkeypatch):
+    cache = UrlCache(max_size=2, ttl=10)
+    cache.put("u", _entry(stored=0.0))
+    monkeypatch.setattr("src.urlcache.time.monotonic", lambda: 11.0)
+
+    assert cache.get("u", "27100") is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_put_evicts_least_recently_used():
+    cache = UrlCache(max_size=2, ttl=60)
+    cache.put("a", _entry())
+    cache.put("b", _entry())
+    cache.get("a", "27100")
+    cache.put("c", _entry())
+
+    assert list(cache.entries) == ["a", "c"]
+    assert cache.stats()["evictions"] == 1
+
+
+def test_revalidated_counts_hit_and_restarts_ttl(monkeypatch):
+    cache = UrlCache(max_size=2, ttl=60)
+    entry = _entry(stored=0.0)
+    monkeypatch.setattr("src.urlcache.time.monotonic", lambda: 30.0)
+
+    cache.revalidated(entry)
+
+    assert entry.stored == 30.0
+    assert cache.stats()["hits"] == 1
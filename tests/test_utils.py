@@ -2,7 +2,7 @@
 
 import pytest
 
-from src.utils import get_clamav_connection
+from src.utils import get_clamav_connection, normalize_url
 
 
 @pytest.fixture
@@ -36,3 +36,16 @@ async def test_get_clamav_connection_sets_persistent_and_returns_socket(monkeypa
     assert calls["created"] == 1
     assert result is fake_socket
     assert fake_socket.persistent is True
+
+
+@pytest.mark.parametrize(
+    "url,expected",
+    [
+        ("HTTPS://Example.COM:443/a?b=1#frag", "https://example.com/a?b=1"),
+        ("http://example.com", "http://example.com/"),
+        ("http://example.com:8080/x", "http://example.com:8080/x"),
+        ("  http://user:pw@Example.com/x ", "http://user:pw@example.com/x"),
+    ],
+)
+def test_normalize_url(url, expected):
+    assert normalize_url(url) == expected
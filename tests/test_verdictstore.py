@@ -0,0 +1,127 @@
+"""Tests for src/verdictstore.py"""
+import logging
+import sqlite3
+
+import pytest
+
+from src.verdictstore import VerdictStore
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+CONF = {
+    "VERDICT_CACHE_PATH": lambda tmp_path: str(tmp_path / "verdicts.db"),
+    "VERDICT_CACHE_MAX_ENTRIES": 100,
+    "VERDICT_CACHE_FLUSH_INTERVAL": 60,
+    "VERDICT_CACHE_FLUSH_SIZE": 100,
+}
+
+
+async def _store(conf):
+    store = VerdictStore(conf, logging.getLogger("test"))
+    await store.start()
+    return store
+
+
+@pytest.mark.anyio
+async def test_verdicts_are_shared_between_stores_after_flush(conf):
+    first = await _store(conf)
+    second = await _store(conf)
+    try:
+        first.put("sha256:a", "27100", "stream: OK")
+
+        assert await first.lookup("sha256:a", "27100") == "stream: OK"
+        assert await second.lookup("sha256:a", "27100") is None
+
+        await first.flush()
+
+        assert await second.lookup("sha256:a", "27100") == "stream: OK"
+        assert await second.lookup("sha256:a", "27101") is None
+    finally:
+        await first.stop()
+        await second.stop()
+
+
+@pytest.mark.anyio
+async def test_verdicts_survive_restart(conf):
+    store = await _store(conf)
+    store.put("sha256:a", "27100", "stream: Eicar FOUND")
+    await store.stop()
+
+    store = await _store(conf)
+    try:
+        assert await store.lookup("sha256:a", "27100") == "stream: Eicar FOUND"
+        assert store.stats()["hits"] == 1
+    finally:
+        await store.stop()
+
+
+@pytest.mark.anyio
+async def test_new_signature_version_purges_older_verdicts(conf):
+    store = await _store(conf)
+    try:
+        store.put("sha256:a", "27100", "stream: OK")
+        await store.flush()
+        store.put("sha256:b", "27101", "stream: OK")
+        await store.flush()
+
+        rows = store.reader.execute("SELECT key, signature FROM verdicts").fetchall()
+    finally:
+        await store.stop()
+
+    assert rows == [("sha256:b", "27101")]
+
+
+@pytest.mark.anyio
+async def test_oldest_entries_are_evicted(conf):
+    conf.VERDICT_CACHE_MAX_ENTRIES = 2
+    store = await _store(conf)
+    try:
+        for key in ("a", "b", "c"):
+            store.put(key, "27100", "stream: OK")
+            await store.flush()
+
+        assert await store.lookup("a", "27100") is None
+        assert await store.lookup("c", "27100") == "stream: OK"
+        assert store.stats()["evictions"] == 1
+    finally:
+        await store.stop()
+
+
+@pytest.mark.anyio
+async def test_eviction_counts_the_table_only_past_the_limit(conf):
+    conf.VERDICT_CACHE_MAX_ENTRIES = 20
+    store = await _store(conf)
+    try:
+        for number in range(21):
+            store.put(f"sha256:{number}", "27100", "stream: OK")
+            await store.flush()
+
+        rows = store.reader.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0]
+    finally:
+        await store.stop()
+
+    # Trimmed to 90% of the limit, leaving room before the next count
+    assert rows == store.count == 18
+    assert store.stats()["evictions"] == 3
+
+
+@pytest.mark.anyio
+async def test_early_flush_failures_are_logged(conf, caplog):
+    conf.VERDICT_CACHE_FLUSH_SIZE = 1
+    store = await _store(conf)
+    writer = store.writer
+    store.writer = sqlite3.connect(":memory:", check_same_thread=False)
+    try:
+        with caplog.at_level(logging.ERROR):
+            store.put("sha256:a", "27100", "stream: OK")
+            await store.flushing
+
+        assert "Verdict store flush failed" in caplog.text
+    finally:
+        store.writer.close()
+        store.writer = writer
+        await store.stop()
@@ -0,0 +1,225 @@
+"""Tests for src/watcher.py"""
+import asyncio
+import json
+import sys
+
+import pytest
+
+from src.watcher import Inotify, Watcher
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is Linux only")
+
+
+class DummyLogger:
+    """Simple logger stub for tests."""
+
+    def __init__(self):
+        self.messages = []
+
+    def info(self, msg, *args):
+        self.messages.append(msg % args)
+
+    warning = error = exception = info
+
+
+class FakeClamAv:
+    """Fake ClamAv client recording scanned paths."""
+
+    def __init__(self, scanned, verdict="OK"):
+        self.scanned = scanned
+        self.verdict = verdict
+
+    async def scan(self, path):
+        self.scanned.append(path)
+        return f"{path}: {self.verdict}"
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+CONF = {
+    "WATCH_PATHS": lambda tmp_path: [str(tmp_path / "drop")],
+    "WATCH_WORKERS": 2,
+    "WATCH_QUEUE_SIZE": 10,
+    "WATCH_DEBOUNCE": 0.05,
+    "WATCH_ACTION": "log",
+    "WATCH_QUARANTINE_DIR": lambda tmp_path: str(tmp_path / "quarantine"),
+    "WATCH_RESULTS_LOG": lambda tmp_path: str(tmp_path / "results.ndjson"),
+}
+
+
+@pytest.fixture
+def conf(conf, tmp_path):
+    (tmp_path / "drop").mkdir()
+    return conf
+
+
+async def _wait_for(predicate, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("condition not met")
+        await asyncio.sleep(0.01)
+
+
+def test_inotify_reports_close_write(tmp_path):
+    inotify = Inotify()
+    try:
+        inotify.add_watch(str(tmp_path))
+        (tmp_path / "a.txt").write_bytes(b"data")
+        events = inotify.read_events()
+    finally:
+        inotify.close()
+
+    assert any(name == "a.txt" for _, _, name in events)
+
+
+@pytest.mark.anyio
+async def test_watcher_debounces_and_scans_new_files(tmp_path, conf):
+    scanned = []
+    watcher = Watcher(conf, lambda: FakeClamAv(scanned), DummyLogger())
+    await watcher.start()
+    try:
+        target = tmp_path / "drop" / "file.bin"
+        target.write_bytes(b"one")
+        target.write_bytes(b"two")
+        await _wait_for(lambda: watcher.scanned == 1 and not watcher.in_progress)
+    finally:
+        await watcher.stop()
+
+    assert scanned == [str(target)]
+    record = json.loads((tmp_path / "results.ndjson").read_text().splitlines()[0])
+    assert record["path"] == str(target)
+    assert record["infected"] is False
+    stats = watcher.stats()
+    assert stats["backlog"] == 0
+    assert stats["throughput"] > 0
+
+
+@pytest.mark.anyio
+async def test_watcher_watches_new_subdirectories(tmp_path, conf):
+    scanned = []
+    watcher = Watcher(conf, lambda: FakeClamAv(scanned), DummyLogger())
+    await watcher.start()
+    try:
+        subdir = tmp_path / "drop" / "nested"
+        subdir.mkdir()
+        await asyncio.sleep(0.05)
+        (subdir / "inner.bin").write_bytes(b"data")
+        await _wait_for(lambda: watcher.scanned == 1 and not watcher.in_progress)
+    finally:
+        await watcher.stop()
+
+    assert scanned == [str(subdir / "inner.bin")]
+
+
+@pytest.mark.anyio
+async def test_watcher_scans_files_already_in_a_new_subdirectory(tmp_path, conf):
+    scanned = []
+    watcher = Watcher(conf, lambda: FakeClamAv(scanned), DummyLogger())
+    await watcher.start()
+    try:
+        # Built elsewhere and moved in whole, so no file event is ever seen for its contents
+        staged = tmp_path / "staged"
+        (staged / "deeper").mkdir(parents=True)
+        (staged / "first.bin").write_bytes(b"one")
+        (staged / "deeper" / "second.bin").write_bytes(b"two")
+        staged.rename(tmp_path / "drop" / "batch")
+        await _wait_for(lambda: watcher.scanned == 2 and not watcher.in_progress)
+    finally:
+        await watcher.stop()
+
+    assert sorted(scanned) == [
+        str(tmp_path / "drop" / "batch" / "deeper" / "second.bin"),
+        str(tmp_path / "drop" / "batch" / "first.bin"),
+    ]
+
+
+class FailingClamAv:
+    """Fake ClamAv client whose first scan fails with an unexpected error."""
+
+    def __init__(self, scanned):
+        self.scanned = scanned
+        self.failed = False
+
+    async def scan(self, path):
+        if not self.failed:
+            self.failed = True
+            raise OSError("results disk full")
+        self.scanned.append(path)
+        return f"{path}: OK"
+
+
+@pytest.mark.anyio
+async def test_worker_survives_unexpected_errors(tmp_path, conf):
+    scanned = []
+    conf.WATCH_WORKERS = 1
+    watcher = Watcher(conf, lambda: FailingClamAv(scanned), DummyLogger())
+    await watcher.start()
+    try:
+        (tmp_path / "drop" / "a.bin").write_bytes(b"a")
+        await _wait_for(lambda: watcher.errors == 1 and not watcher.in_progress)
+        (tmp_path / "drop" / "b.bin").write_bytes(b"b")
+        await _wait_for(lambda: watcher.scanned == 1 and not watcher.in_progress)
+    finally:
+        await watcher.stop()
+
+    assert scanned == [str(tmp_path / "drop" / "b.bin")]
+
+
+@pytest.mark.anyio
+async def test_watcher_quarantines_infected_files(tmp_path, conf):
+    scanned = []
+    conf.WATCH_ACTION = "quarantine"
+    watcher = Watcher(conf, lambda: FakeClamAv(scanned, "Eicar FOUND"), DummyLogger())
+    await watcher.start()
+    try:
+        target = tmp_path / "drop" / "eicar.com"
+        target.write_bytes(b"X5O")
+        await _wait_for(lambda: watcher.infected == 1 and not watcher.in_progress)
+    finally:
+        await watcher.stop()
+
+    assert not target.exists()
+    assert len(list((tmp_path / "quarantine").iterdir())) == 1
+    record = json.loads((tmp_path / "results.ndjson").read_text().splitlines()[0])
+    assert record["action"] == "quarantined"
+
+
+@pytest.mark.anyio
+async def test_quarantine_keeps_files_with_the_same_name(tmp_path, conf):
+    watcher = Watcher(conf, lambda: None, DummyLogger())
+    for directory in ("one", "two"):
+        (tmp_path / "drop" / directory).mkdir()
+        (tmp_path / "drop" / directory / "eicar.com").write_bytes(directory.encode())
+
+    actions = [await watcher.quarantine(str(tmp_path / "drop" / directory / "eicar.com"))
+               for directory in ("one", "two")]
+
+    assert actions == ["quarantined", "quarantined"]
+    assert sorted(path.read_bytes() for path in (tmp_path / "quarantine").iterdir()) == [b"one", b"two"]
+
+
+def test_enqueue_holds_back_paths_while_queue_full(conf):
+    conf.WATCH_QUEUE_SIZE = 1
+
+    async def run():
+        watcher = Watcher(conf, lambda: None, DummyLogger())
+        for name in ("a", "b", "c"):
+            watcher.debounce(name)
+            watcher.enqueue(name)
+        held = watcher.stats()
+        order = []
+        while not watcher.queue.empty():
+            order.append((await watcher.queue.get())[0])
+            watcher.refill()
+        return watcher, held, order
+
+    watcher, held, order = asyncio.run(run())
+
+    assert held["backlog"] == 1
+    assert held["overflow"] == 2
+    assert order == ["a", "b", "c"]
+    assert watcher.stats()["overflow"] == 0
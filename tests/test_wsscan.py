@@ -0,0 +1,158 @@
+"""Tests for src/wsscan.py"""
+import asyncio
+import json
+import logging
+
+import pytest
+
+from src.wsscan import FLAG_END, FrameError, ScanChannel, encode_frame, parse_frame
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+class FakeWebSocket:
+    """ Feeds scripted messages and collects sent text """
+
+    def __init__(self, messages):
+        self.incoming: asyncio.Queue = asyncio.Queue()
+        for message in messages:
+            self.incoming.put_nowait(message)
+        self.sent = []
+
+    async def receive(self):
+        return await self.incoming.get()
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+    def disconnect(self):
+        self.incoming.put_nowait({"type": "websocket.disconnect"})
+
+
+def _binary(data):
+    return {"type": "websocket.receive", "bytes": data}
+
+
+def _text(message):
+    return {"type": "websocket.receive", "text": json.dumps(message)}
+
+
+CONF = {
+    "WS_MAX_IN_FLIGHT": 4,
+    "WS_BUFFER_CHUNKS": 2,
+}
+
+
+async def _echo_scan(chunks, encoding):
+    data = b"".join([chunk async for chunk in chunks])
+    return {"status_code": 200, "response": f"{encoding}:{data.decode()}"}
+
+
+def test_frames_round_trip():
+    assert parse_frame(encode_frame("f-1", b"abc", end=True)) == (FLAG_END, "f-1", b"abc")
+    with pytest.raises(FrameError):
+        parse_frame(b"\x00")
+    with pytest.raises(FrameError):
+        parse_frame(b"\x00\x00\x05ab")
+
+
+async def _serve(websocket, conf, scan=_echo_scan, admit=None):
+    channel = ScanChannel(websocket, scan, conf, logging.getLogger("test"), admit)
+    task = asyncio.create_task(channel.run())
+    return channel, task
+
+
+async def _wait_for(websocket, count):
+    for _ in range(200):
+        if len(websocket.sent) >= count:
+            return
+        await asyncio.sleep(0.005)
+
+
+@pytest.mark.anyio
+async def test_interleaved_files_get_tagged_verdicts(conf):
+    websocket = FakeWebSocket([
+        _text({"type": "begin", "id": "a", "encoding": "gzip"}),
+        _binary(encode_frame("b", b"small", end=True)),
+        _binary(encode_frame("a", b"part1-")),
+        _binary(encode_frame("a", b"part2")),
+        _text({"type": "end", "id": "a"}),
+    ])
+    _, task = await _serve(websocket, conf)
+    await _wait_for(websocket, 2)
+    websocket.disconnect()
+    await task
+
+    verdicts = {message["id"]: message["response"] for message in websocket.sent}
+    assert verdicts == {"a": "gzip:part1-part2", "b": "identity:small"}
+
+
+@pytest.mark.anyio
+async def test_each_file_is_admitted_against_the_rate_limit(conf):
+    waits = [0.0, 2.5, 0.0]
+    websocket = FakeWebSocket([
+        _binary(encode_frame("a", b"first", end=True)),
+        _binary(encode_frame("b", b"refused-")),
+        _binary(encode_frame("b", b"dropped", end=True)),
+        _text({"type": "begin", "id": "c"}),
+        _binary(encode_frame("c", b"third", end=True)),
+    ])
+    _, task = await _serve(websocket, conf, admit=lambda: waits.pop(0))
+    await _wait_for(websocket, 3)
+    websocket.disconnect()
+    await task
+
+    verdicts = {message["id"]: message for message in websocket.sent}
+    assert verdicts["a"]["response"] == "identity:first"
+    assert verdicts["b"] == {
+        "id": "b", "status_code": 429, "response": "Too many requests", "retry_after": 3}
+    assert verdicts["c"]["response"] == "identity:third"
+    assert not waits
+
+
+@pytest.mark.anyio
+async def test_scans_run_concurrently_up_to_limit(conf):
+    running = []
+    peak = []
+    release = asyncio.Event()
+
+    async def slow_scan(chunks, encoding):
+        async for _ in chunks:
+            pass
+        running.append(1)
+        peak.append(len(running))
+        await release.wait()
+        running.pop()
+        return {"status_code": 200, "response": "OK"}
+
+    conf.WS_MAX_IN_FLIGHT = 2
+    websocket = FakeWebSocket([_binary(encode_frame(str(i), b"x", end=True)) for i in range(3)])
+    _, task = await _serve(websocket, conf, slow_scan)
+    await asyncio.sleep(0.02)
+    assert max(peak) == 2
+    release.set()
+    await _wait_for(websocket, 3)
+    websocket.disconnect()
+    await task
+
+    assert sorted(message["id"] for message in websocket.sent) == ["0", "1", "2"]
+
+
+@pytest.mark.anyio
+async def test_early_failure_does_not_block_the_channel(conf):
+    async def failing_scan(chunks, encoding):
+        return {"status_code": 413, "response": "too large"}
+
+    websocket = FakeWebSocket(
+        [_binary(encode_frame("big", b"x")) for _ in range(6)]
+        + [_binary(encode_frame("big", b"", end=True)), _text({"nope": 1})])
+    _, task = await _serve(websocket, conf, failing_scan)
+    await _wait_for(websocket, 2)
+    websocket.disconnect()
+    await task
+
+    assert websocket.sent[0] == {"id": "big", "status_code": 413, "response": "too large"}
+    assert websocket.sent[1]["status_code"] == 400